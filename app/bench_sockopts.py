@@ -0,0 +1,241 @@
+import argparse
+import dataclasses
+import multiprocessing
+import socket
+import statistics
+import threading
+import time
+
+from app.common import *
+from app.common.client import *
+from app.common.server import *
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='app.bench_sockopts',
+                                     description='Control round trips and data throughput of every socket profile')
+    parser.add_argument('--port', type=int, default=50600,
+                        help='Port of the first benchmark server, one more per profile (default: 50600)')
+    parser.add_argument('--round-trips', type=int, default=2000,
+                        help='Control transactions to time per profile (default: 2000)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 16 * 1024, 256 * 1024, 4 * 1024 * 1024],
+                        help='Message sizes (in bytes) to measure the throughput of (default: 256 16384 262144 4194304)')
+    parser.add_argument('--volume', type=int, default=64,
+                        help='Data (in MB) sent per message size, at least 16 messages (default: 64)')
+    parser.add_argument('--sockets', type=int, default=4,
+                        help='Slave sockets per client (default: 4)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of the transport measurements, the median is reported (default: 3)')
+    parser.add_argument('--transport-only', action='store_true',
+                        help='Measure the transport (frames between two processes) only, not through a chat server')
+    return parser.parse_args()
+
+
+def profiles() -> list[SocketProfile]:
+    # Every profile, and the auto-tuned ones without tuning to show what it brings
+    result = []
+    for profile in SOCKET_PROFILES.values():
+        result.append(profile)
+        if profile.auto_tune:
+            result.append(dataclasses.replace(profile, name=f'{profile.name} (fixed)', auto_tune=False))
+    return result
+
+
+def percentiles(samples: list[float]) -> tuple[float, float]:
+    """
+    :return: Median and 99th percentile of the samples
+    """
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+
+def transport_peer(port: int, profile: SocketProfile):
+    """
+    Echo frames until asked for a stream: (size, count) frames of that size, sent back to back
+    """
+    sock = new_socket('tcp')
+    sock.connect(('127.0.0.1', port))
+    apply_socket_profile(sock, profile)
+
+    try:
+        while True:
+            frame = tcp_sock_recv_frame(sock, timeout=None)
+            if frame[:1] != b'S':
+                tcp_sock_send_frames(sock, [frame])
+                continue
+
+            size, count = (int(value) for value in bytes(frame[1:]).split(b','))
+            payload = bytes(size)
+            batch = [payload] * max(1, min(64, 256 * 1024 // size))
+            while count > 0:
+                tcp_sock_send_frames(sock, batch[:count])
+                count -= len(batch)
+    except EOFError:
+        pass
+    finally:
+        sock.close()
+
+
+def transport(context, port: int, profile: SocketProfile, sizes: list[int], volume: int,
+              count: int) -> tuple[tuple[float, float], list[float]]:
+    """
+    Frames between two processes with the profile on both ends, no chat server in between
+
+    :return: Median and 99th percentile (in microseconds) of small frame round trips, and the throughput
+             (in MB per second) of every frame size
+    """
+    listener = new_socket('tcp')
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(1)
+    peer = context.Process(target=transport_peer, args=(port, profile), daemon=True)
+    peer.start()
+    sock, _ = listener.accept()
+    listener.close()
+    apply_socket_profile(sock, profile)
+
+    try:
+        samples = []
+        ping = bytes(64)
+        for _ in range(count):
+            started = time.perf_counter()
+            tcp_sock_send_frames(sock, [ping])
+            tcp_sock_recv_frame(sock, timeout=None)
+            samples.append((time.perf_counter() - started) * 1e6)
+
+        rates = []
+        for size in sizes:
+            frames = max(16, volume * (1 << 20) // size)
+            started = time.perf_counter()
+            tcp_sock_send_frames(sock, [f'S{size},{frames}'.encode()])
+            for _ in range(frames):
+                tcp_sock_recv_frame(sock, timeout=None)
+            rates.append(frames * size / (time.perf_counter() - started) / (1 << 20))
+    finally:
+        sock.close()
+        peer.join()
+
+    return percentiles(samples), rates
+
+
+def round_trips(agent: ChatAgent, count: int) -> tuple[float, float]:
+    """
+    :return: Median and 99th percentile (in microseconds) of control transactions on the master socket
+    """
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        agent.get_connected_clients()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return percentiles(samples)
+
+
+def serve(address: tuple[str, int], profile: SocketProfile):
+    logger.disabled = True
+    server = ChatServer(address, f'{profile.name} benchmark server', sessions=SessionOptions(heartbeat_timeout=0),
+                        delivery=DeliveryOptions(max_backlog=0), rate_limits=None,
+                        control_profile=profile, data_profile=profile)
+    while server.is_alive():
+        server.wait(timeout=1.0)
+
+
+def receive(address: tuple[str, int], profile: SocketProfile, sockets: int, pipe):
+    """
+    Count the messages received, and tell when as many as expected (read from the pipe) have arrived
+    """
+    logger.disabled = True
+    expected, received = [0], [0]
+    done = threading.Event()
+
+    def on_receive(_: MessageProtocol):
+        received[0] += 1
+        if received[0] >= expected[0]:
+            done.set()
+
+    receiver = ChatAgent('receiver', address, open_sockets=sockets, recv_callback=on_receive,
+                         connection=ConnectionOptions(heartbeat_interval=0, reconnect=False),
+                         control_profile=profile, data_profile=profile)
+    pipe.send(receiver.connected)
+    while count := pipe.recv():
+        done.clear()
+        received[0], expected[0] = 0, count
+        pipe.send(done.wait(timeout=120))
+    receiver.stop()
+
+
+def throughput(sender: ChatAgent, pipe, size: int, count: int) -> float:
+    """
+    :return: Data (in MB per second) delivered from the sender to the receiver
+    """
+    body = bytes(size)
+    pipe.send(count)
+
+    started = time.perf_counter()
+    for _ in range(count):
+        sender.send_private('receiver', MessageProtocolCode.DATA.PLAIN_TEXT, body)
+    if not pipe.recv():
+        raise TimeoutError(f'Not every message of {size} bytes arrived')
+    return count * size / (time.perf_counter() - started) / (1 << 20)
+
+
+def main():
+    args = parse_args()
+    logger.disabled = True
+
+    # Server, sender and receiver each get a process (and an interpreter lock) of their own
+    context = multiprocessing.get_context('spawn')
+
+    header = f'{"profile":<20} {"round trip (us)":>17} {"p99":>8}'
+    for size in args.sizes:
+        header += f' {f"{size} B (MB/s)":>18}'
+
+    print(f'Transport: frames between two processes (median of {args.repeat} runs)')
+    print(header)
+    for profile in profiles():
+        runs = [transport(context, args.port, profile, args.sizes, args.volume, args.round_trips)
+                for _ in range(args.repeat)]
+        median = statistics.median(latency[0] for latency, _ in runs)
+        p99 = statistics.median(latency[1] for latency, _ in runs)
+        line = f'{profile.name:<20} {median:>17.1f} {p99:>8.1f}'
+        for i in range(len(args.sizes)):
+            line += f' {statistics.median(rates[i] for _, rates in runs):>18.0f}'
+        print(line, flush=True)
+
+    if args.transport_only:
+        return
+
+    print()
+    print('End to end: sender, chat server and receiver (one run)')
+    print(header)
+    for i, profile in enumerate(profiles()):
+        address = ('127.0.0.1', args.port + i)
+        server = context.Process(target=serve, args=(address, profile), daemon=True)
+        server.start()
+        while probe_latency(address) is None:
+            time.sleep(0.05)
+
+        pipe, receiver_pipe = context.Pipe()
+        receiver = context.Process(target=receive, args=(address, profile, args.sockets, receiver_pipe), daemon=True)
+        receiver.start()
+        if not pipe.recv():
+            raise ConnectionError('Receiver is unable to connect')
+        sender = ChatAgent('sender', address, open_sockets=args.sockets, ack_mode=MessageProtocolAck.CUMULATIVE,
+                           connection=ConnectionOptions(heartbeat_interval=0, reconnect=False),
+                           control_profile=profile, data_profile=profile)
+
+        median, p99 = round_trips(sender, args.round_trips)
+        line = f'{profile.name:<20} {median:>17.1f} {p99:>8.1f}'
+        for size in args.sizes:
+            count = max(16, args.volume * (1 << 20) // size)
+            line += f' {throughput(sender, pipe, size, count):>18.0f}'
+        print(line, flush=True)
+
+        sender.stop()
+        pipe.send(0)
+        receiver.join()
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
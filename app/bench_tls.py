@@ -0,0 +1,129 @@
+import argparse
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import time
+
+from app.common import *
+from app.common.client import *
+from app.common.server import *
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='app.bench_tls',
+                                     description='Handshake cost per login, with and without TLS session resumption')
+    parser.add_argument('--port', type=int, default=50443,
+                        help='Port of the benchmark server (default: 50443)')
+    parser.add_argument('--sockets', type=int, default=64,
+                        help='Slave sockets per login, a login opens one more (default: 64)')
+    parser.add_argument('--logins', type=int, default=10,
+                        help='Logins to average over (default: 10)')
+    parser.add_argument('--tls-cert', default=None,
+                        help='Certificate chain (PEM), a self-signed one is made with openssl if not given')
+    parser.add_argument('--tls-key', default=None,
+                        help='Private key of the certificate (PEM)')
+    return parser.parse_args()
+
+
+def self_signed_certificate(directory: str) -> tuple[str, str]:
+    certfile, keyfile = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-nodes', '-days', '1',
+                    '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+                    '-keyout', keyfile, '-out', certfile,
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def connect_all(address: tuple[str, int], count: int, **kwargs) -> tuple[float, int]:
+    """
+    Open `count` connections one after another, like a login does
+
+    :return: Time (in seconds) it took, and how many TLS sessions were resumed
+    """
+    started = time.perf_counter()
+    clients = [TcpClient('bench', address[0], address[1], max_retries=0, **kwargs) for _ in range(count)]
+    elapsed = time.perf_counter() - started
+
+    resumed = sum(client.tls_resumed for client in clients)
+    if not all(client.status for client in clients):
+        raise ConnectionError('Unable to open every connection')
+    for client in clients:
+        client.close()
+    return elapsed, resumed
+
+
+def resumable_session(address: tuple[str, int], context) -> ssl.SSLSession:
+    client = TcpClient('bench', address[0], address[1], max_retries=0, ssl_context=context)
+    client.transaction(new_message_proto(src=new_user(username='bench'),
+                                         dst=None,
+                                         message_type=MessageProtocolCode.INSTRUCTION.HEARTBEAT.PING,
+                                         body=None))
+    session = client.tls_session
+    client.close()
+    return session
+
+
+def report(label: str, samples: list[float], connections: int, resumed: int | None = None):
+    per_login = statistics.median(samples) * 1000
+    line = f'{label:<34} {per_login:9.2f} ms per login   {per_login / connections:7.3f} ms per connection'
+    if resumed is not None:
+        line += f'   (resumed {resumed}/{connections})'
+    print(line)
+
+
+def main():
+    args = parse_args()
+    connections = args.sockets + 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.tls_cert:
+            certfile, keyfile = args.tls_cert, args.tls_key
+        else:
+            certfile, keyfile = self_signed_certificate(directory)
+
+        server_context = new_tls_server_context(certfile, keyfile)
+        client_context = new_tls_client_context(cafile=certfile)
+
+        plain_address = ('127.0.0.1', args.port)
+        tls_address = ('127.0.0.1', args.port + 1)
+        ChatServer(plain_address, 'Plain benchmark server', sessions=SessionOptions(heartbeat_timeout=0))
+        ChatServer(tls_address, 'TLS benchmark server', sessions=SessionOptions(heartbeat_timeout=0),
+                   ssl_context=server_context)
+        for address in (plain_address, tls_address):
+            while probe_latency(address) is None:
+                time.sleep(0.05)
+
+        logger.disabled = True
+        print(f'{args.logins} logins of {connections} connections each (median)')
+
+        plain = [connect_all(plain_address, connections)[0] for _ in range(args.logins)]
+        report('Plain TCP', plain, connections)
+
+        full = [connect_all(tls_address, connections, ssl_context=client_context) for _ in range(args.logins)]
+        report('TLS, full handshakes', [elapsed for elapsed, _ in full], connections, full[-1][1])
+
+        resumed = []
+        for _ in range(args.logins):
+            session = resumable_session(tls_address, client_context)
+            resumed.append(connect_all(tls_address, connections, ssl_context=client_context, tls_session=session))
+        report('TLS, resumed sessions', [elapsed for elapsed, _ in resumed], connections, resumed[-1][1])
+
+        # Whole logins (identification included), the agent resumes the session of its first connection
+        for label, address, context in (('ChatAgent login, plain', plain_address, None),
+                                        ('ChatAgent login, TLS', tls_address, client_context)):
+            samples = []
+            for i in range(args.logins):
+                started = time.perf_counter()
+                agent = ChatAgent(f'bench-{i}', address, open_sockets=args.sockets,
+                                  connection=ConnectionOptions(heartbeat_interval=0, reconnect=False),
+                                  ssl_context=context)
+                samples.append(time.perf_counter() - started)
+                agent.stop()
+            report(label, samples, connections)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,21 +7,86 @@ from app.common.client import *
 
 __version__ = '1.0.0'
 
+
+def auto_select_server(discovery_address: str) -> tuple[str, int]:
+    print(f'Looking for local servers on {discovery_address}...')
+    servers = discover_servers(timeout=1.0, broadcast_address=discovery_address)
+    for message in servers:
+        info = message.body.info
+        print(f'- {message.src.username} at {service_address(message)} '
+              f'(version: {info.version}, clients: {info.clients}, load: {info.load})')
+
+    selected = least_loaded(servers)
+    if not selected:
+        print('No compatible local servers found!')
+        sys.exit(1)
+
+    print(f'Selected the least loaded server \"{selected.src.username}\"')
+    return service_address(selected)
+
+
+def parse_endpoints(text: str) -> tuple[tuple[str, int] | list[tuple[str, int]], bool]:
+    """
+    :return: Server address(es), and whether to connect over TLS (tls:// prefix)
+    """
+    text = text.strip()
+    tls = text.startswith('tls://')
+    if tls:
+        text = text[len('tls://'):]
+
+    endpoints = []
+    for endpoint in text.split(','):
+        tmp = endpoint.strip().split(':')
+        endpoints.append((tmp[0], int(tmp[1])))
+    return (endpoints[0] if len(endpoints) == 1 else endpoints), tls
+
+
+def parse_profiles(text: str) -> tuple[SocketProfile, SocketProfile]:
+    """
+    :return: Socket profiles of the control and data connections, from CONTROL[,DATA]
+    """
+    names = [name.strip() for name in text.split(',')]
+    control = socket_profile(names[0] or 'latency')
+    data = socket_profile(names[1] if len(names) > 1 and names[1] else 'throughput')
+    return control, data
+
+
 if __name__ == "__main__":
     if len(sys.argv) == 1:
-        print('Usage: python -m app.client_cli [HOST]:[PORT] [NUM_CONNECTIONS?]')
+        print('Usage: python -m app.client_cli [tls://][HOST]:[PORT][,...]|auto [NUM_CONNECTIONS?] [DISCOVERY_ADDRESS?] '
+              '[SOCKET_PROFILES?]')
+        print('                    tls://: Connect over TLS (trusted CAs can be set with SSL_CERT_FILE)')
         print('                      HOST: Server Hostname/IP Address')
         print('                      PORT: Server Port')
+        print('                     [,...]: More servers to fail over to, the fastest is used first')
+        print('                      auto: Connect to the least loaded local server')
         print('NUM_CONNECTIONS (Optional): Number of sockets to open')
+        print('DISCOVERY_ADDRESS (Optional): Broadcast address or multicast group of local servers, '
+              f'e.g. {MULTICAST_GROUP_V4}')
+        print('SOCKET_PROFILES (Optional): Socket options of the control and data connections, CONTROL[,DATA] '
+              f'(one of: {", ".join(SOCKET_PROFILES)}, default: latency,throughput)')
         sys.exit(1)
 
-    if len(sys.argv) > 1 and sys.argv[1].count(':') == 1:
-        tmp = sys.argv[1].strip().split(':')
-        remote_host_port: tuple[str, int] = tmp[0], int(tmp[1])
+    discovery_address = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] else '255.255.255.255'
+    try:
+        control_profile, data_profile = parse_profiles(sys.argv[4] if len(sys.argv) > 4 else '')
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    use_tls = False
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'auto':
+        remote_host_port: tuple[str, int] = auto_select_server(discovery_address)
+
+    elif len(sys.argv) > 1 and ':' in sys.argv[1]:
+        remote_host_port, use_tls = parse_endpoints(sys.argv[1])
 
     else:
-        tmp = input('Server address (Host:Port), e.g., localhost:50000: ').strip().split(':')
-        remote_host_port: tuple[str, int] = tmp[0], int(tmp[1])
+        tmp = input('Server address (Host:Port, or empty to auto-select), e.g., localhost:50000: ').strip()
+        if not tmp:
+            remote_host_port: tuple[str, int] = auto_select_server(discovery_address)
+        else:
+            remote_host_port, use_tls = parse_endpoints(tmp)
 
     if len(sys.argv) > 2 and sys.argv[2]:
         try:
@@ -31,7 +96,8 @@ if __name__ == "__main__":
     else:
         num_connections = int(input('Number of connections to be made (default: 4): ').strip())
 
-    print(f'Connection will be made to {remote_host_port[0]}:{remote_host_port[1]} using {num_connections} sockets')
+    endpoints = remote_host_port if isinstance(remote_host_port, list) else [remote_host_port]
+    print(f'Connection will be made to {", ".join(f"{h}:{p}" for h, p in endpoints)} using {num_connections} sockets')
 
     try:
         client_name = input('Client name > ').strip()
@@ -53,7 +119,11 @@ if __name__ == "__main__":
         app = AppCLI(app_name='app',
                      client_name=client_name,
                      remote_address=remote_host_port,
-                     open_sockets=num_connections)
+                     open_sockets=num_connections,
+                     discovery=DiscoveryOptions(address=discovery_address),
+                     ssl_context=new_tls_client_context() if use_tls else None,
+                     control_profile=control_profile,
+                     data_profile=data_profile)
         app.run()
     except socket.socket:
         pass
@@ -2,37 +2,104 @@ from .serializer import *
 from .message_protocol import *
 from .user import *
 from .utils.socket_utils import *
+from .utils.socket_options import *
+from .utils.tls import *
 from .logger import logger
 from .broadcast import *
 from .utils.general_utils import *
 from .utils.socket_pool import *
+from .utils.buffer_pool import *
+from .utils.coalescer import *
+from .utils.write_poller import *
+from .utils.mapped_file import *
+from .utils.datagram import *
 from .utils.arg_parser import *
 
 __all__ = [
     'logger',
     'new_socket',
     'tcp_sock_send',
+    'tcp_sock_send_frames',
+    'tcp_sock_send_frames_nowait',
+    'FrameFragment',
     'tcp_sock_recv',
+    'tcp_sock_recv_frame',
+    'release_recv_buffer',
     'udp_sock_send',
     'udp_sock_recvfrom',
     'get_internet_ip',
+    'set_nodelay',
+    'set_keepalive',
+    'apply_socket_profile',
+    'SocketProfile',
+    'SocketTuner',
+    'SYSTEM_PROFILE',
+    'LATENCY_PROFILE',
+    'THROUGHPUT_PROFILE',
+    'LAN_PROFILE',
+    'SOCKET_PROFILES',
+    'socket_profile',
+    'new_tls_server_context',
+    'new_tls_client_context',
     'serialize',
     'deserialize',
+    'serialize_bytes',
     'MessageProtocolCode',
     'MessageProtocol',
     'MessageProtocolResponse',
     'MessageProtocolFlag',
+    'MessageProtocolAck',
+    'MessagePriority',
+    'message_priority',
+    'PROTOCOL_VERSION',
     'new_message_proto',
+    'MessageFrame',
+    'serialize_message',
+    'resequence_message',
+    'deserialize_message',
+    'serialize_frame',
+    'deserialize_frame',
     'validate_message',
     'FileProtocol',
     'new_file_proto',
+    'BlobRef',
+    'BlobPart',
+    'Presence',
+    'PresenceState',
+    'Receipt',
+    'ReceiptState',
+    'SearchQuery',
+    'SearchHit',
+    'SearchPage',
+    'new_blob_ref',
+    'blob_digest',
+    'blob_file_digest',
     'User',
     'new_user',
     'UdpBroadcast',
+    'ServiceAnnouncement',
+    'ServiceInfo',
+    'DiscoveryOptions',
+    'MULTICAST_GROUP_V4',
+    'MULTICAST_GROUP_V6',
+    'discover_servers',
+    'least_loaded',
+    'rank_servers',
+    'service_address',
     'datetime_fmt',
     'tokenize',
+    'word_tokenize',
     'uniquify',
     'SocketPool',
+    'BufferPool',
+    'MessageCoalescer',
+    'WritePoller',
+    'MappedFile',
+    'DatagramFramer',
+    'DatagramReassembler',
+    'DATAGRAM_HEADER',
+    'register_datagram',
+    'parse_register_datagram',
     'ProgramArgumentParser',
     'ProgramCommandArgument',
     'ProgramCommand'
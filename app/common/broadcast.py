@@ -1,88 +1,348 @@
+import dataclasses
+import heapq
+import ipaddress
+import selectors
+import struct
 import time
-from typing import Callable, Any
+import uuid
+from typing import Callable
 
-from . import logger, new_socket, udp_sock_send, udp_sock_recvfrom
-from . import MessageProtocol, MessageProtocolCode, new_message_proto
+from . import logger, new_socket, serialize, deserialize
+from . import MessageProtocol, MessageProtocolCode, new_message_proto, PROTOCOL_VERSION
 from . import new_user
 import socket
 import threading
 
+# Administratively scoped (site-local) groups for multicast discovery
+MULTICAST_GROUP_V4 = '239.255.60.0'
+MULTICAST_GROUP_V6 = 'ff15::6000'
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class DiscoveryOptions:
+    """
+    Local network discovery: broadcast address or multicast group (IPv4/IPv6) to announce on and listen to,
+    multicast interface (e.g. 127.0.0.1 for loopback only) and UDP port
+    """
+    address: str = '255.255.255.255'
+    interface: str | None = None
+    port: int = 60000
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class ServiceInfo:
+    port: int
+    version: int = PROTOCOL_VERSION
+    clients: int = 0
+    load: float = 0.
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class ServiceAnnouncement:
+    instance: str
+    ttl: float
+    info: ServiceInfo | None = None
+
 
 class UdpBroadcast:
     def __init__(self,
                  service_name: str,
-                 broadcast_mode: MessageProtocolCode,
+                 broadcast_mode: MessageProtocolCode | None,
                  disc_callback: Callable[[MessageProtocol], None] | None = None,
                  broadcast_address: str = '255.255.255.255',
                  listen_port: int = 60000,
-                 broadcast_period: float = 1.0):
+                 broadcast_period: float = 0.25,
+                 max_broadcast_period: float = 8.0,
+                 leave_callback: Callable[[MessageProtocol], None] | None = None,
+                 info: ServiceInfo | None = None,
+                 interface: str | None = None,
+                 multicast_ttl: int = 1):
+        """
+        Local network discovery on a single event-driven UDP socket
 
-        self.__message = new_message_proto(
-            src=new_user(username=service_name),
-            dst=None,
-            message_type=broadcast_mode,
-            body=None
-        )
+        Announcements start every `broadcast_period` seconds and back off up to `max_broadcast_period`
+        while nothing changes. Every announcement carries its own time-to-live, so peers are expired
+        by a heap-backed index without scanning the whole peer list.
+
+        A multicast `broadcast_address` (IPv4 or IPv6) switches to multicast discovery, e.g. MULTICAST_GROUP_V4
+        with interface 127.0.0.1 to discover over loopback only.
+
+        :param service_name: Name to announce
+        :param broadcast_mode: Kind of announcement (BROADCAST.CLIENT_DISC or BROADCAST.SERVER_DISC),
+                               None to only listen (and ask others to announce themselves)
+        :param disc_callback: Callback function when a peer joins
+        :param broadcast_address: Broadcast address or multicast group to announce to
+        :param listen_port: Port to announce to and listen on
+        :param broadcast_period: Initial (fastest) period of announcements
+        :param max_broadcast_period: Slowest period of announcements when the network is stable
+        :param leave_callback: Callback function when a peer leaves (its announcement expires)
+        :param info: Service metadata to advertise (servers only), see update()
+        :param interface: Multicast interface, an IPv4 address or an IPv6 interface name (default: any)
+        :param multicast_ttl: Hops multicast announcements may travel (1 stays on the local network)
+        """
+        self.__service_name = service_name
+        self.__mode = broadcast_mode
+        self.__instance = uuid.uuid4().hex
         self.__address = broadcast_address
         self.__listen_port = listen_port
+        self.__min_period = broadcast_period
+        self.__max_period = max_broadcast_period
         self.__period = broadcast_period
+        self.__join_callback = disc_callback
+        self.__leave_callback = leave_callback
+        self.__info = info
+        self.__interface = interface
+        self.__multicast_ttl = multicast_ttl
+
+        # Discovered peers by instance, and their expiry index (lazily invalidated)
+        self.__peers: dict[str, tuple[float, MessageProtocol]] = {}
+        self.__expiry: list[tuple[float, str]] = []
+
+        # Announcement is serialized again only when its period changes
+        self.__announcement: bytes | None = None
+        self.__next_announce = time.monotonic()
 
         self.__create_sockets()
-        logger.info('Broadcasting sockets has been created!')
+        logger.info('Broadcasting socket has been created!')
 
         self.__thread_flag = threading.Event()
-        self.__broadcast_thread = self.__start_broadcast()
-        self.__listener_thread = self.__start_listen(disc_callback)
+        self.__thread = threading.Thread(
+            target=self.__run,
+            daemon=True
+        )
+        self.__thread.start()
         logger.info('Started broadcasting and listening!')
 
     def __create_sockets(self):
-        self.__listener = new_socket('udp')
-        self.__listener.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.__listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.__listener.bind(('', self.__listen_port))
-
-        self.__broadcaster = new_socket('udp')
-        self.__broadcaster.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.__broadcaster.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-    def __broadcast_next(self):
-        udp_sock_send(self.__broadcaster, (self.__address, self.__listen_port), self.__message)
-
-    def __start_broadcast(self) -> threading.Thread:
-        def indefinite_tx():
-            while not self.__thread_flag.is_set():
-                self.__broadcast_next()
-                time.sleep(self.__period)
-
-        thr = threading.Thread(
-            target=indefinite_tx,
-            daemon=True
-        )
-        thr.start()
-        return thr
-
-    def __listen_next(self):
-        data: tuple[MessageProtocol, Any] = udp_sock_recvfrom(self.__listener, 16384)
-        return data
-
-    def __start_listen(self, callback: Callable[[MessageProtocol], None] | None) -> threading.Thread:
-        def indefinite_rx():
-            while not self.__thread_flag.is_set():
-                rx, addr = self.__listen_next()
-                if callback and rx and isinstance(rx, MessageProtocol) and rx != self.__message:
-                    rx.src.address = addr
-                    callback(rx)
-
-        thr = threading.Thread(
-            target=indefinite_rx,
-            daemon=True
-        )
-        thr.start()
-        return thr
+        try:
+            group = ipaddress.ip_address(self.__address)
+        except ValueError:
+            group = None
+
+        if group and group.is_multicast:
+            self.__sock = self.__new_multicast_socket(group)
+        else:
+            self.__sock = new_socket('udp')
+            self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self.__reuse(self.__sock)
+            self.__sock.bind(('', self.__listen_port))
+        self.__sock.setblocking(False)
+
+        # Wakes the selector up on stop
+        self.__wakeup_r, self.__wakeup_w = socket.socketpair()
+
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__sock, selectors.EVENT_READ)
+        self.__selector.register(self.__wakeup_r, selectors.EVENT_READ)
+
+    @staticmethod
+    def __reuse(sock: socket.socket):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    def __new_multicast_socket(self, group: ipaddress.IPv4Address | ipaddress.IPv6Address) -> socket.socket:
+        if group.version == 4:
+            sock = new_socket('udp')
+            self.__reuse(sock)
+            sock.bind(('', self.__listen_port))
+
+            interface = socket.inet_aton(self.__interface or '0.0.0.0')
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, group.packed + interface)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.__multicast_ttl)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            if self.__interface:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+        else:
+            sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            self.__reuse(sock)
+            sock.bind(('::', self.__listen_port))
+
+            index = socket.if_nametoindex(self.__interface) if self.__interface else 0
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, group.packed + struct.pack('@I', index))
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, self.__multicast_ttl)
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_LOOP, 1)
+            if index:
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, index)
+
+        return sock
+
+    def _announcement_body(self) -> ServiceAnnouncement:
+        # Peers keep us for a few periods, so a lost announcement doesn't look like a leave
+        return ServiceAnnouncement(instance=self.__instance, ttl=3 * self.__period + 1.0, info=self.__info)
+
+    def __announce(self):
+        if self.__announcement is None:
+            # Pickled whole, so peers of any protocol version can read the version advertised
+            self.__announcement = serialize(new_message_proto(
+                src=new_user(username=self.__service_name),
+                dst=None,
+                message_type=self.__mode if self.__mode is not None else MessageProtocolCode.INSTRUCTION.BROADCAST.QUERY,
+                body=self._announcement_body()
+            ))
+
+        try:
+            self.__sock.sendto(self.__announcement, (self.__address, self.__listen_port))
+        except OSError as e:
+            logger.debug(f'Unable to announce: {e}')
+
+        # Back off while the network is stable
+        if self.__period < self.__max_period:
+            self.__period = min(self.__period * 2, self.__max_period)
+            self.__announcement = None
+        self.__next_announce = time.monotonic() + self.__period
+
+    def _invalidate(self):
+        """
+        Announce again as soon as possible (e.g. announced details have changed)
+        """
+        self.__period = self.__min_period
+        self.__announcement = None
+        self.__next_announce = time.monotonic()
+
+    def update(self, info: ServiceInfo):
+        """
+        Advertise new service metadata from the next announcement on
+        """
+        if info != self.__info:
+            self.__info = info
+            self.__announcement = None
+
+    def __receive(self):
+        while True:
+            try:
+                data, addr = self.__sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+            try:
+                rx = deserialize(data)
+            except Exception:
+                continue
+
+            if not (isinstance(rx, MessageProtocol) and rx.src):
+                continue
+
+            announcement = rx.body
+            if not isinstance(announcement, ServiceAnnouncement) or announcement.instance == self.__instance:
+                continue
+
+            # Someone is looking for peers, let them know about us quickly
+            if rx.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.QUERY:
+                if self.__mode is not None:
+                    self._invalidate()
+                continue
+
+            rx.src.address = addr[:2]
+            expires_at = time.monotonic() + announcement.ttl
+            is_new = announcement.instance not in self.__peers
+
+            self.__peers[announcement.instance] = (expires_at, rx)
+            heapq.heappush(self.__expiry, (expires_at, announcement.instance))
+
+            if is_new:
+                # Let the newcomer know about us quickly
+                self._invalidate()
+                if self.__join_callback:
+                    self.__join_callback(rx)
+
+    def __expire(self):
+        now = time.monotonic()
+        while self.__expiry and self.__expiry[0][0] <= now:
+            expires_at, instance = heapq.heappop(self.__expiry)
+
+            # Skip entries superseded by a newer announcement
+            peer = self.__peers.get(instance)
+            if not peer or peer[0] != expires_at:
+                continue
+
+            self.__peers.pop(instance)
+            if self.__leave_callback:
+                self.__leave_callback(peer[1])
+
+    def __run(self):
+        while not self.__thread_flag.is_set():
+            now = time.monotonic()
+            if now >= self.__next_announce:
+                self.__announce()
+
+            deadline = self.__next_announce
+            if self.__expiry:
+                deadline = min(deadline, self.__expiry[0][0])
+
+            for key, _ in self.__selector.select(timeout=max(deadline - time.monotonic(), 0.)):
+                if key.fileobj is self.__sock:
+                    try:
+                        self.__receive()
+                    except Exception as e:
+                        logger.exception(f'Discovery error: {e}')
+
+            self.__expire()
+
+    @property
+    def peers(self) -> list[MessageProtocol]:
+        return [message for _, message in self.__peers.values()]
 
     def stop(self):
         self.__thread_flag.set()
-        self.__broadcast_thread.join()
-        self.__listener_thread.join()
-        self.__broadcaster.close()
-        self.__listener.close()
+        try:
+            self.__wakeup_w.send(b'\x00')
+        except OSError:
+            pass
+        self.__thread.join()
+        self.__selector.close()
+        self.__sock.close()
+        self.__wakeup_r.close()
+        self.__wakeup_w.close()
+
+
+def service_address(message: MessageProtocol) -> tuple[str, int] | None:
+    """
+    TCP address a discovered server serves on
+    """
+    if not (isinstance(message.body, ServiceAnnouncement) and message.body.info):
+        return None
+    return message.src.address[0], message.body.info.port
+
+
+def discover_servers(timeout: float = 1.0,
+                     broadcast_address: str = '255.255.255.255',
+                     listen_port: int = 60000,
+                     interface: str | None = None) -> list[MessageProtocol]:
+    """
+    Listen for server announcements on the local network (servers are asked to announce right away)
+
+    :param timeout: Time (in seconds) to listen for
+    :return: Server announcements, see service_address() and least_loaded()
+    """
+    discovery = UdpBroadcast(service_name='',
+                             broadcast_mode=None,
+                             broadcast_address=broadcast_address,
+                             listen_port=listen_port,
+                             interface=interface)
+    try:
+        time.sleep(timeout)
+    finally:
+        discovery.stop()
+
+    return [message for message in discovery.peers
+            if message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.SERVER_DISC]
+
+
+def rank_servers(servers: list[MessageProtocol], version: int = PROTOCOL_VERSION) -> list[MessageProtocol]:
+    """
+    Compatible servers by load score, least loaded first (fewest clients on a tie)
+    """
+    candidates = [message for message in servers
+                  if service_address(message) and message.body.info.version == version]
+    return sorted(candidates, key=lambda message: (message.body.info.load, message.body.info.clients))
+
+
+def least_loaded(servers: list[MessageProtocol], version: int = PROTOCOL_VERSION) -> MessageProtocol | None:
+    """
+    Compatible server with the lowest load score (fewest clients on a tie)
+    """
+    ranked = rank_servers(servers, version=version)
+    return ranked[0] if ranked else None
@@ -1,11 +1,18 @@
+from .failover import *
 from .client_socket import *
 from .client_config import *
+from .download import *
 from .chat_agent import *
 
 __all__ = [
     'TcpClient',
     'UdpClient',
     'ChatAgent',
+    'FileDownload',
+    'Backoff',
+    'probe_latency',
+    'rank_by_latency',
+    'ConnectionOptions',
     'REMOTE_HOST',
     'REMOTE_TCP_PORT'
 ]
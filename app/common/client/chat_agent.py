@@ -1,18 +1,46 @@
+import collections
 import functools
+import itertools
+import os
+import socket
+import ssl
 import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Callable
 import queue
 
 from .. import *
-from . import TcpClient
+from . import TcpClient, UdpClient
+from .download import FileDownload
+from .failover import Backoff, rank_by_latency
+from .client_config import ConnectionOptions
 from app.common.types import *
+from app.common.media import *
+
+# Attachments of received messages downloaded at the same time
+DOWNLOAD_WORKERS = 2
 
 
 def single(func):
     @functools.wraps(func)
     def wrapper(cls, *args, **kwargs):
-        with cls.sock_lock:
-            return func(cls, *args, **kwargs)
+        def call():
+            # Pipelined transactions are matched with their responses, no need to hold the socket
+            if cls.pipelined:
+                return func(cls, *args, **kwargs)
+            with cls.sock_lock:
+                return func(cls, *args, **kwargs)
+
+        # Not while reconnecting, the groups we were in aren't joined again yet
+        cls.wait_reconnect()
+        try:
+            return call()
+        except ConnectionError:
+            # Once more on the next connection (waited for without the socket, reconnecting needs it)
+            if not cls.wait_reconnect():
+                raise
+        return call()
 
     return wrapper
 
@@ -20,52 +48,206 @@ def single(func):
 class ChatAgent:
     def __init__(self,
                  client_name: str,
-                 remote_address: tuple[str, int],
+                 remote_address: tuple[str, int] | list[tuple[str, int]] | None,
                  open_sockets: int = 64,
                  recv_callback: Callable[[MessageProtocol], None] | None = None,
-                 disc_callback: Callable[[MessageProtocol], None] | None = None):
+                 disc_callback: Callable[[MessageProtocol], None] | None = None,
+                 coalesce: bool = False,
+                 ack_mode: MessageProtocolAck = MessageProtocolAck.SYNC,
+                 nack_callback: Callable[[MessageProtocol], None] | None = None,
+                 udp: bool = False,
+                 media_receiver: MediaReceiver | None = None,
+                 download_dir: str | None = None,
+                 download_callback: Callable[[FileDownload], None] | None = None,
+                 leave_callback: Callable[[MessageProtocol], None] | None = None,
+                 discovery: DiscoveryOptions = DiscoveryOptions(),
+                 connection: ConnectionOptions = ConnectionOptions(),
+                 ssl_context: ssl.SSLContext | None = None,
+                 server_hostname: str | None = None,
+                 presence_callback: Callable[[Presence], None] | None = None,
+                 typing_refresh: float = 3.0,
+                 receipts: bool = False,
+                 receipt_callback: Callable[[Receipt], None] | None = None,
+                 receipt_interval: float = 0.25,
+                 control_profile: SocketProfile = LATENCY_PROFILE,
+                 data_profile: SocketProfile = THROUGHPUT_PROFILE):
         """
         A simple chat agent (client side backend)
 
         :param client_name: Client name (name to join)
+        :param remote_address: Server address, a list of server addresses to pick from by latency,
+                               or None to pick the least loaded server found by local network discovery
         :param open_sockets: Number of socket to open for concurrent data receive
         :param recv_callback: Callback function on data receive (What to do with data?)
         :param disc_callback: Callback function on local network discovery (What to do if I discover another device?)
+        :param coalesce: Pipeline requests on the master socket and coalesce concurrent sends into one write
+                         (control requests then overtake data, and large payloads are interleaved in chunks)
+        :param ack_mode: Acknowledgement mode of data messages (SYNC waits for a response per message,
+                         NONE is fire-and-forget, CUMULATIVE is acknowledged every few messages)
+        :param nack_callback: Callback function on negative acknowledgement (Which message was undeliverable?)
+        :param udp: Register a UDP endpoint for ephemeral messages (falls back to TCP if the server doesn't serve UDP)
+        :param media_receiver: Receiver of streamed images/videos (otherwise chunks go to the receive callback)
+        :param download_dir: Directory to save received files to as they arrive, the receive callback then gets
+                             the FileDownload (otherwise it gets the whole content in memory)
+        :param download_callback: Callback function on the progress of every file download
+        :param leave_callback: Callback function when a discovered device stops announcing itself
+        :param discovery: Local network discovery (of servers, and of other devices)
+        :param connection: Reconnection, heartbeats and TCP keepalive of the connection with the server
+        :param ssl_context: Connect over TLS with this context (see new_tls_client_context())
+        :param server_hostname: Name to verify server certificates against (default: the server host)
+        :param presence_callback: Callback function on every presence change pushed by the server
+                                  (Who is online, away, typing?)
+        :param typing_refresh: Time (in seconds) between two typing notifications of the same conversation
+                               (keep it below the server's typing timeout)
+        :param receipts: Tell the server which received messages were delivered (and read, see mark_read())
+        :param receipt_callback: Callback function on every receipt of our messages (How many got it, read it?),
+                                 by the sequence number they were sent with (see last_seq)
+        :param receipt_interval: Time (in seconds) between two batches of receipts sent to the server
+        :param control_profile: Socket options of the master socket (control transactions)
+        :param data_profile: Socket options of the slave sockets (data)
         """
         # Agent user
-        self.__user = new_user(username=client_name, group=None, address=None, sock_slaves=None)
+        self.__user = new_user(username=client_name, group=None)
+        # Groups joined (the user's group is the current one), joined again on another server
+        self.__groups: set[str] = set()
+        self.__open_sockets = open_sockets
+        self.__recv_callback = recv_callback
+        self.__is_stop = False
 
-        # Master client: for control transactions
-        logger.info('Setting up connections for you...')
-        self.__master_client = TcpClient(client_name, remote_address[0], remote_address[1])
+        # Servers to pick from, listed or discovered
+        if remote_address is None:
+            self.__endpoints: list[tuple[str, int]] = []
+        elif isinstance(remote_address, list):
+            self.__endpoints: list[tuple[str, int]] = list(remote_address)
+        else:
+            self.__endpoints: list[tuple[str, int]] = [remote_address]
+        self.__discovery = discovery if remote_address is None else None
+        self.__remote_address: tuple[str, int] | None = None
 
-        # Guard test connection before proceeding
-        if not self.__master_client.status:
-            raise ConnectionError('Connection with the server failed!')
+        # Reconnection with exponential backoff and jitter
+        self.__reconnect = connection.reconnect
+        self.__backoff = Backoff(base=connection.reconnect_delay, cap=connection.max_reconnect_delay)
+        self.__connect_timeout = connection.connect_timeout
+        self.__connection_flag = threading.Event()
+        self.__reconnect_lock = threading.Lock()
+        self.__reconnect_thread: threading.Thread | None = None
+        self.__retry_timeout = connection.retry_timeout
+        self.__reconnecting = False
+        self.__connected_cond = threading.Condition()
 
-        self.__slave_clients = [TcpClient(client_name, remote_address[0], remote_address[1]) for _ in
-                                range(open_sockets)]
-        self.__sock_lock = threading.Lock()
+        # Heartbeats: the server hears from us at least every interval, and a silent server is noticed
+        self.__heartbeat_interval = connection.heartbeat_interval
+        self.__heartbeat_timeout = connection.heartbeat_timeout
+        self.__keepalive_idle = connection.keepalive_idle
+        self.__last_sent = time.monotonic()
+        self.__heartbeat_thread: threading.Thread | None = None
 
-        # Identification with server
-        try:
-            if not self.__identify():
-                raise PermissionError('You are not allowed to use that client name!')
-        except Exception:
-            raise ConnectionError('Incorrect socket for server!')
+        # TLS (opt-in): every socket after the first resumes the TLS session of the server instead of a full handshake
+        self.__ssl_context = ssl_context
+        self.__server_hostname = server_hostname
+
+        # Socket options by kind of connection
+        self.__control_profile = control_profile
+        self.__data_profile = data_profile
+        self.__tls_sessions: dict[tuple[str, int], ssl.SSLSession] = {}
+
+        # Resumption token of the current session (if the server keeps sessions of dropped clients)
+        self.__session_token: str | None = None
+        self.__resumed = False
+
+        # Master client: for control transactions, slave clients: for receiving data
+        self.__master_client: TcpClient | None = None
+        self.__slave_clients: list[TcpClient] = []
+        self.__slave_threads: list[threading.Thread] = []
+        self.__sock_lock = threading.RLock()
+
+        # Pipelined master socket (opt-in): requests are written through the coalescer by priority
+        # and matched with their responses in the order they are written
+        self.__outbound: MessageCoalescer | None = None
+        self.__pending: collections.deque[Future] = collections.deque()
+        self.__pending_lock = threading.Lock()
+        self.__master_thread: threading.Thread | None = None
+        if coalesce or ack_mode != MessageProtocolAck.SYNC:
+            self.__outbound = MessageCoalescer(writer=self.__write_master)
 
-        # Slave client: for receiving data
+        # Asynchronous acknowledgements: sequence numbers of data messages not acknowledged yet
+        self.__ack_mode = ack_mode
+        self.__nack_callback = nack_callback
+        self.__seq = itertools.count(1)
+        self.__unacked: collections.deque[int] = collections.deque()
+        self.__sent = threading.local()
+        self.__unwritten = 0
+        self.__ack_cond = threading.Condition()
+
+        # Received messages are handed to the callback by a single orchestrator
         self.__slave_flag = threading.Event()
         self.__receive_buffer: Buffer[MessageProtocol] = Buffer()
-        self.__slave_orchestrator, self.__slave_threads = self.__start_receive(recv_callback)
+
+        # Voice calls by (peer, group), and streamed media
+        self.__calls: dict[tuple[str | None, str | None], VoiceCall] = {}
+        self.__media_receiver = media_receiver
+
+        # Attachment downloads in flight, by digest
+        self.__fetches: dict[str, Future] = {}
+        self.__fetches_lock = threading.Lock()
+
+        # Attachments saved to files as they arrive: files to open by sequence number of the request
+        self.__download_dir = download_dir
+        self.__download_callback = download_callback
+        self.__download_seq = itertools.count(1)
+        self.__downloads: dict[int, Callable[[int], MappedFile]] = {}
+        self.__downloads_lock = threading.Lock()
+        # Attachments of received messages are fetched here, so receiving threads never wait for them
+        self.__downloader = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix='download')
+
+        # Presence of peers as pushed by the server, and our own as last set (repeated settings aren't sent)
+        self.__presence_callback = presence_callback
+        self.__presence: dict[str, Presence] = {}
+        self.__presence_sent: tuple[str, str | None, str | None] | None = None
+        self.__typing_sent = 0.
+        self.__typing_refresh = typing_refresh
+
+        # Receipts (opt-in): the last message received of every conversation (by state) not acknowledged yet,
+        # sent to the server in batches
+        self.__receipts = receipts
+        self.__receipt_callback = receipt_callback
+        self.__receipt_interval = receipt_interval
+        self.__receipts_pending: dict[tuple[str, str | None, str | None], int] = {}
+        self.__receipts_lock = threading.Lock()
+        self.__receipt_thread: threading.Thread | None = None
+
+        # UDP client: for ephemeral messages (opt-in)
+        self.__udp = udp
+        self.__udp_framer = DatagramFramer()
+        self.__udp_client: UdpClient | None = None
+        self.__udp_thread: threading.Thread | None = None
+
+        logger.info('Setting up connections for you...')
+        connected = False
+        for _ in range(3):
+            if connected := self.__connect():
+                break
+            self.__slave_flag.wait(self.__backoff.next())
+        if not connected:
+            if self.__outbound:
+                self.__outbound.close(flush=False)
+            raise ConnectionError('Connection with the server failed!')
+        self.__backoff.reset()
+
+        self.__slave_orchestrator = self.__start_orchestration(recv_callback)
+        if connection.heartbeat_interval > 0:
+            self.__heartbeat_thread = self.__start_heartbeat()
+        if receipts:
+            self.__receipt_thread = self.__start_receipts()
 
         # Local network broadcast
         self.__broadcaster = UdpBroadcast(service_name=client_name,
                                           broadcast_mode=MessageProtocolCode.INSTRUCTION.BROADCAST.CLIENT_DISC,
-                                          disc_callback=disc_callback)
-
-        # Stop flag
-        self.__is_stop = False
+                                          disc_callback=disc_callback,
+                                          leave_callback=leave_callback,
+                                          broadcast_address=discovery.address,
+                                          listen_port=discovery.port,
+                                          interface=discovery.interface)
 
         logger.info('Chat agent is successfully initialized!')
 
@@ -84,13 +266,307 @@ class ChatAgent:
                 self.__is_stop = True
                 logger.info('Stopping slave threads...')
                 self.__slave_flag.set()
+                self.__connection_flag.set()
+                if self.__reconnect_thread:
+                    self.__reconnect_thread.join()
+                if self.__heartbeat_thread:
+                    self.__heartbeat_thread.join()
+                if self.__receipt_thread:
+                    self.__receipt_thread.join()
                 self.__slave_orchestrator.join()
+                # Wake the receiving threads up, they see the connection closed
+                for client in self.__slave_clients:
+                    client.shutdown()
                 for thr in self.__slave_threads:
                     thr.join()
+                self.__downloader.shutdown(wait=False, cancel_futures=True)
+                if self.__outbound:
+                    self.__outbound.close()
+                if self.__master_thread:
+                    self.__master_thread.join()
+                for call in list(self.__calls.values()):
+                    call.stop()
+                if self.__udp_client:
+                    self.__udp_thread.join()
+                    self.__udp_client.close()
                 self.__broadcaster.stop()
         except Exception:
             pass
 
+    # ================================ Connection and failover ================================ #
+
+    def __candidates(self) -> list[tuple[str, int]]:
+        if self.__discovery:
+            servers = discover_servers(timeout=1.0,
+                                       broadcast_address=self.__discovery.address,
+                                       listen_port=self.__discovery.port,
+                                       interface=self.__discovery.interface)
+            if ranked := [service_address(message) for message in rank_servers(servers)]:
+                self.__endpoints = ranked
+            return self.__endpoints
+
+        if len(self.__endpoints) > 1:
+            return rank_by_latency(self.__endpoints, timeout=self.__connect_timeout)
+        return self.__endpoints
+
+    def __connect(self) -> bool:
+        """
+        Connect and identify with the first server that accepts us
+        """
+        for address in self.__candidates():
+            master_client = self.__new_client(address, self.__control_profile)
+            if not (master_client.status and self.__fetch_tls_session(master_client, address)):
+                master_client.close()
+                continue
+
+            slave_clients = [self.__new_client(address, self.__data_profile) for _ in range(self.__open_sockets)]
+            self.__master_client, self.__slave_clients = master_client, slave_clients
+
+            # Resume the session on the same server (one round trip), or identify from scratch
+            try:
+                if not all(slave.status for slave in slave_clients):
+                    raise ConnectionError('Unable to open every socket')
+                for client in [master_client] + slave_clients:
+                    client.keepalive(idle=self.__keepalive_idle, interval=max(self.__keepalive_idle // 3, 1))
+
+                self.__resumed = address == self.__remote_address and self.__resume_session()
+                if self.__resumed or self.__identify():
+                    self.__on_connect(address)
+                    return True
+                logger.warning(f'Server {address[0]}:{address[1]} did not accept you!')
+            except Exception as e:
+                logger.warning(f'Incorrect socket for server {address[0]}:{address[1]}: {e}')
+
+            for client in [master_client] + slave_clients:
+                client.close()
+
+        return False
+
+    def __new_client(self, address: tuple[str, int], profile: SocketProfile) -> TcpClient:
+        return TcpClient(self.__user.username, address[0], address[1],
+                         max_retries=0,
+                         timeout=self.__connect_timeout,
+                         ssl_context=self.__ssl_context,
+                         server_hostname=self.__server_hostname,
+                         tls_session=self.__tls_sessions.get(address),
+                         file_sink=self.__open_download,
+                         profile=profile)
+
+    def __fetch_tls_session(self, client: TcpClient, address: tuple[str, int]) -> bool:
+        """
+        Keep the TLS session of the first connection for the others to resume
+
+        :return: Whether the connection is usable
+        """
+        if not self.__ssl_context:
+            return True
+
+        # TLS 1.3 tickets are sent after the handshake, one round trip brings them in
+        try:
+            response = client.transaction(new_message_proto(
+                src=self.__user,
+                dst=None,
+                message_type=MessageProtocolCode.INSTRUCTION.HEARTBEAT.PING,
+                body=None
+            ))
+        except (socket.error, EOFError):
+            return False
+        if not response:
+            return False
+
+        if session := client.tls_session:
+            self.__tls_sessions[address] = session
+        return True
+
+    def __on_connect(self, address: tuple[str, int]):
+        self.__remote_address = address
+        self.__last_sent = time.monotonic()
+        with self.__connected_cond:
+            connection_flag = self.__connection_flag = threading.Event()
+        logger.info(f'Connected to {address[0]}:{address[1]}')
+
+        self.__slave_threads = self.__start_receive(connection_flag)
+
+        # The server starts over with us online, and with no idea who we are interested in
+        self.__presence_sent = (PresenceState.ONLINE, None, None)
+
+        if self.__udp:
+            self.__udp_client = self.__join_udp(address)
+            if self.__udp_client:
+                self.__udp_thread = self.__start_udp_receive(self.__udp_client, connection_flag)
+
+        if self.__outbound:
+            # Requests sent on the lost connection will never be answered
+            with self.__pending_lock:
+                while self.__pending:
+                    self.__pending.popleft().set_exception(ConnectionError('Connection with the server is lost!'))
+
+            self.__master_client.nodelay = True
+            self.__master_thread = self.__start_master_receive(connection_flag)
+
+    def __on_disconnect(self, connection_flag: threading.Event):
+        """
+        Called by whichever thread notices the connection drop first, reconnects once per connection
+        """
+        with self.__reconnect_lock:
+            if self.__is_stop or connection_flag.is_set():
+                return
+            connection_flag.set()
+
+            # Waiting for acknowledgements of this connection is over
+            with self.__ack_cond:
+                self.__ack_cond.notify_all()
+
+            if not self.__reconnect:
+                logger.warning('Connection with the server is lost!')
+                return
+
+            logger.warning('Connection with the server is lost, reconnecting...')
+            with self.__connected_cond:
+                self.__reconnecting = True
+            self.__reconnect_thread = threading.Thread(
+                target=self.__reconnect_loop,
+                daemon=True
+            )
+            self.__reconnect_thread.start()
+
+    def __reconnect_loop(self):
+        # Stop everything bound to the lost connection
+        for client in [self.__master_client] + self.__slave_clients:
+            client.shutdown()
+        for thr in self.__slave_threads + [self.__master_thread, self.__udp_thread]:
+            if thr and thr is not threading.current_thread():
+                thr.join()
+        for client in [self.__master_client] + self.__slave_clients:
+            client.close()
+        if self.__udp_client:
+            self.__udp_client.close()
+            self.__udp_client = None
+
+        # Acknowledgements are per connection, those still missing are never coming
+        with self.__ack_cond:
+            if self.__unacked:
+                logger.warning(f'{len(self.__unacked)} messages were not acknowledged before the connection dropped!')
+                self.__unacked.clear()
+            self.__ack_cond.notify_all()
+
+        self.__backoff.reset()
+        try:
+            while not self.__slave_flag.wait(self.__backoff.next()):
+                if self.__connect():
+                    if not self.__resumed:
+                        self.__restore()
+                    return
+        finally:
+            # Requests waiting to be sent again go on (unless the connection dropped again meanwhile)
+            with self.__connected_cond:
+                if self.__reconnect_thread is threading.current_thread():
+                    self.__reconnecting = False
+                self.__connected_cond.notify_all()
+
+    def wait_reconnect(self) -> bool:
+        """
+        Wait until the connection that dropped is back, and the groups we were in are joined again
+
+        :return: Whether it's back before the retry timeout
+        """
+        if not self.__reconnect or self.__retry_timeout <= 0 or threading.current_thread() is self.__reconnect_thread:
+            return False
+
+        with self.__connected_cond:
+            self.__connected_cond.wait_for(lambda: self.__is_stop or (self.connected and not self.__reconnecting),
+                                           timeout=self.__retry_timeout)
+            return not self.__is_stop and self.connected and not self.__reconnecting
+
+    def __resume_session(self) -> bool:
+        if not self.__session_token:
+            return False
+
+        # Every socket asks at once, the server answers the master when all of them are back
+        self.__master_client.send(new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.SESSION.RESUME,
+            body=(self.__session_token, len(self.__slave_clients))
+        ))
+        for slave in self.__slave_clients:
+            slave.send(new_message_proto(
+                src=self.__user,
+                dst=None,
+                message_type=MessageProtocolCode.INSTRUCTION.SESSION.ATTACH,
+                body=self.__session_token
+            ))
+
+        # Read every answer, so none is mistaken for the answer of a later request
+        responses: list[MessageProtocol] = [slave.receive() for slave in self.__slave_clients]
+        responses.append(self.__master_client.receive())
+        if not all(response and response.response == MessageProtocolResponse.OK for response in responses):
+            return False
+
+        response = responses[-1]
+
+        self.__session_token, dropped = response.body
+        if dropped:
+            logger.warning(f'{dropped} messages were dropped while you were away!')
+        logger.info('Session is resumed!')
+        return True
+
+    def __restore(self):
+        # Rejoin every group we were in (the server may have restarted and lost them), the current one last
+        current = self.__user.group
+        groups = sorted(self.__groups - {current}) + ([current] if current in self.__groups else [])
+        try:
+            for group_name in groups:
+                self.create_group(group_name)
+                if self.join_group(group_name) != MessageProtocolResponse.OK:
+                    logger.warning(f'Unable to rejoin group {group_name}!')
+                    self.__groups.discard(group_name)
+            self.__user.group = current if current in self.__groups else None
+        except ConnectionError as e:
+            # Dropped again, the next reconnection restores them
+            logger.warning(f'Unable to rejoin groups: {e}')
+
+    def __write_master(self, frames: list[bytes]):
+        self.__last_sent = time.monotonic()
+        self.__master_client.send_frames(frames)
+
+    def __ping(self) -> bool:
+        """
+        :return: Whether the server answered the heartbeat in time
+        """
+        message = new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.HEARTBEAT.PING,
+            body=None
+        )
+
+        try:
+            if not self.__outbound:
+                with self.__sock_lock:
+                    # Somebody talked to the server while we were waiting for the socket
+                    if time.monotonic() - self.__last_sent < self.__heartbeat_interval:
+                        return True
+                    self.__last_sent = time.monotonic()
+                    self.__master_client.send(message)
+                    response = self.__master_client.receive(timeout=self.__heartbeat_timeout)
+            else:
+                future: Future[MessageProtocol] = Future()
+                self.__push(message, future)
+                response = future.result(timeout=self.__heartbeat_timeout)
+        except (socket.error, EOFError, TimeoutError, ConnectionError):
+            return False
+
+        return bool(response and response.message_type == MessageProtocolCode.INSTRUCTION.HEARTBEAT.PONG)
+
+    @property
+    def remote_address(self) -> tuple[str, int] | None:
+        return self.__remote_address
+
+    @property
+    def connected(self) -> bool:
+        return not self.__connection_flag.is_set()
+
     @property
     def username(self):
         return self.__user.username
@@ -99,6 +575,525 @@ class ChatAgent:
     def sock_lock(self):
         return self.__sock_lock
 
+    @property
+    def pipelined(self) -> bool:
+        return self.__outbound is not None
+
+    def __transaction(self, message: MessageProtocol) -> MessageProtocol:
+        if not self.__outbound:
+            connection_flag = self.__connection_flag
+            self.__last_sent = time.monotonic()
+            try:
+                return self.__master_client.transaction(message)
+            except (socket.error, EOFError) as e:
+                self.__on_disconnect(connection_flag)
+                raise ConnectionError('Connection with the server is lost!') from e
+
+        if not self.connected:
+            raise ConnectionError('Connection with the server is lost!')
+
+        future: Future[MessageProtocol] = Future()
+        self.__push(message, future)
+
+        return future.result()
+
+    def __push(self, message: MessageProtocol, future: Future | None = None):
+        """
+        Queue a message on the pipelined master socket by priority
+
+        Control messages overtake data, and large payloads go out in chunks interleaved with the rest. The server
+        answers in the order the messages were written, so futures (and sequence numbers waiting for cumulative
+        acknowledgements) are queued as they are written rather than as they are pushed.
+        """
+        tracked = message.seq is not None and message.ack == MessageProtocolAck.CUMULATIVE
+        if tracked:
+            with self.__ack_cond:
+                self.__unwritten += 1
+
+        def on_write():
+            if future is not None:
+                with self.__pending_lock:
+                    if self.connected:
+                        self.__pending.append(future)
+                    else:
+                        future.set_exception(ConnectionError('Connection with the server is lost!'))
+            if tracked:
+                with self.__ack_cond:
+                    self.__unwritten -= 1
+                    self.__unacked.append(message.seq)
+
+        self.__outbound.push(serialize_message(message), message_priority(message), on_write)
+
+    def __send_data(self, message: MessageProtocol) -> MessageProtocolResponse:
+        # Numbered in every mode, receipts refer to it
+        message.seq = next(self.__seq)
+        self.__sent.seq = message.seq
+        if self.__ack_mode == MessageProtocolAck.SYNC:
+            return self.__transaction(message).response
+
+        # Accepted for sending, failures are reported through negative acknowledgements
+        message.ack = self.__ack_mode
+        self.__push(message)
+
+        return MessageProtocolResponse.OK
+
+    def __on_ack(self, message: MessageProtocol):
+        with self.__ack_cond:
+            if message.message_flag == MessageProtocolFlag.ACK:
+                # Everything written up to this message has been delivered
+                if message.seq in self.__unacked:
+                    while self.__unacked.popleft() != message.seq:
+                        pass
+            elif message.seq in self.__unacked:
+                self.__unacked.remove(message.seq)
+            self.__ack_cond.notify_all()
+
+        if message.message_flag == MessageProtocolFlag.NACK:
+            logger.warning(f'Message {message.seq} is undeliverable to {message.body} ({message.response})')
+            if self.__nack_callback:
+                self.__nack_callback(message)
+
+    @single
+    def missing_blobs(self, digests: list[str]) -> list[str]:
+        response: MessageProtocol = self.__transaction(new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.BLOB.HAS,
+            body=digests
+        ))
+
+        return response.body if response.response == MessageProtocolResponse.OK else digests
+
+    @single
+    def put_blob(self, content: bytes) -> tuple[MessageProtocolResponse, str | None]:
+        response: MessageProtocol = self.__transaction(new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.BLOB.PUT,
+            body=content
+        ))
+
+        return response.response, response.body
+
+    @single
+    def __get_blob(self, digest: str) -> tuple[MessageProtocolResponse, bytes | None]:
+        response: MessageProtocol = self.__transaction(new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.BLOB.GET,
+            body=digest
+        ))
+
+        return response.response, response.body
+
+    def fetch_blob(self, digest: str) -> bytes | None:
+        """
+        Download an attachment by digest, concurrent downloads of the same digest share one request
+        """
+        with self.__fetches_lock:
+            future = self.__fetches.get(digest)
+            fetching = future is not None
+            if not fetching:
+                future = self.__fetches[digest] = Future()
+
+        # Waited for outside the lock, fetches of other digests go on meanwhile
+        if fetching:
+            return future.result()
+
+        try:
+            response, content = self.__get_blob(digest)
+            future.set_result(content if response == MessageProtocolResponse.OK else None)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self.__fetches_lock:
+                self.__fetches.pop(digest, None)
+
+        return future.result()
+
+    @single
+    def __get_blob_into(self, digest: str, open_file: Callable[[int], MappedFile]) -> MessageProtocol:
+        # The content is received straight into the file if large, see __open_download()
+        seq = next(self.__download_seq)
+        with self.__downloads_lock:
+            self.__downloads[seq] = open_file
+
+        try:
+            return self.__transaction(new_message_proto(
+                src=self.__user,
+                dst=None,
+                message_type=MessageProtocolCode.INSTRUCTION.BLOB.GET,
+                seq=seq,
+                body=digest
+            ))
+        finally:
+            with self.__downloads_lock:
+                self.__downloads.pop(seq, None)
+
+    def __open_download(self, message: MessageProtocol, size: int) -> MappedFile | None:
+        # Called by the thread receiving from the master socket, with the header of a large reply
+        if message.seq is None or message.response != MessageProtocolResponse.OK:
+            return None
+
+        with self.__downloads_lock:
+            open_file = self.__downloads.pop(message.seq, None)
+
+        try:
+            return open_file(size) if open_file else None
+        except OSError as e:
+            # Received in memory instead, the download gives up when saving it
+            logger.warning(f'Unable to open the file of a download: {e!r}')
+            return None
+
+    def download_file(self,
+                      blob_ref: BlobRef,
+                      directory: str,
+                      sender: str | None = None,
+                      on_progress: Callable[[FileDownload], None] | None = None) -> FileDownload | None:
+        """
+        Download an attachment into a new file as it arrives, so it's never held in memory whole
+
+        :param blob_ref: Attachment to download
+        :param directory: Directory to save the file to (named after the attachment, made unique)
+        :param sender: Who sent the attachment
+        :param on_progress: Callback function on the progress of the download
+        :return: The complete download, None if the attachment is no longer available
+        """
+        with self.__downloads_lock:
+            # Claim the name right away, concurrent downloads of the same name get their own file
+            path = uniquify(os.path.join(directory, os.path.basename(blob_ref.filename)))
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            open(path, mode='wb').close()
+
+        download = FileDownload(sender=sender, filename=blob_ref.filename, path=path, total_size=blob_ref.size)
+
+        def progress(received: int):
+            download.received = received
+            if on_progress:
+                # Called while receiving from the master socket
+                try:
+                    on_progress(download)
+                except Exception as e:
+                    logger.warning(f'Download callback failed: {e!r}')
+
+        def open_file(size: int) -> MappedFile:
+            download.total_size = size
+            return MappedFile(path, size, on_progress=progress)
+
+        saved = False
+        try:
+            response = self.__get_blob_into(blob_ref.digest, open_file)
+            if response.response != MessageProtocolResponse.OK or not isinstance(response.body, (bytes, MappedFile)):
+                return None
+
+            if not isinstance(response.body, MappedFile):
+                # Small enough to be received whole
+                open_file(len(response.body)).write(response.body)
+            saved = True
+            return download
+        finally:
+            if not saved and os.path.exists(path):
+                # Cut off, evicted or never uploaded
+                os.remove(path)
+
+    @single
+    def __put_blob_part(self, part: BlobPart) -> MessageProtocolResponse:
+        response: MessageProtocol = self.__transaction(new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.BLOB.PUT,
+            body=part
+        ))
+
+        return response.response
+
+    def __upload_blob(self, path: str, blob_ref: BlobRef, chunk_size: int) -> MessageProtocolResponse:
+        # One part per transaction, other requests go in between
+        with open(path, mode='rb') as f:
+            offset = 0
+            while True:
+                payload = f.read(chunk_size)
+                response = self.__put_blob_part(BlobPart(digest=blob_ref.digest,
+                                                         size=blob_ref.size,
+                                                         offset=offset,
+                                                         payload=payload))
+                offset += len(payload)
+                if response != MessageProtocolResponse.OK or not payload or offset >= blob_ref.size:
+                    return response
+
+    def send_file(self,
+                  path: str,
+                  recipient: str | None = None,
+                  group_name: str | None = None,
+                  chunk_size: int = 1024 * 1024) -> MessageProtocolResponse:
+        """
+        Send a file by reference: the content is hashed and uploaded in chunks, only if the server doesn't have it yet
+
+        Files the server doesn't keep (larger than its cache, or gone before the reference is sent) go inline instead.
+
+        :param chunk_size: Size of the parts the file is uploaded in
+        """
+        blob_ref = BlobRef(filename=os.path.basename(path), size=os.path.getsize(path), digest=blob_file_digest(path))
+
+        response = MessageProtocolResponse.OK
+        if self.missing_blobs([blob_ref.digest]):
+            response = self.__upload_blob(path, blob_ref, chunk_size)
+            if response == MessageProtocolResponse.WARN:
+                return response
+
+        if response == MessageProtocolResponse.OK:
+            if group_name:
+                response = self.send_group(group_name, MessageProtocolCode.DATA.FILE, blob_ref)
+            else:
+                response = self.send_private(recipient, MessageProtocolCode.DATA.FILE, blob_ref)
+
+            # Not found is for the attachment (evicted meanwhile), the recipient wouldn't be able to download it
+            if response != MessageProtocolResponse.NOT_EXIST:
+                return response
+
+        logger.warning(f'Server does not keep {blob_ref.filename}, sending it inline')
+        with open(path, mode='rb') as f:
+            file_proto = new_file_proto(filename=blob_ref.filename, content=f.read())
+
+        if group_name:
+            return self.send_group(group_name, MessageProtocolCode.DATA.FILE, file_proto)
+        return self.send_private(recipient, MessageProtocolCode.DATA.FILE, file_proto)
+
+    def __deliver(self, message: MessageProtocol):
+        # Messages with an attachment are handed to the callback once it's downloaded, the others right away
+        if message.message_type == MessageProtocolCode.DATA.FILE and isinstance(message.body, BlobRef):
+            self.__downloader.submit(self.__deliver_file, message)
+        else:
+            self.__receive_buffer.put(message)
+
+    def __deliver_file(self, message: MessageProtocol):
+        try:
+            if resolved := self.__resolve_file(message):
+                self.__receive_buffer.put(resolved)
+        except Exception as e:
+            logger.warning(f'Unable to download the attachment from {message.src.username}: {e!r}')
+
+    def __resolve_file(self, message: MessageProtocol) -> MessageProtocol | None:
+        blob_ref: BlobRef = message.body
+        if self.__download_dir:
+            download = self.download_file(blob_ref, self.__download_dir,
+                                          sender=message.src.username,
+                                          on_progress=self.__download_callback)
+            if download is None:
+                logger.warning(f'Attachment {blob_ref.filename} from {message.src.username} '
+                               f'is no longer available!')
+                return None
+
+            message.body = download
+            return message
+
+        content = self.fetch_blob(blob_ref.digest)
+        if content is None:
+            logger.warning(f'Attachment {blob_ref.filename} from {message.src.username} is no longer available!')
+            return None
+
+        message.body = new_file_proto(filename=blob_ref.filename, content=content)
+        return message
+
+    def start_call(self,
+                   source=None,
+                   sink=None,
+                   recipient: str | None = None,
+                   group_name: str | None = None,
+                   codec: str | None = None,
+                   fmt: VoiceFormat = VoiceFormat()) -> VoiceCall:
+        """
+        Start a voice call with a client or a group, frames are sent as ephemeral VOICE messages
+
+        :param source: Frame source (e.g. WavSource, PyAudioSource), None to listen only
+        :param sink: Frame sink (e.g. WavSink, PyAudioSink), None to talk only
+        :param recipient: Client to call
+        :param group_name: Group to call
+        :param codec: Codec name ('pcm' or 'ulaw')
+        :param fmt: PCM format shared by every participant
+        """
+        if group_name:
+            def send(frame: VoiceFrame):
+                return self.send_group(group_name, MessageProtocolCode.DATA.VOICE, frame, ephemeral=True)
+        elif recipient:
+            def send(frame: VoiceFrame):
+                return self.send_private(recipient, MessageProtocolCode.DATA.VOICE, frame, ephemeral=True)
+        else:
+            raise ValueError('Either recipient or group name is required!')
+
+        key = (None, group_name) if group_name else (recipient, None)
+        if key in self.__calls:
+            self.__calls.pop(key).stop()
+
+        call = VoiceCall(send=send, source=source, sink=sink, fmt=fmt, codec=codec)
+        self.__calls[key] = call
+        return call.start()
+
+    def end_call(self, call: VoiceCall):
+        for key, c in list(self.__calls.items()):
+            if c is call:
+                self.__calls.pop(key)
+        call.stop()
+
+    def send_media(self,
+                   path: str,
+                   data_type: MessageProtocolCode.Data = MessageProtocolCode.DATA.IMAGE,
+                   recipient: str | None = None,
+                   group_name: str | None = None,
+                   chunk_size: int = 65536,
+                   keyframes: list[int] | None = None) -> MessageProtocolResponse:
+        """
+        Stream an image/video in chunks, so the server relays and recipients save it as it goes
+
+        :param path: Media file path
+        :param data_type: DATA.IMAGE or DATA.VIDEO
+        :param recipient: Client to send to
+        :param group_name: Group to send to
+        :param chunk_size: Payload size of each chunk
+        :param keyframes: Byte offsets of keyframes, if known
+        """
+        if not (recipient or group_name):
+            raise ValueError('Either recipient or group name is required!')
+
+        response = MessageProtocolResponse.OK
+        for chunk in iter_media_chunks(path, chunk_size=chunk_size, keyframes=keyframes):
+            if group_name:
+                response = self.send_group(group_name, data_type, chunk)
+            else:
+                response = self.send_private(recipient, data_type, chunk)
+
+            if response != MessageProtocolResponse.OK:
+                logger.warning(f'Streaming {path} stopped at chunk {chunk.index} ({response})')
+                break
+
+        return response
+
+    def __dispatch_media(self, message: MessageProtocol) -> bool:
+        if not self.__media_receiver or message.message_type not in (MessageProtocolCode.DATA.IMAGE,
+                                                                     MessageProtocolCode.DATA.VIDEO):
+            return False
+
+        chunk = message.body
+        if not isinstance(chunk, MediaChunk):
+            return False
+
+        self.__media_receiver.feed(message.src.username, chunk)
+        return True
+
+    def __dispatch_voice(self, message: MessageProtocol) -> bool:
+        if message.message_type != MessageProtocolCode.DATA.VOICE or not self.__calls:
+            return False
+
+        if message.dst and message.dst.group:
+            call = self.__calls.get((None, message.dst.group))
+        else:
+            call = self.__calls.get((message.src.username, None))
+
+        if not call:
+            return False
+
+        frame = message.body
+        if isinstance(frame, VoiceFrame):
+            call.receive(message.src.username, frame)
+        return True
+
+    def __dispatch_presence(self, message: MessageProtocol) -> bool:
+        if message.message_type != MessageProtocolCode.INSTRUCTION.PRESENCE.UPDATE:
+            return False
+
+        for presence in message.body:
+            if not isinstance(presence, Presence):
+                continue
+            if presence.state == PresenceState.OFFLINE:
+                self.__presence.pop(presence.username, None)
+            else:
+                self.__presence[presence.username] = presence
+            if self.__presence_callback:
+                try:
+                    self.__presence_callback(presence)
+                except Exception as e:
+                    logger.warning(f'Presence callback failed: {e!r}')
+        return True
+
+    def __dispatch_receipt(self, message: MessageProtocol) -> bool:
+        if message.message_type != MessageProtocolCode.INSTRUCTION.RECEIPT.UPDATE:
+            return False
+
+        if self.__receipt_callback:
+            for receipt in message.body:
+                if not isinstance(receipt, Receipt):
+                    continue
+                try:
+                    self.__receipt_callback(receipt)
+                except Exception as e:
+                    logger.warning(f'Receipt callback failed: {e!r}')
+        return True
+
+    def __note_receipt(self, state: str, message: MessageProtocol):
+        # Cumulative: the highest sequence number of a conversation stands for everything received before it
+        if not (message.seq is not None and message.src and message.src.username and
+                MessageProtocolCode.is_data(message.message_type) and
+                message.message_flag != MessageProtocolFlag.ANNOUNCE):
+            return
+        group = message.dst.group if message.dst else None
+        key = (state, group, None if group else message.src.username)
+        with self.__receipts_lock:
+            if message.seq > self.__receipts_pending.get(key, 0):
+                self.__receipts_pending[key] = message.seq
+
+    def __send_datagram(self, message: MessageProtocol) -> MessageProtocolResponse:
+        # Loss is acceptable, nothing is acknowledged
+        self.__udp_client.send_datagrams(self.__udp_framer.frame(serialize_message(message)))
+        return MessageProtocolResponse.OK
+
+    def __join_udp(self, remote_address: tuple[str, int], attempts: int = 5) -> UdpClient | None:
+        # Registration token over the identified master connection
+        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.UDP.JOIN,
+            body=None
+        ))
+
+        if not response or response.response != MessageProtocolResponse.OK:
+            logger.warning('Server does not serve UDP, ephemeral messages will go over TCP')
+            return None
+
+        udp_client = UdpClient(self.__user.username, remote_address[0], remote_address[1])
+        reassembler = DatagramReassembler()
+        register = register_datagram(response.body)
+
+        # Registration datagram may be lost as well
+        for _ in range(attempts):
+            udp_client.send_datagrams([register])
+            datagram = udp_client.receive_datagram(timeout=0.2)
+            if datagram and (assembled := reassembler.feed(datagram)):
+                rx = deserialize_frame(assembled[1])
+                if validate_message(rx) and rx.response == MessageProtocolResponse.OK:
+                    logger.info('UDP endpoint is registered!')
+                    return udp_client
+
+        logger.warning('UDP registration failed, ephemeral messages will go over TCP')
+        udp_client.close()
+        return None
+
+    def wait_acks(self, timeout: float | None = None) -> bool:
+        """
+        Wait until every data message sent in cumulative acknowledgement mode has been acknowledged
+
+        :return: Whether all messages are acknowledged before the timeout (False as soon as the connection drops,
+                 what it didn't acknowledge never will be)
+        """
+        with self.__ack_cond:
+            connection_flag = self.__connection_flag
+            self.__ack_cond.wait_for(lambda: not self.unacked or self.__is_stop or connection_flag.is_set(),
+                                     timeout=timeout)
+            return not self.unacked and not connection_flag.is_set()
+
+    @property
+    def unacked(self) -> int:
+        return len(self.__unacked) + self.__unwritten
+
     @single
     def __identify(self):
         # Identify master socket
@@ -135,11 +1130,14 @@ class ChatAgent:
         if response.response != MessageProtocolResponse.OK:
             return False
 
+        # Token to resume this session after a drop
+        self.__session_token = response.body if isinstance(response.body, str) else None
+
         return True
 
     @single
     def get_connected_clients(self) -> tuple[MessageProtocolResponse, list[str]]:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+        response: MessageProtocol = self.__transaction(new_message_proto(
             src=self.__user,
             dst=None,
             message_type=MessageProtocolCode.INSTRUCTION.CLIENT.LIST,
@@ -150,7 +1148,7 @@ class ChatAgent:
 
     @single
     def get_groups(self) -> tuple[MessageProtocolResponse, list[str]]:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+        response: MessageProtocol = self.__transaction(new_message_proto(
             src=self.__user,
             dst=None,
             message_type=MessageProtocolCode.INSTRUCTION.GROUP.LIST_GROUPS,
@@ -161,7 +1159,7 @@ class ChatAgent:
 
     @single
     def get_clients_in_group(self, group_name: str) -> tuple[MessageProtocolResponse, list[str]]:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+        response: MessageProtocol = self.__transaction(new_message_proto(
             src=self.__user,
             dst=None,
             message_type=MessageProtocolCode.INSTRUCTION.GROUP.LIST_CLIENTS,
@@ -172,7 +1170,7 @@ class ChatAgent:
 
     @single
     def create_group(self, group_name: str) -> MessageProtocolResponse:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+        response: MessageProtocol = self.__transaction(new_message_proto(
             src=self.__user,
             dst=None,
             message_type=MessageProtocolCode.INSTRUCTION.GROUP.CREATE,
@@ -183,7 +1181,7 @@ class ChatAgent:
 
     @single
     def join_group(self, group_name: str) -> MessageProtocolResponse:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+        response: MessageProtocol = self.__transaction(new_message_proto(
             src=self.__user,
             dst=None,
             message_type=MessageProtocolCode.INSTRUCTION.GROUP.JOIN,
@@ -192,6 +1190,7 @@ class ChatAgent:
 
         if response.response == MessageProtocolResponse.OK:
             self.__user.group = group_name
+            self.__groups.add(group_name)
 
         return response.response
 
@@ -201,7 +1200,7 @@ class ChatAgent:
 
     @single
     def leave_group(self, group_name: str) -> MessageProtocolResponse:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+        response: MessageProtocol = self.__transaction(new_message_proto(
             src=self.__user,
             dst=None,
             message_type=MessageProtocolCode.INSTRUCTION.GROUP.LEAVE,
@@ -210,12 +1209,13 @@ class ChatAgent:
 
         if response.response == MessageProtocolResponse.OK:
             self.__user.group = None
+            self.__groups.discard(group_name)
 
         return response.response
 
     @single
     def leave_all_groups(self) -> MessageProtocolResponse:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+        response: MessageProtocol = self.__transaction(new_message_proto(
             src=self.__user,
             dst=None,
             message_type=MessageProtocolCode.INSTRUCTION.GROUP.LEAVE_ALL,
@@ -224,6 +1224,114 @@ class ChatAgent:
 
         if response.response == MessageProtocolResponse.OK:
             self.__user.group = None
+            self.__groups.clear()
+
+        return response.response
+
+    def presence_of(self, username: str) -> Presence:
+        """
+        :return: Presence of a peer as last pushed by the server (peers are pushed changes of the members of
+                 their groups and of their recent private message partners, see get_presence() for the others),
+                 kept while receiving (with a receive or presence callback)
+        """
+        return self.__presence.get(username, Presence(username, PresenceState.OFFLINE))
+
+    @single
+    def get_presence(self, usernames: list[str]) -> tuple[MessageProtocolResponse, list[Presence]]:
+        response: MessageProtocol = self.__transaction(new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.PRESENCE.QUERY,
+            body=list(usernames)
+        ))
+
+        return response.response, response.body
+
+    @single
+    def search(self,
+               query: str,
+               recipient: str | None = None,
+               group_name: str | None = None,
+               cursor: int | None = None,
+               limit: int = 20) -> tuple[MessageProtocolResponse, SearchPage]:
+        """
+        Search the text messages of a group (we're a member of) or of our private messages with a client
+        (if the server indexes private messages)
+
+        :param query: Words (all of them), prefixes (word*) and "quoted phrases"
+        :param cursor: Cursor of the previous page (see SearchPage), None for the latest messages
+        :param limit: Hits per page (at most 100)
+        """
+        if not (recipient or group_name):
+            raise ValueError('Either recipient or group name is required!')
+
+        response: MessageProtocol = self.__transaction(new_message_proto(
+            src=self.__user,
+            dst=new_user(username=recipient if not group_name else None, group=group_name),
+            message_type=MessageProtocolCode.INSTRUCTION.SEARCH.QUERY,
+            body=SearchQuery(text=query, cursor=cursor, limit=limit)
+        ))
+
+        return response.response, response.body
+
+    def set_presence(self, state: str) -> MessageProtocolResponse:
+        """
+        Set our presence to online or away (typing goes back to online with it), nothing is sent if it's unchanged
+        """
+        return self.__set_presence(state, None, None)
+
+    def typing(self, recipient: str | None = None, group_name: str | None = None) -> MessageProtocolResponse:
+        """
+        Tell a conversation we're typing, cheap enough to call on every keystroke: the server is told
+        at most every typing refresh, and typing ends by itself (or with set_presence())
+        """
+        if not (recipient or group_name):
+            raise ValueError('Either recipient or group name is required!')
+        return self.__set_presence(PresenceState.TYPING, recipient if not group_name else None, group_name)
+
+    @single
+    def __set_presence(self, state: str, recipient: str | None, group_name: str | None) -> MessageProtocolResponse:
+        now = time.monotonic()
+        setting = (state, recipient, group_name)
+        if setting == self.__presence_sent and (state != PresenceState.TYPING or
+                                                now - self.__typing_sent < self.__typing_refresh):
+            return MessageProtocolResponse.OK
+
+        response: MessageProtocol = self.__transaction(new_message_proto(
+            src=self.__user,
+            dst=new_user(username=recipient, group=group_name) if recipient or group_name else None,
+            message_type=MessageProtocolCode.INSTRUCTION.PRESENCE.SET,
+            body=state
+        ))
+
+        if response.response == MessageProtocolResponse.OK:
+            self.__presence_sent = setting
+            self.__typing_sent = now
+        return response.response
+
+    def mark_read(self, message: MessageProtocol):
+        """
+        Tell the sender (with the next batch of receipts) that a received message, and the ones before it
+        in the same conversation, were read
+        """
+        if self.__receipts:
+            self.__note_receipt(ReceiptState.READ, message)
+
+    @property
+    def last_seq(self) -> int | None:
+        """
+        :return: Sequence number of the last message sent by the calling thread, receipts refer to it
+        """
+        return getattr(self.__sent, 'seq', None)
+
+    @single
+    def __send_receipts(self, acks: list[tuple[str, str | None, str | None, int]]) -> MessageProtocolResponse:
+        response: MessageProtocol = self.__transaction(new_message_proto(
+            src=self.__user,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.RECEIPT.ACK,
+            body=acks
+        ))
 
         return response.response
 
@@ -231,34 +1339,40 @@ class ChatAgent:
     def send_private(self,
                      recipient: str,
                      data_type: MessageProtocolCode.Data,
-                     data: Any) -> MessageProtocolResponse:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+                     data: Any,
+                     ephemeral: bool = False) -> MessageProtocolResponse:
+        message = new_message_proto(
             src=self.__user,
             dst=new_user(username=recipient, group=None),
             message_type=data_type,
             body=data
-        ))
+        )
 
-        return response.response
+        if ephemeral and self.__udp_client:
+            return self.__send_datagram(message)
+        return self.__send_data(message)
 
     @single
     def send_group(self,
                    group_name: str,
                    data_type: MessageProtocolCode.Data,
-                   data: Any) -> MessageProtocolResponse:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+                   data: Any,
+                   ephemeral: bool = False) -> MessageProtocolResponse:
+        message = new_message_proto(
             src=self.__user,
             dst=new_user(username=None, group=group_name),
             message_type=data_type,
             body=data
-        ))
+        )
 
-        return response.response
+        if ephemeral and self.__udp_client:
+            return self.__send_datagram(message)
+        return self.__send_data(message)
 
     @single
     def announce(self,
                  data: str) -> MessageProtocolResponse:
-        response: MessageProtocol = self.__master_client.transaction(new_message_proto(
+        return self.__send_data(new_message_proto(
             src=self.__user,
             dst=None,
             message_type=MessageProtocolCode.DATA.PLAIN_TEXT,
@@ -266,33 +1380,35 @@ class ChatAgent:
             body=data
         ))
 
-        return response.response
+    def __dispatch(self, message: MessageProtocol):
+        if self.__dispatch_presence(message) or self.__dispatch_receipt(message):
+            return
+        if self.__receipts:
+            self.__note_receipt(ReceiptState.DELIVERED, message)
+        if self.__dispatch_voice(message) or self.__dispatch_media(message):
+            return
+        if self.__recv_callback:
+            self.__deliver(message)
 
-    def __start_receive(self,
-                        callback: Callable[[MessageProtocol], None] | None
-                        ) -> tuple[threading.Thread, list[threading.Thread]]:
+    def __start_receive(self, connection_flag: threading.Event) -> list[threading.Thread]:
         def message_receive(client: TcpClient):
-            if not callback:
-                return
-
             # Put in queue
-            while not self.__slave_flag.is_set():
-                rx = client.receive()
-                if rx and isinstance(rx, MessageProtocol):
-                    self.__receive_buffer.put(rx)
+            while not connection_flag.is_set():
+                try:
+                    rx = client.receive()
+                except Exception:
+                    self.__on_disconnect(connection_flag)
+                    return
+                if not (rx and isinstance(rx, MessageProtocol)):
+                    continue
 
-        def message_orchestration():
-            if not callback:
-                return
+                # A message that can't be handled is dropped, the connection is fine
+                try:
+                    self.__dispatch(rx)
+                except Exception as e:
+                    logger.warning(f'Unable to handle message {rx.message_type} from {rx.src}: {e!r}')
 
-            # Get from queue and call the callback function
-            while not self.__slave_flag.is_set():
-                while not self.__receive_buffer.empty():
-                    data = self.__receive_buffer.get()
-                    try:
-                        callback(data)
-                    except Exception:
-                        pass
+        # Read whether there are callbacks or not, a dropped server is noticed right away
 
         threads = [threading.Thread(
             target=message_receive,
@@ -303,6 +1419,79 @@ class ChatAgent:
         for thr in threads:
             thr.start()
 
+        return threads
+
+    def __start_heartbeat(self) -> threading.Thread:
+        def heartbeat():
+            delay = self.__heartbeat_interval
+            while not self.__slave_flag.wait(delay):
+                idle = time.monotonic() - self.__last_sent
+                if not self.connected:
+                    delay = self.__heartbeat_interval
+                    continue
+                if idle < self.__heartbeat_interval:
+                    delay = self.__heartbeat_interval - idle
+                    continue
+
+                delay = self.__heartbeat_interval
+                connection_flag = self.__connection_flag
+                if not self.__ping() and not self.__slave_flag.is_set():
+                    logger.warning('Server did not answer the heartbeat!')
+                    self.__on_disconnect(connection_flag)
+
+        thr = threading.Thread(
+            target=heartbeat,
+            daemon=True
+        )
+        thr.start()
+        return thr
+
+    def __start_receipts(self) -> threading.Thread:
+        def receipts():
+            while not self.__slave_flag.wait(self.__receipt_interval):
+                with self.__receipts_lock:
+                    pending, self.__receipts_pending = self.__receipts_pending, {}
+                if not pending or not self.connected:
+                    self.__requeue_receipts(pending)
+                    continue
+
+                try:
+                    self.__send_receipts([(state, group, sender, seq)
+                                          for (state, group, sender), seq in pending.items()])
+                except ConnectionError:
+                    # Sent once connected again
+                    self.__requeue_receipts(pending)
+
+        thr = threading.Thread(
+            target=receipts,
+            daemon=True
+        )
+        thr.start()
+        return thr
+
+    def __requeue_receipts(self, pending: dict[tuple[str, str | None, str | None], int]):
+        with self.__receipts_lock:
+            for key, seq in pending.items():
+                if seq > self.__receipts_pending.get(key, 0):
+                    self.__receipts_pending[key] = seq
+
+    def __start_orchestration(self, callback: Callable[[MessageProtocol], None] | None) -> threading.Thread:
+        def message_orchestration():
+            if not callback:
+                return
+
+            # Get from queue and call the callback function
+            # (block on the queue instead of spinning, so real-time threads keep the interpreter)
+            while not self.__slave_flag.is_set():
+                try:
+                    data = self.__receive_buffer.get(timeout=0.25)
+                except queue.Empty:
+                    continue
+                try:
+                    callback(data)
+                except Exception:
+                    pass
+
         orchestrator = threading.Thread(
             target=message_orchestration,
             daemon=True
@@ -310,4 +1499,70 @@ class ChatAgent:
 
         orchestrator.start()
 
-        return orchestrator, threads
+        return orchestrator
+
+    def __start_udp_receive(self, udp_client: UdpClient, connection_flag: threading.Event) -> threading.Thread:
+        def datagram_receive():
+            reassembler = DatagramReassembler()
+            while not connection_flag.is_set():
+                try:
+                    datagram = udp_client.receive_datagram(timeout=0.5)
+                except OSError:
+                    break
+                if not datagram:
+                    reassembler.expire()
+                    continue
+
+                if assembled := reassembler.feed(datagram):
+                    try:
+                        rx = deserialize_frame(assembled[1])
+                    except Exception:
+                        continue
+                    if validate_message(rx) and not self.__dispatch_voice(rx) and self.__recv_callback:
+                        self.__receive_buffer.put(rx)
+
+        thr = threading.Thread(
+            target=datagram_receive,
+            daemon=True
+        )
+        thr.start()
+        return thr
+
+    def __start_master_receive(self, connection_flag: threading.Event) -> threading.Thread:
+        master_client = self.__master_client
+
+        def response_receive():
+            try:
+                while not connection_flag.is_set():
+                    rx = master_client.receive()
+                    if not (rx and isinstance(rx, MessageProtocol)):
+                        continue
+
+                    if rx.message_flag in (MessageProtocolFlag.ACK, MessageProtocolFlag.NACK):
+                        self.__on_ack(rx)
+                        continue
+
+                    with self.__pending_lock:
+                        future = self.__pending.popleft() if self.__pending else None
+
+                    if future:
+                        future.set_result(rx)
+                    else:
+                        logger.warning('Received a response without a pending request!')
+            except Exception as e:
+                logger.warning(f'Master connection is closed: {e}')
+                self.__on_disconnect(connection_flag)
+
+            # Nobody is going to answer the rest
+            with self.__pending_lock:
+                while self.__pending:
+                    self.__pending.popleft().set_exception(ConnectionError('Connection with the server is closed!'))
+            with self.__ack_cond:
+                self.__ack_cond.notify_all()
+
+        thr = threading.Thread(
+            target=response_receive,
+            daemon=True
+        )
+        thr.start()
+        return thr
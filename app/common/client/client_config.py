@@ -1,3 +1,31 @@
+import dataclasses
+
 REMOTE_HOST = 'localhost'
 REMOTE_TCP_PORT = 50000
 REMOTE_UDP_PORT = 60000
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class ConnectionOptions:
+    """
+    How the connection with the server is kept up
+
+    :param reconnect: Reconnect (to any of the servers) when the connection drops
+    :param reconnect_delay: Upper bound of the first reconnection delay (in seconds), doubled on every failure
+    :param max_reconnect_delay: Upper bound of any reconnection delay (in seconds)
+    :param retry_timeout: Time (in seconds) a request cut off by a dropped connection waits to be sent again
+                          once reconnected, 0 to fail right away (a message may then be delivered twice)
+    :param connect_timeout: Timeout (in seconds) of each connection attempt
+    :param heartbeat_interval: Ping the server after this many seconds without sending anything, 0 to disable
+                               (keep it well below the server's heartbeat timeout)
+    :param heartbeat_timeout: Time (in seconds) to wait for the answer to a ping before reconnecting
+    :param keepalive_idle: Time (in seconds) without traffic before TCP keepalive probes start, 0 to disable
+    """
+    reconnect: bool = True
+    reconnect_delay: float = 0.1
+    max_reconnect_delay: float = 5.0
+    retry_timeout: float = 10.0
+    connect_timeout: float = 2.0
+    heartbeat_interval: float = 15.0
+    heartbeat_timeout: float = 5.0
+    keepalive_idle: int = 30
@@ -1,8 +1,10 @@
-from typing import Any
+from typing import Any, Callable
 
 from .. import *
+from .failover import Backoff
 from abc import abstractmethod
 import socket
+import ssl
 import time
 
 
@@ -19,10 +21,10 @@ class Client:
         pass
 
     @abstractmethod
-    def receive(self, buffer_size: int):
+    def receive(self, buffer_size: int | None):
         pass
 
-    def transaction(self, data: Any, buffer_size: int = 16384):
+    def transaction(self, data: Any, buffer_size: int | None = None):
         self.send(data)
         return self.receive(buffer_size)
 
@@ -58,21 +60,56 @@ class TcpClient(Client):
                  remote_host: str,
                  remote_port: int,
                  retry: float = 1.0,
-                 max_retries: int = 3):
+                 max_retries: int = 3,
+                 timeout: float | None = None,
+                 ssl_context: ssl.SSLContext | None = None,
+                 server_hostname: str | None = None,
+                 tls_session: ssl.SSLSession | None = None,
+                 file_sink: Callable[[MessageProtocol, int], MappedFile | None] | None = None,
+                 profile: SocketProfile | None = None):
+        """
+        :param retry: Upper bound of the first retry delay (in seconds), doubled on every retry (with jitter)
+        :param max_retries: Number of retries after the first attempt fails
+        :param timeout: Timeout (in seconds) of each connection attempt
+        :param ssl_context: Connect over TLS with this context (see new_tls_client_context())
+        :param server_hostname: Name to verify the server certificate against (default: remote host)
+        :param tls_session: Session of a previous connection to the same server to resume (skips the full handshake)
+        :param file_sink: Gives the files large bytes bodies are received into (see tcp_sock_recv())
+        :param profile: Options of the connection (see apply_socket_profile())
+        """
         super().__init__(name, remote_host, remote_port, new_socket('tcp'))
+        self.__file_sink = file_sink
 
+        backoff = Backoff(base=retry, cap=max(retry, 1.0) * 8)
         while True:
             try:
                 try:
+                    self._sock.settimeout(timeout)
                     self._sock.connect(self.address)
+                    if ssl_context:
+                        self._sock = ssl_context.wrap_socket(self._sock,
+                                                             server_hostname=server_hostname or remote_host,
+                                                             session=tls_session)
+                    if profile:
+                        apply_socket_profile(self._sock, profile)
+                    self._sock.settimeout(None)
                     self._status = True
                     break
+                except ssl.SSLError as e:
+                    # Retrying won't fix a certificate or protocol mismatch
+                    logger.error(f'TLS handshake failed: {e}')
+                    break
                 except socket.error:
-                    if not max_retries:
+                    if backoff.attempt >= max_retries:
                         break
-                    while max_retries := max_retries - 1:
-                        logger.error(f'Error connecting to server, retrying in {retry} s... ({max_retries})')
-                        time.sleep(retry)
+                    delay = backoff.next()
+                    logger.error(f'Error connecting to server, retrying in {delay:.2f} s... '
+                                 f'({max_retries - backoff.attempt + 1})')
+                    time.sleep(delay)
+
+                    # A failed connection attempt leaves the socket unusable
+                    self._sock.close()
+                    self._sock = new_socket('tcp')
             except KeyboardInterrupt:
                 logger.warning(f'User interrupted connection retry! Exiting...')
                 break
@@ -86,19 +123,71 @@ class TcpClient(Client):
             logger.exception(f'Error sending data: {e}')
             raise
 
-    def receive(self, buffer_size: int = 16384):
+    def send_frames(self, frames: list[bytes]):
         try:
-            return tcp_sock_recv(self._sock, buffer_size)
+            tcp_sock_send_frames(self._sock, frames)
+        except socket.error as e:
+            logger.exception(f'Error sending data: {e}')
+            raise
+
+    def receive(self, buffer_size: int | None = None, timeout: float | None = 1.0):
+        try:
+            return tcp_sock_recv(self._sock, buffer_size, timeout=timeout, file_sink=self.__file_sink)
         except socket.timeout:
             pass
         except socket.error as e:
             logger.exception(f'Error receiving data: {e}')
             raise
 
+    def shutdown(self):
+        """
+        Wake up threads blocked on this socket (they see the connection closed)
+        """
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.shutdown()
+        super().close()
+
+    @property
+    def nodelay(self) -> bool:
+        return bool(self._sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+
+    @nodelay.setter
+    def nodelay(self, v: bool):
+        set_nodelay(self._sock, v)
+
+    @property
+    def tls_session(self) -> ssl.SSLSession | None:
+        """
+        Session to resume on further connections to the same server
+        (with TLS 1.3 only once something has been received, tickets come after the handshake)
+        """
+        return self._sock.session if isinstance(self._sock, ssl.SSLSocket) else None
+
+    @property
+    def tls_resumed(self) -> bool:
+        return isinstance(self._sock, ssl.SSLSocket) and self._sock.session_reused
+
+    def keepalive(self, idle: int = 30, interval: int = 10, count: int = 3):
+        """
+        Tune TCP keepalive of the connection, see set_keepalive()
+        """
+        set_keepalive(self._sock, idle=idle, interval=interval, count=count)
+
 
 class UdpClient(Client):
     def __init__(self, name: str, remote_host: str, remote_port: int):
         super().__init__(name, remote_host, remote_port, new_socket('udp'))
+        # Datagrams are only taken from this address (the host resolved)
+        self.__remote = socket.getaddrinfo(remote_host, remote_port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+
+        # Bind right away so receiving can start before anything is sent
+        self._sock.bind(('', 0))
+        self._status = True
 
     def send(self, data: Any):
         try:
@@ -109,11 +198,31 @@ class UdpClient(Client):
             logger.exception(f'Error sending data: {e}')
             raise
 
-    def receive(self, buffer_size: int = 16384):
+    def send_datagrams(self, datagrams: list[bytes]):
+        try:
+            for datagram in datagrams:
+                self._sock.sendto(datagram, self.address)
+        except socket.error as e:
+            logger.warning(f'Error sending datagram: {e}')
+
+    def receive(self, buffer_size: int | None = None):
         try:
-            return udp_sock_recvfrom(self._sock, buffer_size)[0]
+            return udp_sock_recvfrom(self._sock, buffer_size or 65535)[0]
         except socket.timeout:
             pass
         except socket.error as e:
             logger.exception(f'Error receiving data: {e}')
             raise
+
+    def receive_datagram(self, timeout: float | None = 1.0) -> bytes | None:
+        """
+        Receive one raw datagram from the remote host, returns None if a timeout occurs
+        """
+        self._sock.settimeout(timeout)
+        try:
+            while True:
+                data, addr = self._sock.recvfrom(65535)
+                if addr == self.__remote:
+                    return data
+        except (socket.timeout, ConnectionResetError):
+            return None
@@ -0,0 +1,14 @@
+import dataclasses
+
+
+@dataclasses.dataclass(init=True, repr=True)
+class FileDownload:
+    sender: str | None
+    filename: str
+    path: str
+    total_size: int
+    received: int = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.received >= self.total_size
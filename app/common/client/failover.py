@@ -0,0 +1,69 @@
+import random
+import socket
+import threading
+import time
+
+from .. import new_socket
+
+
+class Backoff:
+    def __init__(self, base: float = 0.1, cap: float = 10.0):
+        """
+        Exponential backoff with full jitter
+
+        The n-th delay is drawn uniformly from [0, min(cap, base * 2^n)], so clients dropped at the same time
+        don't all come back at once.
+
+        :param base: Upper bound of the first delay (in seconds)
+        :param cap: Upper bound of any delay (in seconds)
+        """
+        self.__base = base
+        self.__cap = cap
+        self.__attempt = 0
+
+    def next(self) -> float:
+        delay = random.uniform(0, min(self.__cap, self.__base * (1 << min(self.__attempt, 32))))
+        self.__attempt += 1
+        return delay
+
+    def reset(self):
+        self.__attempt = 0
+
+    @property
+    def attempt(self) -> int:
+        return self.__attempt
+
+
+def probe_latency(address: tuple[str, int], timeout: float = 0.5) -> float | None:
+    """
+    Time (in seconds) to open a TCP connection, None if the endpoint is unreachable
+    """
+    sock = new_socket('tcp')
+    sock.settimeout(timeout)
+    started = time.perf_counter()
+    try:
+        sock.connect(address)
+        return time.perf_counter() - started
+    except (socket.error, OverflowError):
+        return None
+    finally:
+        sock.close()
+
+
+def rank_by_latency(endpoints: list[tuple[str, int]], timeout: float = 0.5) -> list[tuple[str, int]]:
+    """
+    Probe every endpoint at once, fastest first, unreachable endpoints last
+    """
+    latencies: list[float | None] = [None] * len(endpoints)
+
+    def probe(i: int):
+        latencies[i] = probe_latency(endpoints[i], timeout=timeout)
+
+    threads = [threading.Thread(target=probe, args=(i,), daemon=True) for i in range(len(endpoints))]
+    for thr in threads:
+        thr.start()
+    for thr in threads:
+        thr.join()
+
+    order = sorted(range(len(endpoints)), key=lambda i: (latencies[i] is None, latencies[i] or 0.))
+    return [endpoints[i] for i in order]
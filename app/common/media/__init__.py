@@ -0,0 +1,20 @@
+from .voice import *
+from .stream import *
+
+__all__ = [
+    'VoiceFormat',
+    'VoiceFrame',
+    'VoiceCall',
+    'JitterBuffer',
+    'PcmCodec',
+    'MuLawCodec',
+    'WavSource',
+    'WavSink',
+    'PyAudioSource',
+    'PyAudioSink',
+    'mix_frames',
+    'MediaChunk',
+    'MediaStreamState',
+    'MediaReceiver',
+    'iter_media_chunks'
+]
@@ -0,0 +1,228 @@
+import collections
+import dataclasses
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Iterable, Iterator
+
+from .. import logger, uniquify
+
+
+@dataclasses.dataclass(init=True, repr=False, order=True, frozen=True)
+class MediaChunk:
+    stream_id: str
+    index: int
+    offset: int
+    keyframe: bool
+    final: bool
+    filename: str
+    total_size: int
+    payload: bytes
+
+    def __repr__(self):
+        return (f'MediaChunk(stream_id={self.stream_id}, index={self.index}, offset={self.offset}, '
+                f'keyframe={self.keyframe}, final={self.final}, payload={len(self.payload)} bytes)')
+
+
+def iter_media_chunks(path: str,
+                      chunk_size: int = 65536,
+                      keyframe_interval: int = 16,
+                      keyframes: Iterable[int] | None = None) -> Iterator[MediaChunk]:
+    """
+    Read a media file as a stream of chunks, without loading the whole file
+
+    :param path: Media file path
+    :param chunk_size: Payload size of each chunk
+    :param keyframe_interval: Mark every n-th chunk as a keyframe (resynchronization point)
+    :param keyframes: Byte offsets of keyframes (e.g. from a container index), overrides the interval
+    """
+    stream_id = uuid.uuid4().hex
+    filename = os.path.basename(path)
+    total_size = os.path.getsize(path)
+    keyframe_offsets = sorted(keyframes) if keyframes is not None else None
+
+    with open(path, mode='rb') as f:
+        index = 0
+        offset = 0
+        while True:
+            payload = f.read(chunk_size)
+            final = offset + len(payload) >= total_size
+
+            if keyframe_offsets is None:
+                keyframe = index % keyframe_interval == 0
+            else:
+                # A chunk is a keyframe if it starts one
+                while keyframe_offsets and keyframe_offsets[0] < offset:
+                    keyframe_offsets.pop(0)
+                keyframe = index == 0 or bool(keyframe_offsets and keyframe_offsets[0] < offset + len(payload))
+
+            yield MediaChunk(stream_id=stream_id,
+                             index=index,
+                             offset=offset,
+                             keyframe=keyframe,
+                             final=final,
+                             filename=filename,
+                             total_size=total_size,
+                             payload=payload)
+
+            if final:
+                break
+            index += 1
+            offset += len(payload)
+
+
+@dataclasses.dataclass(init=True, repr=True)
+class MediaStreamState:
+    sender: str
+    path: str
+    total_size: int
+    received: int = 0
+    keyframes: int = 0
+
+
+class _Stream:
+    __slots__ = ('state', 'file', 'lock', 'indexes', 'last_seen')
+
+    def __init__(self, state: MediaStreamState, f):
+        self.state = state
+        self.file = f
+        self.lock = threading.Lock()
+        # Chunks written, duplicates (e.g. sent again after a reconnection) are counted once
+        self.indexes: set[int] = set()
+        self.last_seen = time.monotonic()
+
+
+class MediaReceiver:
+    def __init__(self,
+                 directory: str,
+                 on_progress: Callable[[MediaStreamState, MediaChunk], None] | None = None,
+                 on_complete: Callable[[MediaStreamState], None] | None = None,
+                 on_expire: Callable[[MediaStreamState], None] | None = None,
+                 timeout: float = 60.0,
+                 max_completed: int = 1024):
+        """
+        Save media streams progressively as their chunks arrive (in any order)
+
+        :param directory: Directory to save media to
+        :param on_progress: Callback function on every chunk written (e.g. to render up to the last keyframe)
+        :param on_complete: Callback function when every byte of a stream is written
+        :param on_expire: Callback function when an incomplete stream is given up (its file is removed)
+        :param timeout: Time (in seconds) without a chunk after which an incomplete stream is given up
+        :param max_completed: Completed streams remembered, so late duplicates of their chunks are ignored
+        """
+        self.__directory = directory
+        self.__on_progress = on_progress
+        self.__on_complete = on_complete
+        self.__on_expire = on_expire
+        self.__timeout = timeout
+        self.__max_completed = max_completed
+
+        self.__streams: dict[str, _Stream] = {}
+        self.__completed: collections.OrderedDict[str, None] = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__timer: threading.Timer | None = None
+
+    def feed(self, sender: str, chunk: MediaChunk):
+        with self.__lock:
+            if chunk.stream_id in self.__completed:
+                return
+
+            stream = self.__streams.get(chunk.stream_id)
+            if stream is None:
+                path = uniquify(os.path.join(self.__directory, os.path.basename(chunk.filename)))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                f = open(path, mode='wb')
+                f.truncate(chunk.total_size)
+
+                state = MediaStreamState(sender=sender, path=path, total_size=chunk.total_size)
+                stream = self.__streams[chunk.stream_id] = _Stream(state, f)
+                logger.info(f'Receiving {chunk.filename} from {sender} as "{path}"')
+                self.__schedule_expiry()
+
+            stream.last_seen = time.monotonic()
+
+        state, f = stream.state, stream.file
+        with stream.lock:
+            if f.closed or chunk.index in stream.indexes:
+                return
+            stream.indexes.add(chunk.index)
+
+            f.seek(chunk.offset)
+            f.write(chunk.payload)
+            state.received += len(chunk.payload)
+            state.keyframes += chunk.keyframe
+
+            if self.__on_progress:
+                f.flush()
+                self.__on_progress(state, chunk)
+
+            if state.received < state.total_size:
+                return
+
+            f.close()
+
+        with self.__lock:
+            self.__streams.pop(chunk.stream_id, None)
+            self.__completed[chunk.stream_id] = None
+            if len(self.__completed) > self.__max_completed:
+                self.__completed.popitem(last=False)
+
+        if self.__on_complete:
+            self.__on_complete(state)
+
+    def expire(self):
+        """
+        Give up the streams without a chunk for longer than the timeout: their files are closed and removed
+        """
+        deadline = time.monotonic() - self.__timeout
+        with self.__lock:
+            expired = [(stream_id, stream) for stream_id, stream in self.__streams.items()
+                       if stream.last_seen < deadline]
+            for stream_id, _ in expired:
+                self.__streams.pop(stream_id)
+
+        for _, stream in expired:
+            with stream.lock:
+                stream.file.close()
+            try:
+                os.remove(stream.state.path)
+            except OSError:
+                pass
+
+            logger.warning(f'Gave up {stream.state.path} from {stream.state.sender} '
+                           f'({stream.state.received}/{stream.state.total_size} bytes)')
+            if self.__on_expire:
+                self.__on_expire(stream.state)
+
+    def close(self):
+        """
+        Give up every stream still incomplete
+        """
+        with self.__lock:
+            if self.__timer:
+                self.__timer.cancel()
+            self.__timeout = -1.
+        self.expire()
+
+    def __schedule_expiry(self):
+        # One timer while streams are incomplete (called with the lock held)
+        if self.__timer is not None or self.__timeout < 0:
+            return
+
+        def run():
+            self.expire()
+            with self.__lock:
+                self.__timer = None
+                if self.__streams:
+                    self.__schedule_expiry()
+
+        self.__timer = threading.Timer(self.__timeout / 2, run)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    @property
+    def streams(self) -> list[MediaStreamState]:
+        with self.__lock:
+            return [stream.state for stream in self.__streams.values()]
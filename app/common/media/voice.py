@@ -0,0 +1,421 @@
+import array
+import dataclasses
+import heapq
+import itertools
+import sys
+import threading
+import time
+import warnings
+import wave
+from typing import Any, Callable
+
+from .. import logger
+
+# Optional dependencies: audioop for the u-law codec (standard library until Python 3.13),
+# PyAudio for capturing and playing audio on real hardware
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:
+        audioop = None
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class VoiceFormat:
+    sample_rate: int = 16000
+    channels: int = 1
+    sample_width: int = 2
+    frame_duration: float = 0.02
+
+    @property
+    def frame_samples(self) -> int:
+        return int(self.sample_rate * self.frame_duration)
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.frame_samples * self.channels * self.sample_width
+
+    @property
+    def silence(self) -> bytes:
+        return bytes(self.frame_bytes)
+
+
+@dataclasses.dataclass(init=True, repr=False, order=True, frozen=True)
+class VoiceFrame:
+    seq: int
+    timestamp: float
+    codec: str
+    payload: bytes
+
+    def __repr__(self):
+        return f'VoiceFrame(seq={self.seq}, codec={self.codec}, payload={len(self.payload)} bytes)'
+
+
+# ================================ Codecs ================================ #
+
+class PcmCodec:
+    name = 'pcm'
+
+    def encode(self, pcm: bytes) -> bytes:
+        return pcm
+
+    def decode(self, data: bytes) -> bytes:
+        return data
+
+
+class MuLawCodec:
+    name = 'ulaw'
+
+    def __init__(self, sample_width: int = 2):
+        if audioop is None:
+            raise RuntimeError('u-law codec requires audioop (Python 3.12 or lower)')
+        self.__sample_width = sample_width
+
+    def encode(self, pcm: bytes) -> bytes:
+        return audioop.lin2ulaw(pcm, self.__sample_width)
+
+    def decode(self, data: bytes) -> bytes:
+        return audioop.ulaw2lin(data, self.__sample_width)
+
+
+def new_codec(name: str | None, fmt: VoiceFormat) -> PcmCodec | MuLawCodec:
+    if name == MuLawCodec.name:
+        return MuLawCodec(fmt.sample_width)
+    return PcmCodec()
+
+
+# ================================ Sources and sinks ================================ #
+
+class WavSource:
+    paced = False
+
+    def __init__(self, path: str, fmt: VoiceFormat = VoiceFormat()):
+        """
+        Read fixed-duration PCM frames from a WAV file (for headless use)
+        """
+        self.__wav = wave.open(path, 'rb')
+        self.__fmt = fmt
+
+        if (self.__wav.getframerate(), self.__wav.getnchannels(), self.__wav.getsampwidth()) != \
+                (fmt.sample_rate, fmt.channels, fmt.sample_width):
+            raise ValueError(f'WAV file {path} does not match {fmt}')
+
+    def read(self) -> bytes | None:
+        data = self.__wav.readframes(self.__fmt.frame_samples)
+        if not data:
+            return None
+        return data.ljust(self.__fmt.frame_bytes, b'\x00')
+
+    def close(self):
+        self.__wav.close()
+
+
+class WavSink:
+    def __init__(self, path: str, fmt: VoiceFormat = VoiceFormat()):
+        self.__wav = wave.open(path, 'wb')
+        self.__wav.setframerate(fmt.sample_rate)
+        self.__wav.setnchannels(fmt.channels)
+        self.__wav.setsampwidth(fmt.sample_width)
+
+    def write(self, pcm: bytes):
+        self.__wav.writeframes(pcm)
+
+    def close(self):
+        self.__wav.close()
+
+
+class PyAudioSource:
+    # Reading from the device blocks for one frame duration already
+    paced = True
+
+    def __init__(self, fmt: VoiceFormat = VoiceFormat()):
+        if pyaudio is None:
+            raise RuntimeError('Audio capture requires PyAudio')
+
+        self.__fmt = fmt
+        self.__audio = pyaudio.PyAudio()
+        self.__stream = self.__audio.open(format=self.__audio.get_format_from_width(fmt.sample_width),
+                                          channels=fmt.channels,
+                                          rate=fmt.sample_rate,
+                                          input=True,
+                                          frames_per_buffer=fmt.frame_samples)
+
+    def read(self) -> bytes | None:
+        return self.__stream.read(self.__fmt.frame_samples, exception_on_overflow=False)
+
+    def close(self):
+        self.__stream.close()
+        self.__audio.terminate()
+
+
+class PyAudioSink:
+    def __init__(self, fmt: VoiceFormat = VoiceFormat()):
+        if pyaudio is None:
+            raise RuntimeError('Audio playback requires PyAudio')
+
+        self.__audio = pyaudio.PyAudio()
+        self.__stream = self.__audio.open(format=self.__audio.get_format_from_width(fmt.sample_width),
+                                          channels=fmt.channels,
+                                          rate=fmt.sample_rate,
+                                          output=True,
+                                          frames_per_buffer=fmt.frame_samples)
+
+    def write(self, pcm: bytes):
+        self.__stream.write(pcm)
+
+    def close(self):
+        self.__stream.close()
+        self.__audio.terminate()
+
+
+# ================================ Jitter buffer ================================ #
+
+class JitterBuffer:
+    def __init__(self, delay: float = 0.06, max_frames: int = 50):
+        """
+        Reorder voice frames of one speaker and hold them for a fixed playout delay
+
+        :param delay: Playout delay (in seconds) after the first frame arrives
+        :param max_frames: Maximum number of frames held (oldest are dropped first)
+        """
+        self.__delay = delay
+        self.__max_frames = max_frames
+
+        self.__heap: list[tuple[int, VoiceFrame]] = []
+        self.__next_seq: int | None = None
+        self.__playout_at: float | None = None
+        self.__last_arrival = 0.
+        self.__lock = threading.Lock()
+
+    def put(self, frame: VoiceFrame):
+        with self.__lock:
+            self.__last_arrival = time.monotonic()
+
+            # Too late to be played
+            if self.__next_seq is not None and frame.seq < self.__next_seq:
+                return
+
+            if self.__playout_at is None:
+                self.__playout_at = self.__last_arrival + self.__delay
+
+            if len(self.__heap) >= self.__max_frames:
+                heapq.heappop(self.__heap)
+            heapq.heappush(self.__heap, (frame.seq, frame))
+
+    def pop(self) -> tuple[bool, VoiceFrame | None]:
+        """
+        Frame to be played now
+
+        :return: Whether the speaker is playing, and the frame (None if it's lost)
+        """
+        with self.__lock:
+            if self.__playout_at is None or time.monotonic() < self.__playout_at:
+                return False, None
+
+            if self.__next_seq is None:
+                self.__next_seq = self.__heap[0][0] if self.__heap else 0
+
+            while self.__heap and self.__heap[0][0] < self.__next_seq:
+                heapq.heappop(self.__heap)
+
+            expected = self.__next_seq
+            self.__next_seq += 1
+
+            if self.__heap and self.__heap[0][0] == expected:
+                return True, heapq.heappop(self.__heap)[1]
+            return True, None
+
+    def idle(self, timeout: float) -> bool:
+        return time.monotonic() - self.__last_arrival >= timeout
+
+    @property
+    def size(self) -> int:
+        return len(self.__heap)
+
+
+def mix_frames(frames: list[bytes], sample_width: int = 2) -> bytes:
+    """
+    Mix PCM frames of equal length with clipping
+    """
+    if len(frames) == 1:
+        return frames[0]
+
+    if audioop is not None:
+        mixed = frames[0]
+        for frame in frames[1:]:
+            mixed = audioop.add(mixed, frame, sample_width)
+        return mixed
+
+    limit = (1 << (8 * sample_width - 1)) - 1
+    samples = [_unpack_samples(frame, sample_width) for frame in frames]
+    return _pack_samples([max(-limit - 1, min(limit, sum(values))) for values in zip(*samples)], sample_width)
+
+
+# Signed little-endian samples by width, as audioop takes them (24-bit samples have no array type)
+_SAMPLE_TYPES = {1: 'b', 2: 'h', 4: 'i' if array.array('i').itemsize == 4 else 'l'}
+
+
+def _unpack_samples(frame: bytes, sample_width: int) -> list[int]:
+    typecode = _SAMPLE_TYPES.get(sample_width)
+    if typecode is None:
+        return [int.from_bytes(frame[i:i + sample_width], 'little', signed=True)
+                for i in range(0, len(frame), sample_width)]
+
+    samples = array.array(typecode, frame)
+    if sys.byteorder != 'little':
+        samples.byteswap()
+    return samples.tolist()
+
+
+def _pack_samples(values: list[int], sample_width: int) -> bytes:
+    typecode = _SAMPLE_TYPES.get(sample_width)
+    if typecode is None:
+        return b''.join(value.to_bytes(sample_width, 'little', signed=True) for value in values)
+
+    samples = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        samples.byteswap()
+    return samples.tobytes()
+
+
+# ================================ Call ================================ #
+
+class VoiceCall:
+    def __init__(self,
+                 send: Callable[[VoiceFrame], Any],
+                 source=None,
+                 sink=None,
+                 fmt: VoiceFormat = VoiceFormat(),
+                 codec: str | None = None,
+                 jitter_delay: float = 0.06,
+                 idle_timeout: float = 1.0):
+        """
+        Real-time voice pipeline: source -> codec -> send, and receive -> jitter buffers -> mixer -> sink
+
+        With 20 ms frames and a 60 ms jitter buffer, the mouth-to-ear latency stays around 100 ms on a LAN.
+
+        :param send: Function to send one encoded frame (usually an ephemeral message)
+        :param source: Frame source (WavSource, PyAudioSource), None to listen only
+        :param sink: Frame sink (WavSink, PyAudioSink), None to talk only
+        :param fmt: PCM format shared by every participant
+        :param codec: Codec name ('pcm' or 'ulaw')
+        :param jitter_delay: Playout delay (in seconds) of every speaker
+        :param idle_timeout: Time (in seconds) after which a silent speaker is dropped from the mix
+        """
+        self.__send = send
+        self.__source = source
+        self.__sink = sink
+        self.__fmt = fmt
+        self.__codec = new_codec(codec, fmt)
+        self.__jitter_delay = jitter_delay
+        self.__idle_timeout = idle_timeout
+
+        self.__speakers: dict[str, JitterBuffer] = {}
+        self.__speakers_lock = threading.Lock()
+        self.__decoders: dict[str, PcmCodec | MuLawCodec] = {}
+        self.__seq = itertools.count()
+
+        self.__stop_flag = threading.Event()
+        self.__threads: list[threading.Thread] = []
+
+    def start(self):
+        for target, enabled in ((self.__capture_loop, self.__source), (self.__playout_loop, self.__sink)):
+            if enabled:
+                thr = threading.Thread(target=target, daemon=True)
+                thr.start()
+                self.__threads.append(thr)
+        return self
+
+    def stop(self):
+        self.__stop_flag.set()
+        for thr in self.__threads:
+            if thr is not threading.current_thread():
+                thr.join()
+
+        for device in (self.__source, self.__sink):
+            if device:
+                device.close()
+
+    def receive(self, speaker: str, frame: VoiceFrame):
+        with self.__speakers_lock:
+            if speaker not in self.__speakers:
+                self.__speakers[speaker] = JitterBuffer(delay=self.__jitter_delay)
+            buffer = self.__speakers[speaker]
+        buffer.put(frame)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the source is exhausted
+        """
+        if not self.__threads or not self.__source:
+            return True
+        self.__threads[0].join(timeout=timeout)
+        return not self.__threads[0].is_alive()
+
+    @property
+    def speakers(self) -> list[str]:
+        with self.__speakers_lock:
+            return list(self.__speakers)
+
+    def __capture_loop(self):
+        started = time.monotonic()
+        while not self.__stop_flag.is_set():
+            pcm = self.__source.read()
+            if pcm is None:
+                break
+
+            seq = next(self.__seq)
+            try:
+                self.__send(VoiceFrame(seq=seq,
+                                       timestamp=time.time(),
+                                       codec=self.__codec.name,
+                                       payload=self.__codec.encode(pcm)))
+            except Exception as e:
+                logger.warning(f'Unable to send voice frame {seq}: {e}')
+
+            # Pace file sources in real time
+            if not self.__source.paced:
+                delay = started + (seq + 1) * self.__fmt.frame_duration - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def __playout_loop(self):
+        next_tick = time.monotonic()
+        while not self.__stop_flag.is_set():
+            frames = []
+            with self.__speakers_lock:
+                speakers = list(self.__speakers.items())
+
+            for speaker, buffer in speakers:
+                if buffer.idle(self.__idle_timeout) and not buffer.size:
+                    with self.__speakers_lock:
+                        self.__speakers.pop(speaker, None)
+                    continue
+
+                playing, frame = buffer.pop()
+                if not playing:
+                    continue
+                if frame is None:
+                    # Lost frame, conceal with silence
+                    frames.append(self.__fmt.silence)
+                    continue
+                if frame.codec not in self.__decoders:
+                    self.__decoders[frame.codec] = new_codec(frame.codec, self.__fmt)
+                frames.append(self.__decoders[frame.codec].decode(frame.payload))
+
+            if frames:
+                self.__sink.write(mix_frames(frames, self.__fmt.sample_width))
+
+            next_tick += self.__fmt.frame_duration
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind (e.g. blocking sink), start over from now
+                next_tick = time.monotonic()
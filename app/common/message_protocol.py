@@ -3,6 +3,11 @@ from typing import Any
 from .serializer import serialize, deserialize
 from .user import User
 import dataclasses
+import hashlib
+import struct
+
+# Bumped on incompatible wire changes, advertised by servers on local discovery
+PROTOCOL_VERSION = 4
 
 
 class MessageProtocolResponse:
@@ -23,6 +28,7 @@ class MessageProtocolCode:
         class BROADCAST:
             CLIENT_DISC = 1004
             SERVER_DISC = 1005
+            QUERY = 1006
 
         class CLIENT:
             LIST = 2000
@@ -36,6 +42,40 @@ class MessageProtocolCode:
             LEAVE_ALL = 3004
             CREATE = 3005
 
+        class UDP:
+            JOIN = 4000
+            REGISTER = 4001
+
+        class BLOB:
+            HAS = 5000
+            PUT = 5001
+            GET = 5002
+
+        class SESSION:
+            RESUME = 6000
+            ATTACH = 6001
+
+        class HEARTBEAT:
+            PING = 7000
+            PONG = 7001
+
+        class RELAY:
+            JOIN = 8000
+            SUBSCRIBE = 8001
+            GROUPS = 8002
+
+        class PRESENCE:
+            SET = 9000
+            UPDATE = 9001
+            QUERY = 9002
+
+        class RECEIPT:
+            ACK = 10000
+            UPDATE = 10001
+
+        class SEARCH:
+            QUERY = 11000
+
     class DATA:
         NULL = 100
         PLAIN_TEXT = 101
@@ -59,9 +99,52 @@ class MessageProtocolCode:
 
 class MessageProtocolFlag:
     ANNOUNCE = 10001
+    ACK = 10002
+    NACK = 10003
+
+
+class MessageProtocolAck:
+    SYNC = 0
+    NONE = 1
+    CUMULATIVE = 2
+
+
+class PresenceState:
+    ONLINE = 'online'
+    AWAY = 'away'
+    TYPING = 'typing'
+    OFFLINE = 'offline'
+
+
+class ReceiptState:
+    DELIVERED = 'delivered'
+    READ = 'read'
+
+
+class MessagePriority:
+    """
+    Send priority classes, a class is only sent when no higher one (lower value) is waiting
+    """
+    CONTROL = 0
+    INTERACTIVE = 1
+    BULK = 2
+
+
+# Payloads (in bytes) above which a message is a bulk transfer, whatever its type
+BULK_THRESHOLD = 64 * 1024
 
 
-@dataclasses.dataclass(init=True, repr=True, order=True)
+# Marks a body not decoded yet
+_UNDECODED = object()
+
+# Wire format of a message: this header (marker, size of the routing header), the routing header (everything
+# but the body, serialized), then the serialized body as is. Routing only decodes the routing header,
+# the body is forwarded untouched. The marker is never the first byte of a pickle
+MESSAGE_HEADER = struct.Struct('!BI')
+MESSAGE_MARKER = 0xFE
+
+
+@dataclasses.dataclass(init=True, repr=True, slots=True)
 class MessageProtocol:
     src: User | None
     dst: User | None
@@ -69,17 +152,29 @@ class MessageProtocol:
     message_flag: MessageProtocolFlag | None
     response: MessageProtocolResponse | None
     _body: bytes
+    seq: int | None = None
+    ack: MessageProtocolAck | None = None
+    _decoded: Any = dataclasses.field(default=_UNDECODED, init=False, repr=False, compare=False)
 
     @property
     def body(self):
-        return deserialize(self._body)
+        # Decoded on first use only, routing never needs it
+        if self._decoded is _UNDECODED:
+            self._decoded = deserialize(self._body)
+        return self._decoded
 
     @body.setter
     def body(self, v):
         self._body = serialize(v)
+        self._decoded = v
 
+    def __reduce__(self):
+        # Pickled as a plain constructor call, the decoded body stays behind
+        return MessageProtocol, (self.src, self.dst, self.message_type, self.message_flag, self.response,
+                                 bytes(self._body), self.seq, self.ack)
 
-@dataclasses.dataclass(init=True, repr=False, order=True, frozen=True)
+
+@dataclasses.dataclass(init=True, repr=False, frozen=True, slots=True)
 class FileProtocol:
     filename: str
     _size: int
@@ -90,22 +185,200 @@ class FileProtocol:
         return len(self.content)
 
 
+@dataclasses.dataclass(init=True, repr=True, frozen=True, slots=True)
+class BlobRef:
+    filename: str
+    size: int
+    digest: str
+
+
+@dataclasses.dataclass(init=True, repr=False, frozen=True, slots=True)
+class BlobPart:
+    """
+    Part of an attachment uploaded in order, the blob is stored once its last byte arrives
+    """
+    digest: str
+    size: int
+    offset: int
+    payload: bytes
+
+    def __repr__(self):
+        return (f'BlobPart(digest={self.digest}, size={self.size}, offset={self.offset}, '
+                f'payload={len(self.payload)} bytes)')
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True, slots=True)
+class Presence:
+    """
+    State of a client, typing in a group (or to the recipient if no group)
+    """
+    username: str
+    state: str = PresenceState.ONLINE
+    group: str | None = None
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True, slots=True)
+class Receipt:
+    """
+    Delivery and read summary of a message, by its sequence number as sent, to a group or a client
+    """
+    seq: int
+    group: str | None
+    username: str | None
+    delivered: int
+    read: int
+    recipients: int
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True, slots=True)
+class SearchQuery:
+    """
+    Search of a conversation: words (all of them), prefixes (word*) and "quoted phrases",
+    the page of hits before the cursor of the previous page (None for the latest)
+    """
+    text: str
+    cursor: int | None = None
+    limit: int = 20
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True, slots=True)
+class SearchHit:
+    """
+    Message found, by its sequence number as delivered (numbered by the group, or by the sender if private)
+    """
+    seq: int
+    group: str | None
+    username: str
+    text: str
+    timestamp: float
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True, slots=True)
+class SearchPage:
+    """
+    Hits, latest first, and the cursor of the next page (None if it's the last)
+    """
+    hits: list[SearchHit]
+    cursor: int | None
+
+
 def new_message_proto(src: User | None,
                       dst: User | None,
                       message_type: MessageProtocolCode,
                       body: Any,
                       response: MessageProtocolResponse | None = None,
-                      flag: MessageProtocolFlag | None = None):
+                      flag: MessageProtocolFlag | None = None,
+                      seq: int | None = None,
+                      ack: MessageProtocolAck | None = None):
     return MessageProtocol(
         src=src,
         dst=dst,
         message_type=message_type,
         message_flag=flag,
         response=response,
-        _body=serialize(body)
+        _body=serialize(body),
+        seq=seq,
+        ack=ack
+    )
+
+
+class MessageFrame:
+    __slots__ = ('header', 'body')
+
+    def __init__(self, header: bytes | memoryview, body: bytes | memoryview):
+        """
+        Serialized message kept as its routing header and its body, written with one vectored write
+        (see tcp_sock_send_frames()), so the body is never copied to put them together
+
+        Slicing it gives the views of both parts within the slice.
+        """
+        self.header = header
+        self.body = body
+
+    @property
+    def parts(self) -> tuple[bytes | memoryview, bytes | memoryview]:
+        return self.header, self.body
+
+    def __len__(self):
+        return len(self.header) + len(self.body)
+
+    def __getitem__(self, item: slice) -> 'MessageFrame':
+        start, stop, _ = item.indices(len(self))
+        size = len(self.header)
+        return MessageFrame(memoryview(self.header)[min(start, size):min(stop, size)],
+                            memoryview(self.body)[max(start - size, 0):max(stop - size, 0)])
+
+    def __bytes__(self):
+        return b''.join(self.parts)
+
+    def __repr__(self):
+        return f'MessageFrame(header={len(self.header)}, body={len(self.body)})'
+
+
+def serialize_message(message: MessageProtocol) -> bytes:
+    return bytes(resequence_message(message, message.seq))
+
+
+def resequence_message(message: MessageProtocol, seq: int | None) -> MessageFrame:
+    """
+    Serialize the message with another sequence number, only the routing header is serialized again
+    """
+    header = serialize((message.src, message.dst, message.message_type, message.message_flag, message.response,
+                        seq, message.ack))
+    return MessageFrame(MESSAGE_HEADER.pack(MESSAGE_MARKER, len(header)) + header, message._body)
+
+
+def deserialize_message(frame: bytes | memoryview) -> MessageProtocol:
+    """
+    Decode the routing header only, the body stays a view of the frame until it's used
+    """
+    view = memoryview(frame)
+    marker, size = MESSAGE_HEADER.unpack_from(view)
+    if marker != MESSAGE_MARKER:
+        raise ValueError('Frame is not a message!')
+
+    start = MESSAGE_HEADER.size + size
+    src, dst, message_type, message_flag, response, seq, ack = deserialize(view[MESSAGE_HEADER.size:start])
+    return MessageProtocol(
+        src=src,
+        dst=dst,
+        message_type=message_type,
+        message_flag=message_flag,
+        response=response,
+        _body=view[start:],
+        seq=seq,
+        ack=ack
     )
 
 
+def serialize_frame(data: Any) -> bytes:
+    """
+    Messages in their wire format, anything else pickled
+    """
+    if isinstance(data, MessageProtocol):
+        return serialize_message(data)
+    return serialize(data)
+
+
+def deserialize_frame(frame: bytes | memoryview) -> Any:
+    if len(frame) and frame[0] == MESSAGE_MARKER:
+        return deserialize_message(frame)
+    return deserialize(frame)
+
+
+def message_priority(message: MessageProtocol) -> int:
+    """
+    Instructions are control traffic, streamed media and large payloads are bulk transfers, the rest is interactive
+    """
+    if len(message._body) > BULK_THRESHOLD:
+        return MessagePriority.BULK
+    if MessageProtocolCode.is_instruction(message.message_type):
+        return MessagePriority.CONTROL
+    if message.message_type in (MessageProtocolCode.DATA.IMAGE, MessageProtocolCode.DATA.VIDEO):
+        return MessagePriority.BULK
+    return MessagePriority.INTERACTIVE
+
+
 def validate_message(message: MessageProtocol):
     return message and isinstance(message, MessageProtocol)
 
@@ -117,3 +390,27 @@ def new_file_proto(filename: str,
         content=content,
         _size=len(content)
     )
+
+
+def blob_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def blob_file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Digest of a file, read in chunks (never held in memory whole)
+    """
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def new_blob_ref(filename: str,
+                 content: bytes):
+    return BlobRef(
+        filename=filename,
+        size=len(content),
+        digest=blob_digest(content)
+    )
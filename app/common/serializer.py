@@ -1,6 +1,14 @@
 import pickle
+import struct
 from typing import Any
 
+# Layout of a pickled bytes object made by serialize_bytes(): this header (protocol 4, BINBYTES8, size of the content),
+# the content as is, then BYTES_TRAILER. Any unpickler reads it, and a receiver can find the content without unpickling
+BYTES_HEADER = struct.Struct('<2sBQ')
+BYTES_TRAILER = b'.'
+_PROTO_4 = b'\x80\x04'
+_BINBYTES8 = 0x8e
+
 
 def serialize(obj) -> bytes:
     return pickle.dumps(obj)
@@ -8,3 +16,18 @@ def serialize(obj) -> bytes:
 
 def deserialize(stream: bytes) -> Any:
     return pickle.loads(stream)
+
+
+def serialize_bytes(content: bytes) -> bytes:
+    return b''.join((BYTES_HEADER.pack(_PROTO_4, _BINBYTES8, len(content)), content, BYTES_TRAILER))
+
+
+def serialized_bytes_size(header: bytes | memoryview) -> int | None:
+    """
+    :param header: First BYTES_HEADER.size bytes of a serialized object
+    :return: Size of the content if the object was serialized by serialize_bytes(), otherwise None
+    """
+    if len(header) < BYTES_HEADER.size:
+        return None
+    proto, opcode, size = BYTES_HEADER.unpack_from(header)
+    return size if proto == _PROTO_4 and opcode == _BINBYTES8 else None
@@ -1,11 +1,19 @@
 from .server_config import *
 from .server_socket import *
 from .server_chat import *
+from .rate_limit import *
 
 __all__ = [
     'TcpServer',
     'UdpServer',
     'HOST',
     'PORT',
-    'ChatServer'
+    'ChatServer',
+    'RateLimits',
+    'DeliveryOptions',
+    'WorkerPools',
+    'SessionOptions',
+    'RelayOptions',
+    'PresenceOptions',
+    'SearchOptions'
 ]
@@ -0,0 +1,56 @@
+import time
+
+
+class CumulativeAck:
+    def __init__(self, every: int = 32, interval: float = 0.05):
+        """
+        Cumulative acknowledgement state of one connection
+
+        Only the worker bound to the connection touches this object, so it needs no locking.
+        Messages are acknowledged up to the latest one processed: senders may send by priority rather than
+        by sequence number, but they know the order their messages went out in.
+
+        :param every: Acknowledge after this many messages
+        :param interval: Acknowledge at most this many seconds after the first unacknowledged message
+        """
+        self.__every = every
+        self.__interval = interval
+
+        self.__latest: int | None = None
+        self.__count = 0
+        self.__deadline: float | None = None
+
+    def track(self, seq: int | None) -> bool:
+        """
+        Track a successfully processed message
+
+        :return: Whether the acknowledgement should be sent right away
+        """
+        if seq is not None:
+            self.__latest = seq
+        self.__count += 1
+
+        if self.__deadline is None:
+            self.__deadline = time.monotonic() + self.__interval
+
+        return self.__count >= self.__every
+
+    def timeout(self) -> float | None:
+        """
+        Time left until the pending acknowledgement is due (None if nothing is pending)
+        """
+        if self.__deadline is None:
+            return None
+        return max(self.__deadline - time.monotonic(), 0.)
+
+    def due(self) -> bool:
+        return self.__deadline is not None and time.monotonic() >= self.__deadline
+
+    def take(self) -> int | None:
+        """
+        Take the latest acknowledged sequence number and reset the window
+        """
+        latest = self.__latest
+        self.__count = 0
+        self.__deadline = None
+        return latest
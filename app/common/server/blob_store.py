@@ -0,0 +1,202 @@
+import collections
+import hashlib
+import threading
+import time
+from typing import Iterable
+
+from .. import BlobPart, serialize_bytes, blob_digest
+
+
+class _Upload:
+    __slots__ = ('size', 'content', 'digest', 'last_seen')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.content = bytearray()
+        self.digest = hashlib.sha256()
+        self.last_seen = time.monotonic()
+
+
+class BlobStore:
+    def __init__(self,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 pin_ttl: float = 24 * 3600.,
+                 upload_timeout: float = 60.):
+        """
+        Content-addressed blob store with least-recently-used eviction
+
+        Blobs are kept already serialized, so answering a download never pickles the content again,
+        and in a layout receivers can stream into files (see serialize_bytes()).
+
+        Blobs referenced by messages are pinned until every recipient downloaded them (or the pins expire),
+        eviction passes them over: a blob that doesn't fit besides the pinned ones is refused instead.
+
+        :param max_bytes: Total size of blobs kept before the least recently used ones are evicted
+        :param pin_ttl: Time (in seconds) a blob is kept for a recipient who doesn't download it
+        :param upload_timeout: Time (in seconds) without a part after which an upload is given up
+        """
+        self.__max_bytes = max_bytes
+        self.__pin_ttl = pin_ttl
+        self.__upload_timeout = upload_timeout
+        self.__size = 0
+        self.__blobs: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+        # Recipients (with their deadline) every pinned blob is kept for
+        self.__pins: dict[str, dict[str, float]] = {}
+        # Uploads in parts by uploader and digest, with the bytes they hold
+        self.__uploads: dict[tuple[str | None, str], _Upload] = {}
+        self.__uploading = 0
+        self.__lock = threading.Lock()
+
+    def put(self, content: bytes, digest: str | None = None) -> str | None:
+        """
+        :return: Digest of the content, None if it doesn't match the given digest or doesn't fit in the store
+        """
+        actual_digest = blob_digest(content)
+        if digest is not None and digest != actual_digest:
+            return None
+
+        with self.__lock:
+            if actual_digest in self.__blobs:
+                self.__blobs.move_to_end(actual_digest)
+                return actual_digest
+
+        return self.__store(actual_digest, serialize_bytes(content))
+
+    def put_part(self, uploader: str | None, part: BlobPart) -> int | None:
+        """
+        Upload a blob in parts, in order: the digest is computed as they arrive and checked with the last one
+
+        :param uploader: Who uploads it (uploads of the same blob by different clients don't mix)
+        :return: Bytes of the blob received so far (the blob is stored once all of them are),
+                 None if the part is out of order, the blob doesn't fit in the store or doesn't match its digest
+        """
+        key = (uploader, part.digest)
+        with self.__lock:
+            self.__expire_uploads()
+
+            upload = self.__uploads.get(key)
+            if upload is None:
+                if part.offset != 0 or part.size > self.__max_bytes - self.__uploading:
+                    return None
+                upload = self.__uploads[key] = _Upload(part.size)
+                self.__uploading += part.size
+
+            if part.offset != len(upload.content) or part.size != upload.size or \
+                    part.offset + len(part.payload) > upload.size:
+                self.__drop_upload(key)
+                return None
+
+            upload.content += part.payload
+            upload.digest.update(part.payload)
+            upload.last_seen = time.monotonic()
+            if len(upload.content) < upload.size:
+                return len(upload.content)
+
+            self.__drop_upload(key)
+            if upload.digest.hexdigest() != part.digest:
+                return None
+            if part.digest in self.__blobs:
+                self.__blobs.move_to_end(part.digest)
+                return upload.size
+
+        return upload.size if self.__store(part.digest, serialize_bytes(upload.content)) else None
+
+    def get_serialized(self, digest: str) -> bytes | None:
+        with self.__lock:
+            ser = self.__blobs.get(digest)
+            if ser is not None:
+                self.__blobs.move_to_end(digest)
+            return ser
+
+    def missing(self, digests: list[str]) -> list[str]:
+        with self.__lock:
+            return [digest for digest in digests if digest not in self.__blobs]
+
+    def pin(self, digest: str, recipients: Iterable[str]) -> bool:
+        """
+        Keep a blob until every recipient downloaded it
+
+        :return: Whether the blob is there to be downloaded
+        """
+        with self.__lock:
+            if digest not in self.__blobs:
+                return False
+
+            deadline = time.monotonic() + self.__pin_ttl
+            pins = self.__pins.setdefault(digest, {})
+            for recipient in recipients:
+                pins[recipient] = deadline
+            if not pins:
+                self.__pins.pop(digest)
+            return True
+
+    def unpin(self, digest: str, recipient: str | None):
+        with self.__lock:
+            pins = self.__pins.get(digest)
+            if pins is not None:
+                pins.pop(recipient, None)
+                if not pins:
+                    self.__pins.pop(digest)
+
+    def __store(self, digest: str, ser: bytes) -> str | None:
+        if len(ser) > self.__max_bytes:
+            return None
+
+        with self.__lock:
+            if digest in self.__blobs:
+                return digest
+
+            # Least recently used first, pinned blobs stay
+            now = time.monotonic()
+            for evicted in list(self.__blobs):
+                if self.__size + len(ser) <= self.__max_bytes:
+                    break
+                if not self.__is_pinned(evicted, now):
+                    self.__size -= len(self.__blobs.pop(evicted))
+
+            if self.__size + len(ser) > self.__max_bytes:
+                return None
+
+            self.__blobs[digest] = ser
+            self.__size += len(ser)
+
+        return digest
+
+    def __is_pinned(self, digest: str, now: float) -> bool:
+        pins = self.__pins.get(digest)
+        if pins is None:
+            return False
+
+        for recipient, deadline in list(pins.items()):
+            if deadline <= now:
+                pins.pop(recipient)
+        if not pins:
+            self.__pins.pop(digest)
+        return bool(pins)
+
+    def __expire_uploads(self):
+        deadline = time.monotonic() - self.__upload_timeout
+        for key in [key for key, upload in self.__uploads.items() if upload.last_seen < deadline]:
+            self.__drop_upload(key)
+
+    def __drop_upload(self, key: tuple[str | None, str]):
+        upload = self.__uploads.pop(key, None)
+        if upload is not None:
+            self.__uploading -= upload.size
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    @property
+    def pinned(self) -> int:
+        """
+        Blobs kept for recipients who haven't downloaded them yet
+        """
+        return len(self.__pins)
+
+    def __len__(self):
+        return len(self.__blobs)
+
+    def __contains__(self, digest: str):
+        return digest in self.__blobs
@@ -0,0 +1,365 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable
+from .. import *
+from .executor import KeyedExecutor
+
+
+class ChatRoom:
+    def __init__(self, name: str):
+        """
+        A group chat, changed only by the shard it is bound to (see ChatRooms), so it needs no locks
+
+        Members are an immutable set replaced on every change, any thread can read them at any time.
+        So are the members behind every relay subscribed to the room (see subscribe()).
+        """
+        self.__name = name
+        self.__members: frozenset[str] = frozenset()
+        self.__remote: dict[str, frozenset[str]] = {}
+        self.__seq = 0
+        self.__spread = False
+        self.__closed = False
+
+    def add(self, username: str) -> bool:
+        """
+        :return: Whether the user wasn't a member yet
+        """
+        if username in self.__members:
+            return False
+        self.__members = self.__members | {username}
+        return True
+
+    def discard(self, username: str) -> bool:
+        """
+        :return: Whether the user was a member
+        """
+        if username not in self.__members:
+            return False
+        self.__members = self.__members - {username}
+        return True
+
+    def subscribe(self, relay: str, members: frozenset[str]) -> bool:
+        """
+        Set the members behind a relay, none to unsubscribe it
+
+        :return: Whether they changed
+        """
+        if self.__remote.get(relay, frozenset()) == members:
+            return False
+        remote = dict(self.__remote)
+        if members:
+            remote[relay] = members
+        else:
+            remote.pop(relay)
+        self.__remote = remote
+        return True
+
+    def next_seq(self) -> int:
+        self.__seq += 1
+        return self.__seq
+
+    def spread(self):
+        self.__spread = True
+
+    def close(self):
+        self.__closed = True
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def members(self) -> frozenset[str]:
+        return self.__members
+
+    @property
+    def relays(self) -> list[str]:
+        """
+        Relays subscribed to the room, each gets one copy of its messages for the members behind it
+        """
+        return list(self.__remote)
+
+    @property
+    def audience(self) -> frozenset[str]:
+        """
+        Members, and members behind relays
+        """
+        return self.__members.union(*self.__remote.values())
+
+    @property
+    def seq(self) -> int:
+        """
+        Sequence number of the last message sent to the room
+        """
+        return self.__seq
+
+    @property
+    def spread_out(self) -> bool:
+        """
+        Whether its messages are fanned out by several writer shards
+        """
+        return self.__spread
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    def __repr__(self):
+        return (f'ChatRoom(name={self.__name}, members={len(self.__members)}, relays={len(self.__remote)}, '
+                f'seq={self.__seq})')
+
+
+class ChatRooms:
+    def __init__(self,
+                 deliver: Callable[[list[str], MessageProtocol, bytes | MessageFrame], None],
+                 shards: int = 4,
+                 writer_shards: int = 4,
+                 spread_members: int = 256,
+                 queue_size: int = 1024,
+                 relay: Callable[[list[str], MessageProtocol, bytes | MessageFrame], None] | None = None,
+                 on_change: Callable[[str, frozenset[str]], None] | None = None,
+                 on_post: Callable[[str, int, MessageProtocol, frozenset[str]], None] | None = None):
+        """
+        Group chats, every room bound to one of a fixed number of shards (threads) which makes its membership
+        changes and sends its messages one at a time, in order. Rooms of different shards run in parallel.
+
+        Every message sent to a room gets the next sequence number of the room (in place of the sender's),
+        so members see the messages of a room in one order, numbered without gaps.
+
+        Rooms of `spread_members` members or more spread their fan-out over the writer shards, every member
+        always going through the same one (so it still gets the messages of the room in order). Once spread,
+        a room stays spread, or members could get a message ahead of those still queued for them.
+
+        Relays subscribed to a room get one copy of each of its messages, whatever the number of members behind them.
+
+        :param deliver: Sends a frame to some members of a room (called by the shards)
+        :param shards: Number of room shards
+        :param writer_shards: Number of writer shards for large rooms, 0 to always fan out from the room shard
+        :param spread_members: Members from which a room spreads its fan-out over the writer shards
+        :param queue_size: Tasks waiting per shard, before whoever hands out more work has to wait
+        :param relay: Sends a frame to some relays subscribed to a room (called by the shards)
+        :param on_change: Called by the shards with the name and audience of a room its members changed,
+                          empty once it's removed
+        :param on_post: Called by the shards with the name of a room, the sequence number given to a message
+                        and the members it's sent to, before it's sent
+        """
+        self.__deliver = deliver
+        self.__relay = relay
+        self.__on_change = on_change
+        self.__on_post = on_post
+        self.__spread_members = spread_members
+
+        # The registry is locked only to create and remove rooms, rooms are changed by their shards
+        self.__rooms: dict[str, ChatRoom] = {}
+        self.__lock = threading.Lock()
+
+        self.__shards = KeyedExecutor(shards, queue_size=queue_size, name='room')
+        self.__writer_shards = writer_shards
+        self.__writers = KeyedExecutor(writer_shards, queue_size=queue_size, name='room-writer') \
+            if writer_shards > 1 else None
+
+    def get(self, name: str | None) -> ChatRoom | None:
+        return self.__rooms.get(name) if name else None
+
+    def names(self) -> list[str]:
+        return list(self.__rooms)
+
+    def rooms_of(self, username: str) -> list[str]:
+        """
+        :return: Names of the rooms the user is a member of
+        """
+        return [room.name for room in list(self.__rooms.values()) if username in room.members]
+
+    def rooms_of_relay(self, relay: str) -> list[str]:
+        """
+        :return: Names of the rooms the relay is subscribed to
+        """
+        return [room.name for room in list(self.__rooms.values()) if relay in room.relays]
+
+    def is_member(self, name: str | None, username: str | None) -> bool:
+        room = self.get(name)
+        return room is not None and username in room.members
+
+    def create(self, name: str) -> bool:
+        """
+        :return: Whether the room didn't exist yet
+        """
+        with self.__lock:
+            if name in self.__rooms:
+                return False
+            self.__rooms[name] = ChatRoom(name)
+            return True
+
+    def join(self, name: str, username: str) -> bool:
+        """
+        Add a member, once the room processed what was sent to it before
+
+        :return: Whether the room exists
+        """
+        room = self.get(name)
+        return room is not None and self.__call(room, self.__join, room, username)
+
+    def leave(self, name: str, username: str) -> bool | None:
+        """
+        Remove a member, the room goes once it has none left
+
+        :return: Whether the user was a member, None if the room doesn't exist
+        """
+        room = self.get(name)
+        return None if room is None else self.__call(room, self.__leave, room, username)
+
+    def add(self, name: str, username: str):
+        """
+        Add a member without waiting for it (e.g. of a resumed session), if the room still exists
+        """
+        if room := self.get(name):
+            self.__shards.submit(room.name, self.__join, room, username)
+
+    def discard(self, name: str, username: str):
+        """
+        Remove a member without waiting for it, the room stays even if empty
+        """
+        if room := self.get(name):
+            self.__shards.submit(room.name, self.__discard, room, username)
+
+    def subscribe(self, name: str, relay: str, members: list[str] | frozenset[str]):
+        """
+        Set the members behind a relay without waiting for it, the room is created if need be,
+        and goes once nobody is left in it
+        """
+        members = frozenset(members)
+        if members:
+            self.create(name)
+        if room := self.get(name):
+            self.__shards.submit(room.name, self.__subscribe, room, relay, members)
+
+    def resubscribe(self):
+        """
+        Report the audience of every room (see on_change), e.g. to a relay connected again
+        """
+        for room in list(self.__rooms.values()):
+            self.__shards.submit(room.name, self.__changed, room)
+
+    def post(self, name: str, message: MessageProtocol, frame: bytes) -> bool:
+        """
+        Number and send a message (its sender already checked) to the members of a room, asynchronously
+
+        :return: Whether the room exists
+        """
+        room = self.get(name)
+        if room is None:
+            return False
+        self.__shards.submit(room.name, self.__post, room, message, frame)
+        return True
+
+    def forward(self, name: str, message: MessageProtocol, frame: bytes) -> bool:
+        """
+        Send a message numbered upstream to the members of a room as is, asynchronously
+
+        :return: Whether the room exists
+        """
+        room = self.get(name)
+        if room is None:
+            return False
+        self.__shards.submit(room.name, self.__distribute, room, message, frame)
+        return True
+
+    def shutdown(self):
+        self.__shards.shutdown()
+        if self.__writers:
+            self.__writers.shutdown()
+
+    def __call(self, room: ChatRoom, fn: Callable[..., Any], *args) -> Any:
+        # Run on the shard of the room, and wait for it (shards never wait for anyone, so this can't deadlock)
+        future: Future = Future()
+
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        self.__shards.submit(room.name, run)
+        return future.result()
+
+    def __join(self, room: ChatRoom, username: str) -> bool:
+        # A room removed meanwhile can't be joined anymore
+        if room.closed:
+            return False
+        if room.add(username):
+            self.__changed(room)
+        return True
+
+    def __leave(self, room: ChatRoom, username: str) -> bool:
+        left = room.discard(username)
+        if left:
+            self.__remove_if_empty(room)
+            self.__changed(room)
+        return left
+
+    def __discard(self, room: ChatRoom, username: str):
+        if room.discard(username):
+            self.__changed(room)
+
+    def __subscribe(self, room: ChatRoom, relay: str, members: frozenset[str]):
+        if room.closed:
+            # Removed meanwhile: the room that replaces it is bound to this shard too, so it's changed right here
+            # (submitting to this shard from itself would wait forever on a full queue)
+            if not members:
+                return
+            self.create(room.name)
+            room = self.get(room.name)
+        if room.subscribe(relay, members):
+            if not members:
+                self.__remove_if_empty(room)
+            self.__changed(room)
+
+    def __remove_if_empty(self, room: ChatRoom):
+        if room.members or room.relays:
+            return
+        room.close()
+        with self.__lock:
+            if self.__rooms.get(room.name) is room:
+                self.__rooms.pop(room.name)
+
+    def __changed(self, room: ChatRoom):
+        if self.__on_change:
+            self.__on_change(room.name, frozenset() if room.closed else room.audience)
+
+    def __post(self, room: ChatRoom, message: MessageProtocol, frame: bytes):
+        # Nobody is left in a room removed meanwhile
+        if room.closed:
+            return
+        seq = room.next_seq()
+        if self.__on_post:
+            self.__on_post(room.name, seq, message, room.members)
+        self.__distribute(room, message, resequence_message(message, seq))
+
+    def __distribute(self, room: ChatRoom, message: MessageProtocol, frame: bytes | MessageFrame):
+        if room.closed:
+            return
+
+        # One copy per relay, they deliver to the members behind them
+        relays = room.relays
+        if relays and self.__relay:
+            self.__relay(relays, message, frame)
+
+        members = room.members
+        if self.__writers is None or (not room.spread_out and len(members) < self.__spread_members):
+            self.__deliver(list(members), message, frame)
+            return
+
+        room.spread()
+        shares: list[list[str]] = [[] for _ in range(self.__writer_shards)]
+        for member in members:
+            shares[hash(member) % self.__writer_shards].append(member)
+        for i, share in enumerate(shares):
+            if share:
+                self.__writers.submit((room.name, i), self.__deliver, share, message, frame)
+
+    @property
+    def backlog(self) -> int:
+        """
+        Tasks waiting (approximately)
+        """
+        return self.__shards.backlog + (self.__writers.backlog if self.__writers else 0)
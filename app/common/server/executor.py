@@ -0,0 +1,63 @@
+import queue
+import threading
+from typing import Any, Callable, Hashable
+from .. import logger
+
+
+class KeyedExecutor:
+    def __init__(self, workers: int, queue_size: int = 1024, name: str = 'worker'):
+        """
+        Fixed pool of threads, tasks of the same key run one at a time in the order they were submitted
+
+        Every key is bound to one worker (by hash) and every worker has a bounded queue. Submitting to a full queue
+        blocks, so a burst slows its submitters down instead of piling up work (and threads).
+
+        :param workers: Number of threads
+        :param queue_size: Tasks waiting per thread, before submitting blocks
+        :param name: Name of the threads (for debugging)
+        """
+        self.__queues: list[queue.Queue[tuple[Callable[..., Any], tuple] | None]] = [
+            queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))
+        ]
+        self.__threads = [threading.Thread(
+            target=self.__work,
+            args=(tasks,),
+            name=f'{name}-{i}',
+            daemon=True
+        ) for i, tasks in enumerate(self.__queues)]
+
+        for thr in self.__threads:
+            thr.start()
+
+    def submit(self, key: Hashable, fn: Callable[..., Any], *args):
+        self.__queues[hash(key) % len(self.__queues)].put((fn, args))
+
+    def shutdown(self):
+        """
+        Let the workers finish what was submitted, then stop them
+        """
+        for tasks in self.__queues:
+            tasks.put(None)
+        for thr in self.__threads:
+            if thr is not threading.current_thread():
+                thr.join()
+
+    @staticmethod
+    def __work(tasks: queue.Queue):
+        while (task := tasks.get()) is not None:
+            fn, args = task
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.exception(f'Task {getattr(fn, "__name__", fn)} failed: {e}')
+
+    @property
+    def workers(self) -> int:
+        return len(self.__threads)
+
+    @property
+    def backlog(self) -> int:
+        """
+        Tasks waiting (approximately)
+        """
+        return sum(tasks.qsize() for tasks in self.__queues)
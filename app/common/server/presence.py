@@ -0,0 +1,206 @@
+import collections
+import threading
+import time
+from typing import Callable, Iterable
+from .. import *
+
+
+class PresenceService:
+    def __init__(self,
+                 publish: Callable[[list[str], list[Presence]], None],
+                 audience: Callable[[str], Iterable[str]],
+                 group_members: Callable[[str], Iterable[str]],
+                 window: float = 0.2,
+                 debounce: float = 0.3,
+                 typing_timeout: float = 6.0,
+                 max_partners: int = 64,
+                 partner_ttl: float = 600.0):
+        """
+        Presence of clients (online, away, typing, offline), pushed to the peers interested in it:
+        members of their groups and their recent private message partners
+
+        Changes are published every window, in one update per recipient for all the changes it's interested in.
+        A change is published once it has held for the debounce time, so a client flapping between states
+        (or back to where it was) causes no update at all. Typing is shown to the conversation only,
+        and goes back to online by itself unless refreshed.
+
+        :param publish: Sends updates to recipients (called by the publishing thread)
+        :param audience: Peers interested in the presence of a client, besides its recent partners
+        :param group_members: Members of a group
+        :param window: Time (in seconds) between two publications
+        :param debounce: Time (in seconds) a change must hold before it's published
+        :param typing_timeout: Time (in seconds) typing lasts unless refreshed
+        :param max_partners: Recent private message partners kept per client
+        :param partner_ttl: Time (in seconds) a private message partner stays recent
+        """
+        self.__publish = publish
+        self.__audience = audience
+        self.__group_members = group_members
+        self.__window = window
+        self.__debounce = debounce
+        self.__typing_timeout = typing_timeout
+        self.__max_partners = max_partners
+        self.__partner_ttl = partner_ttl
+
+        # Presence (and recipient of private typing) by client: as set, and as last published (absent is offline)
+        self.__current: dict[str, tuple[Presence, str | None]] = {}
+        self.__published: dict[str, tuple[Presence, str | None]] = {}
+        self.__changed_at: dict[str, float] = {}
+        self.__typing_until: dict[str, float] = {}
+        self.__peers: dict[str, set[str]] = {}
+
+        # Recent private message partners, least recent first
+        self.__partners: dict[str, collections.OrderedDict[str, float]] = {}
+        self.__lock = threading.Lock()
+
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run,
+            name='presence',
+            daemon=True
+        )
+        self.__thread.start()
+
+    def set(self,
+            username: str,
+            state: str,
+            group: str | None = None,
+            peer: str | None = None,
+            peers: Iterable[str] = ()):
+        """
+        :param group: Group the client is typing in
+        :param peer: Client the client is typing to (if not in a group)
+        :param peers: Peers interested in the change besides the usual ones (e.g. members of groups just left)
+        """
+        now = time.monotonic()
+        typing = state == PresenceState.TYPING
+        if typing:
+            presence = (Presence(username, state, group), None if group else peer)
+        else:
+            presence = (Presence(username, state), None)
+
+        with self.__lock:
+            if typing:
+                self.__typing_until[username] = now + self.__typing_timeout
+            else:
+                self.__typing_until.pop(username, None)
+
+            if peers:
+                self.__peers.setdefault(username, set()).update(peers)
+            if self.__current.get(username) != presence:
+                self.__current[username] = presence
+                self.__changed_at[username] = now
+
+    def touch(self, username: str, peer: str):
+        """
+        Account a private message between two clients, they're interested in each other's presence for a while
+        """
+        now = time.monotonic()
+        with self.__lock:
+            for a, b in ((username, peer), (peer, username)):
+                partners = self.__partners.setdefault(a, collections.OrderedDict())
+                partners[b] = now
+                partners.move_to_end(b)
+                while len(partners) > self.__max_partners:
+                    partners.popitem(last=False)
+
+    def get(self, usernames: Iterable[str]) -> list[Presence]:
+        """
+        :return: Presence of the clients as last published
+        """
+        with self.__lock:
+            return [self.__published.get(username, (Presence(username, PresenceState.OFFLINE), None))[0]
+                    for username in usernames]
+
+    def stop(self):
+        self.__stopped.set()
+
+    def __run(self):
+        while not self.__stopped.wait(self.__window):
+            try:
+                self.__flush()
+            except Exception as e:
+                logger.exception(f'Presence error: {e}')
+
+    def __flush(self):
+        now = time.monotonic()
+        changes: list[tuple[str, tuple[Presence, str | None], tuple[Presence, str | None], list[str]]] = []
+
+        with self.__lock:
+            # Typing that wasn't refreshed goes back to online, right away
+            for username, until in list(self.__typing_until.items()):
+                if until <= now:
+                    self.__typing_until.pop(username)
+                    self.__current[username] = (Presence(username, PresenceState.ONLINE), None)
+                    self.__changed_at[username] = now - self.__debounce
+
+            for username, changed_at in list(self.__changed_at.items()):
+                if now - changed_at < self.__debounce:
+                    continue
+                self.__changed_at.pop(username)
+                peers = self.__peers.pop(username, set())
+
+                offline = (Presence(username, PresenceState.OFFLINE), None)
+                new = self.__current.get(username, offline)
+                old = self.__published.get(username, offline)
+                if new == old:
+                    continue
+
+                if new[0].state == PresenceState.OFFLINE:
+                    self.__current.pop(username, None)
+                    self.__published.pop(username, None)
+                else:
+                    self.__published[username] = new
+                changes.append((username, old, new, self.__recent_partners(username, now) + list(peers)))
+
+        if not changes:
+            return
+
+        # Every recipient gets one update, recipients of the same updates share a frame
+        updates: dict[str, list[Presence]] = collections.defaultdict(list)
+        for username, old, new, partners in changes:
+            for recipient, presence in self.__recipients(username, old, new, partners).items():
+                if recipient != username:
+                    updates[recipient].append(presence)
+
+        batches: dict[tuple[Presence, ...], list[str]] = collections.defaultdict(list)
+        for recipient, presences in updates.items():
+            batches[tuple(presences)].append(recipient)
+        for presences, recipients in batches.items():
+            self.__publish(recipients, list(presences))
+
+    def __recipients(self,
+                     username: str,
+                     old: tuple[Presence, str | None],
+                     new: tuple[Presence, str | None],
+                     partners: list[str]) -> dict[str, Presence]:
+        # Typing is seen by the conversation only, the rest (online, away, offline) by every interested peer
+        def base(presence: Presence) -> str:
+            return PresenceState.ONLINE if presence.state == PresenceState.TYPING else presence.state
+
+        recipients: dict[str, Presence] = {}
+        if base(old[0]) != base(new[0]):
+            everyone = Presence(username, base(new[0]))
+            for recipient in self.__audience(username):
+                recipients[recipient] = everyone
+            for recipient in partners:
+                recipients[recipient] = everyone
+
+        for presence, peer in (old, new):
+            if presence.state != PresenceState.TYPING:
+                continue
+            conversation = self.__group_members(presence.group) if presence.group else [peer] if peer else []
+            for recipient in conversation:
+                recipients[recipient] = new[0]
+
+        return recipients
+
+    def __recent_partners(self, username: str, now: float) -> list[str]:
+        partners = self.__partners.get(username)
+        if not partners:
+            return []
+        while partners and next(iter(partners.values())) < now - self.__partner_ttl:
+            partners.popitem(last=False)
+        if not partners:
+            self.__partners.pop(username)
+        return list(partners)
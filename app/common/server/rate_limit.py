@@ -0,0 +1,134 @@
+import dataclasses
+import threading
+import time
+from typing import Hashable
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class RateLimits:
+    """
+    Per-user limits, sustained rate and burst of each (a rate of 0 disables the limit)
+    """
+    messages_per_second: float = 1000.
+    message_burst: int = 5000
+    bytes_per_second: float = 64 * 1024 * 1024
+    byte_burst: int = 256 * 1024 * 1024
+    announces_per_minute: float = 6.
+    announce_burst: int = 3
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: Tokens added per second
+        :param capacity: Most tokens kept (the burst allowed after being idle)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount: float = 1., now: float | None = None) -> bool:
+        """
+        :return: Whether there were enough tokens (they are taken only if so)
+        """
+        now = time.monotonic() if now is None else now
+        # A bucket may be newer than the time it is used at
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+        # More than a whole burst goes through only from a full bucket, and leaves it in debt
+        if self.tokens < min(amount, self.capacity):
+            return False
+        self.tokens -= amount
+        return True
+
+
+class RateLimiter:
+    def __init__(self, limits: RateLimits):
+        """
+        Token buckets of every user, refilled lazily when used, so accounting a message is O(1)
+        """
+        self.__limits = limits
+        self.__buckets: dict[str, dict[Hashable, TokenBucket]] = {}
+        self.__lock = threading.Lock()
+
+    def admit(self, username: str, message_type: int, size: int, announce: bool = False) -> bool:
+        """
+        Account a message, messages refused still count against the message rate
+
+        :param message_type: Messages of every type are limited separately
+        :param size: Size (in bytes) of the message
+        :param announce: Whether the message is a server-wide announcement
+        """
+        limits = self.__limits
+        now = time.monotonic()
+
+        with self.__lock:
+            buckets = self.__buckets.setdefault(username, {})
+
+            if announce and limits.announces_per_minute > 0:
+                if not self.__bucket(buckets, 'announce', limits.announces_per_minute / 60,
+                                     limits.announce_burst).take(now=now):
+                    return False
+
+            if limits.messages_per_second > 0:
+                if not self.__bucket(buckets, message_type, limits.messages_per_second,
+                                     limits.message_burst).take(now=now):
+                    return False
+
+            if limits.bytes_per_second > 0:
+                if not self.__bucket(buckets, 'bytes', limits.bytes_per_second,
+                                     limits.byte_burst).take(size, now=now):
+                    return False
+
+        return True
+
+    @staticmethod
+    def __bucket(buckets: dict[Hashable, TokenBucket], key: Hashable, rate: float, capacity: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    def forget(self, username: str):
+        with self.__lock:
+            self.__buckets.pop(username, None)
+
+    @property
+    def users(self) -> int:
+        """
+        Users whose buckets are kept
+        """
+        return len(self.__buckets)
+
+
+class OutboundBacklog:
+    def __init__(self, limit: int):
+        """
+        Bytes accepted for delivery but not written to their recipients yet
+
+        :param limit: Backlog (in bytes) above which new messages are refused, 0 for no limit
+        """
+        self.__limit = limit
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    def reserve(self, size: int):
+        with self.__lock:
+            self.__size += size
+
+    def release(self, size: int):
+        with self.__lock:
+            self.__size -= size
+
+    @property
+    def overloaded(self) -> bool:
+        return 0 < self.__limit < self.__size
+
+    @property
+    def size(self) -> int:
+        return self.__size
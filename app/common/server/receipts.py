@@ -0,0 +1,207 @@
+import bisect
+import collections
+import threading
+import time
+from typing import Callable, Hashable
+from .. import *
+
+
+class _Tracked:
+    """
+    A message waiting for receipts: one bit per recipient (by its index among the members it was sent to)
+    """
+    __slots__ = ('sender', 'seq', 'group', 'username', 'members', 'recipients', 'delivered', 'read',
+                 'delivered_count', 'read_count', 'sent_at')
+
+    def __init__(self,
+                 sender: str,
+                 seq: int,
+                 group: str | None,
+                 username: str | None,
+                 members: dict[str, int],
+                 recipients: int):
+        self.sender = sender
+        self.seq = seq
+        self.group = group
+        self.username = username
+        self.members = members
+        self.recipients = recipients
+        self.delivered = bytearray((len(members) + 7) // 8)
+        self.read = bytearray((len(members) + 7) // 8)
+        self.delivered_count = 0
+        self.read_count = 0
+        self.sent_at = time.monotonic()
+
+    def mark(self, username: str, state: str) -> bool:
+        """
+        :return: Whether the recipient wasn't marked yet
+        """
+        i = self.members.get(username)
+        if i is None or username == self.sender:
+            return False
+
+        byte, bit = i >> 3, 1 << (i & 7)
+        changed = False
+        if not self.delivered[byte] & bit:
+            self.delivered[byte] |= bit
+            self.delivered_count += 1
+            changed = True
+        if state == ReceiptState.READ and not self.read[byte] & bit:
+            self.read[byte] |= bit
+            self.read_count += 1
+            changed = True
+        return changed
+
+    @property
+    def complete(self) -> bool:
+        return self.read_count >= self.recipients
+
+    def receipt(self) -> Receipt:
+        return Receipt(seq=self.seq,
+                       group=self.group,
+                       username=self.username,
+                       delivered=self.delivered_count,
+                       read=self.read_count,
+                       recipients=self.recipients)
+
+
+class _Conversation:
+    __slots__ = ('seqs', 'tracked', 'acked', 'index')
+
+    def __init__(self):
+        # Messages by their number in the conversation (increasing), and how far every recipient acknowledged
+        self.seqs: list[int] = []
+        self.tracked: dict[int, _Tracked] = {}
+        self.acked: dict[tuple[str, str], int] = {}
+        # Index of the members the last message was sent to, shared by messages sent to the same members
+        self.index: tuple[frozenset[str], dict[str, int]] | None = None
+
+
+class ReceiptTracker:
+    def __init__(self,
+                 publish: Callable[[str, list[Receipt]], None],
+                 window: float = 0.25,
+                 max_tracked: int = 4096,
+                 ttl: float = 24 * 3600.):
+        """
+        Delivered and read receipts of messages, summarized for their senders
+
+        Recipients acknowledge a conversation (a group, or a sender of private messages) cumulatively,
+        up to a message number. Every message keeps a bitmap of its recipients, and its sender gets counts:
+        once per window for all of its messages that changed, whatever the number of recipients.
+
+        :param publish: Sends receipts to a sender (called by the publishing thread)
+        :param window: Time (in seconds) between two receipts to the same sender
+        :param max_tracked: Messages tracked per conversation, the oldest are forgotten first
+        :param ttl: Time (in seconds) a message is tracked
+        """
+        self.__publish = publish
+        self.__window = window
+        self.__max_tracked = max_tracked
+        self.__ttl = ttl
+
+        self.__conversations: dict[Hashable, _Conversation] = {}
+        self.__changed: dict[str, dict[int, _Tracked]] = collections.defaultdict(dict)
+        self.__lock = threading.Lock()
+
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run,
+            name='receipts',
+            daemon=True
+        )
+        self.__thread.start()
+
+    def track(self,
+              conversation: Hashable,
+              number: int,
+              sender: str,
+              seq: int,
+              members: frozenset[str],
+              group: str | None = None,
+              username: str | None = None):
+        """
+        Track a message sent
+
+        :param conversation: Conversation recipients acknowledge it in
+        :param number: Number of the message in the conversation, increasing
+        :param seq: Sequence number of the message as sent, receipts refer to it
+        :param members: Recipients (the sender is left out if one of them)
+        :param group: Group it was sent to
+        :param username: Client it was sent to
+        """
+        with self.__lock:
+            # Numbered from the start again (a room created again, a sender restarted), so is the conversation
+            conv = self.__conversations.get(conversation)
+            if conv is None or (conv.seqs and number <= conv.seqs[-1]):
+                conv = self.__conversations[conversation] = _Conversation()
+
+            if conv.index is None or conv.index[0] is not members:
+                conv.index = (members, {member: i for i, member in enumerate(members)})
+            recipients = len(members) - (sender in members)
+
+            conv.seqs.append(number)
+            conv.tracked[number] = _Tracked(sender, seq, group, username, conv.index[1], recipients)
+            if len(conv.seqs) > self.__max_tracked:
+                self.__forget(conv, len(conv.seqs) - self.__max_tracked)
+
+    def ack(self, username: str, state: str, conversation: Hashable, number: int):
+        """
+        Acknowledge every message of a conversation up to a number
+        """
+        with self.__lock:
+            conv = self.__conversations.get(conversation)
+            if conv is None:
+                return
+
+            # Only what wasn't acknowledged yet is looked at
+            last = conv.acked.get((username, state), 0)
+            if number <= last:
+                return
+            conv.acked[(username, state)] = number
+
+            lo = bisect.bisect_right(conv.seqs, last)
+            hi = bisect.bisect_right(conv.seqs, number)
+            for i in range(lo, hi):
+                tracked = conv.tracked[conv.seqs[i]]
+                if tracked.mark(username, state):
+                    self.__changed[tracked.sender][id(tracked)] = tracked
+
+    def stop(self):
+        self.__stopped.set()
+
+    def __run(self):
+        while not self.__stopped.wait(self.__window):
+            try:
+                self.__flush()
+            except Exception as e:
+                logger.exception(f'Receipts error: {e}')
+
+    def __flush(self):
+        with self.__lock:
+            changed, self.__changed = self.__changed, collections.defaultdict(dict)
+            receipts = {sender: [tracked.receipt() for tracked in messages.values()]
+                        for sender, messages in changed.items()}
+
+            # Messages read by everyone (or too old) are forgotten, oldest first
+            expired = time.monotonic() - self.__ttl
+            for key, conv in list(self.__conversations.items()):
+                count = 0
+                for number in conv.seqs:
+                    tracked = conv.tracked[number]
+                    if not (tracked.complete or tracked.sent_at < expired):
+                        break
+                    count += 1
+                if count:
+                    self.__forget(conv, count)
+                if not conv.seqs:
+                    self.__conversations.pop(key)
+
+        for sender, summary in receipts.items():
+            self.__publish(sender, summary)
+
+    @staticmethod
+    def __forget(conv: _Conversation, count: int):
+        for number in conv.seqs[:count]:
+            conv.tracked.pop(number)
+        del conv.seqs[:count]
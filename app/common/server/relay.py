@@ -0,0 +1,187 @@
+import functools
+import socket
+import ssl
+import threading
+from typing import Callable
+from .. import *
+
+
+class RelayLink:
+    def __init__(self,
+                 address: tuple[str, int],
+                 name: str,
+                 secret: str,
+                 on_frame: Callable[[MessageProtocol, bytes], None],
+                 on_connect: Callable[[], None],
+                 ssl_context: ssl.SSLContext | None = None,
+                 profile: SocketProfile = THROUGHPUT_PROFILE,
+                 keepalive_idle: int = 30,
+                 connect_timeout: float = 2.0,
+                 retry_delay: float = 1.0):
+        """
+        Connection of a relay to the server upstream of it, kept open (connected again whenever it drops)
+
+        The relay subscribes to the groups it has members of, the server upstream sends it one copy of every message
+        of those groups, and the relay delivers them to its members. Group messages of its members are sent upstream
+        to be numbered (and sent back) there, so every member sees the messages of a group in the same order.
+
+        :param address: Address of the server upstream
+        :param name: Name of this relay, unique upstream
+        :param secret: Shared secret of relays, set on the server upstream
+        Frames are queued and written by the link's own writer thread (see MessageCoalescer), in order,
+        so whoever sends them never waits for the connection.
+
+        :param on_frame: Called with every message (and its frame as received) from upstream, by the link's thread
+        :param on_connect: Called once connected (again), the relay should subscribe to its groups then
+        :param ssl_context: Connect over TLS with this context (see new_tls_client_context())
+        :param profile: Socket options of the connection
+        :param keepalive_idle: Time (in seconds) without traffic before TCP keepalive probes start, 0 to disable
+        :param connect_timeout: Timeout (in seconds) of each connection attempt
+        :param retry_delay: Time (in seconds) between two connection attempts
+        """
+        self.__address = address
+        self.__user = new_user(username=name, group=None)
+        self.__secret = secret
+        self.__on_frame = on_frame
+        self.__on_connect = on_connect
+        self.__ssl_context = ssl_context
+        self.__profile = profile
+        self.__keepalive_idle = keepalive_idle
+        self.__connect_timeout = connect_timeout
+        self.__retry_delay = retry_delay
+
+        # Frames are queued for the writer of the current connection
+        self.__sock: socket.socket | None = None
+        self.__writer: MessageCoalescer | None = None
+        self.__send_lock = threading.Lock()
+        self.__stopped = threading.Event()
+
+        self.__thread = threading.Thread(
+            target=self.__run,
+            name=f'relay-{name}',
+            daemon=True
+        )
+        self.__thread.start()
+
+    def send(self, frame: bytes | MessageFrame) -> bool:
+        """
+        Queue a frame for upstream, without waiting for it to be written
+
+        :return: Whether the frame was queued (the link is up)
+        """
+        with self.__send_lock:
+            writer = self.__writer
+        if writer is None:
+            return False
+        try:
+            # One priority class, frames are written in the order they are sent
+            writer.push(frame)
+            return True
+        except ConnectionError:
+            return False
+
+    def subscribe(self, group: str, members: frozenset[str]) -> bool:
+        """
+        Set the members of a group behind this relay, none to unsubscribe from it
+
+        :return: Whether it was queued (the link is up, on_connect() is called once it's up again)
+        """
+        return self.send(serialize_message(new_message_proto(
+            src=self.__user,
+            dst=new_user(username=None, group=group),
+            message_type=MessageProtocolCode.INSTRUCTION.RELAY.SUBSCRIBE,
+            body=sorted(members)
+        )))
+
+    def stop(self):
+        self.__stopped.set()
+        with self.__send_lock:
+            if self.__sock is not None:
+                self.__shutdown(self.__sock)
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            sock = self.__connect()
+            if sock is None:
+                self.__stopped.wait(self.__retry_delay)
+                continue
+
+            logger.info(f'Relay {self.__user.username} linked to {self.__address}')
+            try:
+                self.__on_connect()
+                while True:
+                    frame = tcp_sock_recv_frame(sock, timeout=None)
+                    message = deserialize_frame(frame)
+                    if isinstance(message, MessageProtocol):
+                        self.__on_frame(message, frame)
+            except (EOFError, OSError) as e:
+                logger.warning(f'Relay link to {self.__address} is lost: {e!r}')
+            except Exception as e:
+                logger.exception(f'Relay link error: {e}')
+            finally:
+                with self.__send_lock:
+                    self.__sock = None
+                    writer, self.__writer = self.__writer, None
+                # What is still queued is lost with the connection, relays subscribe again once linked again
+                self.__shutdown(sock)
+                if writer:
+                    writer.close(flush=False)
+                sock.close()
+                release_recv_buffer(sock)
+
+            self.__stopped.wait(self.__retry_delay)
+
+    def __connect(self) -> socket.socket | None:
+        sock = new_socket('tcp')
+        try:
+            sock.settimeout(self.__connect_timeout)
+            sock.connect(self.__address)
+            if self.__ssl_context:
+                sock = self.__ssl_context.wrap_socket(sock, server_hostname=self.__address[0])
+            if self.__keepalive_idle > 0:
+                set_keepalive(sock, idle=self.__keepalive_idle, interval=max(self.__keepalive_idle // 3, 1))
+            apply_socket_profile(sock, self.__profile)
+
+            tcp_sock_send(sock, new_message_proto(
+                src=self.__user,
+                dst=None,
+                message_type=MessageProtocolCode.INSTRUCTION.RELAY.JOIN,
+                body=self.__secret
+            ))
+            response = tcp_sock_recv(sock, timeout=self.__connect_timeout)
+            if not (isinstance(response, MessageProtocol) and response.response == MessageProtocolResponse.OK):
+                raise ConnectionRefusedError('Relay is refused (wrong secret, or name already linked)')
+
+            sock.settimeout(None)
+            with self.__send_lock:
+                if self.__stopped.is_set():
+                    raise ConnectionAbortedError('Relay is stopped')
+                self.__sock = sock
+                self.__writer = MessageCoalescer(writer=functools.partial(self.__write, sock))
+            return sock
+        except (OSError, EOFError) as e:
+            logger.warning(f'Unable to link relay to {self.__address}: {e!r}')
+            sock.close()
+            release_recv_buffer(sock)
+            return None
+
+    @classmethod
+    def __write(cls, sock: socket.socket, frames: list[bytes | MessageFrame | FrameFragment]):
+        # Called by the writer of the connection
+        try:
+            tcp_sock_send_frames(sock, frames)
+        except OSError as e:
+            # The link's thread sees it closed and connects again
+            logger.warning(f'Unable to send upstream: {e!r}')
+            cls.__shutdown(sock)
+
+    @staticmethod
+    def __shutdown(sock: socket.socket):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    @property
+    def connected(self) -> bool:
+        return self.__sock is not None
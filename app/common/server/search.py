@@ -0,0 +1,332 @@
+import bisect
+import collections
+import heapq
+import threading
+import time
+from array import array
+from typing import Hashable, Iterator
+from .. import *
+
+# Memory (in bytes, about) a message takes besides its text, and every term of it in the postings
+DOCUMENT_SIZE = 200
+POSTING_SIZE = 8
+
+
+class _Scope:
+    __slots__ = ('postings', 'terms', 'new_terms', 'documents', 'forgotten', 'compacting', 'emptied')
+
+    def __init__(self):
+        # Messages (by increasing id) of every term, and the terms in order for prefixes (new ones on their own,
+        # merged in once there are enough of them)
+        self.postings: dict[str, array] = {}
+        self.terms: list[str] = []
+        self.new_terms: list[str] = []
+
+        # Messages kept, and forgotten since the postings were last compacted
+        self.documents = 0
+        self.forgotten = 0
+        # Terms left to compact in the current pass, and the ones left without messages by it
+        self.compacting: list[str] | None = None
+        self.emptied: list[str] = []
+
+
+class SearchIndex:
+    def __init__(self,
+                 max_documents: int = 1_000_000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 max_text: int = 16 * 1024,
+                 max_expansions: int = 128,
+                 max_scan: int = 100_000,
+                 compact_terms: int = 1024):
+        """
+        Full-text index of the text messages passing through the server, built as they pass, per conversation
+
+        Every conversation (a group, or two clients) has an inverted index: the messages of every word, in the order
+        they were indexed. Hits are found latest first by walking the shortest list of the query and looking up
+        the others, so a page costs about its size whatever the number of messages indexed. The oldest messages
+        are forgotten once there are too many, or once they take too much memory. The postings of a conversation
+        are compacted once as many of its messages were forgotten as are kept, a few terms with every message added.
+
+        :param max_documents: Messages kept, the oldest are forgotten first
+        :param max_bytes: Memory (in bytes, about) the messages kept and their postings take at most
+        :param max_text: Longer messages are not indexed (in characters)
+        :param max_expansions: Words a prefix stands for at most (the first ones in order)
+        :param max_scan: Candidates looked at per page, a page may come short (with a cursor to go on) past them
+        :param compact_terms: Terms compacted per message added, while conversations need it
+        """
+        self.__max_documents = max_documents
+        self.__max_bytes = max_bytes
+        self.__max_text = max_text
+        self.__max_expansions = max_expansions
+        self.__max_scan = max_scan
+        self.__compact_terms = compact_terms
+
+        # Messages by id (increasing, without gaps from the oldest one kept), with their conversation and size
+        self.__documents: dict[int, tuple[Hashable, SearchHit, int]] = {}
+        self.__next_id = 0
+        self.__first_id = 0
+        self.__bytes = 0
+
+        self.__scopes: dict[Hashable, _Scope] = {}
+        # Conversations with postings to compact, in turn
+        self.__compacting: collections.deque[Hashable] = collections.deque()
+        self.__lock = threading.Lock()
+
+    def add(self,
+            scope: Hashable,
+            seq: int,
+            username: str,
+            text: str,
+            group: str | None = None):
+        """
+        Index a message
+
+        :param scope: Conversation of the message
+        :param seq: Sequence number of the message as delivered
+        :param username: Sender
+        :param group: Group it was sent to
+        """
+        if len(text) > self.__max_text:
+            return
+        terms = set(word_tokenize(text))
+        if not terms:
+            return
+
+        hit = SearchHit(seq=seq, group=group, username=username, text=text, timestamp=time.time())
+        size = DOCUMENT_SIZE + len(text) + POSTING_SIZE * len(terms)
+        with self.__lock:
+            doc_id = self.__next_id
+            self.__next_id += 1
+            self.__documents[doc_id] = (scope, hit, size)
+            self.__bytes += size
+
+            index = self.__scopes.get(scope)
+            if index is None:
+                index = self.__scopes[scope] = _Scope()
+            index.documents += 1
+            for term in terms:
+                postings = index.postings.get(term)
+                if postings is None:
+                    postings = index.postings[term] = array('Q')
+                    index.new_terms.append(term)
+                postings.append(doc_id)
+
+            # Merged in once they're a fraction of the terms, so every term is moved a few times at most
+            if len(index.new_terms) > max(len(index.terms) // 8, 64):
+                self.__merge_terms(index)
+
+            if len(self.__documents) > self.__max_documents or self.__bytes > self.__max_bytes:
+                self.__forget()
+            if self.__compacting:
+                self.__compact()
+
+    def search(self,
+               scope: Hashable,
+               query: str,
+               cursor: int | None = None,
+               limit: int = 20) -> SearchPage:
+        """
+        :param scope: Conversation to search
+        :param query: Words (all of them), prefixes (word*) and "quoted phrases"
+        :param cursor: Cursor of the previous page, None for the latest hits
+        :param limit: Hits per page
+        """
+        clauses, phrases = self.__parse(query)
+        if not clauses or limit <= 0:
+            return SearchPage(hits=[], cursor=None)
+
+        with self.__lock:
+            index = self.__scopes.get(scope)
+            if index is None:
+                return SearchPage(hits=[], cursor=None)
+
+            # Every clause is the union of the messages of some words (several for a prefix)
+            lists = [self.__expand(index, term, prefix) for term, prefix in clauses]
+            if not all(lists):
+                return SearchPage(hits=[], cursor=None)
+
+            upper = self.__next_id if cursor is None else min(cursor, self.__next_id)
+            lower = self.__first_id
+            lists.sort(key=lambda postings: sum(len(p) for p in postings))
+            driver, others = lists[0], lists[1:]
+
+            hits: list[SearchHit] = []
+            scanned = 0
+            for doc_id in self.__walk(driver, lower, upper):
+                scanned += 1
+                if scanned > self.__max_scan:
+                    # Going on from here with the next page
+                    return SearchPage(hits=hits, cursor=doc_id + 1)
+                if not all(self.__contains(postings, doc_id) for postings in others):
+                    continue
+                hit = self.__documents[doc_id][1]
+                if phrases and not self.__matches(hit.text, phrases):
+                    continue
+                if len(hits) == limit:
+                    return SearchPage(hits=hits, cursor=doc_id + 1)
+                hits.append(hit)
+
+            return SearchPage(hits=hits, cursor=None)
+
+    def __parse(self, query: str) -> tuple[list[tuple[str, bool]], list[list[str]]]:
+        # Quoted phrases (and words joined by punctuation) need their words next to each other
+        clauses: list[tuple[str, bool]] = []
+        phrases: list[list[str]] = []
+        for token in tokenize(query):
+            words = word_tokenize(token)
+            if not words:
+                continue
+            if len(words) > 1:
+                phrases.append(words)
+                clauses.extend((word, False) for word in words)
+            else:
+                clauses.append((words[0], token.endswith('*')))
+        return list(dict.fromkeys(clauses)), phrases
+
+    def __expand(self, index: _Scope, term: str, prefix: bool) -> list[array]:
+        if not prefix:
+            postings = index.postings.get(term)
+            return [postings] if postings else []
+
+        if index.new_terms:
+            self.__merge_terms(index)
+        start = bisect.bisect_left(index.terms, term)
+        expansions = []
+        for word in index.terms[start:start + self.__max_expansions]:
+            if not word.startswith(term):
+                break
+            # Left without messages until the end of a compaction
+            if postings := index.postings[word]:
+                expansions.append(postings)
+        return expansions
+
+    @staticmethod
+    def __merge_terms(index: _Scope):
+        # Two sorted runs, merged in linear time
+        index.new_terms.sort()
+        index.terms.extend(index.new_terms)
+        index.terms.sort()
+        index.new_terms.clear()
+
+    @staticmethod
+    def __walk(postings: list[array], lower: int, upper: int) -> Iterator[int]:
+        # Messages in [lower, upper) of any of the lists, latest first
+        def backwards(p: array) -> Iterator[int]:
+            for i in range(bisect.bisect_left(p, upper) - 1, bisect.bisect_left(p, lower) - 1, -1):
+                yield p[i]
+
+        if len(postings) == 1:
+            yield from backwards(postings[0])
+            return
+
+        last = None
+        for doc_id in heapq.merge(*(backwards(p) for p in postings), reverse=True):
+            if doc_id != last:
+                last = doc_id
+                yield doc_id
+
+    @staticmethod
+    def __contains(postings: list[array], doc_id: int) -> bool:
+        for p in postings:
+            i = bisect.bisect_left(p, doc_id)
+            if i < len(p) and p[i] == doc_id:
+                return True
+        return False
+
+    @staticmethod
+    def __matches(text: str, phrases: list[list[str]]) -> bool:
+        words = word_tokenize(text)
+        for phrase in phrases:
+            n = len(phrase)
+            if not any(words[i:i + n] == phrase for i in range(len(words) - n + 1)):
+                return False
+        return True
+
+    def __forget(self):
+        while self.__documents and (len(self.__documents) > self.__max_documents or
+                                    self.__bytes > self.__max_bytes):
+            scope, _, size = self.__documents.pop(self.__first_id)
+            self.__first_id += 1
+            self.__bytes -= size
+
+            index = self.__scopes[scope]
+            index.documents -= 1
+            index.forgotten += 1
+            if not index.documents:
+                # Nothing left to search in there
+                self.__scopes.pop(scope)
+            elif index.compacting is None and index.forgotten >= max(index.documents, 16):
+                # Searches skip forgotten messages, postings are compacted once they're mostly forgotten ones
+                index.forgotten = 0
+                index.compacting = list(index.postings)
+                self.__compacting.append(scope)
+
+    def __compact(self):
+        # A few terms at a time, so adding a message never costs a whole index
+        budget = self.__compact_terms
+        while budget > 0 and self.__compacting:
+            scope = self.__compacting[0]
+            index = self.__scopes.get(scope)
+            if index is None or index.compacting is None:
+                # Gone (or created again) meanwhile
+                self.__compacting.popleft()
+                continue
+
+            while budget > 0 and index.compacting:
+                term = index.compacting.pop()
+                budget -= 1
+                postings = index.postings.get(term)
+                if postings:
+                    del postings[:bisect.bisect_left(postings, self.__first_id)]
+                    if not postings:
+                        index.emptied.append(term)
+            if index.compacting:
+                break
+
+            # Terms still without messages are dropped at the end of the pass
+            self.__compacting.popleft()
+            index.compacting = None
+            emptied = {term for term in index.emptied if not index.postings.get(term)}
+            index.emptied = []
+            if emptied:
+                for term in emptied:
+                    index.postings.pop(term)
+                index.terms = [term for term in index.terms if term not in emptied]
+                index.new_terms = [term for term in index.new_terms if term not in emptied]
+
+    @property
+    def documents(self) -> int:
+        """
+        Messages indexed and kept
+        """
+        return len(self.__documents)
+
+    @property
+    def size(self) -> int:
+        """
+        Memory (in bytes, about) the messages kept take
+        """
+        return self.__bytes
+
+    @property
+    def conversations(self) -> int:
+        """
+        Conversations with messages kept
+        """
+        return len(self.__scopes)
+
+    @property
+    def terms(self) -> int:
+        """
+        Terms of every conversation, forgotten ones included until their postings are compacted
+        """
+        with self.__lock:
+            return sum(len(index.postings) for index in self.__scopes.values())
+
+    @property
+    def postings(self) -> int:
+        """
+        Entries in the postings of every term, forgotten messages included until they are compacted
+        """
+        with self.__lock:
+            return sum(len(postings) for index in self.__scopes.values() for postings in index.postings.values())
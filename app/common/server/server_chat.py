@@ -1,21 +1,161 @@
 from .. import *
-from . import TcpServer
-
+from . import TcpServer, UdpServer
+from .acknowledgement import CumulativeAck
+from .blob_store import BlobStore
+from .session import ConnectedClient, Session, SessionStore
+from .timer_wheel import TimerWheel
+from .executor import KeyedExecutor
+from .chat_room import ChatRooms
+from .relay import RelayLink
+from .presence import PresenceService
+from .receipts import ReceiptTracker
+from .search import SearchIndex
+from .rate_limit import RateLimits, RateLimiter, OutboundBacklog
+from .server_config import DeliveryOptions, WorkerPools, SessionOptions, RelayOptions, PresenceOptions, SearchOptions
+
+import functools
+import os
+import secrets
 import threading
 import socket
+import ssl
+import time
+from typing import Iterable
 
 
 class ChatServer:
     def __init__(self,
                  address: tuple[str, int],
-                 server_name: str):
-        # List of chat clients, socket pools, and chat groups
-        self.__clients: dict[str, User] = {}
+                 server_name: str,
+                 udp: bool = False,
+                 ssl_context: ssl.SSLContext | None = None,
+                 delivery: DeliveryOptions = DeliveryOptions(),
+                 rate_limits: RateLimits | None = RateLimits(),
+                 pools: WorkerPools = WorkerPools(),
+                 sessions: SessionOptions = SessionOptions(),
+                 discovery: DiscoveryOptions = DiscoveryOptions(),
+                 relay: RelayOptions = RelayOptions(),
+                 presence: PresenceOptions = PresenceOptions(),
+                 search: SearchOptions | None = SearchOptions(),
+                 blob_cache_size: int = 256 * 1024 * 1024,
+                 control_profile: SocketProfile = LATENCY_PROFILE,
+                 data_profile: SocketProfile = THROUGHPUT_PROFILE):
+        """
+        A simple chat server
+
+        :param address: Address to bind the TCP server to
+        :param server_name: Broadcasting identifier of this server
+        :param udp: Serve ephemeral messages (typing, presence, voice) over UDP on the same port
+        :param ssl_context: Serve over TLS with this context (see new_tls_server_context()), UDP stays plaintext
+        :param delivery: Coalescing of writes, cumulative acknowledgements and the outbound backlog
+        :param rate_limits: Per-user rate limits, None for no limits (messages over the limits are answered with WARN)
+        :param pools: Thread pools processing and sending messages, and running the chat groups
+        :param sessions: Resumable sessions of dropped clients, heartbeats and TCP keepalive
+        :param discovery: Local network discovery to announce this server on
+        :param relay: Relays accepted by this server, and its link to upstream
+        :param presence: Presence, typing and receipt updates pushed to clients
+        :param search: Full-text search index of text messages, None to disable search
+        :param blob_cache_size: Size (in bytes) of the content-addressed attachment cache
+        :param control_profile: Socket options of master connections (control transactions), once identified
+        :param data_profile: Socket options of slave connections (data), once identified
+        """
+        # List of chat clients and socket pools
+        self.__clients: dict[str, ConnectedClient] = {}
         self.__sock_pools: dict[str, SocketPool] = {}
-        self.__groups: dict[str, set[str]] = {}
+
+        # Per-recipient coalescing writers (opt-in), flushed by the senders. They never wait for a recipient,
+        # what it doesn't take stays queued until its connection is writable again
+        self.__coalesce = delivery.coalesce
+        self.__writers: dict[str, MessageCoalescer] = {}
+        self.__writers_lock = threading.Lock()
+        self.__write_poller = WritePoller() if delivery.coalesce else None
+
+        # Cumulative acknowledgement window for senders that opted out of per-message responses
+        self.__ack_every = delivery.ack_every
+        self.__ack_interval = delivery.ack_interval
+
+        # Admission control: per-user token buckets, and the outbound backlog of the whole server
+        self.__limiter = RateLimiter(rate_limits) if rate_limits else None
+        self.__backlog = OutboundBacklog(delivery.max_backlog)
+
+        # Fixed thread pools: connection threads only read, messages are processed and sent by these
+        self.__workers = KeyedExecutor(pools.workers or os.cpu_count() or 4, queue_size=pools.queue_size,
+                                       name='worker')
+        self.__senders = KeyedExecutor(pools.send_workers, queue_size=pools.queue_size, name='sender')
+        self.__bulk_senders = KeyedExecutor(pools.bulk_workers, queue_size=pools.queue_size, name='bulk-sender')
+
+        # Relays linked to this server by name (and by connection), each gets one copy of a group message
+        # for all of its members
+        self.__relay_secret = relay.secret
+        self.__relays: dict[str, socket.socket] = {}
+        self.__relay_socks: dict[socket.socket, str] = {}
+        self.__upstream: RelayLink | None = None
+        # Groups upstream and their audience (as announced by the server upstream), joined here on demand
+        self.__upstream_groups: dict[str, frozenset[str]] = {}
+
+        # Chat groups, each run by one room thread (members, sequence numbers and fan-out)
+        self.__rooms = ChatRooms(self.__fan_out,
+                                 shards=pools.room_workers or os.cpu_count() or 4,
+                                 writer_shards=pools.room_writers,
+                                 spread_members=pools.spread_members,
+                                 queue_size=pools.queue_size,
+                                 relay=self.__relay_out,
+                                 on_change=self.__on_room_change,
+                                 on_post=self.__on_post)
+
+        # Presence pushed to group members and recent private message partners
+        self.__presence = PresenceService(self.__publish_presence,
+                                          audience=self.__presence_audience,
+                                          group_members=self.__group_members,
+                                          window=presence.window,
+                                          debounce=presence.debounce,
+                                          typing_timeout=presence.typing_timeout)
+
+        # Delivered and read receipts, summarized for senders (groups are tracked where they're numbered)
+        self.__receipts = ReceiptTracker(self.__publish_receipts, window=presence.receipt_window)
+
+        # Full-text search of the text messages of every conversation, indexed as they pass (opt-out)
+        self.__search = SearchIndex(max_documents=search.documents, max_bytes=search.max_bytes) if search else None
+        self.__search_private = bool(search and search.private)
+
+        # Link to the server upstream (opt-in): groups are numbered there, this server is one of its relays
+        if relay.upstream:
+            self.__upstream = RelayLink(relay.upstream,
+                                        name=relay.name or server_name,
+                                        secret=relay.secret or '',
+                                        on_frame=self.__on_upstream,
+                                        on_connect=self.__on_upstream_link,
+                                        ssl_context=relay.ssl_context,
+                                        profile=data_profile,
+                                        keepalive_idle=sessions.keepalive_idle)
+
+        # Content-addressed attachments, uploaded once and fetched by digest
+        self.__blobs = BlobStore(max_bytes=blob_cache_size)
+
+        # Resumable sessions of dropped clients
+        self.__sessions = SessionStore(grace=sessions.grace, max_pending=sessions.queue)
+        self.__resume_lock = threading.Lock()
+
+        # Dead-peer detection: master (and not yet identified) connections silent for too long are reaped,
+        # slave connections go with their master
+        self.__heartbeat_timeout = sessions.heartbeat_timeout
+        self.__keepalive_idle = sessions.keepalive_idle
+        self.__reaper = TimerWheel(tick=1.0)
+
+        # Socket options by kind of connection
+        self.__control_profile = control_profile
+        self.__data_profile = data_profile
+
+        # UDP data path for ephemeral messages (opt-in)
+        self.__udp_tokens: dict[str, str] = {}
+        self.__udp_endpoints: dict[str, tuple[str, int]] = {}
+        self.__udp_clients: dict[tuple[str, int], str] = {}
+        self.__udp_framer = DatagramFramer()
+        self.__udp_reassembler = DatagramReassembler()
+        self.__udp_server = UdpServer(*address) if udp else None
 
         # TCP Server
-        self.__server = TcpServer(*address)
+        self.__server = TcpServer(*address, ssl_context=ssl_context)
 
         # Main server thread
         self.__server_thread = threading.Thread(
@@ -24,10 +164,29 @@ class ChatServer:
         )
         self.__server_thread.start()
 
-        # Local network broadcast
+        # Reaper of silent connections and expired sessions
+        self.__reaper_thread = threading.Thread(
+            target=self.__reap,
+            daemon=True
+        )
+        self.__reaper_thread.start()
+
+        if self.__udp_server:
+            self.__udp_thread = threading.Thread(
+                target=self.__start_udp,
+                daemon=True
+            )
+            self.__udp_thread.start()
+
+        # Local network broadcast, advertising where and how busy this server is
+        self.__port = self.__server.address[1]
         self.__broadcaster = UdpBroadcast(service_name=server_name,
                                           broadcast_mode=MessageProtocolCode.INSTRUCTION.BROADCAST.SERVER_DISC,
-                                          disc_callback=None)
+                                          disc_callback=None,
+                                          broadcast_address=discovery.address,
+                                          listen_port=discovery.port,
+                                          info=ServiceInfo(port=self.__port),
+                                          interface=discovery.interface)
 
         logger.info(f'Broadcasting identifier is {server_name}')
 
@@ -35,37 +194,53 @@ class ChatServer:
         with self.__server as server:
             server.start(self.__handle_message)
 
+    def __start_udp(self):
+        with self.__udp_server as server:
+            server.timeout = 0.5
+            server.start(self.__handle_datagram, idle_callback=self.__udp_reassembler.expire)
+
     def __handle_message(self, sock: socket.socket, addr: tuple[str, int]):
+        # This (I/O) thread only reads, frames are decoded and routed in order by the worker bound to the connection
         this_clients: list[str | None] = [None]
+        this_acks = CumulativeAck(every=self.__ack_every, interval=self.__ack_interval)
+        ack_deadline: float | None = None
+
+        try:
+            set_keepalive(sock, idle=self.__keepalive_idle, interval=max(self.__keepalive_idle // 3, 1))
+        except OSError as e:
+            logger.warning(f'Unable to set TCP keepalive: {e}')
+        self.__watch(sock)
 
         try:
             while True:
-                message: MessageProtocol | None = None
+                frame: bytes | None = None
                 try:
-                    message = tcp_sock_recv(sock, timeout=None)
+                    # Wake up in time to have pending cumulative acknowledgements sent
+                    # (never a zero timeout, it would make the socket non-blocking)
+                    timeout = None if ack_deadline is None else max(ack_deadline - time.monotonic(), 0.001)
+                    frame = tcp_sock_recv_frame(sock, timeout=timeout)
                     logger.info(f'Received from {addr}.')
 
                 except socket.timeout:
-                    logger.exception(f'Client timeout!')
+                    pass
 
                 except EOFError:
                     break
 
-                if not message:
-                    continue
+                now = time.monotonic()
+                if ack_deadline is not None and now >= ack_deadline:
+                    ack_deadline = None
+                    self.__workers.submit(sock, self.__flush_pending_acks, sock, this_acks)
 
-                if not isinstance(message, MessageProtocol):
-                    raise TypeError('Message is invalid!')
+                if frame is None:
+                    continue
 
-                # Response to messages
-                __message_processor = None
-                if MessageProtocolCode.is_instruction(message.message_type):
-                    __message_processor = self.__process_instruction
-                elif this_clients[0] is not None:
-                    __message_processor = self.__process_data
+                # Heard from the client, postpone reaping
+                self.__rewatch(sock)
 
-                if __message_processor is not None:
-                    __message_processor(this_clients, addr, sock, message)
+                self.__workers.submit(sock, self.__process_frame, this_clients, addr, sock, frame, this_acks)
+                if ack_deadline is None:
+                    ack_deadline = now + self.__ack_interval
 
         except socket.error:
             logger.warning('Connection is forcibly reset by the client!')
@@ -74,28 +249,81 @@ class ChatServer:
             logger.exception(f'An error has occurred: {e}')
 
         finally:
-            # Clean up when client closed the connections or error has occurred
-            if this_clients[0] in self.__clients:
-                # Leave group list
-                just_left = []
-                for group in self.__groups:
-                    if this_clients[0] in self.__groups[group]:
-                        just_left.append(group)
-                    self.__groups[group].discard(this_clients[0])
-
-                # Close the socket
-                sock.close()
-                logger.info(f'Connection closed with {addr}')
-
-                # Leave client list
-                if this_clients[0] in self.__sock_pools:
-                    self.__sock_pools.pop(this_clients[0])
-                if this_clients[0] in self.__clients:
-                    self.__clients.pop(this_clients[0])
-
-                # Clear empty groups inefficiently
-                # Don't clear other empty groups (may just been created)
-                # self.__groups: dict[str, set[str]] = {k: v for k, v in self.__groups.items() if v and k in just_left}
+            # Clean up once the frames already read are processed
+            self.__workers.submit(sock, self.__close_connection, this_clients, addr, sock)
+
+    def __process_frame(self,
+                        clients: list[str | None],
+                        addr: tuple[str, int] | None,
+                        sock: socket.socket,
+                        frame: bytes,
+                        acks: CumulativeAck):
+        try:
+            # Only the routing header is decoded, the body is forwarded as received
+            message = deserialize_frame(frame)
+            if not isinstance(message, MessageProtocol):
+                raise TypeError('Message is invalid!')
+
+            # Response to messages
+            if relay := self.__relay_socks.get(sock):
+                self.__process_relay(relay, message, frame)
+            elif MessageProtocolCode.is_instruction(message.message_type):
+                self.__process_instruction(clients, addr, sock, message)
+            elif clients[0] is not None:
+                self.__process_data(clients, addr, sock, message, frame, acks)
+
+        except socket.error:
+            logger.warning('Connection is forcibly reset by the client!')
+            self.__shutdown(sock)
+
+        except Exception as e:
+            # The connection's thread sees it closed and cleans up
+            logger.exception(f'An error has occurred: {e}')
+            self.__shutdown(sock)
+
+    def __flush_pending_acks(self, sock: socket.socket, acks: CumulativeAck):
+        if acks.timeout() is None:
+            return
+        try:
+            self.__flush_acks(sock, None, acks)
+        except socket.error:
+            self.__shutdown(sock)
+
+    def __close_connection(self, clients: list[str | None], addr: tuple[str, int] | None, sock: socket.socket):
+        # Clean up when client closed the connections or error has occurred
+        self.__reaper.cancel(sock)
+        # A socket of a resumption in progress must not end up in the resumed client's pool
+        with self.__resume_lock:
+            self.__sessions.detach(sock)
+        sock.close()
+        release_recv_buffer(sock)
+
+        # A relay is unsubscribed from every group, its members are gone with it
+        if relay := self.__relay_socks.pop(sock, None):
+            if self.__relays.get(relay) is sock:
+                self.__relays.pop(relay)
+                for group in self.__rooms.rooms_of_relay(relay):
+                    self.__rooms.subscribe(group, relay, [])
+            logger.info(f'Relay {relay} unlinked')
+
+        if self.__disconnect(clients[0], sock):
+            logger.info(f'Connection closed with {addr}')
+
+        self.__expire_sessions()
+
+    @staticmethod
+    def __apply_profile(sock: socket.socket, profile: SocketProfile):
+        try:
+            apply_socket_profile(sock, profile)
+        except OSError as e:
+            logger.warning(f'Unable to set socket options ({profile.name}): {e}')
+
+    @staticmethod
+    def __shutdown(sock: socket.socket):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def __process_instruction(self,
                               clients: list[str | None],
@@ -103,7 +331,9 @@ class ChatServer:
                               sock: socket.socket,
                               message: MessageProtocol):
         logger.info(f'Processing instruction from {addr} using {sock}')
-        logger.info(f'Message: {message}'[:256])
+        # Never format the body, it may be megabytes
+        logger.info(f'Message: {message.message_type} from {message.src} to {message.dst} '
+                    f'({len(message._body)} bytes)')
 
         if message.message_type == MessageProtocolCode.INSTRUCTION.IDENTIFY_MASTER:
             # Initial identification
@@ -113,14 +343,18 @@ class ChatServer:
             if not (message.src and message.src.username):
                 return
 
-            if message.src.username not in self.__clients:
+            self.__expire_sessions()
+
+            # Names of suspended sessions are reserved until they expire
+            if message.src.username not in self.__clients and not self.__sessions.is_suspended(message.src.username):
                 # New client
                 clients[0] = message.src.username
-                self.__clients[clients[0]] = new_user(username=clients[0],
-                                                      group=None,
-                                                      address=addr,
-                                                      sock_master=sock,
-                                                      sock_slaves=[])
+                self.__clients[clients[0]] = ConnectedClient(username=clients[0],
+                                                             group=None,
+                                                             address=addr,
+                                                             sock_master=sock,
+                                                             sock_slaves=[])
+                self.__apply_profile(sock, self.__control_profile)
                 tcp_sock_send(sock, new_message_proto(
                     src=None,
                     dst=message.src,
@@ -159,9 +393,11 @@ class ChatServer:
                 ))
                 logger.warning(f'Client {message.src.username} master not found! Unable to add slave')
             else:
-                # Add new socket
+                # Add new socket, it lives as long as the master does
                 clients[0] = message.src.username
                 self.__clients[clients[0]].sock_slaves.append(sock)
+                self.__reaper.cancel(sock)
+                self.__apply_profile(sock, self.__data_profile)
 
                 tcp_sock_send(sock, new_message_proto(
                     src=None,
@@ -194,14 +430,111 @@ class ChatServer:
                 # Confirm socket list
                 self.__sock_pools[clients[0]] = SocketPool(self.__clients[clients[0]].sock_slaves)
 
+                # Reply with a token to resume this session after a drop
                 tcp_sock_send(sock, new_message_proto(
                     src=None,
                     dst=message.src,
                     message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
                     response=MessageProtocolResponse.OK,
-                    body=None
+                    body=self.__sessions.open(clients[0])
                 ))
                 logger.info(f'Client {message.src.username} slave confirmed by master!')
+                self.__presence.set(clients[0], PresenceState.ONLINE)
+                self.__advertise()
+
+        elif message.message_type == MessageProtocolCode.INSTRUCTION.RELAY.JOIN:
+            # Relay linking to this server
+            # Made by relays, over a connection of their own
+
+            # Exit if invalid source
+            if not (message.src and message.src.username):
+                return
+
+            relay = message.src.username
+            secret = message.body
+            if (self.__relay_secret and isinstance(secret, str) and
+                    secrets.compare_digest(secret.encode(), self.__relay_secret.encode()) and
+                    relay not in self.__relays and clients[0] is None):
+                # Relays stay linked as long as the connection does (keepalive notices a dead one)
+                self.__reaper.cancel(sock)
+                self.__apply_profile(sock, self.__data_profile)
+
+                tcp_sock_send(sock, new_message_proto(
+                    src=None,
+                    dst=message.src,
+                    message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                    response=MessageProtocolResponse.OK,
+                    body=None
+                ))
+
+                # From now on written by the sender bound to the relay only, the groups first
+                self.__relays[relay] = sock
+                self.__relay_socks[sock] = relay
+                self.__senders.submit(relay, self.__send_directory, relay)
+                logger.info(f'Relay {relay} linked successfully!')
+            else:
+                # Relays not accepted, wrong secret, or relay already linked
+                tcp_sock_send(sock, new_message_proto(
+                    src=None,
+                    dst=message.src,
+                    message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                    response=MessageProtocolResponse.ERROR,
+                    body=None
+                ))
+                logger.warning(f'Relay {relay} refused!')
+
+        elif message.message_type == MessageProtocolCode.INSTRUCTION.HEARTBEAT.PING:
+            # Idle client checking the connection is still alive (receiving it already postponed reaping)
+            tcp_sock_send(sock, new_message_proto(
+                src=None,
+                dst=message.src,
+                message_type=MessageProtocolCode.INSTRUCTION.HEARTBEAT.PONG,
+                response=MessageProtocolResponse.OK,
+                body=None
+            ))
+
+        elif message.message_type in (MessageProtocolCode.INSTRUCTION.SESSION.RESUME,
+                                      MessageProtocolCode.INSTRUCTION.SESSION.ATTACH):
+            # Resumption: master sends (token, number of slaves), every slave sends the token, all at once
+            is_master = message.message_type == MessageProtocolCode.INSTRUCTION.SESSION.RESUME
+            body = message.body
+            if is_master and isinstance(body, tuple) and len(body) == 2 and isinstance(body[1], int):
+                token, expected_slaves = body
+            else:
+                token, expected_slaves = (None, None) if is_master else (body, None)
+
+            self.__expire_sessions()
+
+            # The client reconnected before we noticed its connections were gone (e.g. half-open),
+            # the token proves it's the same client: let go of the old connections
+            if (isinstance(token, str) and message.src and message.src.username in self.__clients
+                    and self.__sessions.owns(token, message.src.username)):
+                logger.warning(f'Client {message.src.username} took its session over from stale connections')
+                self.__disconnect(message.src.username, None)
+
+            # Slaves are answered before the session completes, so replayed messages come after the answer
+            with self.__resume_lock:
+                session, complete = (None, False)
+                if isinstance(token, str) and message.src and message.src.username:
+                    session, complete = self.__sessions.attach(token, message.src.username, sock,
+                                                               is_master, expected_slaves)
+
+                if session:
+                    clients[0] = session.username
+                    if not is_master:
+                        self.__reaper.cancel(sock)
+                    self.__apply_profile(sock, self.__control_profile if is_master else self.__data_profile)
+                if not (session and is_master):
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.OK if session else MessageProtocolResponse.NOT_EXIST,
+                        body=None
+                    ))
+
+            if complete:
+                self.__resume(session)
 
         else:
             # Other instructions later after identification
@@ -225,18 +558,19 @@ class ChatServer:
                     dst=message.src,
                     message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
                     response=MessageProtocolResponse.OK,
-                    body=list(self.__groups.keys())
+                    body=self.__group_names()
                 ))
 
             elif message.message_type == MessageProtocolCode.INSTRUCTION.GROUP.LIST_CLIENTS:
                 body = message.body
-                if body and isinstance(body, str) and body in self.__groups:
+                audience = self.__group_listing(body) if body and isinstance(body, str) else None
+                if audience is not None:
                     tcp_sock_send(sock, new_message_proto(
                         src=None,
                         dst=message.src,
                         message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
                         response=MessageProtocolResponse.OK,
-                        body=list(self.__groups[body])
+                        body=list(audience)
                     ))
                 else:
                     tcp_sock_send(sock, new_message_proto(
@@ -270,8 +604,8 @@ class ChatServer:
             elif message.message_type == MessageProtocolCode.INSTRUCTION.GROUP.CREATE:
                 body = message.body
                 if body and isinstance(body, str):
-                    # Create a group if not exist
-                    if body in self.__groups:
+                    # Create a group if not exist (here, or upstream for relays)
+                    if body in self.__upstream_groups or not self.__rooms.create(body):
                         tcp_sock_send(sock, new_message_proto(
                             src=None,
                             dst=message.src,
@@ -281,7 +615,7 @@ class ChatServer:
                         ))
                     # Throws error if exists
                     else:
-                        self.__groups[body] = set()
+                        self.__announce_groups([(body, [])])
 
                         # Reply successful message
                         tcp_sock_send(sock, new_message_proto(
@@ -303,9 +637,11 @@ class ChatServer:
 
             elif message.message_type == MessageProtocolCode.INSTRUCTION.GROUP.JOIN:
                 body = message.body
-                if body and isinstance(body, str) and body in self.__groups:
-                    # Add user to that group
-                    self.__groups[body].add(message.src.username)
+                # Relays join groups upstream through a room of their own, subscribed to the group upstream
+                if isinstance(body, str) and body in self.__upstream_groups:
+                    self.__rooms.create(body)
+                if body and isinstance(body, str) and self.__rooms.join(body, message.src.username):
+                    # User added to that group
                     self.__clients[clients[0]].group = body
 
                     # Reply successful message
@@ -329,14 +665,10 @@ class ChatServer:
             elif message.message_type == MessageProtocolCode.INSTRUCTION.GROUP.LEAVE:
                 # Remove user from specific group
                 body = message.body
-                if body and isinstance(body, str) and body in self.__groups:
-                    if message.src.username in self.__groups[body]:
-                        self.__groups[body].discard(message.src.username)
-
-                        # Clear if empty
-                        if not self.__groups[body]:
-                            self.__groups.pop(body)
-
+                # The group goes once empty
+                left = self.__rooms.leave(body, message.src.username) if body and isinstance(body, str) else None
+                if left is not None:
+                    if left:
                         # Unassign group from user
                         self.__clients[clients[0]].group = None
 
@@ -367,16 +699,136 @@ class ChatServer:
                         body=None
                     ))
 
+            elif message.message_type == MessageProtocolCode.INSTRUCTION.UDP.JOIN:
+                # Only ever of the client identified on this connection
+                username = clients[0]
+                if username is None or message.src.username != username:
+                    # Reply error message
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.ERROR,
+                        body=None
+                    ))
+                elif self.__udp_server:
+                    # Token to register a datagram endpoint against this client
+                    token = secrets.token_hex(16)
+                    self.__udp_tokens[token] = username
+
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.OK,
+                        body=token
+                    ))
+                else:
+                    # Reply error message (UDP is not served)
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.NOT_EXIST,
+                        body=None
+                    ))
+
+            elif message.message_type == MessageProtocolCode.INSTRUCTION.BLOB.HAS:
+                body = message.body
+                if body and isinstance(body, list):
+                    # Reply with the digests that still have to be uploaded
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
+                        response=MessageProtocolResponse.OK,
+                        body=self.__blobs.missing(body)
+                    ))
+                else:
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
+                        response=MessageProtocolResponse.ERROR,
+                        body=[]
+                    ))
+
+            elif message.message_type == MessageProtocolCode.INSTRUCTION.BLOB.PUT:
+                if clients[0] is None:
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.ERROR,
+                        body=None
+                    ))
+                    return
+
+                if not self.__admit(clients[0], message):
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.WARN,
+                        body=None
+                    ))
+                    return
+
+                body = message.body
+                if isinstance(body, BlobPart):
+                    # Uploaded in order, one part at a time: reply with the bytes received so far
+                    received = self.__blobs.put_part(clients[0], body)
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.OK if received is not None else MessageProtocolResponse.ERROR,
+                        body=received
+                    ))
+                    return
+
+                digest = self.__blobs.put(body) if isinstance(body, bytes) else None
+                tcp_sock_send(sock, new_message_proto(
+                    src=None,
+                    dst=message.src,
+                    message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                    response=MessageProtocolResponse.OK if digest else MessageProtocolResponse.ERROR,
+                    body=digest
+                ))
+
+            elif message.message_type == MessageProtocolCode.INSTRUCTION.BLOB.GET:
+                # Replies carry the sequence number of the request, so the client knows which download it is
+                ser = self.__blobs.get_serialized(message.body)
+                if ser is not None:
+                    # Kept for this recipient until now
+                    self.__blobs.unpin(message.body, clients[0])
+
+                    # Content is already serialized, send it as is
+                    tcp_sock_send(sock, MessageProtocol(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
+                        message_flag=None,
+                        response=MessageProtocolResponse.OK,
+                        _body=ser,
+                        seq=message.seq
+                    ))
+                else:
+                    # Reply error message (evicted or never uploaded)
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
+                        response=MessageProtocolResponse.NOT_EXIST,
+                        seq=message.seq,
+                        body=None
+                    ))
+
             elif message.message_type == MessageProtocolCode.INSTRUCTION.GROUP.LEAVE_ALL:
                 # Remove user from every group
-                just_left = []
-                for group in self.__groups:
-                    if message.src.username in self.__groups[group]:
-                        just_left.append(group)
-                    self.__groups[group].discard(message.src.username)
-
-                # Clear empty groups
-                # self.__groups: dict[str, set[str]] = {k: v for k, v in self.__groups.items() if v and k in just_left}
+                just_left = self.__rooms.rooms_of(message.src.username)
+                for group in just_left:
+                    self.__rooms.discard(group, message.src.username)
 
                 # Unassign group from user
                 self.__clients[clients[0]].group = None
@@ -390,48 +842,319 @@ class ChatServer:
                     body=None
                 ))
 
+            elif message.message_type == MessageProtocolCode.INSTRUCTION.PRESENCE.SET:
+                # Online, away, or typing in a group (members only) or to a client
+                # Only ever of the client identified on this connection
+                username = clients[0]
+                state = message.body
+                group = message.dst.group if message.dst else None
+                peer = message.dst.username if message.dst else None
+                if username is not None and message.src.username == username and (
+                        state in (PresenceState.ONLINE, PresenceState.AWAY) or (
+                        state == PresenceState.TYPING and (
+                        self.__rooms.is_member(group, username) if group else bool(peer)))):
+                    # Pushed to the interested peers with the next update, if it holds
+                    self.__presence.set(username, state, group=group, peer=peer)
+
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.OK,
+                        body=None
+                    ))
+                else:
+                    # Reply error message
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.ERROR,
+                        body=None
+                    ))
+
+            elif message.message_type == MessageProtocolCode.INSTRUCTION.PRESENCE.QUERY:
+                body = message.body
+                if isinstance(body, list) and all(isinstance(username, str) for username in body):
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
+                        response=MessageProtocolResponse.OK,
+                        body=self.__presence.get(body)
+                    ))
+                else:
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
+                        response=MessageProtocolResponse.ERROR,
+                        body=[]
+                    ))
+
+            elif message.message_type == MessageProtocolCode.INSTRUCTION.RECEIPT.ACK:
+                # Cumulative acknowledgements: (state, group, sender, seq), of a group or of a sender's private messages
+                # Only ever of the client identified on this connection
+                username = clients[0]
+                body = message.body
+                if username is not None and message.src.username == username and isinstance(body, list) and all(
+                        isinstance(ack, tuple) and len(ack) == 4 and
+                        ack[0] in (ReceiptState.DELIVERED, ReceiptState.READ) and
+                        isinstance(ack[3], int) and (ack[1] or ack[2]) for ack in body):
+                    for state, group, sender, seq in body:
+                        conversation = ('group', group) if group else ('user', sender, username)
+                        self.__receipts.ack(username, state, conversation, seq)
+
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.OK,
+                        body=None
+                    ))
+                else:
+                    # Reply error message
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                        response=MessageProtocolResponse.ERROR,
+                        body=None
+                    ))
+
+            elif message.message_type == MessageProtocolCode.INSTRUCTION.SEARCH.QUERY:
+                # A group the client is a member of, or its private messages with a client
+                # Only ever for the client identified on this connection
+                username = clients[0]
+                query = message.body
+                group = message.dst.group if message.dst else None
+                peer = message.dst.username if message.dst else None
+                if username is None or message.src.username != username:
+                    scope = None
+                elif group and self.__rooms.is_member(group, username):
+                    scope = ('group', group)
+                elif peer and not group and self.__search_private:
+                    scope = self.__private_scope(username, peer)
+                else:
+                    scope = None
+
+                if self.__search is not None and scope is not None and isinstance(query, SearchQuery):
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
+                        response=MessageProtocolResponse.OK,
+                        body=self.__search.search(scope, query.text, cursor=query.cursor,
+                                                  limit=max(1, min(query.limit, 100)))
+                    ))
+                else:
+                    tcp_sock_send(sock, new_message_proto(
+                        src=None,
+                        dst=message.src,
+                        message_type=MessageProtocolCode.DATA.PYTHON_OBJECT,
+                        response=MessageProtocolResponse.ERROR,
+                        body=SearchPage(hits=[], cursor=None)
+                    ))
+
     def __send_each(self,
                     target_client: str,
-                    message: MessageProtocol):
-        # Skip sending to the original sender
-        if target_client == message.src.username:
+                    message: MessageProtocol,
+                    frame: bytes | MessageFrame,
+                    size: int = 0):
+        try:
+            # Skip sending to the original sender
+            if target_client == message.src.username:
+                return
+
+            # Bulk transfers wait for a socket behind everything else, and leave some free for it
+            priority = message_priority(message)
+
+            if message.message_type and message.message_flag == MessageProtocolFlag.ANNOUNCE:
+                logger.info(f'Announcing message '
+                            f'from {message.src.username} '
+                            f'server-wide '
+                            f'(Semaphore {self.__sock_pools[target_client].value})')
+
+                with self.__sock_pools[target_client].get_socket(priority) as target_sock:
+                    tcp_sock_send_frames(target_sock, [frame])
+
+                logger.info(f'Finished announcing message '
+                            f'from {message.src.username} '
+                            f'server-wide '
+                            f'(Semaphore {self.__sock_pools[target_client].value})')
+            else:
+                # Message to target
+                logger.info(f'Direct messaging '
+                            f'from {message.src.username} '
+                            f'to {message.dst.group}/{target_client}... '
+                            f'(Semaphore {self.__sock_pools[target_client].value})')
+
+                with self.__sock_pools[target_client].get_socket(priority) as target_sock:
+                    tcp_sock_send_frames(target_sock, [frame])
+
+                logger.info(f'Finished request '
+                            f'from {message.src.username} '
+                            f'to {message.dst.group}/{target_client}... '
+                            f'(Semaphore {self.__sock_pools[target_client].value})')
+        except (KeyError, socket.error) as e:
+            # Recipient left meanwhile
+            logger.warning(f'Unable to send to {target_client}: {e!r}')
+        finally:
+            # Written (or given up on), no longer part of the outbound backlog
+            self.__backlog.release(size)
+
+    def __writer_of(self, target_client: str) -> MessageCoalescer:
+        with self.__writers_lock:
+            if target_client not in self.__writers:
+                pool = self.__sock_pools[target_client]
+
+                # Coalescing happens here, so keep Nagle out of the way
+                for target_sock in self.__clients[target_client].sock_slaves:
+                    set_nodelay(target_sock)
+
+                # Batches are already in priority order here. Fragments of a frame have to follow each other
+                # on the same socket, and so does what a socket didn't take, so it is kept until none is left
+                # half-written
+                held: list[socket.socket] = []
+                open_lanes: set[int] = set()
+                unsent: list[memoryview] = []
+                owed = 0
+
+                def write(frames: list[bytes | MessageFrame | FrameFragment]) -> bool:
+                    nonlocal owed
+                    target_sock = held.pop() if held else pool.acquire_socket(MessagePriority.CONTROL)
+                    owed += sum(len(frame) for frame in frames)
+                    written = True
+                    try:
+                        written = tcp_sock_send_frames_nowait(target_sock, frames, unsent)
+                        for frame in frames:
+                            if isinstance(frame, FrameFragment):
+                                (open_lanes.discard if frame.last else open_lanes.add)(frame.lane)
+                    except Exception:
+                        open_lanes.clear()
+                        unsent.clear()
+                        raise
+                    finally:
+                        if open_lanes or unsent:
+                            held.append(target_sock)
+                        else:
+                            pool.release_socket(target_sock)
+                        if not unsent:
+                            # Written (or given up on), no longer part of the outbound backlog
+                            self.__backlog.release(owed)
+                            owed = 0
+
+                    if not written:
+                        # The sender goes on with other recipients meanwhile
+                        self.__write_poller.watch(target_sock, writer.resume)
+                    return written
+
+                writer = MessageCoalescer(writer=write,
+                                          submit=functools.partial(self.__senders.submit, target_client))
+                self.__writers[target_client] = writer
+
+            return self.__writers[target_client]
+
+    def __fan_out(self,
+                  target_clients: list[str],
+                  message: MessageProtocol,
+                  frame: bytes | MessageFrame):
+        # The frame is forwarded as received, its body is never serialized again
+        # (groups number their messages, only the routing header is serialized again for them)
+        # Suspended clients get the message when they resume
+        connected_clients = []
+        for target_client in target_clients:
+            if target_client != message.src.username and self.__sessions.is_suspended(target_client):
+                self.__sessions.queue(target_client, frame)
+            else:
+                connected_clients.append(target_client)
+        target_clients = connected_clients
+
+        if not self.__coalesce:
+            size = len(frame)
+            target_clients = [target_client for target_client in target_clients
+                              if target_client != message.src.username]
+            self.__backlog.reserve(size * len(target_clients))
+
+            # Bulk transfers have their own senders, so they never hold up messages to the same recipient
+            senders = self.__bulk_senders if message_priority(message) == MessagePriority.BULK else self.__senders
+            for target_client in target_clients:
+                senders.submit(target_client, self.__send_each, target_client, message, frame, size)
             return
 
-        if message.message_type and message.message_flag == MessageProtocolFlag.ANNOUNCE:
-            logger.info(f'Announcing message '
-                        f'from {message.src.username} '
-                        f'server-wide '
-                        f'(Semaphore {self.__sock_pools[target_client].value})')
+        # Queue the same frame for every recipient
+        priority = message_priority(message)
+        for target_client in target_clients:
+            if target_client == message.src.username or target_client not in self.__sock_pools:
+                continue
+            self.__backlog.reserve(len(frame))
+            try:
+                self.__writer_of(target_client).push(frame, priority)
+            except (ConnectionError, KeyError):
+                # Recipient left meanwhile
+                self.__backlog.release(len(frame))
+
+    def __acknowledge(self,
+                      sock: socket.socket,
+                      message: MessageProtocol,
+                      response: MessageProtocolResponse,
+                      acks: CumulativeAck):
+        if response != MessageProtocolResponse.OK and message.ack in (MessageProtocolAck.NONE,
+                                                                      MessageProtocolAck.CUMULATIVE):
+            # Negative acknowledgement for the undeliverable message only
+            tcp_sock_send(sock, new_message_proto(
+                src=None,
+                dst=message.src,
+                message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                response=response,
+                flag=MessageProtocolFlag.NACK,
+                seq=message.seq,
+                body=message.dst
+            ))
+
+        elif message.ack == MessageProtocolAck.NONE:
+            # Fire and forget
+            pass
 
-            with self.__sock_pools[target_client].get_socket() as target_sock:
-                tcp_sock_send(target_sock, message)
+        elif message.ack == MessageProtocolAck.CUMULATIVE:
+            if acks.track(message.seq):
+                self.__flush_acks(sock, message.src, acks)
 
-            logger.info(f'Finished announcing message '
-                        f'from {message.src.username} '
-                        f'server-wide '
-                        f'(Semaphore {self.__sock_pools[target_client].value})')
         else:
-            # Message to target
-            logger.info(f'Direct messaging '
-                        f'from {message.src.username} '
-                        f'to {message.dst.group}/{target_client}... '
-                        f'(Semaphore {self.__sock_pools[target_client].value})')
-
-            with self.__sock_pools[target_client].get_socket() as target_sock:
-                tcp_sock_send(target_sock, message)
+            tcp_sock_send(sock, new_message_proto(
+                src=None,
+                dst=message.src,
+                message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                response=response,
+                seq=message.seq,
+                body=None
+            ))
 
-            logger.info(f'Finished request '
-                        f'from {message.src.username} '
-                        f'to {message.dst.group}/{target_client}... '
-                        f'(Semaphore {self.__sock_pools[target_client].value})')
+    @staticmethod
+    def __flush_acks(sock: socket.socket,
+                     dst: User | None,
+                     acks: CumulativeAck):
+        tcp_sock_send(sock, new_message_proto(
+            src=None,
+            dst=dst,
+            message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+            response=MessageProtocolResponse.OK,
+            flag=MessageProtocolFlag.ACK,
+            seq=acks.take(),
+            body=None
+        ))
 
     def __process_data(self,
                        clients: list[str | None],
                        addr: tuple[str, int] | None,
                        sock: socket.socket,
-                       message: MessageProtocol):
+                       message: MessageProtocol,
+                       frame: bytes,
+                       acks: CumulativeAck):
         logger.info(f'Processing data from {addr}')
-        logger.info(f'Message: {message}'[:256])
+        # Never format the body, it may be megabytes
+        logger.info(f'Message: {message.message_type} from {message.src} to {message.dst} '
+                    f'({len(message._body)} bytes)')
 
         source_exists: bool = message.src and message.src.username and message.src.username in self.__clients
 
@@ -440,97 +1163,546 @@ class ChatServer:
             logger.warning('Source client not found!')
             return
 
-        destination_is_group: bool = message.dst and message.dst.group and message.dst.group in self.__groups
-        destination_is_private: bool = message.dst and message.dst.username and message.dst.username in self.__clients
-        user_is_in_group: bool = (message.src.group in self.__groups and
-                                  message.src.username in self.__groups[message.src.group])
+        # Only ever on behalf of the client identified on this connection
+        if message.src.username != clients[0]:
+            logger.warning(f'Message from {message.src.username} refused on the connection of {clients[0]}')
+            self.__acknowledge(sock, message, MessageProtocolResponse.ERROR, acks)
+            return
+
+        # Refuse before doing any work for the message
+        if not self.__admit(clients[0], message):
+            self.__acknowledge(sock, message, MessageProtocolResponse.WARN, acks)
+            return
+
+        room = self.__rooms.get(message.dst.group) if message.dst else None
+        destination_is_group: bool = room is not None
+        destination_is_private: bool = message.dst and message.dst.username and (
+                message.dst.username in self.__clients or self.__sessions.is_suspended(message.dst.username))
+        user_is_in_group: bool = self.__rooms.is_member(message.src.group, message.src.username)
 
         if message.message_flag and message.message_flag == MessageProtocolFlag.ANNOUNCE:
             logger.info(f'Starting server-side broadcast announcement...')
 
-            threads = [threading.Thread(
-                target=self.__send_each,
-                args=(target_client, message),
-                daemon=True
-            ) for target_client in self.__clients]
-
-            for thr in threads:
-                thr.start()
+            self.__fan_out(list(self.__clients) + self.__sessions.suspended, message, frame)
 
             # Always reply successful message when all done
-            tcp_sock_send(sock, new_message_proto(
-                src=None,
-                dst=message.src,
-                message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
-                response=MessageProtocolResponse.OK,
-                body=None
-            ))
+            self.__acknowledge(sock, message, MessageProtocolResponse.OK, acks)
 
         elif destination_is_group:
             # WANT TO SEND IN A GROUP CHAT
             if not user_is_in_group:
                 logger.warning(f'User {message.src.username} is not in the group!')
+                self.__acknowledge(sock, message, MessageProtocolResponse.ERROR, acks)
                 return
 
             logger.info(f'Group chat broadcast for Group {message.dst.group}')
 
-            threads = [threading.Thread(
-                target=self.__send_each,
-                args=(target_client, message),
-                daemon=True
-            ) for target_client in self.__groups[message.dst.group]]
-
-            for thr in threads:
-                thr.start()
+            if not self.__pin_attachment(message, room.members - {message.src.username}):
+                self.__acknowledge(sock, message, MessageProtocolResponse.NOT_EXIST, acks)
+                return
 
-            # Always reply successful message when all done
-            tcp_sock_send(sock, new_message_proto(
-                src=None,
-                dst=message.src,
-                message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
-                response=MessageProtocolResponse.OK,
-                body=None
-            ))
+            # The thread of the group numbers and fans it out, replies stay on the thread of this connection
+            if self.__post_group(room.name, message, frame):
+                self.__acknowledge(sock, message, MessageProtocolResponse.OK, acks)
+            else:
+                self.__acknowledge(sock, message, MessageProtocolResponse.ERROR, acks)
 
         elif destination_is_private:
             if message.src.username != message.dst.username:
-
-                threading.Thread(
-                    target=self.__send_each,
-                    args=(message.dst.username, message),
-                    daemon=True
-                ).start()
+                if not self.__pin_attachment(message, (message.dst.username,)):
+                    self.__acknowledge(sock, message, MessageProtocolResponse.NOT_EXIST, acks)
+                    return
+
+                # Tracked before it can be acknowledged by the recipient
+                if message.seq is not None:
+                    self.__receipts.track(('user', message.src.username, message.dst.username), message.seq,
+                                          message.src.username, message.seq, frozenset((message.dst.username,)),
+                                          username=message.dst.username)
+                if self.__search_private:
+                    self.__index(self.__private_scope(message.src.username, message.dst.username), message.seq,
+                                 message)
+                self.__fan_out([message.dst.username], message, frame)
+                self.__presence.touch(message.src.username, message.dst.username)
 
                 # Always reply successful message when done
-                tcp_sock_send(sock, new_message_proto(
-                    src=None,
-                    dst=message.src,
-                    message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
-                    response=MessageProtocolResponse.OK,
-                    body=None
-                ))
+                self.__acknowledge(sock, message, MessageProtocolResponse.OK, acks)
             else:
                 logger.info(f'Client loopback tried by: {message.src.username}')
-                tcp_sock_send(sock, new_message_proto(
-                    src=None,
-                    dst=message.src,
-                    message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
-                    response=MessageProtocolResponse.ERROR,
-                    body=None
-                ))
+                self.__acknowledge(sock, message, MessageProtocolResponse.ERROR, acks)
 
         else:
             # INVALID DESTINATION
             logger.warning(f'Destination client not found!')
 
-            # Reply error message
-            tcp_sock_send(sock, new_message_proto(
+            # Reply error message (negative acknowledgements tell why it was undeliverable)
+            self.__acknowledge(sock, message, MessageProtocolResponse.NOT_EXIST if message.ack in (
+                MessageProtocolAck.NONE, MessageProtocolAck.CUMULATIVE) else MessageProtocolResponse.ERROR, acks)
+
+    def __pin_attachment(self, message: MessageProtocol, recipients: Iterable[str]) -> bool:
+        """
+        Keep the attachment a message refers to until its recipients downloaded it
+
+        :return: Whether the attachment is there (always for other messages)
+        """
+        # Only the small body of a reference is deserialized, never an attachment sent inline
+        if message.message_type != MessageProtocolCode.DATA.FILE or len(message._body) > 4096:
+            return True
+
+        blob_ref = message.body
+        if not isinstance(blob_ref, BlobRef):
+            return True
+        return self.__blobs.pin(blob_ref.digest, recipients)
+
+    def __post_group(self, group: str, message: MessageProtocol, frame: bytes) -> bool:
+        """
+        :return: Whether the message was taken (the group exists, or the link upstream is up)
+        """
+        # Relays have group messages numbered upstream, they come back to be delivered (see __on_upstream())
+        if self.__upstream:
+            return self.__upstream.send(frame)
+        return self.__rooms.post(group, message, frame)
+
+    def __process_relay(self,
+                        relay: str,
+                        message: MessageProtocol,
+                        frame: bytes):
+        logger.info(f'Message: {message.message_type} from relay {relay} to {message.dst} '
+                    f'({len(message._body)} bytes)')
+
+        # Relays check the members behind them, and what they send on their behalf
+        if not (message.dst and message.dst.group):
+            logger.warning(f'Relay {relay} sent a message to no group!')
+
+        elif message.message_type == MessageProtocolCode.INSTRUCTION.RELAY.SUBSCRIBE:
+            if isinstance(message.body, list):
+                self.__rooms.subscribe(message.dst.group, relay, message.body)
+
+        elif MessageProtocolCode.is_data(message.message_type) and message.src and message.src.username:
+            if not self.__post_group(message.dst.group, message, frame):
+                logger.warning(f'Unable to post to group {message.dst.group} for relay {relay}')
+
+    def __relay_out(self,
+                    relays: list[str],
+                    message: MessageProtocol,
+                    frame: bytes | MessageFrame):
+        # One copy per relay, written by the sender bound to it (so in order, and one at a time)
+        size = len(frame)
+        self.__backlog.reserve(size * len(relays))
+        for relay in relays:
+            self.__senders.submit(relay, self.__send_relay, relay, frame, size)
+
+    def __send_relay(self, relay: str, frame: bytes | MessageFrame, size: int):
+        try:
+            sock = self.__relays.get(relay)
+            if sock is not None:
+                tcp_sock_send_frames(sock, [frame])
+        except socket.error as e:
+            # The connection's thread sees it closed and unsubscribes the relay
+            logger.warning(f'Unable to send to relay {relay}: {e!r}')
+            self.__shutdown(sock)
+        finally:
+            self.__backlog.release(size)
+
+    def __on_room_change(self, group: str, audience: frozenset[str]):
+        # Called by the thread of the group, subscriptions and announcements are written in the order it changes
+        if self.__upstream:
+            self.__upstream.subscribe(group, audience)
+        else:
+            self.__announce_groups([(group, sorted(audience) if self.__rooms.get(group) else None)])
+
+    def __announce_groups(self, groups: list[tuple[str, list[str] | None]]):
+        """
+        Tell the relays about groups changed here (their audience, None once removed), only where groups are numbered
+        """
+        if self.__upstream or not self.__relays:
+            return
+        message = new_message_proto(
+            src=None,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.RELAY.GROUPS,
+            body=groups
+        )
+        self.__relay_out(list(self.__relays), message, serialize_message(message))
+
+    def __group_directory(self) -> list[tuple[str, list[str]]]:
+        # Every group known here: announced from upstream, or those numbered here
+        if self.__upstream:
+            return [(group, sorted(audience)) for group, audience in list(self.__upstream_groups.items())]
+        return [(room.name, sorted(room.audience)) for name in self.__rooms.names()
+                if (room := self.__rooms.get(name))]
+
+    def __send_directory(self, relay: str):
+        # Called by the sender bound to a newly linked relay, before anything else is sent to it
+        message = new_message_proto(
+            src=None,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.RELAY.GROUPS,
+            body=self.__group_directory()
+        )
+        frame = serialize_message(message)
+        self.__backlog.reserve(len(frame))
+        self.__send_relay(relay, frame, len(frame))
+
+    def __group_names(self) -> list[str]:
+        names = self.__rooms.names()
+        local = set(names)
+        return names + [group for group in list(self.__upstream_groups) if group not in local]
+
+    def __group_listing(self, group: str) -> frozenset[str] | None:
+        """
+        :return: Audience of a group, upstream included, None if the group doesn't exist
+        """
+        room = self.__rooms.get(group)
+        upstream = self.__upstream_groups.get(group)
+        if room is None and upstream is None:
+            return None
+        return (room.audience if room else frozenset()) | (upstream or frozenset())
+
+    def __on_upstream_link(self):
+        # Called by the link's thread once linked (again), the server upstream sends its groups first
+        self.__upstream_groups.clear()
+        self.__rooms.resubscribe()
+
+    def __on_upstream(self, message: MessageProtocol, frame: bytes):
+        if message.message_type == MessageProtocolCode.INSTRUCTION.RELAY.GROUPS:
+            # Groups changed upstream, passed on to the relays of this server
+            if isinstance(message.body, list):
+                for group, audience in message.body:
+                    if audience is None:
+                        self.__upstream_groups.pop(group, None)
+                    else:
+                        self.__upstream_groups[group] = frozenset(audience)
+                if self.__relays:
+                    self.__relay_out(list(self.__relays), message, frame)
+
+        # Group message numbered upstream, delivered here as is
+        elif message.dst and message.dst.group and MessageProtocolCode.is_data(message.message_type):
+            if self.__rooms.forward(message.dst.group, message, frame):
+                self.__index(('group', message.dst.group), message.seq, message)
+
+    def __on_post(self, group: str, seq: int, message: MessageProtocol, members: frozenset[str]):
+        # Called by the thread of the group, before its members get the message
+        if message.seq is not None and message.src and message.src.username:
+            self.__receipts.track(('group', group), seq, message.src.username, message.seq, members, group=group)
+        self.__index(('group', group), seq, message)
+
+    def __index(self, scope: tuple, seq: int | None, message: MessageProtocol):
+        # Text messages only, the body of anything else is never deserialized here
+        if (self.__search is None or seq is None or message.message_type != MessageProtocolCode.DATA.PLAIN_TEXT or
+                not (message.src and message.src.username)):
+            return
+        text = message.body
+        if isinstance(text, str):
+            self.__search.add(scope, seq, message.src.username, text,
+                              group=message.dst.group if message.dst else None)
+
+    @staticmethod
+    def __private_scope(username: str, peer: str) -> tuple:
+        return ('user',) + tuple(sorted((username, peer)))
+
+    def __presence_audience(self, username: str) -> set[str]:
+        # Members of the groups of the client
+        return self.__group_audience(self.__rooms.rooms_of(username))
+
+    def __group_audience(self, groups: Iterable[str]) -> set[str]:
+        audience = set()
+        for group in groups:
+            audience |= self.__group_members(group)
+        return audience
+
+    def __group_members(self, group: str) -> frozenset[str]:
+        room = self.__rooms.get(group)
+        return room.members if room else frozenset()
+
+    def __publish_presence(self, recipients: list[str], presences: list[Presence]):
+        # Pushed on the receive channel of connected recipients, never kept for suspended sessions (it goes stale)
+        frame = serialize_message(new_message_proto(
+            src=None,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.PRESENCE.UPDATE,
+            body=presences
+        ))
+        for recipient in recipients:
+            if recipient in self.__sock_pools:
+                self.__queue_update(recipient, frame)
+
+    def __publish_receipts(self, sender: str, receipts: list[Receipt]):
+        # Summaries of every message of the sender that changed, only counts however large the group
+        if sender not in self.__sock_pools:
+            return
+        frame = serialize_message(new_message_proto(
+            src=None,
+            dst=None,
+            message_type=MessageProtocolCode.INSTRUCTION.RECEIPT.UPDATE,
+            body=receipts
+        ))
+        self.__queue_update(sender, frame)
+
+    def __queue_update(self, target_client: str, frame: bytes):
+        size = len(frame)
+        self.__backlog.reserve(size)
+        if not self.__coalesce:
+            self.__senders.submit(target_client, self.__send_update, target_client, frame, size)
+            return
+
+        # The coalescing writer may hold on to a socket of the recipient for as long as it doesn't read,
+        # so updates queue up behind it instead of waiting for one
+        try:
+            self.__writer_of(target_client).push(frame, MessagePriority.CONTROL)
+        except (ConnectionError, KeyError):
+            # Recipient left meanwhile
+            self.__backlog.release(size)
+
+    def __send_update(self, target_client: str, frame: bytes, size: int):
+        try:
+            with self.__sock_pools[target_client].get_socket(MessagePriority.CONTROL) as target_sock:
+                tcp_sock_send_frames(target_sock, [frame])
+        except (KeyError, socket.error) as e:
+            # Recipient left meanwhile
+            logger.warning(f'Unable to send update to {target_client}: {e!r}')
+        finally:
+            self.__backlog.release(size)
+
+    def __handle_datagram(self, datagram: bytes, addr: tuple[str, int]):
+        token = parse_register_datagram(datagram)
+        if token is not None:
+            self.__register_udp(token, addr)
+            return
+
+        # Nothing from an endpoint that isn't registered is reassembled or deserialized
+        username = self.__udp_clients.get(addr)
+        if username is None:
+            return
+
+        assembled = self.__udp_reassembler.feed(datagram, addr)
+        if not assembled:
+            return
+
+        _, payload = assembled
+        try:
+            message: MessageProtocol = deserialize_frame(payload)
+        except Exception:
+            return
+
+        # Only on behalf of the client registered
+        if not validate_message(message) or not (message.src and message.src.username == username):
+            return
+
+        # Loss is acceptable on this path, datagrams over the limits are dropped
+        if not self.__admit(username, message):
+            return
+
+        if message.message_flag and message.message_flag == MessageProtocolFlag.ANNOUNCE:
+            target_clients = list(self.__udp_endpoints)
+        elif message.dst and self.__rooms.is_member(message.dst.group, username):
+            target_clients = list(self.__rooms.get(message.dst.group).members)
+        elif message.dst and message.dst.username in self.__udp_endpoints:
+            target_clients = [message.dst.username]
+        else:
+            # Loss is acceptable on this path
+            return
+
+        # Forward the payload as is, only the datagram framing is new
+        datagrams = self.__udp_framer.frame(payload)
+        for target_client in target_clients:
+            endpoint = self.__udp_endpoints.get(target_client)
+            if target_client == username or not endpoint:
+                continue
+            for datagram in datagrams:
+                self.__udp_server.send(datagram, endpoint)
+
+    def __register_udp(self, token: str, addr: tuple[str, int]):
+        # Bind this endpoint to the client who requested the token
+        username = self.__udp_tokens.get(token)
+        if username is None or username not in self.__clients:
+            logger.warning(f'Invalid UDP registration from {addr}')
+            return
+
+        self.__udp_clients.pop(self.__udp_endpoints.get(username), None)
+        self.__udp_endpoints[username] = addr
+        self.__udp_clients[addr] = username
+
+        for reply in self.__udp_framer.frame(serialize_message(new_message_proto(
                 src=None,
-                dst=message.src,
+                dst=None,
                 message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
-                response=MessageProtocolResponse.ERROR,
+                response=MessageProtocolResponse.OK,
                 body=None
-            ))
+        ))):
+            self.__udp_server.send(reply, addr)
+
+        logger.info(f'Client {username} registered UDP endpoint {addr}')
+
+    def __leave_udp(self, username: str):
+        self.__udp_clients.pop(self.__udp_endpoints.pop(username, None), None)
+        for token in [k for k, v in self.__udp_tokens.items() if v == username]:
+            self.__udp_tokens.pop(token)
+
+    def __disconnect(self, username: str | None, sock: socket.socket | None) -> bool:
+        """
+        Tear a client down (or suspend its session) once one of its connections is gone
+
+        :param sock: Connection that is gone, None to drop every connection of the client
+        :return: Whether the client was torn down (only the first of its connections to go does it)
+        """
+        # Leftover connections of a resumed session don't tear the new one down
+        with self.__resume_lock:
+            user = self.__clients.get(username)
+            if not (user and (sock is None or sock is user.sock_master or sock in user.sock_slaves)):
+                return False
+
+            just_left = self.__rooms.rooms_of(username)
+
+            # Keep the session (and its group membership) for a while if the client can resume it
+            suspended = self.__sessions.suspend(username, user.group, set(just_left))
+
+            # Leave client list
+            self.__clients.pop(username)
+            self.__sock_pools.pop(username, None)
+            self.__leave_udp(username)
+            with self.__writers_lock:
+                writer = self.__writers.pop(username, None)
+
+        # The rest of its connections are of no use anymore (and may be half-open)
+        for other_sock in [user.sock_master] + user.sock_slaves:
+            if other_sock is not None and other_sock is not sock:
+                try:
+                    other_sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        # Leave group list
+        if not suspended:
+            for group in just_left:
+                self.__rooms.discard(group, username)
+            self.__sessions.close(username)
+
+        if writer:
+            self.__backlog.release(sum(len(frame) for frame in writer.close(flush=False)))
+        if not suspended and self.__limiter:
+            self.__limiter.forget(username)
+        # Away until the session is resumed (or expires), members of the groups it left still get to know
+        self.__presence.set(username, PresenceState.AWAY if suspended else PresenceState.OFFLINE,
+                            peers=self.__group_audience(just_left))
+        self.__advertise()
+
+        if suspended:
+            logger.info(f'Session of {username} is kept for resumption')
+        return True
+
+    def __resume(self, session: Session):
+        username = session.username
+        try:
+            address = session.master.getpeername()
+        except OSError:
+            address = None
+
+        with self.__resume_lock:
+            slaves = list(session.slaves)
+        user = ConnectedClient(username=username,
+                               group=session.group,
+                               address=address,
+                               sock_master=session.master,
+                               sock_slaves=slaves)
+        pool = SocketPool(user.sock_slaves)
+
+        # Replay what was missed before anything new is sent directly, then whatever came in meanwhile
+        self.__replay(pool, self.__sessions.take_pending(username))
+        self.__clients[username] = user
+        self.__sock_pools[username] = pool
+        dropped = session.dropped
+        self.__sessions.activate(username)
+        self.__presence.set(username, PresenceState.ONLINE)
+        self.__replay(pool, self.__sessions.take_pending(username))
+
+        for group in session.groups:
+            self.__rooms.add(group, username)
+
+        # A slave that closed while the session was being resumed was not seen by its client yet
+        if closed := next((slave for slave in slaves if slave.fileno() == -1), None):
+            self.__disconnect(username, closed)
+            return
+
+        # Reply with the next token, and how many messages didn't fit in the queue
+        tcp_sock_send(user.sock_master, new_message_proto(
+            src=None,
+            dst=new_user(username=username),
+            message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+            response=MessageProtocolResponse.OK,
+            body=(session.token, dropped)
+        ))
+        self.__advertise()
+        logger.info(f'Client {username} resumed its session!')
+
+    @staticmethod
+    def __replay(pool: SocketPool, frames: list[bytes | MessageFrame]):
+        if not frames:
+            return
+        with pool.get_socket() as target_sock:
+            tcp_sock_send_frames(target_sock, frames)
+
+    def __admit(self, username: str, message: MessageProtocol) -> bool:
+        """
+        Admission control of a message from an identified client, O(1)
+
+        :param username: Client identified on the connection (or datagram endpoint) the message came from,
+                         never what the message claims
+        """
+        if self.__backlog.overloaded:
+            logger.warning(f'Server is overloaded ({self.__backlog.size} bytes waiting), '
+                           f'refusing message from {username}')
+            return False
+
+        if self.__limiter and not self.__limiter.admit(username,
+                                                       message.message_type,
+                                                       len(message._body),
+                                                       announce=message.message_flag == MessageProtocolFlag.ANNOUNCE):
+            logger.warning(f'Client {username} is over its rate limit')
+            return False
+
+        return True
+
+    def __watch(self, sock: socket.socket):
+        if self.__heartbeat_timeout > 0:
+            self.__reaper.schedule(sock, time.monotonic() + self.__heartbeat_timeout)
+
+    def __rewatch(self, sock: socket.socket):
+        # Only if still watched, the connection may have been made a slave meanwhile
+        if self.__heartbeat_timeout > 0:
+            self.__reaper.postpone(sock, time.monotonic() + self.__heartbeat_timeout)
+
+    def __reap(self):
+        while True:
+            time.sleep(1.0)
+
+            try:
+                # Waking the connection's thread up tears the client down (or suspends its session)
+                for sock in self.__reaper.advance():
+                    logger.warning(f'Reaping connection silent for {self.__heartbeat_timeout} s: {sock}')
+                    self.__shutdown(sock)
+
+                self.__expire_sessions()
+            except Exception as e:
+                logger.exception(f'Reaper error: {e}')
+
+    def __expire_sessions(self):
+        for session in self.__sessions.expire():
+            for group in session.groups:
+                self.__rooms.discard(group, session.username)
+            for session_sock in [session.master] + session.slaves:
+                if session_sock:
+                    session_sock.close()
+            if self.__limiter:
+                self.__limiter.forget(session.username)
+            self.__presence.set(session.username, PresenceState.OFFLINE, peers=self.__group_audience(session.groups))
+            logger.info(f'Session of {session.username} has expired')
+
+    def __advertise(self):
+        # Every connection is served by its own thread, so open connections are the load score
+        clients = list(self.__clients.values())
+        self.__broadcaster.update(ServiceInfo(port=self.__port,
+                                              clients=len(clients),
+                                              load=float(sum(1 + len(c.sock_slaves) for c in clients))))
 
     def is_alive(self) -> bool:
         return self.__server_thread.is_alive()
@@ -1,2 +1,110 @@
+import dataclasses
+import ssl
+
 HOST = '0.0.0.0'
 PORT = 50000
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class DeliveryOptions:
+    """
+    How messages are written to recipients and acknowledged to senders
+
+    :param coalesce: Coalesce small messages queued for the same recipient into one vectored write
+    :param ack_every: Send a cumulative acknowledgement after this many messages
+    :param ack_interval: Send a cumulative acknowledgement at most this many seconds after a message
+    :param max_backlog: Bytes waiting to be written to recipients above which new messages are refused (with WARN),
+                        0 for no limit
+    """
+    coalesce: bool = False
+    ack_every: int = 32
+    ack_interval: float = 0.05
+    max_backlog: int = 256 * 1024 * 1024
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class WorkerPools:
+    """
+    Fixed thread pools of the server, connection threads only read
+
+    :param workers: Threads decoding and routing received messages (default: number of CPUs),
+                    every connection is bound to one of them, so its messages are processed in order
+    :param send_workers: Threads sending messages to recipients, every recipient is bound to one of them
+    :param bulk_workers: Threads sending bulk transfers (files, media) to recipients
+    :param queue_size: Tasks waiting per thread, before whoever hands out more work has to wait
+    :param room_workers: Threads running the chat groups (default: number of CPUs), every group is bound to one
+                         of them, so its members and messages are changed and sent in order without locks
+    :param room_writers: Threads sharing the fan-out of large groups, 0 to fan out from the group thread
+    :param spread_members: Members from which a group spreads its fan-out over the room writers
+    """
+    workers: int | None = None
+    send_workers: int = 16
+    bulk_workers: int = 4
+    queue_size: int = 1024
+    room_workers: int | None = None
+    room_writers: int = 4
+    spread_members: int = 256
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class SessionOptions:
+    """
+    Sessions of dropped clients, and how dead peers are noticed
+
+    :param grace: Time (in seconds) the session of a dropped client can be resumed, 0 to disable
+    :param queue: Messages kept for a dropped client until it resumes its session
+    :param heartbeat_timeout: Time (in seconds) a client may stay silent (clients ping when idle)
+                              before its connections are reaped, 0 to disable
+    :param keepalive_idle: Time (in seconds) without traffic before TCP keepalive probes start, 0 to disable
+    """
+    grace: float = 30.0
+    queue: int = 1024
+    heartbeat_timeout: float = 45.0
+    keepalive_idle: int = 30
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class RelayOptions:
+    """
+    Relays of group messages between linked servers
+
+    :param secret: Shared secret of relays, to accept relays (None to refuse them) and to link to upstream
+    :param upstream: Address of the server to relay group messages of (None to number them here), this server
+                     then delivers them to its members and sends those of its members upstream
+    :param name: Name of this relay upstream (default: the broadcasting identifier)
+    :param ssl_context: Link to upstream over TLS with this context (see new_tls_client_context())
+    """
+    secret: str | None = None
+    upstream: tuple[str, int] | None = None
+    name: str | None = None
+    ssl_context: ssl.SSLContext | None = None
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class PresenceOptions:
+    """
+    Presence, typing and receipts pushed to clients
+
+    :param window: Time (in seconds) between two presence updates to the same client
+    :param debounce: Time (in seconds) a presence change must hold before it's pushed
+    :param typing_timeout: Time (in seconds) typing lasts unless the client refreshes it
+    :param receipt_window: Time (in seconds) between two receipt updates to the same sender
+    """
+    window: float = 0.2
+    debounce: float = 0.3
+    typing_timeout: float = 6.0
+    receipt_window: float = 0.25
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True)
+class SearchOptions:
+    """
+    Full-text search index of text messages
+
+    :param documents: Text messages kept, the oldest are forgotten first
+    :param max_bytes: Memory (in bytes, about) the index takes at most, the oldest are forgotten first
+    :param private: Index private messages too (kept in memory as long as group ones), for their clients
+    """
+    documents: int = 1_000_000
+    max_bytes: int = 64 * 1024 * 1024
+    private: bool = False
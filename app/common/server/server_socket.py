@@ -4,6 +4,7 @@ from abc import abstractmethod
 from .. import *
 import threading
 import socket
+import ssl
 
 
 class Server:
@@ -31,9 +32,18 @@ class Server:
 
 
 class TcpServer(Server):
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, ssl_context: ssl.SSLContext | None = None, handshake_timeout: float = 5.):
+        """
+        :param ssl_context: Serve over TLS with this context (see new_tls_server_context())
+        :param handshake_timeout: Timeout (in seconds) of each TLS handshake
+        """
         super().__init__(host, port, new_socket('tcp'))
         self._sock.settimeout(5.)
+        self.__ssl_context = ssl_context
+        self.__handshake_timeout = handshake_timeout
+
+        # Restarted instances rebind right away, even with connections of the previous one in TIME_WAIT
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         logger.info('TCP Server is created.')
 
     def start(self, callback: Callable[[socket.socket, tuple[str, int]], None]):
@@ -49,7 +59,13 @@ class TcpServer(Server):
                     client_sock, client_addr = self._sock.accept()
                     logger.info(f'Connected with {client_addr}')
 
-                    if callback:
+                    if callback and self.__ssl_context:
+                        threading.Thread(
+                            target=self.__serve,
+                            args=(client_sock, client_addr, callback),
+                            daemon=True
+                        ).start()
+                    elif callback:
                         threading.Thread(
                             target=callback,
                             args=(client_sock, client_addr),
@@ -63,31 +79,78 @@ class TcpServer(Server):
             raise
 
 
+    def __serve(self,
+                client_sock: socket.socket,
+                client_addr: tuple[str, int],
+                callback: Callable[[socket.socket, tuple[str, int]], None]):
+        # Handshake on the connection's own thread, so a slow client doesn't hold the others up
+        try:
+            client_sock.settimeout(self.__handshake_timeout)
+            tls_sock = self.__ssl_context.wrap_socket(client_sock, server_side=True)
+            tls_sock.settimeout(None)
+        except (ssl.SSLError, OSError) as e:
+            logger.warning(f'TLS handshake with {client_addr} failed: {e}')
+            client_sock.close()
+            return
+
+        logger.info(f'TLS {tls_sock.version()} with {client_addr} (resumed: {tls_sock.session_reused})')
+        callback(tls_sock, client_addr)
+
+    @property
+    def tls(self) -> bool:
+        return self.__ssl_context is not None
+
+
 class UdpServer(Server):
     def __init__(self, host: str, port: int):
         super().__init__(host, port, new_socket('udp'))
         self._sock.settimeout(5.)
+        self.__stop_flag = threading.Event()
 
-    def start(self, callback: Callable[[bytes, tuple[str, int]], None]):
+    def start(self,
+              callback: Callable[[bytes, tuple[str, int]], None],
+              idle_callback: Callable[[], None] | None = None):
+        """
+        Receive raw datagrams and handle them in order on the calling thread
+
+        :param callback: Callback function on every datagram received
+        :param idle_callback: Callback function when no datagram arrived within the socket timeout
+        """
         self._sock.bind(self.address)
         logger.info(f'UDP Server started at {self.address[0]}:{self.address[1]}. Waiting for connections...')
-        self.__receive_data(callback=callback)
+        self.__receive_data(callback=callback, idle_callback=idle_callback)
 
-    def __receive_data(self, callback: Callable[[bytes, tuple[str, int]], None]):
+    def send(self, data: bytes, address: tuple[str, int]):
+        self._sock.sendto(data, address)
+
+    def stop(self):
+        self.__stop_flag.set()
+        super().stop()
+
+    @property
+    def timeout(self) -> float | None:
+        return self._sock.timeout
+
+    @timeout.setter
+    def timeout(self, v: float | None):
+        self._sock.settimeout(v)
+
+    def __receive_data(self,
+                       callback: Callable[[bytes, tuple[str, int]], None],
+                       idle_callback: Callable[[], None] | None):
         try:
-            while True:
+            while not self.__stop_flag.is_set():
                 try:
-                    client_data, client_addr = udp_sock_recvfrom(self._sock, 16384)
-                    logger.info(f'Received data from {client_addr}')
-
+                    client_data, client_addr = self._sock.recvfrom(65535)
                     if callback:
-                        threading.Thread(
-                            target=callback,
-                            args=(client_data, client_addr),
-                            daemon=True
-                        ).start()
+                        callback(client_data, client_addr)
                 except socket.timeout:
+                    if idle_callback:
+                        idle_callback()
+                except ConnectionResetError:
+                    # ICMP port unreachable from a previous send, the peer is simply gone
                     pass
         except Exception as e:
-            logger.exception(f'UDP Server error: {e}')
-            raise
+            if not self.__stop_flag.is_set():
+                logger.exception(f'UDP Server error: {e}')
+                raise
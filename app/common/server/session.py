@@ -0,0 +1,253 @@
+import collections
+import dataclasses
+import heapq
+import secrets
+import socket
+import threading
+import time
+
+from .. import MessageFrame
+
+
+@dataclasses.dataclass(init=True, repr=False, slots=True)
+class ConnectedClient:
+    """
+    Connections of an identified client, these never leave the server
+    """
+    username: str
+    group: str | None = None
+    address: tuple[str, int] | None = None
+    sock_master: socket.socket | None = None
+    sock_slaves: list[socket.socket] = dataclasses.field(default_factory=list)
+
+    def __repr__(self):
+        return f'ConnectedClient(username={self.username}, group={self.group}, sockets={1 + len(self.sock_slaves)})'
+
+
+@dataclasses.dataclass(init=True, repr=False)
+class Session:
+    username: str
+    token: str
+    group: str | None = None
+    groups: set[str] = dataclasses.field(default_factory=set)
+    expires_at: float | None = None
+    pending: collections.deque[bytes | MessageFrame] = dataclasses.field(default_factory=collections.deque)
+    dropped: int = 0
+
+    # Sockets of a resumption in progress
+    master: socket.socket | None = None
+    slaves: list[socket.socket] = dataclasses.field(default_factory=list)
+    expected_slaves: int | None = None
+
+    def __repr__(self):
+        return (f'Session(username={self.username}, groups={self.groups}, '
+                f'suspended={self.expires_at is not None}, pending={len(self.pending)})')
+
+
+class SessionStore:
+    def __init__(self, grace: float = 30.0, max_pending: int = 1024):
+        """
+        Resumable client sessions
+
+        A session gets a token once the client is fully identified. When its connection drops, the session is
+        suspended for `grace` seconds: its name stays reserved, it stays in its groups, and messages for it are
+        queued. Resuming with the token attaches new sockets and replays the queue.
+
+        :param grace: Time (in seconds) a suspended session survives, 0 to disable resumption
+        :param max_pending: Messages queued per suspended session (the oldest are dropped first)
+        """
+        self.__grace = grace
+        self.__max_pending = max_pending
+
+        self.__sessions: dict[str, Session] = {}
+        self.__tokens: dict[str, str] = {}
+        self.__expiry: list[tuple[float, str]] = []
+        # Sockets of resumptions in progress, by the client they were attached for
+        self.__attached: dict[socket.socket, str] = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.__grace > 0
+
+    def open(self, username: str) -> str | None:
+        """
+        :return: Resumption token of a newly identified client (None if resumption is disabled)
+        """
+        if not self.enabled:
+            return None
+
+        with self.__lock:
+            self.__discard(username)
+            session = Session(username=username, token=secrets.token_urlsafe(24))
+            self.__sessions[username] = session
+            self.__tokens[session.token] = username
+            return session.token
+
+    def suspend(self, username: str, group: str | None, groups: set[str]) -> bool:
+        """
+        Keep the session of a dropped client for the grace period
+
+        :return: Whether the session is kept (otherwise the client has to be torn down)
+        """
+        with self.__lock:
+            session = self.__sessions.get(username)
+            if session is None or session.expires_at is not None:
+                return False
+
+            session.group = group
+            session.groups = set(groups)
+            session.expires_at = time.monotonic() + self.__grace
+            heapq.heappush(self.__expiry, (session.expires_at, username))
+            return True
+
+    def is_suspended(self, username: str) -> bool:
+        session = self.__sessions.get(username)
+        return session is not None and session.expires_at is not None
+
+    @property
+    def suspended(self) -> list[str]:
+        with self.__lock:
+            return [username for username, session in self.__sessions.items() if session.expires_at is not None]
+
+    def queue(self, username: str, frame: bytes | MessageFrame) -> bool:
+        """
+        Queue a serialized message for a suspended client
+
+        :return: Whether the client is suspended (and the message queued)
+        """
+        with self.__lock:
+            session = self.__sessions.get(username)
+            if session is None or session.expires_at is None:
+                return False
+
+            if len(session.pending) >= self.__max_pending:
+                session.pending.popleft()
+                session.dropped += 1
+            session.pending.append(frame)
+            return True
+
+    def owns(self, token: str, username: str) -> bool:
+        """
+        :return: Whether the token is the current token of the client's session (suspended or not)
+        """
+        with self.__lock:
+            return self.__tokens.get(token) == username
+
+    def attach(self,
+               token: str,
+               username: str,
+               sock: socket.socket,
+               master: bool,
+               expected_slaves: int | None = None) -> tuple[Session | None, bool]:
+        """
+        Attach a socket of a resuming client
+
+        :return: The session (None if the token is invalid or expired),
+                 and whether this socket completed the resumption (exactly once per resumption)
+        """
+        with self.__lock:
+            session = self.__sessions.get(self.__tokens.get(token))
+            if session is None or session.username != username:
+                return None, False
+            if session.expires_at is None or session.expires_at <= time.monotonic():
+                return None, False
+
+            if master:
+                if session.master is not None:
+                    self.__attached.pop(session.master, None)
+                session.master = sock
+                session.expected_slaves = expected_slaves
+            else:
+                session.slaves.append(sock)
+            self.__attached[sock] = username
+
+            if session.master is None or len(session.slaves) < session.expected_slaves:
+                return session, False
+
+            # Resumed: a new token for the next time
+            self.__tokens.pop(session.token, None)
+            session.token = secrets.token_urlsafe(24)
+            self.__tokens[session.token] = session.username
+            return session, True
+
+    def detach(self, sock: socket.socket) -> bool:
+        """
+        Forget a socket of a resumption in progress that closed before the resumption completed
+
+        :return: Whether the socket was attached to a session
+        """
+        with self.__lock:
+            username = self.__attached.pop(sock, None)
+            session = self.__sessions.get(username)
+            if session is None:
+                return False
+
+            if session.master is sock:
+                session.master = None
+            elif sock in session.slaves:
+                session.slaves.remove(sock)
+            return True
+
+    def take_pending(self, username: str) -> list[bytes | MessageFrame]:
+        with self.__lock:
+            session = self.__sessions.get(username)
+            if session is None:
+                return []
+            frames = list(session.pending)
+            session.pending.clear()
+            return frames
+
+    def activate(self, username: str):
+        """
+        Mark a resumed session as connected again
+        """
+        with self.__lock:
+            session = self.__sessions.get(username)
+            if session is not None:
+                self.__forget_sockets(session)
+                session.expires_at = None
+                session.dropped = 0
+                session.master = None
+                session.slaves = []
+                session.expected_slaves = None
+
+    def close(self, username: str):
+        with self.__lock:
+            self.__discard(username)
+
+    def expire(self) -> list[Session]:
+        """
+        Drop suspended sessions past their grace period
+
+        :return: Expired sessions, so their groups (and half-attached sockets) can be cleaned up
+        """
+        expired = []
+        now = time.monotonic()
+        with self.__lock:
+            while self.__expiry and self.__expiry[0][0] <= now:
+                expires_at, username = heapq.heappop(self.__expiry)
+
+                # Skip entries of sessions resumed (or suspended again) since
+                session = self.__sessions.get(username)
+                if session is None or session.expires_at != expires_at:
+                    continue
+
+                self.__discard(username)
+                expired.append(session)
+
+        return expired
+
+    def __discard(self, username: str):
+        session = self.__sessions.pop(username, None)
+        if session is not None:
+            self.__tokens.pop(session.token, None)
+            self.__forget_sockets(session)
+
+    def __forget_sockets(self, session: Session):
+        for sock in [session.master] + session.slaves:
+            if sock is not None:
+                self.__attached.pop(sock, None)
+
+    def __len__(self):
+        return len(self.__sessions)
@@ -0,0 +1,108 @@
+import math
+import threading
+import time
+from typing import Hashable
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 1.0, slots: int = 64):
+        """
+        Hashed timer wheel of deadlines, e.g. when idle connections are due to be reaped
+
+        Timers are bucketed by the tick they fire on, so advancing the wheel only looks at the buckets of the
+        ticks that passed. Postponing a timer (the common case, on every message received) only records the new
+        deadline; the timer moves to its new bucket when its old one comes around. Deadlines further away than
+        one revolution (`tick * slots`) are carried over the same way.
+
+        :param tick: Resolution (in seconds) of the deadlines
+        :param slots: Number of buckets (ticks of one revolution)
+        """
+        self.__tick = tick
+        self.__slots: list[set[Hashable]] = [set() for _ in range(slots)]
+        self.__deadlines: dict[Hashable, float] = {}
+        self.__slot_of: dict[Hashable, int] = {}
+        self.__current = math.floor(time.monotonic() / tick)
+        self.__lock = threading.Lock()
+
+    def schedule(self, key: Hashable, deadline: float):
+        """
+        Set (or move) the deadline of a timer
+        """
+        with self.__lock:
+            previous = self.__deadlines.get(key)
+            self.__deadlines[key] = deadline
+
+            # Postponed: picked up again when its current bucket comes around
+            if previous is not None and deadline >= previous:
+                return
+
+            self.__unplace(key)
+            self.__place(key, deadline)
+
+    def postpone(self, key: Hashable, deadline: float) -> bool:
+        """
+        Move the deadline of a timer later, only if it is still scheduled
+
+        :return: Whether the timer is scheduled
+        """
+        with self.__lock:
+            if key not in self.__deadlines:
+                return False
+            self.__deadlines[key] = max(self.__deadlines[key], deadline)
+            return True
+
+    def cancel(self, key: Hashable):
+        with self.__lock:
+            if self.__deadlines.pop(key, None) is not None:
+                self.__unplace(key)
+
+    def advance(self, now: float | None = None) -> list[Hashable]:
+        """
+        Move the wheel up to `now`
+
+        :return: Timers past their deadline (they are removed from the wheel)
+        """
+        now = time.monotonic() if now is None else now
+        target = math.floor(now / self.__tick)
+        expired = []
+
+        with self.__lock:
+            # Every bucket is visited at most once, however long the wheel was left alone
+            steps = min(target - self.__current, len(self.__slots))
+            self.__current = target - steps
+
+            for _ in range(steps):
+                self.__current += 1
+                index = self.__current % len(self.__slots)
+                bucket = self.__slots[index]
+                if not bucket:
+                    continue
+
+                self.__slots[index] = set()
+                for key in bucket:
+                    self.__slot_of.pop(key, None)
+                    deadline = self.__deadlines[key]
+                    if deadline <= now:
+                        self.__deadlines.pop(key)
+                        expired.append(key)
+                    else:
+                        self.__place(key, deadline)
+
+        return expired
+
+    def __place(self, key: Hashable, deadline: float):
+        # Never into a bucket already passed, and never before its deadline
+        index = max(math.ceil(deadline / self.__tick), self.__current + 1) % len(self.__slots)
+        self.__slots[index].add(key)
+        self.__slot_of[key] = index
+
+    def __unplace(self, key: Hashable):
+        index = self.__slot_of.pop(key, None)
+        if index is not None:
+            self.__slots[index].discard(key)
+
+    def __len__(self):
+        return len(self.__deadlines)
+
+    def __contains__(self, key: Hashable):
+        return key in self.__deadlines
@@ -1,23 +1,22 @@
 import dataclasses
-import socket
 
 
-@dataclasses.dataclass(init=True, repr=True, order=True)
+@dataclasses.dataclass(init=True, repr=True, slots=True)
 class User:
+    """
+    Identity on the wire: names only, never connections (the server keeps those on its own)
+    """
     username: str | None
-    group: str | None
-    address: tuple[str, int] | None  # Socket: (Host, Port)
-    sock_master: socket.socket | None
-    sock_slaves: list[socket.socket] | None
+    group: str | None = None
+    address: tuple[str, int] | None = None  # Where it was heard from: (Host, Port), set by local network discovery
+
+    def __reduce__(self):
+        return User, (self.username, self.group, self.address)
 
 
 def new_user(username: str | None,
              group: str | None = None,
-             address: tuple[str, int] | None = None,
-             sock_master: socket.socket | None = None,
-             sock_slaves: list[socket.socket] | None = None):
+             address: tuple[str, int] | None = None):
     return User(username=username,
                 group=group,
-                address=address,
-                sock_master=sock_master,
-                sock_slaves=sock_slaves)
+                address=address)
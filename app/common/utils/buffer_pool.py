@@ -0,0 +1,78 @@
+import threading
+
+
+class BufferPool:
+    def __init__(self,
+                 min_size: int = 16 * 1024,
+                 max_size: int = 4 * 1024 * 1024,
+                 max_bytes: int = 64 * 1024 * 1024):
+        """
+        Reusable bytearrays in size classes (powers of two), so buffers aren't allocated and freed over and over
+
+        :param min_size: Smallest size class
+        :param max_size: Largest size class, larger buffers are allocated (and freed) every time
+        :param max_bytes: Total size of the free buffers kept, the rest are left to the garbage collector
+        """
+        self.__min_size = 1 << (max(min_size, 1) - 1).bit_length()
+        self.__max_size = max(max_size, self.__min_size)
+        self.__max_bytes = max_bytes
+
+        self.__free: dict[int, list[bytearray]] = {}
+        self.__free_bytes = 0
+        self.__lock = threading.Lock()
+
+        # Statistics
+        self.__reused = 0
+        self.__allocated = 0
+
+    def size_class(self, size: int) -> int:
+        """
+        :return: Size of the buffers given for the size, 0 if too large to be pooled
+        """
+        if size > self.__max_size:
+            return 0
+        return max(self.__min_size, 1 << (size - 1).bit_length())
+
+    def acquire(self, size: int) -> bytearray:
+        """
+        :return: Buffer of at least `size` bytes (its size class), with stale content
+        """
+        size_class = self.size_class(size)
+        if size_class:
+            with self.__lock:
+                free = self.__free.get(size_class)
+                if free:
+                    self.__free_bytes -= size_class
+                    self.__reused += 1
+                    return free.pop()
+                self.__allocated += 1
+            return bytearray(size_class)
+
+        with self.__lock:
+            self.__allocated += 1
+        return bytearray(size)
+
+    def release(self, buffer: bytearray):
+        """
+        Give back a buffer, it must no longer be used (nor any view of it)
+        """
+        size_class = len(buffer)
+        if self.size_class(size_class) != size_class:
+            return
+
+        with self.__lock:
+            if self.__free_bytes + size_class <= self.__max_bytes:
+                self.__free.setdefault(size_class, []).append(buffer)
+                self.__free_bytes += size_class
+
+    @property
+    def free_bytes(self) -> int:
+        return self.__free_bytes
+
+    @property
+    def reused(self) -> int:
+        return self.__reused
+
+    @property
+    def allocated(self) -> int:
+        return self.__allocated
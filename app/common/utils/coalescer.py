@@ -0,0 +1,235 @@
+import collections
+import threading
+from typing import Callable
+from .. import logger
+from ..message_protocol import MessagePriority, MessageFrame
+from .socket_utils import FrameFragment
+
+
+class _Queued:
+    __slots__ = ('whole', 'frame', 'offset', 'on_write')
+
+    def __init__(self, frame: bytes | MessageFrame, on_write: Callable[[], None] | None):
+        # Fragments are views of the frame, both kinds slice without copying
+        self.whole = frame
+        self.frame = frame if isinstance(frame, MessageFrame) else memoryview(frame)
+        self.offset = 0
+        self.on_write = on_write
+
+    def __len__(self):
+        return len(self.frame) - self.offset
+
+
+class MessageCoalescer:
+    def __init__(self,
+                 writer: Callable[[list[bytes | MessageFrame | FrameFragment]], bool | None],
+                 max_bytes: int = 65536,
+                 max_frames: int = 64,
+                 chunk_size: int = 65536,
+                 submit: Callable[[Callable[[], None]], None] | None = None):
+        """
+        Nagle-style coalescing of small frames into one vectored write, by priority class
+
+        A frame pushed while the writer is idle is written right away. Frames pushed while a write is outstanding
+        wait for it, and are then flushed together, at most `max_bytes` or `max_frames` per batch.
+
+        Every batch is filled from the highest priority class first, frames of the same class keep their order.
+        Frames larger than `chunk_size` are written in fragments, one batch at a time, so frames of higher classes
+        pushed meanwhile overtake the rest of them.
+
+        :param writer: Function that writes a batch of frames (in order) to the peer. With `submit`, it may return
+                       False when the peer doesn't take more for now, keeping what is left to write (it's called
+                       with an empty batch to write it): flushing then stops until resume() is called,
+                       frames pushed meanwhile queue up
+        :param max_bytes: Payload bytes per batch (at most)
+        :param max_frames: Frames per batch (at most)
+        :param chunk_size: Fragment size of large frames
+        :param submit: Runs the flushes, one at a time (e.g. on a worker bound to the peer),
+                       instead of a thread of this coalescer
+        """
+        self.__writer = writer
+        self.__max_bytes = max_bytes
+        self.__max_frames = max_frames
+        self.__chunk_size = chunk_size
+        self.__submit = submit
+
+        # One queue per priority class
+        self.__queues: list[collections.deque[_Queued]] = [
+            collections.deque() for _ in range(MessagePriority.BULK + 1)
+        ]
+        self.__count = 0
+        self.__cond = threading.Condition()
+        self.__closed = False
+
+        # Flushes run by `submit`: one is submitted (or running), flushing waits for resume(),
+        # the writer was left with something to write, resume() came during a write
+        self.__scheduled = False
+        self.__blocked = False
+        self.__unwritten = False
+        self.__resumed = False
+        self.__flusher: threading.Thread | None = None
+
+        self.__thread: threading.Thread | None = None
+        if not submit:
+            self.__thread = threading.Thread(
+                target=self.__flush_loop,
+                daemon=True
+            )
+            self.__thread.start()
+
+    def push(self,
+             frame: bytes | MessageFrame,
+             priority: int = MessagePriority.INTERACTIVE,
+             on_write: Callable[[], None] | None = None):
+        """
+        :param priority: Priority class of the frame (see MessagePriority)
+        :param on_write: Called (by the flushing thread) right before the end of the frame is written,
+                         frames are written whole in the order these calls are made
+        """
+        with self.__cond:
+            if self.__closed:
+                raise ConnectionError('Coalescer is already closed!')
+
+            self.__queues[priority].append(_Queued(frame, on_write))
+            self.__count += 1
+
+            if not self.__submit:
+                if self.__count == 1:
+                    self.__cond.notify()
+                return
+
+            submit = not self.__scheduled and not self.__blocked
+            self.__scheduled |= submit
+
+        # Outside the lock, submitting may wait for room in the queue of the executor
+        if submit:
+            self.__submit(self.__flush)
+
+    def resume(self):
+        """
+        The writer can write again (see `writer`), go on flushing
+        """
+        with self.__cond:
+            # Even once closed, the writer is left to finish (or give up on) what it has
+            submit = self.__blocked and not self.__scheduled
+            self.__blocked = False
+            self.__scheduled |= submit
+            # The writer may be told before its flush finds out it is stuck
+            self.__resumed = True
+
+        if submit:
+            self.__submit(self.__flush)
+
+    def close(self, flush: bool = True) -> list[bytes]:
+        """
+        :param flush: Write the frames still queued before closing, otherwise drop them
+        :return: Frames dropped (only what is left of those partly written)
+        """
+        dropped = []
+        with self.__cond:
+            self.__closed = True
+            if not flush:
+                for frames in self.__queues:
+                    dropped.extend(bytes(queued.frame[queued.offset:]) for queued in frames)
+                    frames.clear()
+                self.__count = 0
+            self.__cond.notify_all()
+
+            # Flushes by `submit` are waited for, unless the writer is stuck (or this is one of them)
+            if self.__submit and flush and threading.current_thread() is not self.__flusher:
+                self.__cond.wait_for(lambda: not self.__scheduled and (not self.__count or self.__blocked))
+
+        if self.__thread and threading.current_thread() is not self.__thread:
+            self.__thread.join()
+        return dropped
+
+    def __next_batch(self) -> tuple[list[bytes | MessageFrame | FrameFragment], list[Callable[[], None]]] | None:
+        with self.__cond:
+            while not self.__count and not self.__closed:
+                self.__cond.wait()
+
+            if not self.__count:
+                return None
+
+            # Whatever was pushed during the last write goes out together, nothing waits on an idle writer
+            return self.__take_batch()
+
+    def __take_batch(self) -> tuple[list[bytes | MessageFrame | FrameFragment], list[Callable[[], None]]]:
+        batch: list[bytes | MessageFrame | FrameFragment] = []
+        callbacks: list[Callable[[], None]] = []
+        budget = self.__max_bytes
+
+        for priority, frames in enumerate(self.__queues):
+            while frames and len(batch) < self.__max_frames:
+                queued = frames[0]
+                whole = queued.offset == 0 and len(queued) <= self.__chunk_size
+
+                # Stop rather than let a lower class overtake
+                if batch and (budget <= 0 or (whole and len(queued) > budget)):
+                    return batch, callbacks
+
+                if whole:
+                    batch.append(queued.whole)
+                    size = len(queued)
+                else:
+                    size = min(self.__chunk_size, len(queued))
+                    batch.append(FrameFragment(lane=priority,
+                                               last=size == len(queued),
+                                               data=queued.frame[queued.offset:queued.offset + size]))
+
+                queued.offset += size
+                budget -= size
+
+                if not len(queued):
+                    frames.popleft()
+                    self.__count -= 1
+                    if queued.on_write:
+                        callbacks.append(queued.on_write)
+
+        return batch, callbacks
+
+    def __flush_loop(self):
+        while (next_batch := self.__next_batch()) is not None:
+            self.__write(*next_batch)
+
+    def __flush(self):
+        # Submitted: batches are written until none is left, or until the writer is stuck
+        self.__flusher = threading.current_thread()
+        try:
+            while True:
+                with self.__cond:
+                    if self.__count:
+                        batch, callbacks = self.__take_batch()
+                    elif self.__unwritten:
+                        # Only what the writer was left with
+                        batch, callbacks = [], []
+                    else:
+                        self.__scheduled = False
+                        self.__cond.notify_all()
+                        return
+                    self.__resumed = False
+
+                written = self.__write(batch, callbacks)
+                with self.__cond:
+                    self.__unwritten = not written
+                    if not written and not self.__resumed:
+                        # Picked up again by resume()
+                        self.__blocked = True
+                        self.__scheduled = False
+                        self.__cond.notify_all()
+                        return
+        finally:
+            self.__flusher = None
+
+    def __write(self, batch: list[bytes | MessageFrame | FrameFragment], callbacks: list[Callable[[], None]]) -> bool:
+        try:
+            for callback in callbacks:
+                callback()
+            return self.__writer(batch) is not False
+        except Exception as e:
+            logger.warning(f'Unable to flush {len(batch)} coalesced frames: {e}')
+            return True
+
+    @property
+    def pending(self) -> int:
+        return self.__count
@@ -0,0 +1,144 @@
+import collections
+import dataclasses
+import itertools
+import struct
+import time
+
+# Version, sequence number, fragment index, fragment count
+DATAGRAM_HEADER = struct.Struct('!BIHH')
+DATAGRAM_VERSION = 1
+
+# Registration of an endpoint, followed by its token: kept raw, so nothing an unknown endpoint sends is unpickled
+DATAGRAM_REGISTER = b'\x00REGISTER:'
+
+# Conservative datagram size that fits the path MTU of most networks (including IPv6 minimum of 1280)
+DEFAULT_MTU = 1200
+
+
+@dataclasses.dataclass(init=True, repr=False)
+class _PartialDatagram:
+    deadline: float
+    fragments: list[bytes | None]
+    received: int = 0
+
+
+class DatagramFramer:
+    def __init__(self, mtu: int = DEFAULT_MTU):
+        """
+        Split payloads into numbered datagrams no larger than `mtu` bytes
+        """
+        if mtu <= DATAGRAM_HEADER.size:
+            raise ValueError(f'MTU must be larger than {DATAGRAM_HEADER.size} bytes')
+
+        self.__chunk_size = mtu - DATAGRAM_HEADER.size
+        self.__seq = itertools.count(1)
+
+    def frame(self, payload: bytes) -> list[bytes]:
+        seq = next(self.__seq) & 0xFFFFFFFF
+        count = max((len(payload) + self.__chunk_size - 1) // self.__chunk_size, 1)
+
+        if count > 0xFFFF:
+            raise ValueError(f'Payload of {len(payload)} bytes is too large for a datagram')
+
+        view = memoryview(payload)
+        return [DATAGRAM_HEADER.pack(DATAGRAM_VERSION, seq, index, count) +
+                view[index * self.__chunk_size:(index + 1) * self.__chunk_size]
+                for index in range(count)]
+
+
+def register_datagram(token: str) -> bytes:
+    """
+    Datagram registering the endpoint it is sent from with a token
+    """
+    return DATAGRAM_HEADER.pack(DATAGRAM_VERSION, 0, 0, 1) + DATAGRAM_REGISTER + token.encode('ascii')
+
+
+def parse_register_datagram(datagram: bytes) -> str | None:
+    """
+    :return: Token of a registration datagram, None for any other datagram
+    """
+    if len(datagram) <= DATAGRAM_HEADER.size + len(DATAGRAM_REGISTER):
+        return None
+
+    version, _, index, count = DATAGRAM_HEADER.unpack_from(datagram)
+    if version != DATAGRAM_VERSION or index != 0 or count != 1 or \
+            not datagram.startswith(DATAGRAM_REGISTER, DATAGRAM_HEADER.size):
+        return None
+
+    try:
+        return datagram[DATAGRAM_HEADER.size + len(DATAGRAM_REGISTER):].decode('ascii')
+    except UnicodeDecodeError:
+        return None
+
+
+class DatagramReassembler:
+    def __init__(self,
+                 max_pending: int = 64,
+                 max_fragments: int = 256,
+                 timeout: float = 0.5):
+        """
+        Reassemble fragmented datagrams, dropping incomplete ones
+
+        Loss is acceptable: a payload is given up once any of its fragments is late by more than `timeout`
+        seconds, or when more than `max_pending` payloads are incomplete (oldest first).
+
+        :param max_pending: Maximum number of incomplete payloads kept
+        :param max_fragments: Maximum number of fragments accepted per payload
+        :param timeout: Time (in seconds) to wait for the rest of the fragments
+        """
+        self.__max_pending = max_pending
+        self.__max_fragments = max_fragments
+        self.__timeout = timeout
+
+        # Insertion order is also deadline order, so expiry only looks at the head
+        self.__pending: collections.OrderedDict[tuple, _PartialDatagram] = collections.OrderedDict()
+
+    def feed(self, datagram: bytes, source=None) -> tuple[int, bytes] | None:
+        """
+        :return: Sequence number and payload once complete, otherwise None
+        """
+        if len(datagram) < DATAGRAM_HEADER.size:
+            return None
+
+        version, seq, index, count = DATAGRAM_HEADER.unpack_from(datagram)
+        if version != DATAGRAM_VERSION or index >= count or count > self.__max_fragments:
+            return None
+
+        payload = datagram[DATAGRAM_HEADER.size:]
+        if count == 1:
+            return seq, payload
+
+        self.expire()
+
+        key = (source, seq)
+        partial = self.__pending.get(key)
+        if partial is None:
+            if len(self.__pending) >= self.__max_pending:
+                self.__pending.popitem(last=False)
+            partial = self.__pending[key] = _PartialDatagram(deadline=time.monotonic() + self.__timeout,
+                                                             fragments=[None] * count)
+
+        if len(partial.fragments) != count:
+            return None
+
+        if partial.fragments[index] is None:
+            partial.fragments[index] = payload
+            partial.received += 1
+
+        if partial.received < count:
+            return None
+
+        self.__pending.pop(key)
+        return seq, b''.join(partial.fragments)
+
+    def expire(self):
+        now = time.monotonic()
+        while self.__pending:
+            key, partial = next(iter(self.__pending.items()))
+            if partial.deadline > now:
+                break
+            self.__pending.popitem(last=False)
+
+    @property
+    def pending(self) -> int:
+        return len(self.__pending)
@@ -1,7 +1,10 @@
 import os
 import re
+import unicodedata
 from datetime import datetime
 
+_WORD_PATTERN = re.compile(r'\w+')
+
 
 def datetime_fmt() -> str:
     return datetime.now().strftime('%d/%m/%Y %H:%M:%S')
@@ -14,6 +17,16 @@ def tokenize(text: str) -> list[str]:
     return tokens
 
 
+def word_tokenize(text: str) -> list[str]:
+    """
+    Words of a text to index or search, case and accents folded, punctuation and symbols left out
+    """
+    text = text.casefold()
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _WORD_PATTERN.findall(text)
+
+
 def uniquify(path: str):
     filename, extension = os.path.splitext(path)
     counter = 1
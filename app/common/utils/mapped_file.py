@@ -0,0 +1,132 @@
+import mmap
+import os
+import socket
+from typing import Callable
+
+
+class MappedFile:
+    def __init__(self,
+                 path: str,
+                 size: int,
+                 window: int = 16 * 1024 * 1024,
+                 on_progress: Callable[[int], None] | None = None,
+                 progress_step: int = 1024 * 1024):
+        """
+        Destination file preallocated to its final size and written in place through a memory map
+
+        Only a window of the file is mapped at a time and it slides forward as it fills up, so the memory used
+        doesn't depend on the size of the file. Sockets receive straight into the map (no intermediate buffer).
+
+        :param path: File to create (overwritten if it exists)
+        :param size: Final size (in bytes) of the file
+        :param window: Size (in bytes) of the part of the file mapped at a time
+        :param on_progress: Callback function with the number of bytes written so far,
+                            every `progress_step` bytes and once complete
+        :param progress_step: Bytes written between progress callbacks
+        """
+        self.__path = path
+        self.__size = size
+        # Windows start at multiples of the allocation granularity
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self.__window = max(granularity, window // granularity * granularity)
+        self.__on_progress = on_progress
+        self.__progress_step = progress_step
+        self.__next_progress = progress_step
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.__file = open(path, mode='w+b')
+        self.__file.truncate(size)
+
+        # Current window: offset of its first byte in the file, and position in it
+        self.__map: mmap.mmap | None = None
+        self.__offset = 0
+        self.__position = 0
+        self.__written = 0
+
+        if not size:
+            self.close()
+            if on_progress:
+                on_progress(0)
+
+    def __next_window(self) -> mmap.mmap:
+        if self.__map is not None and self.__position < len(self.__map):
+            return self.__map
+
+        if self.__map is not None:
+            # Unmapped pages are written back by the kernel, and no longer count against this process
+            self.__map.close()
+            self.__offset += self.__position
+
+        self.__map = mmap.mmap(self.__file.fileno(),
+                               length=min(self.__window, self.__size - self.__offset),
+                               offset=self.__offset)
+        self.__position = 0
+        return self.__map
+
+    def __advance(self, size: int):
+        self.__position += size
+        self.__written += size
+
+        if self.__on_progress and (self.__written >= self.__next_progress or self.complete):
+            self.__next_progress = self.__written + self.__progress_step
+            self.__on_progress(self.__written)
+
+        if self.complete:
+            self.close()
+
+    def recv_from(self, sock: socket.socket, buffer_size: int = 1024 * 1024) -> int:
+        """
+        Receive once from the socket into the file
+
+        :param buffer_size: Most bytes received at once
+        :return: Bytes received, 0 if the connection is closed by the peer
+        """
+        window = self.__next_window()
+        with memoryview(window) as view:
+            with view[self.__position:self.__position + buffer_size] as free:
+                size = sock.recv_into(free)
+
+        if size:
+            self.__advance(size)
+        return size
+
+    def write(self, data: bytes | memoryview):
+        data = memoryview(data).cast('B')
+        while data:
+            window = self.__next_window()
+            size = min(len(data), len(window) - self.__position)
+            window[self.__position:self.__position + size] = data[:size]
+            data = data[size:]
+            self.__advance(size)
+
+    def close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        self.__file.close()
+
+    def discard(self):
+        """
+        Close and delete the file (e.g. when the transfer is cut off)
+        """
+        self.close()
+        try:
+            os.remove(self.__path)
+        except OSError:
+            pass
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    @property
+    def written(self) -> int:
+        return self.__written
+
+    @property
+    def complete(self) -> bool:
+        return self.__written >= self.__size
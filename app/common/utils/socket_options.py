@@ -0,0 +1,129 @@
+import dataclasses
+
+
+@dataclasses.dataclass(init=True, repr=True, frozen=True, slots=True)
+class SocketProfile:
+    """
+    Options of a kind of TCP connection, see apply_socket_profile()
+
+    Kernel buffers left to the system are sized by the kernel as the connection goes (on Linux),
+    setting them pins their size.
+
+    :param name: Name of the profile (on the command line)
+    :param nodelay: Disable Nagle's algorithm (TCP_NODELAY), None to leave it to the system
+    :param quickack: Acknowledge received data right away instead of delaying it (TCP_QUICKACK, Linux only)
+    :param send_buffer: Kernel send buffer (in bytes, SO_SNDBUF), None to leave it to the system
+    :param recv_buffer: Kernel receive buffer (in bytes, SO_RCVBUF), None to leave it to the system
+    :param read_buffer: Receive buffer (in bytes) frames are read through, and the smallest it is tuned down to
+    :param auto_tune: Size the receive buffer from the frames received on the connection
+    :param max_buffer: Largest size (in bytes) the receive buffer is tuned up to, it's left at `read_buffer`
+                       for frames too large to be buffered several at a time
+    :param max_frame: Largest frame (in bytes, fragmented frames put together) received, the connection is
+                      given up on a larger one
+    """
+    name: str = 'system'
+    nodelay: bool | None = None
+    quickack: bool = False
+    send_buffer: int | None = None
+    recv_buffer: int | None = None
+    read_buffer: int = 16 * 1024
+    auto_tune: bool = False
+    max_buffer: int = 1024 * 1024
+    max_frame: int = 1024 * 1024 * 1024
+
+
+# Options are left as the system sets them
+SYSTEM_PROFILE = SocketProfile()
+
+# Control connections: small requests answered right away
+LATENCY_PROFILE = SocketProfile(name='latency',
+                                nodelay=True,
+                                quickack=True,
+                                read_buffer=16 * 1024,
+                                auto_tune=True,
+                                max_buffer=256 * 1024)
+
+# Data connections: messages, files and media, often large and back to back.
+# Kernel buffers are left to the kernel, which grows them with the round trip time of the connection
+THROUGHPUT_PROFILE = SocketProfile(name='throughput',
+                                   nodelay=True,
+                                   read_buffer=64 * 1024,
+                                   auto_tune=True,
+                                   max_buffer=1024 * 1024)
+
+# Data connections over a local network (short round trips): small pinned kernel buffers stay in the CPU caches
+LAN_PROFILE = SocketProfile(name='lan',
+                            nodelay=True,
+                            send_buffer=256 * 1024,
+                            recv_buffer=256 * 1024,
+                            read_buffer=64 * 1024,
+                            auto_tune=True,
+                            max_buffer=1024 * 1024)
+
+SOCKET_PROFILES: dict[str, SocketProfile] = {
+    profile.name: profile for profile in (SYSTEM_PROFILE, LATENCY_PROFILE, THROUGHPUT_PROFILE, LAN_PROFILE)
+}
+
+
+def socket_profile(name: str) -> SocketProfile:
+    """
+    :return: Profile of the given name (see SOCKET_PROFILES)
+    """
+    try:
+        return SOCKET_PROFILES[name]
+    except KeyError:
+        raise ValueError(f'Unknown socket profile "{name}", expected one of: {", ".join(SOCKET_PROFILES)}')
+
+
+class SocketTuner:
+    # Frames the receive buffer should hold, so a burst of them takes few system calls
+    FRAMES_BUFFERED = 8
+
+    __slots__ = ('__profile', '__every', '__weight', '__average', '__count')
+
+    def __init__(self, profile: SocketProfile, every: int = 32, weight: float = 0.125):
+        """
+        Running average of the frame sizes of a connection, and the receive buffer it calls for
+
+        :param every: Frames between two checks of the receive buffer
+        :param weight: Weight of every new frame in the average
+        """
+        self.__profile = profile
+        self.__every = every
+        self.__weight = weight
+        self.__average = 0.
+        self.__count = 0
+
+    def observe(self, size: int) -> bool:
+        """
+        Account a received frame
+
+        :return: Whether it's time to check the receive buffer
+        """
+        self.__count += 1
+        if self.__count == 1:
+            self.__average = float(size)
+        else:
+            self.__average += (size - self.__average) * self.__weight
+        return self.__count % self.__every == 0
+
+    def read_buffer(self, current: int) -> int:
+        """
+        :param current: Size (in bytes) of the receive buffer
+        :return: Size the receive buffer should have, `current` unless it's off by a factor of 4 or more
+        """
+        minimum = self.__profile.read_buffer
+        wanted = int(self.__average * self.FRAMES_BUFFERED)
+
+        # Frames too large to be buffered several at a time are better received straight into buffers of their own
+        if wanted > self.__profile.max_buffer:
+            target = minimum
+        else:
+            target = max(1 << (max(wanted, 1) - 1).bit_length(), minimum)
+        if target >= current * 4 or target * 4 <= current:
+            return target
+        return current
+
+    @property
+    def average(self) -> float:
+        return self.__average
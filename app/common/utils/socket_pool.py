@@ -5,35 +5,57 @@ from .. import *
 
 
 class SocketPool:
-    def __init__(self, socks: list[socket.socket]):
+    def __init__(self, socks: list[socket.socket], reserved: int | None = None):
+        """
+        :param reserved: Sockets bulk transfers leave free for other traffic (default: one in eight, at least one)
+        """
         self.__pool: list[socket.socket | None] = socks.copy()
-        self.__lock = threading.Lock()
-        self.__available = threading.Semaphore(len(self.__pool))
+        self.__available = len(self.__pool)
+        self.__reserved = reserved if reserved is not None else max(1, len(self.__pool) // 8)
+        self.__reserved = min(self.__reserved, len(self.__pool) - 1) if self.__pool else 0
+
+        # Waiters of every priority class, a socket goes to the highest class waiting
+        self.__waiting = [0] * (MessagePriority.BULK + 1)
+        self.__cond = threading.Condition()
 
     @contextmanager
-    def get_socket(self) -> socket.socket:
-        sock = self.acquire_socket()
+    def get_socket(self, priority: int = MessagePriority.INTERACTIVE) -> socket.socket:
+        sock = self.acquire_socket(priority)
         try:
             yield sock
         finally:
             self.release_socket(sock)
 
-    def acquire_socket(self) -> socket.socket:
-        self.__available.acquire()
-        with self.__lock:
+    def acquire_socket(self, priority: int = MessagePriority.INTERACTIVE) -> socket.socket:
+        with self.__cond:
+            self.__waiting[priority] += 1
+            try:
+                self.__cond.wait_for(lambda: self.__can_acquire(priority))
+            finally:
+                self.__waiting[priority] -= 1
+
+            self.__available -= 1
             for i, sock in enumerate(self.__pool):
                 if sock:
                     self.__pool[i] = None
                     return sock
 
     def release_socket(self, sock: socket.socket):
-        with self.__lock:
+        with self.__cond:
             for i, s in enumerate(self.__pool):
                 if s is None:
                     self.__pool[i] = sock
                     break
-        self.__available.release()
+            self.__available += 1
+            self.__cond.notify_all()
+
+    def __can_acquire(self, priority: int) -> bool:
+        if any(self.__waiting[:priority]):
+            return False
+        if priority == MessagePriority.BULK:
+            return self.__available > self.__reserved
+        return self.__available > 0
 
     @property
     def value(self):
-        return self.__available._value
+        return self.__available
@@ -1,6 +1,90 @@
-from typing import Literal, Any
+from typing import Literal, Any, Callable, Iterable
+import dataclasses
 import socket
-from .. import serialize, deserialize
+import ssl
+import struct
+import threading
+import weakref
+from .. import serialize_frame, deserialize_frame, deserialize_message, serialized_bytes_size
+from .. import MessageProtocol, MessageFrame, MESSAGE_HEADER, MESSAGE_MARKER, BYTES_HEADER, BYTES_TRAILER
+from .buffer_pool import BufferPool
+from .socket_options import SocketProfile, SocketTuner, SYSTEM_PROFILE
+
+# Every TCP frame is prefixed with its length so several frames can share one write
+FRAME_HEADER = struct.Struct('!I')
+
+# Large frames may be sent in fragments, interleaved with other frames. The top bit of the header marks a fragment,
+# the next one the last fragment of its frame, the next two its lane (one fragmented frame at a time per lane)
+FRAGMENT_BIT = 1 << 31
+LAST_FRAGMENT_BIT = 1 << 30
+LANE_SHIFT = 28
+LANES = 4
+MAX_FRAME_SIZE = FRAGMENT_BIT - 1
+MAX_FRAGMENT_SIZE = (1 << LANE_SHIFT) - 1
+
+# Frames (in bytes) from which a file sink is offered the body, smaller ones are read whole
+FILE_SINK_THRESHOLD = 64 * 1024
+
+# Frames too large for the receive buffer are received into a buffer grown as they arrive, from this size (in bytes)
+RECV_GROWTH = 1024 * 1024
+
+# Fragments received so far, by socket and lane
+_fragments: weakref.WeakKeyDictionary[socket.socket, dict[int, bytearray]] = weakref.WeakKeyDictionary()
+_fragments_lock = threading.Lock()
+
+# Receive buffers of connections, they read ahead so several small frames take one system call.
+# Their memory comes from (and goes back to) the pool
+_recv_buffers: weakref.WeakKeyDictionary[socket.socket, '_RecvBuffer'] = weakref.WeakKeyDictionary()
+_recv_buffers_lock = threading.Lock()
+_buffer_pool = BufferPool()
+
+# Receive buffer (in bytes) of connections without a profile
+DEFAULT_READ_BUFFER = 16 * 1024
+
+# Profiles of connections (see apply_socket_profile()), and the tuners of those auto-tuned
+_profiles: weakref.WeakKeyDictionary[socket.socket, SocketProfile] = weakref.WeakKeyDictionary()
+_tuners: weakref.WeakKeyDictionary[socket.socket, SocketTuner] = weakref.WeakKeyDictionary()
+
+# Buffers (in bytes) from which TLS writes send them as they are, smaller ones are joined into one record
+TLS_JOIN_LIMIT = 16 * 1024
+
+# Whether writes can be made without waiting for the peer (see tcp_sock_send_frames_nowait())
+SEND_NOWAIT = hasattr(socket, 'MSG_DONTWAIT')
+
+
+class _RecvBuffer:
+    __slots__ = ('data', 'view', 'start', 'end')
+
+    def __init__(self, data: bytearray):
+        # Bytes received but not consumed yet are data[start:end]
+        self.data = data
+        self.view = memoryview(data)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def take(self, size: int) -> memoryview:
+        # Valid until the next read from the socket
+        view = self.view[self.start:self.start + size]
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+        return view
+
+
+@dataclasses.dataclass(init=True, repr=False, frozen=True, slots=True)
+class FrameFragment:
+    lane: int
+    last: bool
+    data: bytes | memoryview | MessageFrame
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f'FrameFragment(lane={self.lane}, last={self.last}, size={len(self.data)})'
 
 
 def new_socket(socket_type: Literal['tcp', 'udp']) -> socket.socket:
@@ -12,70 +96,438 @@ def new_socket(socket_type: Literal['tcp', 'udp']) -> socket.socket:
     return sock
 
 
-def tcp_sock_send(sock: socket.socket, data: Any, buffer_size: int = 16384):
-    ser = serialize(data)
-    for i in range(0, len(ser), buffer_size):
-        chunk = ser[i:i + buffer_size]
-        sock.sendall(chunk)
+def set_nodelay(sock: socket.socket, enabled: bool = True):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(enabled))
+
+
+def set_keepalive(sock: socket.socket, idle: int = 30, interval: int = 10, count: int = 3):
+    """
+    Let the kernel probe an idle connection, so a peer that silently went away is noticed
+
+    The connection is dropped after `idle + interval * count` seconds without an answer,
+    unacknowledged writes give up after the same time (where supported).
+
+    :param idle: Time (in seconds) without traffic before the first probe, 0 to disable keepalive
+    :param interval: Time (in seconds) between probes
+    :param count: Unanswered probes before the connection is dropped
+    """
+    if idle <= 0:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 0)
+        return
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, (idle + interval * count) * 1000)
+
+
+def apply_socket_profile(sock: socket.socket, profile: SocketProfile):
+    """
+    Set the options of a TCP connection, and the receive buffer frames are read through (see SocketProfile)
+
+    Options the system doesn't have are skipped.
+    """
+    if profile.nodelay is not None:
+        set_nodelay(sock, profile.nodelay)
+    if profile.send_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, profile.send_buffer)
+    if profile.recv_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, profile.recv_buffer)
+    if profile.quickack and hasattr(socket, 'TCP_QUICKACK'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+    _profiles[sock] = profile
+    if profile.auto_tune:
+        _tuners[sock] = SocketTuner(profile)
+    else:
+        _tuners.pop(sock, None)
+
+
+def tcp_sock_send(sock: socket.socket, data: Any):
+    tcp_sock_send_frames(sock, [serialize_frame(data)])
+
+
+def tcp_sock_send_frames(sock: socket.socket, frames: Iterable[bytes | MessageFrame | FrameFragment]):
+    """
+    Write already serialized frames (or fragments of frames) using a single vectored write where possible
+    """
+    buffers = _frame_buffers(frames)
+
+    # TLS records are encrypted from one buffer at a time, join small ones (headers included) instead
+    if not hasattr(sock, 'sendmsg') or isinstance(sock, ssl.SSLSocket):
+        small = []
+        for buffer in buffers:
+            if len(buffer) < TLS_JOIN_LIMIT:
+                small.append(buffer)
+                continue
+            if small:
+                sock.sendall(b''.join(small))
+                small.clear()
+            sock.sendall(memoryview(buffer))
+        if small:
+            sock.sendall(b''.join(small))
+        return
+
+    views = [memoryview(buffer) for buffer in buffers]
+    index = 0
+    while index < len(views):
+        index = _send_views(sock, views, index)
+
+
+def tcp_sock_send_frames_nowait(sock: socket.socket,
+                                frames: Iterable[bytes | MessageFrame | FrameFragment],
+                                unsent: list[memoryview]) -> bool:
+    """
+    Write frames like tcp_sock_send_frames(), as far as the socket takes them without waiting for the peer
+
+    What the socket doesn't take is left in `unsent` (in order), and written first on the next call.
+    TLS sockets, and sockets of platforms without MSG_DONTWAIT, are written whole like tcp_sock_send_frames() does.
+
+    :return: Whether everything was written, `unsent` included (otherwise wait for the socket to be writable)
+    """
+    if not SEND_NOWAIT or not hasattr(sock, 'sendmsg') or isinstance(sock, ssl.SSLSocket):
+        tcp_sock_send_frames(sock, frames)
+        return True
+
+    views = unsent + [memoryview(buffer) for buffer in _frame_buffers(frames)]
+    index = 0
+    try:
+        while index < len(views):
+            index = _send_views(sock, views, index, socket.MSG_DONTWAIT)
+    except (BlockingIOError, socket.timeout):
+        # Full, the peer is reading slower than it is written to
+        pass
+
+    unsent[:] = views[index:]
+    return not unsent
+
+
+def _frame_buffers(frames: Iterable[bytes | MessageFrame | FrameFragment]) -> list[bytes | memoryview]:
+    buffers = []
+    for frame in frames:
+        if isinstance(frame, FrameFragment):
+            if not 0 <= frame.lane < LANES or len(frame) > MAX_FRAGMENT_SIZE:
+                raise ValueError(f'Invalid fragment: {frame}')
+            buffers.append(FRAME_HEADER.pack(FRAGMENT_BIT | (LAST_FRAGMENT_BIT if frame.last else 0) |
+                                             frame.lane << LANE_SHIFT | len(frame)))
+            _append_parts(buffers, frame.data)
+            continue
+
+        if len(frame) > MAX_FRAME_SIZE:
+            raise ValueError(f'Frame of {len(frame)} bytes is too large, send it in fragments')
+        buffers.append(FRAME_HEADER.pack(len(frame)))
+        _append_parts(buffers, frame)
+    return buffers
+
+
+def _send_views(sock: socket.socket, views: list[memoryview], index: int, flags: int = 0) -> int:
+    # One vectored write from views[index], what was partly written is sliced in place
+    sent = sock.sendmsg(views[index:index + 1024], (), flags)
+    while index < len(views) and sent >= len(views[index]):
+        sent -= len(views[index])
+        index += 1
+    if sent:
+        views[index] = views[index][sent:]
+    return index
+
+
+def _append_parts(buffers: list, data: bytes | memoryview | MessageFrame):
+    if isinstance(data, MessageFrame):
+        buffers.extend(part for part in data.parts if len(part))
+    else:
+        buffers.append(data)
 
 
 def udp_sock_send(sock: socket.socket, address: tuple[str, int], data: Any):
-    sock.sendto(serialize(data), address)
+    sock.sendto(serialize_frame(data), address)
+
+
+def tcp_sock_recv(sock: socket.socket,
+                  buffer_size: int | None = None,
+                  timeout: float | None = 1.0,
+                  file_sink: Callable[[Any, int], Any] | None = None) -> Any:
+    """
+    Raises socket.timeout if a timeout occurs before a frame starts arriving
+    Raises EOFError if the connection is closed by the peer
+
+    :param file_sink: Called with the message (routing header only) of every large message whose body is bytes
+                      serialized by serialize_bytes(), and the size of those bytes. If it returns a MappedFile,
+                      the bytes are received straight into it and it becomes the body of the message
+    """
+    if file_sink is None:
+        return deserialize_frame(tcp_sock_recv_frame(sock, buffer_size, timeout=timeout))
+
+    frame = _recv_frame(sock, buffer_size, timeout,
+                        lambda buffer, length: _recv_message(sock, buffer, length, file_sink))
+    return frame if isinstance(frame, MessageProtocol) else deserialize_frame(frame)
 
 
-def tcp_sock_recv(sock: socket.socket, buffer_size: int = 16384, timeout: float | None = 1.0) -> Any:
+def tcp_sock_recv_frame(sock: socket.socket,
+                        buffer_size: int | None = None,
+                        timeout: float | None = 1.0) -> bytes | bytearray:
     """
-    Raises socket.timeout if a timeout occurs
+    Receive one serialized frame, see tcp_sock_recv()
+
+    Fragments are put together on the way, frames sent in between them are returned as they complete.
+    Only one thread may receive from a socket.
+
+    :param buffer_size: Receive buffer (in bytes) of the connection, when it's first used
+                        (default: from its profile, see apply_socket_profile()).
+                        Frames that don't fit are received straight into buffers of their own
+    """
+    return _recv_frame(sock, buffer_size, timeout, lambda buffer, length: _recv_exact(sock, buffer, length))
+
+
+def release_recv_buffer(sock: socket.socket):
     """
+    Give the receive buffer of a closed connection back to the pool
+    """
+    with _recv_buffers_lock:
+        buffer = _recv_buffers.pop(sock, None)
+    if buffer is not None:
+        buffer.view.release()
+        _buffer_pool.release(buffer.data)
+
+
+def _recv_buffer(sock: socket.socket, buffer_size: int | None) -> _RecvBuffer:
+    buffer = _recv_buffers.get(sock)
+    if buffer is None:
+        if not buffer_size:
+            profile = _profiles.get(sock)
+            buffer_size = profile.read_buffer if profile else DEFAULT_READ_BUFFER
+        with _recv_buffers_lock:
+            buffer = _recv_buffers.setdefault(sock, _RecvBuffer(_buffer_pool.acquire(buffer_size)))
+    return buffer
+
 
-    # return deserialize(sock.recv(buffer_size))
+def _resize_recv_buffer(sock: socket.socket, buffer: _RecvBuffer, size: int) -> _RecvBuffer:
+    """
+    Move what is buffered to a receive buffer of another size (unless it doesn't fit)
+    """
+    if size == len(buffer.data) or len(buffer) > size:
+        return buffer
+
+    resized = _RecvBuffer(_buffer_pool.acquire(size))
+    resized.end = len(buffer)
+    resized.view[:resized.end] = buffer.view[buffer.start:buffer.end]
+    with _recv_buffers_lock:
+        _recv_buffers[sock] = resized
+
+    buffer.view.release()
+    _buffer_pool.release(buffer.data)
+    return resized
+
+
+def _quickack(sock: socket.socket):
+    # Delayed acknowledgements come back after every acknowledgement sent, so it's switched off again before waiting
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+    except OSError:
+        pass
 
-    chunks = []
+
+def _set_timeout(sock: socket.socket, timeout: float | None):
+    # Switching the socket mode is a system call, skip it when there's nothing to switch
+    if sock.timeout != timeout:
+        sock.settimeout(timeout)
+
+
+def _recv_frame(sock: socket.socket,
+                buffer_size: int | None,
+                timeout: float | None,
+                read: Callable[[_RecvBuffer, int], Any]) -> Any:
+    """
+    :param read: Reads a whole (not fragmented) frame of the given length
+    """
+    buffer = _recv_buffer(sock, buffer_size)
+    profile = _profiles.get(sock)
+    quickack = profile is not None and profile.quickack and hasattr(socket, 'TCP_QUICKACK')
+    max_frame = (profile or SYSTEM_PROFILE).max_frame
+    tuner = _tuners.get(sock)
     prev_timeout = sock.timeout
-    sock.settimeout(timeout)
 
     try:
         while True:
-            data = sock.recv(buffer_size)
-            chunks.append(data)
+            # Wait for a frame to start, unless it already has
+            if not len(buffer):
+                if quickack:
+                    _quickack(sock)
+                _set_timeout(sock, timeout)
+                _fill(sock, buffer, 1)
 
-            if len(data) < buffer_size:
-                break
-    except Exception:
-        raise
+            # Once a frame has started, wait for the rest of it
+            _set_timeout(sock, None)
+            _fill(sock, buffer, FRAME_HEADER.size)
+            length = FRAME_HEADER.unpack(buffer.take(FRAME_HEADER.size))[0]
+
+            # Size the receive buffer from the frames seen lately
+            if tuner is not None and tuner.observe(length & MAX_FRAGMENT_SIZE if length & FRAGMENT_BIT else length):
+                buffer = _resize_recv_buffer(sock, buffer, tuner.read_buffer(len(buffer.data)))
+
+            if not length & FRAGMENT_BIT:
+                if length > max_frame:
+                    raise ValueError(f'Frame of {length} bytes is larger than {max_frame} bytes')
+                return read(buffer, length)
+
+            lane = (length >> LANE_SHIFT) & (LANES - 1)
+            with _fragments_lock:
+                partial = _fragments.setdefault(sock, {}).setdefault(lane, bytearray())
+            if len(partial) + (length & MAX_FRAGMENT_SIZE) > max_frame:
+                raise ValueError(f'Fragmented frame is larger than {max_frame} bytes')
+            _recv_append(sock, buffer, length & MAX_FRAGMENT_SIZE, partial)
+
+            if length & LAST_FRAGMENT_BIT:
+                with _fragments_lock:
+                    return _fragments[sock].pop(lane)
     finally:
-        sock.settimeout(prev_timeout)
+        _set_timeout(sock, prev_timeout)
 
-    all_data = b''.join(chunks)
-    return deserialize(all_data)
 
+def _recv_message(sock: socket.socket,
+                  buffer: _RecvBuffer,
+                  length: int,
+                  file_sink: Callable[[Any, int], Any]) -> Any:
+    """
+    Read a whole frame, the bytes body of a large message goes to the file the sink gives (if any)
+    """
+    prefix_size = MESSAGE_HEADER.size
+    if length < FILE_SINK_THRESHOLD:
+        return _recv_exact(sock, buffer, length)
 
-def udp_sock_recvfrom(sock: socket.socket, buffer_size: int = 16384, timeout: float | None = 2.) -> tuple[Any, Any]:
-    chunks = []
-    prev_timeout = sock.timeout
-    address = None
-    sock.settimeout(timeout)
+    prefix = _recv_exact(sock, buffer, prefix_size)
+    marker, header_size = MESSAGE_HEADER.unpack(prefix)
+    if marker != MESSAGE_MARKER or prefix_size + header_size + BYTES_HEADER.size > length:
+        return _recv_exact(sock, buffer, length - prefix_size, prefix)
+
+    # Routing header and the start of the body
+    head = _recv_exact(sock, buffer, header_size + BYTES_HEADER.size)
+    remaining = length - prefix_size - len(head)
+    size = serialized_bytes_size(memoryview(head)[header_size:])
+
+    destination = None
+    if size is not None and size + len(BYTES_TRAILER) == remaining:
+        message = deserialize_message(prefix + head[:header_size])
+        destination = file_sink(message, size)
+
+    if destination is None:
+        return _recv_exact(sock, buffer, remaining, prefix + head)
 
     try:
-        while True:
-            data, addr = sock.recvfrom(buffer_size)
+        # What was read ahead first, then straight from the socket
+        if len(buffer):
+            destination.write(buffer.take(min(len(buffer), size)))
+        while not destination.complete:
+            if not destination.recv_from(sock):
+                raise EOFError('Connection closed by the peer')
+        _recv_exact(sock, buffer, len(BYTES_TRAILER))
+    except BaseException:
+        destination.discard()
+        raise
+
+    message._decoded = destination
+    return message
 
-            if address is None:
-                address = addr
-            elif address != addr:
-                continue
 
-            chunks.append(data)
+def _fill(sock: socket.socket, buffer: _RecvBuffer, size: int):
+    """
+    Read until at least `size` bytes (at most the size of the buffer) are buffered, and as many more as are available
+    """
+    if buffer.start + size > len(buffer.data):
+        # Move what is left to the front
+        remaining = len(buffer)
+        buffer.view[:remaining] = buffer.view[buffer.start:buffer.end]
+        buffer.start, buffer.end = 0, remaining
+
+    while len(buffer) < size:
+        received = sock.recv_into(buffer.view[buffer.end:])
+        if not received:
+            raise EOFError('Connection closed by the peer')
+        buffer.end += received
+
+
+def _recv_exact(sock: socket.socket, buffer: _RecvBuffer, size: int, prefix: bytes = b'') -> bytes | bytearray:
+    """
+    Read `size` bytes (after `prefix`), what was read ahead first
+    """
+    if not prefix and size <= len(buffer.data):
+        _fill(sock, buffer, size)
+        return bytes(buffer.take(size))
+
+    # Too large for the receive buffer, received in place into a pooled buffer of its own.
+    # It grows (at least doubling, to the next size class) as the frame arrives, never much beyond
+    # what the peer actually sent
+    end = len(prefix) + size
+    ahead = min(len(buffer), size)
+    data = _buffer_pool.acquire(min(end, max(len(prefix) + ahead, RECV_GROWTH)))
+    position = len(prefix)
+    data[:position] = prefix
+    if ahead:
+        data[position:position + ahead] = buffer.take(ahead)
+        position += ahead
+
+    try:
+        while position < end:
+            if position == len(data):
+                grown = _buffer_pool.acquire(min(end, position + max(position, RECV_GROWTH)))
+                with memoryview(data) as view:
+                    grown[:position] = view[:position]
+                _buffer_pool.release(data)
+                data = grown
 
-            if len(data) < buffer_size:
-                break
+            with memoryview(data) as view, view[position:min(len(data), end)] as free:
+                received = sock.recv_into(free)
+            if not received:
+                raise EOFError('Connection closed by the peer')
+            position += received
+    except BaseException:
+        _buffer_pool.release(data)
+        raise
+
+    if len(data) == end:
+        return data
+
+    # The frame is kept by whoever reads it, the buffer goes back to the pool
+    frame = data[:end]
+    _buffer_pool.release(data)
+    return frame
+
+
+def _recv_append(sock: socket.socket, buffer: _RecvBuffer, size: int, data: bytearray) -> bytearray:
+    """
+    Append `size` bytes to `data` through the receive buffer
+    """
+    while size:
+        if not len(buffer):
+            _fill(sock, buffer, 1)
+        chunk = min(size, len(buffer))
+        data += buffer.take(chunk)
+        size -= chunk
+    return data
+
+
+def udp_sock_recvfrom(sock: socket.socket, buffer_size: int = 65535, timeout: float | None = 2.) -> tuple[Any, Any]:
+    """
+    Receive one datagram (one message), returns (None, None) if a timeout occurs
+    """
+    prev_timeout = sock.timeout
+    sock.settimeout(timeout)
+
+    try:
+        data, address = sock.recvfrom(buffer_size)
     except socket.timeout:
-        pass
+        return None, None
     finally:
         sock.settimeout(prev_timeout)
 
-    all_data = b''.join(chunks)
-    return deserialize(all_data), address
+    return deserialize_frame(data), address
 
 
 def get_internet_ip() -> str:
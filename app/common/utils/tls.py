@@ -0,0 +1,34 @@
+import ssl
+
+
+def new_tls_server_context(certfile: str, keyfile: str | None = None, num_tickets: int = 2) -> ssl.SSLContext:
+    """
+    TLS context of a server
+
+    Clients resume sessions with the tickets handed out after every handshake (TLS 1.3),
+    or with the session cache of the context (TLS 1.2), skipping the certificate exchange.
+
+    :param certfile: Certificate chain (PEM)
+    :param keyfile: Private key (PEM), None if it's in the certificate file
+    :param num_tickets: Session tickets issued per full handshake (TLS 1.3)
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    context.num_tickets = num_tickets
+    return context
+
+
+def new_tls_client_context(cafile: str | None = None, verify: bool = True) -> ssl.SSLContext:
+    """
+    TLS context of a client
+
+    :param cafile: Certificate authorities to trust (PEM), None for the system ones (or SSL_CERT_FILE)
+    :param verify: Verify the server certificate and hostname (disable for testing only)
+    """
+    context = ssl.create_default_context(cafile=cafile)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
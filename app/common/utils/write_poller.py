@@ -0,0 +1,100 @@
+import selectors
+import socket
+import threading
+from typing import Callable
+from .. import logger
+
+
+class WritePoller:
+    def __init__(self, interval: float = 1.0):
+        """
+        One thread waiting for sockets to be writable again, for writers that never wait for a peer themselves
+        (see tcp_sock_send_frames_nowait())
+
+        :param interval: Time (in seconds) between two looks for sockets closed while they are waited for
+        """
+        self.__interval = interval
+        self.__waiting: dict[socket.socket, Callable[[], None]] = {}
+        self.__lock = threading.Lock()
+        self.__stopped = False
+
+        # Wakes the thread up when a socket is added
+        self.__wakeup, self.__waker = socket.socketpair()
+        self.__wakeup.setblocking(False)
+        self.__waker.setblocking(False)
+
+        self.__thread = threading.Thread(
+            target=self.__run,
+            name='write-poller',
+            daemon=True
+        )
+        self.__thread.start()
+
+    def watch(self, sock: socket.socket, callback: Callable[[], None]):
+        """
+        Call `callback` once the socket is writable, or closed (by the thread of the poller, it must not wait)
+        """
+        with self.__lock:
+            self.__waiting[sock] = callback
+        self.__wake()
+
+    def stop(self):
+        with self.__lock:
+            self.__stopped = True
+        self.__wake()
+        if threading.current_thread() is not self.__thread:
+            self.__thread.join()
+        self.__wakeup.close()
+        self.__waker.close()
+
+    def __wake(self):
+        try:
+            self.__waker.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Awake already (or stopped)
+            pass
+
+    def __run(self):
+        while True:
+            with self.__lock:
+                if self.__stopped:
+                    return
+                waiting = list(self.__waiting)
+
+            # Only a few connections are ever stuck at a time, so the selector is made anew every time
+            ready = []
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.__wakeup, selectors.EVENT_READ)
+                for sock in waiting:
+                    try:
+                        selector.register(sock, selectors.EVENT_WRITE)
+                    except (ValueError, OSError):
+                        # Closed meanwhile, its writer finds out
+                        ready.append(sock)
+
+                if not ready:
+                    for key, _ in selector.select(timeout=self.__interval if waiting else None):
+                        if key.fileobj is self.__wakeup:
+                            self.__drain()
+                        else:
+                            ready.append(key.fileobj)
+
+            for sock in ready:
+                with self.__lock:
+                    callback = self.__waiting.pop(sock, None)
+                if callback:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logger.warning(f'Unable to resume writing: {e!r}')
+
+    def __drain(self):
+        try:
+            while self.__wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    @property
+    def waiting(self) -> int:
+        return len(self.__waiting)
@@ -1,12 +1,15 @@
 import functools
+import mimetypes
 import os
 import socket
+import ssl
 import time
 import sys
 import datetime
 
 from app.common import *
 from app.common.client import *
+from app.common.media import *
 
 
 def suppress(func):
@@ -28,13 +31,21 @@ class ProgramQuitException(Exception):
 class AppCLI:
     def __init__(self,
                  client_name: str,
-                 remote_address: tuple[str, int],
+                 remote_address: tuple[str, int] | list[tuple[str, int]] | None,
                  open_sockets: int = 64,
-                 app_name: str = 'Chat App (CLI)'):
+                 app_name: str = 'Chat App (CLI)',
+                 discovery: DiscoveryOptions = DiscoveryOptions(),
+                 ssl_context: ssl.SSLContext | None = None,
+                 control_profile: SocketProfile = LATENCY_PROFILE,
+                 data_profile: SocketProfile = THROUGHPUT_PROFILE):
         # App Parameters
         self.__agent_client_name = client_name
         self.__agent_remote_address = remote_address
         self.__agent_open_sockets = open_sockets
+        self.__agent_discovery = discovery
+        self.__agent_ssl_context = ssl_context
+        self.__agent_control_profile = control_profile
+        self.__agent_data_profile = data_profile
 
         # Local devices
         self.__local_clients: dict[str, tuple[float, tuple[str, int]]] = {}
@@ -42,6 +53,7 @@ class AppCLI:
 
         # Program argument parser (CLI)
         self.__src: tuple[str | None, str | None] = (None, None)
+        self.__search: tuple[str, tuple[str | None, str | None], int | None] | None = None
         self.__parser = ProgramArgumentParser(app_name=app_name)
         self.__prev_cmd = ''
         self.__setup_parser()
@@ -123,6 +135,17 @@ class AppCLI:
                 callback=self.__cmd_send_file,
                 aliases=['send-file', 'f']
             ),
+            ProgramCommand(
+                'stream', 'Stream an image/video to the recipient/group',
+                ProgramCommandArgument(
+                    name='path',
+                    help_str='Image/video path to stream',
+                    data_type=str,
+                    long_string=True
+                ),
+                callback=self.__cmd_send_media,
+                aliases=['media']
+            ),
             ProgramCommand(
                 'announce', 'Announce/broadcast message server-wide',
                 ProgramCommandArgument(
@@ -134,6 +157,30 @@ class AppCLI:
                 callback=self.__cmd_announce,
                 aliases=['all', 'broadcast', 'shout', 'sos']
             ),
+            ProgramCommand(
+                'search', 'Search the messages of the recipient/group (words, prefix*, "phrases")',
+                ProgramCommandArgument(
+                    name='query',
+                    help_str='Words to search',
+                    data_type=str,
+                    long_string=True
+                ),
+                callback=self.__cmd_search,
+                aliases=['find']
+            ),
+            ProgramCommand(
+                'more', 'Show more results of the last search',
+                callback=self.__cmd_search_more
+            ),
+            ProgramCommand(
+                'status', 'Set your presence (online or away)',
+                ProgramCommandArgument(
+                    name='state',
+                    help_str='Presence to show',
+                    data_type=str,
+                    choices=[PresenceState.ONLINE, PresenceState.AWAY]
+                ), callback=self.__cmd_status
+            ),
             ProgramCommand(
                 'quit', 'Exit the application',
                 callback=self.__cmd_quit,
@@ -150,8 +197,20 @@ class AppCLI:
                 client_name=self.__agent_client_name,
                 remote_address=self.__agent_remote_address,
                 open_sockets=self.__agent_open_sockets,
-                recv_callback=AppCLI.on_receive,
-                disc_callback=self.__on_discovery
+                recv_callback=self.__on_receive,
+                presence_callback=AppCLI.on_presence,
+                receipts=True,
+                receipt_callback=AppCLI.on_receipt,
+                disc_callback=self.__on_discovery,
+                leave_callback=self.__on_leave,
+                discovery=self.__agent_discovery,
+                ssl_context=self.__agent_ssl_context,
+                control_profile=self.__agent_control_profile,
+                data_profile=self.__agent_data_profile,
+                media_receiver=MediaReceiver(directory=AppCLI.download_dir(),
+                                             on_complete=AppCLI.on_media_complete),
+                download_dir=AppCLI.download_dir(),
+                download_callback=AppCLI.on_download_progress
         ) as self.__agent:
             while True:
                 time.sleep(0.25)
@@ -187,33 +246,55 @@ class AppCLI:
         if not validate_message(message):
             return
 
-        # Adding
         if message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.SERVER_DISC:
-            self.__local_servers[message.src.username] = time.time(), message.src.address
+            self.__local_servers[message.src.username] = time.time(), service_address(message) or message.src.address
         elif message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.CLIENT_DISC:
             self.__local_clients[message.src.username] = time.time(), message.src.address
-        else:
+
+    def __on_receive(self, message: MessageProtocol):
+        # Printed messages are read
+        AppCLI.on_receive(message)
+        self.__agent.mark_read(message)
+
+    @suppress
+    def __on_leave(self, message: MessageProtocol):
+        if not validate_message(message):
             return
 
-        # Cleanup
-        tim_callback = time.time()
-        for server in list(self.__local_servers.keys()):
-            if tim_callback - self.__local_servers[server][0] >= 5.0:
-                self.__local_servers.pop(server)
-        for client in list(self.__local_clients.keys()):
-            if tim_callback - self.__local_clients[client][0] >= 5.0:
-                self.__local_clients.pop(client)
+        # Expiry is tracked by the broadcaster, only drop the device here
+        if message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.SERVER_DISC:
+            self.__local_servers.pop(message.src.username, None)
+        elif message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.CLIENT_DISC:
+            self.__local_clients.pop(message.src.username, None)
+
+    @staticmethod
+    def download_dir() -> str:
+        home_dir = os.path.expanduser("~").replace('\\', '/')
+        return f'{home_dir}/Downloads/socket'
+
+    @staticmethod
+    def on_media_complete(state: MediaStreamState):
+        print(f'[{datetime_fmt()}] {state.sender}: '
+              f'Streamed a media file (size: {state.total_size} bytes), saved as \"{state.path}\"')
 
-        # print(f'Discovered a device: \"{message.src.username}\" at {message.src.address}')
-        # print(self.__local_servers)
-        # print(self.__local_clients)
+    @staticmethod
+    def on_download_progress(download: FileDownload):
+        logger.info(f'Downloading {download.filename} from {download.sender}: '
+                    f'{download.received}/{download.total_size} bytes')
 
     @staticmethod
     def on_receive(message: MessageProtocol):
         if not validate_message(message):
             return
 
-        if message.message_type == MessageProtocolCode.DATA.FILE:
+        if message.message_type == MessageProtocolCode.DATA.FILE and isinstance(message.body, FileDownload):
+            # Received file, already saved as it arrived
+            download: FileDownload = message.body
+            print(f'[{datetime_fmt()}] {message.src.username}: '
+                  f'Sent a file: {download.filename} '
+                  f'(size: {download.total_size} bytes), saved as \"{download.path}\"')
+
+        elif message.message_type == MessageProtocolCode.DATA.FILE:
             # Receive file
             _file_proto: FileProtocol = message.body
             print(f'[{datetime_fmt()}] {message.src.username}: '
@@ -236,6 +317,20 @@ class AppCLI:
             else:
                 print(f'[{datetime_fmt()}] {message.src.username}: {message.body}')
 
+    @staticmethod
+    def on_presence(presence: Presence):
+        if presence.state == PresenceState.TYPING:
+            where = f' in {presence.group}' if presence.group else ''
+            print(f'[{datetime_fmt()}] {presence.username} is typing{where}...')
+        else:
+            print(f'[{datetime_fmt()}] {presence.username} is {presence.state}')
+
+    @staticmethod
+    def on_receipt(receipt: Receipt):
+        to = receipt.group or receipt.username
+        print(f'[{datetime_fmt()}] Message #{receipt.seq} to {to}: delivered to {receipt.delivered}, '
+              f'read by {receipt.read} of {receipt.recipients}')
+
     @suppress
     def __cmd_list(self, args):
         if not args.option or args.option == 'clients':
@@ -334,29 +429,77 @@ class AppCLI:
     def __cmd_send_file(self, args):
         file_path: str = ' '.join(args.path)
         if os.path.isfile(file_path):
-            with open(file_path, mode='rb') as f:
-                file_content: bytes = f.read()
-                file_proto = new_file_proto(filename=os.path.basename(file_path),
-                                            content=file_content)
-                if self.__src[0]:
-                    self.__agent.send_group(group_name=self.__src[0],
-                                            data_type=MessageProtocolCode.DATA.FILE,
-                                            data=file_proto)
-                else:
-                    self.__agent.send_private(recipient=self.__src[1],
-                                              data_type=MessageProtocolCode.DATA.FILE,
-                                              data=file_proto)
+            if self.__src[0]:
+                self.__agent.send_file(file_path, group_name=self.__src[0])
+            else:
+                self.__agent.send_file(file_path, recipient=self.__src[1])
             return 0
         else:
             logger.error(f'File {file_path} doesn\'t exist!')
             return 1
 
+    @suppress
+    def __cmd_send_media(self, args):
+        file_path: str = ' '.join(args.path)
+        if not os.path.isfile(file_path):
+            logger.error(f'File {file_path} doesn\'t exist!')
+            return 1
+
+        mime_type = mimetypes.guess_type(file_path)[0] or ''
+        data_type = MessageProtocolCode.DATA.VIDEO if mime_type.startswith('video') else MessageProtocolCode.DATA.IMAGE
+
+        if self.__src[0]:
+            self.__agent.send_media(file_path, data_type=data_type, group_name=self.__src[0])
+        else:
+            self.__agent.send_media(file_path, data_type=data_type, recipient=self.__src[1])
+        return 0
+
     @suppress
     def __cmd_announce(self, args):
         message = ' '.join(args.message)
         self.__agent.announce(data=message)
         return 0
 
+    @suppress
+    def __cmd_search(self, args):
+        # Quoted phrases arrive unquoted, quote them again
+        query = ' '.join(f'"{token}"' if ' ' in token else token for token in args.query)
+        return self.__show_search(query, self.__src, None)
+
+    @suppress
+    def __cmd_search_more(self, _):
+        if not self.__search or self.__search[2] is None:
+            print('No more results')
+            return 1
+        return self.__show_search(*self.__search)
+
+    def __show_search(self, query: str, src: tuple[str | None, str | None], cursor: int | None) -> int:
+        if not (src[0] or src[1]):
+            print('Chat with someone or in a group first')
+            return 1
+
+        response, page = self.__agent.search(query, recipient=src[1], group_name=src[0], cursor=cursor)
+        if response != MessageProtocolResponse.OK:
+            print('Unable to search')
+            return 1
+
+        for hit in page.hits:
+            sent_at = datetime.datetime.fromtimestamp(hit.timestamp).strftime('%d/%m/%Y %H:%M:%S')
+            print(f'[{sent_at}] #{hit.seq} {hit.username}: {hit.text}')
+        if not page.hits:
+            print('No results')
+        self.__search = (query, src, page.cursor)
+        if page.cursor is not None:
+            print('More results with "more"')
+        return 0
+
+    @suppress
+    def __cmd_status(self, args):
+        if self.__agent.set_presence(args.state) != MessageProtocolResponse.OK:
+            print('Unable to set your presence')
+            return 1
+        return 0
+
     @suppress
     def __cmd_quit(self, _):
         raise ProgramQuitException
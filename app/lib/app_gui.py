@@ -306,12 +306,18 @@ class AppGUI(App):
 
         self.client_name: str = client_name
 
+        # Filled in by discovery callbacks, as soon as the agent is created
+        self.local_clients: dict[str, tuple[float, tuple[str, int]]] = {}
+        self.local_servers: dict[str, tuple[float, tuple[str, int]]] = {}
+
         self.agent = ChatAgent(
             client_name=self.client_name,
             remote_address=(remote_host, remote_port),
             open_sockets=4,
             recv_callback=self.on_receive,
-            disc_callback=None
+            disc_callback=self.on_discovery,
+            leave_callback=self.on_leave,
+            download_dir=os.path.join(os.path.expanduser('~'), 'Downloads', 'socket')
         )
 
         self.message_to_send = ''
@@ -320,9 +326,6 @@ class AppGUI(App):
 
         self.recv_count = 0
 
-        self.local_clients: dict[str, tuple[float, tuple[str, int]]] = {}
-        self.local_servers: dict[str, tuple[float, tuple[str, int]]] = {}
-
         self.src: tuple[str | None, str | None] = (None, None)
 
         # Buffers
@@ -365,26 +368,19 @@ class AppGUI(App):
         # )
 
         if message.message_type == MessageProtocolCode.DATA.FILE:
-            # Receive file
-            _file_proto: FileProtocol = message.body
+            # Receive file, saved by the agent as it arrived
+            download: FileDownload = message.body
 
             print(f'[{datetime_fmt()}] {message.src.username}: '
-                  f'Sent a file: {_file_proto.filename} '
-                  f'(size: {_file_proto.size} bytes)')
-
-            # Save file
-            home_dir = os.path.expanduser("~").replace('\\', '/')
-            filename = uniquify(f'{home_dir}/Downloads/socket/{_file_proto.filename}')
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-            with open(filename, mode='wb') as f:
-                f.write(_file_proto.content)
+                  f'Sent a file: {download.filename} '
+                  f'(size: {download.total_size} bytes)')
 
             if self.src[0]:
                 self.store_chat(
                     self.src[0],
                     MessageInfo(
                         sender=f'{message.src.username} {datetime_fmt()}',
-                        body=f'SENT A {_file_proto.size} bytes FILE to \"{filename}\".'
+                        body=f'SENT A {download.total_size} bytes FILE to \"{download.path}\".'
                     )
                 )
             else:
@@ -392,11 +388,11 @@ class AppGUI(App):
                     self.src[1],
                     MessageInfo(
                         sender=f'{message.src.username} {datetime_fmt()}',
-                        body=f'SENT A {_file_proto.size} bytes FILE to \"{filename}\".'
+                        body=f'SENT A {download.total_size} bytes FILE to \"{download.path}\".'
                     )
                 )
 
-            logger.info(f'File {_file_proto.filename} is saved as \"{filename}\".')
+            logger.info(f'File {download.filename} is saved as \"{download.path}\".')
 
         else:
             # Other formats
@@ -436,22 +432,19 @@ class AppGUI(App):
 
         logger.info(f'I discovered something!: {message}')
 
-        # Adding
         if message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.SERVER_DISC:
-            self.local_servers[message.src.username] = time.time(), message.src.address
+            self.local_servers[message.src.username] = time.time(), service_address(message) or message.src.address
         elif message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.CLIENT_DISC:
             self.local_clients[message.src.username] = time.time(), message.src.address
-        else:
+
+    def on_leave(self, message: MessageProtocol):
+        if not validate_message(message):
             return
 
-        # Cleanup
-        tim_callback = time.time()
-        for server in list(self.local_servers.keys()):
-            if tim_callback - self.local_servers[server][0] >= 5.0:
-                self.local_servers.pop(server)
-        for client in list(self.local_clients.keys()):
-            if tim_callback - self.local_clients[client][0] >= 5.0:
-                self.local_clients.pop(client)
+        if message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.SERVER_DISC:
+            self.local_servers.pop(message.src.username, None)
+        elif message.message_type == MessageProtocolCode.INSTRUCTION.BROADCAST.CLIENT_DISC:
+            self.local_clients.pop(message.src.username, None)
 
     def chat(self, recipient):
         if (self.src[0]): self.agent.leave_group(self.src[0])
@@ -547,33 +540,25 @@ class AppGUI(App):
     @on(Button.Pressed, '#sendFileButton')
     def action_add_file(self) -> None:
         if os.path.isfile(self.message_to_send):
-            with open(self.message_to_send, mode='rb') as f:
-                file_content: bytes = f.read()
-                file_proto = new_file_proto(filename=os.path.basename(self.message_to_send),
-                                            content=file_content)
-                if self.src[0]:
-                    self.agent.send_group(group_name=self.src[0],
-                                        data_type=MessageProtocolCode.DATA.FILE,
-                                        data=file_proto)
-                    self.store_chat(
-                        self.src[0],
-                        MessageInfo(
-                            sender=f'You {datetime_fmt()}',
-                            body=f'Sent a file'
-                        )
+            if self.src[0]:
+                self.agent.send_file(self.message_to_send, group_name=self.src[0])
+                self.store_chat(
+                    self.src[0],
+                    MessageInfo(
+                        sender=f'You {datetime_fmt()}',
+                        body=f'Sent a file'
                     )
+                )
 
-                else:
-                    self.agent.send_private(recipient=self.src[1],
-                                            data_type=MessageProtocolCode.DATA.FILE,
-                                            data=file_proto)
-                    self.store_chat(
-                        self.src[1],
-                        MessageInfo(
-                            sender=f'You {datetime_fmt()}',
-                            body=f'Sent a file'
-                        )
+            else:
+                self.agent.send_file(self.message_to_send, recipient=self.src[1])
+                self.store_chat(
+                    self.src[1],
+                    MessageInfo(
+                        sender=f'You {datetime_fmt()}',
+                        body=f'Sent a file'
                     )
+                )
             self.refresh_chat_messages()
             return 0
         else:
@@ -1,28 +1,177 @@
+import argparse
+import dataclasses
 import sys
 from app.common.logger import logger
 
 if sys.version_info < (3, 12):
     raise Exception('Requires Python 3.12 or higher')
 
+from app.common import MULTICAST_GROUP_V4, MULTICAST_GROUP_V6, new_tls_server_context, new_tls_client_context, \
+    SOCKET_PROFILES, socket_profile, DiscoveryOptions
 from app.common.server import *
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(prog='app.server')
+    parser.add_argument('address', nargs='?', default=None,
+                        help=f'Address to bind, [HOST]:[PORT] (default: {HOST}:{PORT})')
+    parser.add_argument('name', nargs='?', default='Example chat server',
+                        help='Broadcasting identifier of this server')
+    parser.add_argument('--coalesce', action='store_true',
+                        help='Coalesce small messages to the same recipient into one write')
+    parser.add_argument('--udp', action='store_true',
+                        help='Serve ephemeral messages (typing, presence, voice) over UDP on the same port')
+    parser.add_argument('--blob-cache-size', type=int, default=256,
+                        help='Size (in MB) of the content-addressed attachment cache (default: 256)')
+    parser.add_argument('--discovery', default='255.255.255.255',
+                        help='Broadcast address or multicast group (IPv4/IPv6) to announce on, '
+                             f'e.g. {MULTICAST_GROUP_V4} or {MULTICAST_GROUP_V6} (default: 255.255.255.255)')
+    parser.add_argument('--discovery-interface', default=None,
+                        help='Multicast interface to announce on, an IPv4 address or an IPv6 interface name')
+    parser.add_argument('--discovery-port', type=int, default=60000,
+                        help='UDP port of local network discovery (default: 60000)')
+    parser.add_argument('--session-grace', type=float, default=30.0,
+                        help='Time (in seconds) the session of a dropped client can be resumed, 0 to disable '
+                             '(default: 30)')
+    parser.add_argument('--session-queue', type=int, default=1024,
+                        help='Messages kept for a dropped client until it resumes its session (default: 1024)')
+    parser.add_argument('--heartbeat-timeout', type=float, default=45.0,
+                        help='Time (in seconds) a client may stay silent before its connections are reaped, '
+                             '0 to disable (default: 45)')
+    parser.add_argument('--keepalive-idle', type=int, default=30,
+                        help='Time (in seconds) without traffic before TCP keepalive probes start, '
+                             '0 to disable (default: 30)')
+    parser.add_argument('--tls-cert', default=None,
+                        help='Serve over TLS with this certificate chain (PEM)')
+    parser.add_argument('--tls-key', default=None,
+                        help='Private key of the TLS certificate (PEM), if not in the certificate file')
+    parser.add_argument('--max-messages-per-second', type=float, default=1000.,
+                        help='Messages of one type a client may send per second, 0 for no limit (default: 1000)')
+    parser.add_argument('--max-bytes-per-second', type=float, default=64.,
+                        help='Data (in MB) a client may send per second, 0 for no limit (default: 64)')
+    parser.add_argument('--max-announces-per-minute', type=float, default=6.,
+                        help='Server-wide announcements a client may make per minute, 0 for no limit (default: 6)')
+    parser.add_argument('--max-backlog', type=int, default=256,
+                        help='Data (in MB) waiting to be written to recipients above which new messages are refused, '
+                             '0 for no limit (default: 256)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Threads decoding and routing received messages (default: number of CPUs)')
+    parser.add_argument('--send-workers', type=int, default=16,
+                        help='Threads sending messages to recipients (default: 16)')
+    parser.add_argument('--bulk-workers', type=int, default=4,
+                        help='Threads sending files and media to recipients (default: 4)')
+    parser.add_argument('--room-workers', type=int, default=None,
+                        help='Threads running the chat groups, every group is bound to one of them '
+                             '(default: number of CPUs)')
+    parser.add_argument('--room-writers', type=int, default=4,
+                        help='Threads sharing the fan-out of large groups, 0 to fan out from the group thread '
+                             '(default: 4)')
+    parser.add_argument('--spread-members', type=int, default=256,
+                        help='Members from which a group spreads its fan-out over the room writers (default: 256)')
+    parser.add_argument('--relay-secret', default=None,
+                        help='Shared secret of relays: accept relays with it, and link to --upstream with it')
+    parser.add_argument('--upstream', default=None,
+                        help='Relay group messages of this server, HOST:PORT: members of a group get its messages '
+                             'through this server, numbered upstream')
+    parser.add_argument('--relay-name', default=None,
+                        help='Name of this relay upstream (default: the broadcasting identifier)')
+    parser.add_argument('--upstream-ca', default=None,
+                        help='Link to --upstream over TLS, trusting these certificate authorities (PEM)')
+    parser.add_argument('--presence-window', type=float, default=0.2,
+                        help='Time (in seconds) between two presence updates to the same client (default: 0.2)')
+    parser.add_argument('--presence-debounce', type=float, default=0.3,
+                        help='Time (in seconds) a presence change must hold before it is pushed (default: 0.3)')
+    parser.add_argument('--typing-timeout', type=float, default=6.0,
+                        help='Time (in seconds) typing lasts unless the client refreshes it (default: 6)')
+    parser.add_argument('--receipt-window', type=float, default=0.25,
+                        help='Time (in seconds) between two receipt updates to the same sender (default: 0.25)')
+    parser.add_argument('--search-documents', type=int, default=1_000_000,
+                        help='Text messages kept in the search index, 0 to disable search (default: 1000000)')
+    parser.add_argument('--search-bytes', type=int, default=64 * 1024 * 1024,
+                        help='Memory (in bytes, about) the search index takes at most (default: 64 MiB)')
+    parser.add_argument('--search-private', action='store_true',
+                        help='Index private messages too, kept in memory like group ones (default: groups only)')
+    parser.add_argument('--queue-size', type=int, default=1024,
+                        help='Tasks waiting per thread before readers have to wait (default: 1024)')
+    parser.add_argument('--control-profile', choices=list(SOCKET_PROFILES), default='latency',
+                        help='Socket options of master (control) connections (default: latency)')
+    parser.add_argument('--data-profile', choices=list(SOCKET_PROFILES), default='throughput',
+                        help='Socket options of slave (data) connections, lan pins small kernel buffers '
+                             '(default: throughput)')
+    parser.add_argument('--no-auto-tune', action='store_true',
+                        help='Keep receive buffers at the size of their profile instead of sizing them '
+                             'from the messages received')
+    return parser.parse_args()
+
+
 def main():
-    if len(sys.argv) > 1 and sys.argv[1].count(':') == 1:
-        tmp = sys.argv[1].strip().split(':')
+    args = parse_args()
+
+    if args.address and args.address.count(':') == 1:
+        tmp = args.address.strip().split(':')
         host_port: tuple[str, int] = tmp[0], int(tmp[1])
 
     else:
         host_port: tuple[str, int] = (HOST, PORT)
 
-    if len(sys.argv) > 2 and sys.argv[2]:
-        server_name = sys.argv[2]
-    else:
-        server_name = 'Example chat server'
+    server_name = args.name
+    ssl_context = new_tls_server_context(args.tls_cert, args.tls_key) if args.tls_cert else None
+
+    upstream: tuple[str, int] | None = None
+    if args.upstream:
+        tmp = args.upstream.strip().rsplit(':', 1)
+        upstream = tmp[0], int(tmp[1])
+    upstream_ssl_context = new_tls_client_context(args.upstream_ca) if args.upstream_ca else None
+    rate_limits = RateLimits(messages_per_second=args.max_messages_per_second,
+                             message_burst=max(1, int(args.max_messages_per_second * 5)),
+                             bytes_per_second=args.max_bytes_per_second * 1024 * 1024,
+                             byte_burst=max(1, int(args.max_bytes_per_second * 4 * 1024 * 1024)),
+                             announces_per_minute=args.max_announces_per_minute,
+                             announce_burst=max(1, int(args.max_announces_per_minute / 2)))
+
+    control_profile = socket_profile(args.control_profile)
+    data_profile = socket_profile(args.data_profile)
+    if args.no_auto_tune:
+        control_profile = dataclasses.replace(control_profile, auto_tune=False)
+        data_profile = dataclasses.replace(data_profile, auto_tune=False)
 
     logger.info('Starting server...')
 
-    chat_server = ChatServer(address=host_port, server_name=server_name)
+    chat_server = ChatServer(address=host_port,
+                             server_name=server_name,
+                             udp=args.udp,
+                             ssl_context=ssl_context,
+                             delivery=DeliveryOptions(coalesce=args.coalesce,
+                                                      max_backlog=args.max_backlog * 1024 * 1024),
+                             rate_limits=rate_limits,
+                             pools=WorkerPools(workers=args.workers,
+                                               send_workers=args.send_workers,
+                                               bulk_workers=args.bulk_workers,
+                                               queue_size=args.queue_size,
+                                               room_workers=args.room_workers,
+                                               room_writers=args.room_writers,
+                                               spread_members=args.spread_members),
+                             sessions=SessionOptions(grace=args.session_grace,
+                                                     queue=args.session_queue,
+                                                     heartbeat_timeout=args.heartbeat_timeout,
+                                                     keepalive_idle=args.keepalive_idle),
+                             discovery=DiscoveryOptions(address=args.discovery,
+                                                        interface=args.discovery_interface,
+                                                        port=args.discovery_port),
+                             relay=RelayOptions(secret=args.relay_secret,
+                                                upstream=upstream,
+                                                name=args.relay_name,
+                                                ssl_context=upstream_ssl_context),
+                             presence=PresenceOptions(window=args.presence_window,
+                                                      debounce=args.presence_debounce,
+                                                      typing_timeout=args.typing_timeout,
+                                                      receipt_window=args.receipt_window),
+                             search=SearchOptions(documents=args.search_documents,
+                                                  max_bytes=args.search_bytes,
+                                                  private=args.search_private) if args.search_documents > 0 else None,
+                             blob_cache_size=args.blob_cache_size * 1024 * 1024,
+                             control_profile=control_profile,
+                             data_profile=data_profile)
 
     try:
         while chat_server.is_alive():
@@ -0,0 +1,207 @@
+import multiprocessing
+import socket
+import threading
+import time
+from typing import Any
+
+import pytest
+
+from app.common import *
+from app.common.client import ConnectionOptions, TcpClient, probe_latency
+from app.common.server import SessionOptions
+
+# Agents of the tests: a socket to receive on, no heartbeats, and no reconnecting behind the back of a test
+AGENT_OPTIONS = dict(open_sockets=2, connection=ConnectionOptions(heartbeat_interval=0, reconnect=False))
+
+
+@pytest.fixture(autouse=True, scope='session')
+def quiet_logger():
+    logger.disabled = True
+    yield
+
+
+def new_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def free_port() -> int:
+    return new_port()
+
+
+def wait_for(predicate, timeout: float = 5.0, interval: float = 0.01) -> bool:
+    """
+    Poll until the predicate holds, or the timeout elapses
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def wait_listening(address: tuple[str, int], timeout: float = 10.0):
+    if not wait_for(lambda: probe_latency(address) is not None, timeout=timeout, interval=0.05):
+        raise TimeoutError(f'No server at {address}')
+
+
+def identified(address: tuple[str, int], username: str) -> TcpClient:
+    """
+    Bare connection identified as `username`, to send what agents never do (e.g. messages on behalf of others)
+    """
+    client = TcpClient(username, *address, retry=0.05)
+    response = client.transaction(new_message_proto(
+        src=new_user(username=username),
+        dst=None,
+        message_type=MessageProtocolCode.INSTRUCTION.IDENTIFY_MASTER,
+        body=None
+    ))
+    assert response.response == MessageProtocolResponse.OK
+    return client
+
+
+class Published:
+    """
+    Records what a service publishes: published(recipient or recipients, items)
+    """
+
+    def __init__(self):
+        self.calls: list[tuple[Any, list]] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, recipients: str | list[str], items: list):
+        with self.lock:
+            self.calls.append((sorted(recipients) if isinstance(recipients, list) else recipients, items))
+
+    def to(self, recipient: str) -> list:
+        """
+        Items published to the recipient, in order
+        """
+        with self.lock:
+            return [item for recipients, items in self.calls
+                    if recipient == recipients or isinstance(recipients, list) and recipient in recipients
+                    for item in items]
+
+
+class Proxy:
+    def __init__(self, address: tuple[str, int]):
+        """
+        Forwards connections to a server, until they are cut (as a failing network would, neither peer leaving)
+        """
+        self.__target = address
+        self.__listener = socket.create_server(('127.0.0.1', 0))
+        self.address: tuple[str, int] = self.__listener.getsockname()
+        self.__socks: list[socket.socket] = []
+        self.__lock = threading.Lock()
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def cut(self):
+        """
+        Drop the connections made so far, new ones are still forwarded
+        """
+        with self.__lock:
+            socks, self.__socks = self.__socks, []
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def close(self):
+        self.__listener.close()
+        self.cut()
+
+    def __accept(self):
+        while True:
+            try:
+                downstream, _ = self.__listener.accept()
+                upstream = socket.create_connection(self.__target)
+            except OSError:
+                return
+            with self.__lock:
+                self.__socks += [downstream, upstream]
+            for source, destination in ((downstream, upstream), (upstream, downstream)):
+                threading.Thread(target=self.__forward, args=(source, destination), daemon=True).start()
+
+    @staticmethod
+    def __forward(source: socket.socket, destination: socket.socket):
+        try:
+            while data := source.recv(65536):
+                destination.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                destination.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+
+@pytest.fixture
+def proxy():
+    """
+    Forward connections to servers, to cut them: proxy(address) -> Proxy
+    """
+    proxies = []
+
+    def start(address: tuple[str, int]) -> Proxy:
+        proxies.append(Proxy(address))
+        return proxies[-1]
+
+    yield start
+    for started in proxies:
+        started.close()
+
+
+@pytest.fixture
+def chat_server():
+    """
+    Start chat servers in this process: chat_server(**options) -> address
+    """
+    from app.common.server import ChatServer
+
+    def start(**options) -> tuple[str, int]:
+        address = ('127.0.0.1', new_port())
+        options.setdefault('sessions', SessionOptions(heartbeat_timeout=0))
+        options.setdefault('rate_limits', None)
+        ChatServer(address, f'test-{address[1]}', **options)
+        wait_listening(address)
+        return address
+
+    return start
+
+
+def serve(address: tuple[str, int], options: dict):
+    from app.common.server import ChatServer
+    logger.disabled = True
+    server = ChatServer(address, f'test-{address[1]}', **options)
+    while server.is_alive():
+        server.wait(timeout=1.0)
+
+
+@pytest.fixture
+def server_process():
+    """
+    Start chat servers in processes of their own, to be killed: server_process(**options) -> (address, process)
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = []
+
+    def start(**options):
+        address = ('127.0.0.1', new_port())
+        options.setdefault('sessions', SessionOptions(heartbeat_timeout=0))
+        options.setdefault('rate_limits', None)
+        process = context.Process(target=serve, args=(address, options), daemon=True)
+        process.start()
+        processes.append(process)
+        wait_listening(address)
+        return address, process
+
+    yield start
+    for process in processes:
+        process.kill()
+        process.join()
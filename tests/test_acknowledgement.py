@@ -0,0 +1,66 @@
+import threading
+import time
+
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.server import DeliveryOptions
+from app.common.server.acknowledgement import CumulativeAck
+from conftest import AGENT_OPTIONS
+
+
+def test_cumulative_ack_every_n_messages():
+    acks = CumulativeAck(every=3, interval=10)
+    assert acks.timeout() is None
+    assert not acks.track(1)
+    assert not acks.track(2)
+    assert acks.track(3)
+    assert acks.take() == 3
+    assert acks.timeout() is None
+
+
+def test_cumulative_ack_is_due_after_the_interval():
+    acks = CumulativeAck(every=100, interval=0.01)
+    acks.track(7)
+    assert not acks.due()
+    time.sleep(0.02)
+    assert acks.due()
+    assert acks.timeout() == 0.
+    assert acks.take() == 7
+
+
+def agent(name, address, **options):
+    return ChatAgent(name, address, **AGENT_OPTIONS, **options)
+
+
+def test_sync_send_to_nobody_is_an_error(chat_server):
+    address = chat_server()
+    with agent('a', address) as a:
+        assert a.send_private('nobody', MessageProtocolCode.DATA.PLAIN_TEXT, 'hi') == MessageProtocolResponse.ERROR
+
+
+def test_cumulative_send_to_nobody_is_nacked(chat_server):
+    address = chat_server(delivery=DeliveryOptions(ack_every=4, ack_interval=0.01))
+    nacks = []
+    with agent('a', address, ack_mode=MessageProtocolAck.CUMULATIVE, nack_callback=nacks.append) as a, \
+            agent('b', address, recv_callback=lambda _: None):
+        for _ in range(10):
+            a.send_private('b', MessageProtocolCode.DATA.PLAIN_TEXT, 'hi')
+        a.send_private('nobody', MessageProtocolCode.DATA.PLAIN_TEXT, 'hi')
+        assert a.wait_acks(timeout=5)
+        assert [nack.response for nack in nacks] == [MessageProtocolResponse.NOT_EXIST]
+        assert nacks[0].seq == a.last_seq
+
+
+def test_wait_acks_returns_when_the_connection_drops(server_process):
+    address, process = server_process(delivery=DeliveryOptions(ack_every=1000, ack_interval=60))
+    a = agent('a', address, ack_mode=MessageProtocolAck.CUMULATIVE)
+    b = agent('b', address)
+    try:
+        a.send_private('b', MessageProtocolCode.DATA.PLAIN_TEXT, 'never acknowledged')
+        threading.Timer(0.3, process.kill).start()
+        started = time.monotonic()
+        assert not a.wait_acks(timeout=30)
+        assert time.monotonic() - started < 10
+    finally:
+        a.stop()
+        b.stop()
@@ -0,0 +1,129 @@
+import concurrent.futures
+import os
+import time
+
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.server.blob_store import BlobStore
+from conftest import AGENT_OPTIONS, wait_for
+
+
+def upload(store: BlobStore, content: bytes, chunk_size: int, uploader: str = 'a') -> int | None:
+    digest = blob_digest(content)
+    received = None
+    for offset in range(0, max(len(content), 1), chunk_size):
+        received = store.put_part(uploader, BlobPart(digest=digest, size=len(content), offset=offset,
+                                                     payload=content[offset:offset + chunk_size]))
+        if received is None:
+            break
+    return received
+
+
+def test_least_recently_used_blobs_are_evicted():
+    store = BlobStore(max_bytes=3 * 1100)
+    digests = [store.put(os.urandom(1000)) for _ in range(3)]
+    store.get_serialized(digests[0])
+
+    store.put(os.urandom(1000))
+    assert digests[0] in store
+    assert digests[1] not in store
+    assert store.put(os.urandom(4000)) is None
+
+
+def test_pinned_blobs_are_kept_until_fetched():
+    store = BlobStore(max_bytes=2 * 1100)
+    first = store.put(os.urandom(1000))
+    assert store.pin(first, ['b', 'c'])
+    assert not store.pin(blob_digest(b'never uploaded'), ['b'])
+
+    store.put(os.urandom(1000))
+    store.put(os.urandom(1000))
+    assert first in store
+
+    store.unpin(first, 'b')
+    store.unpin(first, 'c')
+    assert store.pinned == 0
+    store.put(os.urandom(1000))
+    assert first not in store
+
+
+def test_blobs_that_do_not_fit_besides_pinned_ones_are_refused():
+    store = BlobStore(max_bytes=1100, pin_ttl=0.05)
+    first = store.put(os.urandom(1000))
+    store.pin(first, ['b'])
+    assert store.put(os.urandom(1000)) is None
+
+    # Nobody came for it
+    time.sleep(0.06)
+    assert store.put(os.urandom(1000)) is not None
+    assert first not in store
+
+
+def test_upload_in_parts():
+    store = BlobStore()
+    content = os.urandom(10_000)
+    assert upload(store, content, 3000) == len(content)
+    assert deserialize(store.get_serialized(blob_digest(content))) == content
+
+    assert upload(store, b'', 10) == 0
+    assert blob_digest(b'') in store
+
+
+def test_uploads_in_parts_are_checked():
+    store = BlobStore(max_bytes=100_000)
+    content = os.urandom(10_000)
+    digest = blob_digest(content)
+
+    # Out of order
+    assert store.put_part('a', BlobPart(digest=digest, size=len(content), offset=5000, payload=content[5000:])) is None
+    # Not the content of the digest
+    assert store.put_part('a', BlobPart(digest=digest, size=len(content), offset=0,
+                                        payload=os.urandom(len(content)))) is None
+    assert digest not in store
+    # Larger than the store
+    assert store.put_part('a', BlobPart(digest=digest, size=200_000, offset=0, payload=b'')) is None
+
+
+def test_send_file_by_reference(chat_server, tmp_path):
+    content = os.urandom(300_000)
+    (tmp_path / 'file.bin').write_bytes(content)
+    address = chat_server()
+    received = []
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', address, recv_callback=received.append, **AGENT_OPTIONS):
+        assert a.send_file(str(tmp_path / 'file.bin'), recipient='b', chunk_size=65536) == MessageProtocolResponse.OK
+        assert wait_for(lambda: received)
+        assert a.missing_blobs([blob_digest(content)]) == []
+
+    assert received[0].body.filename == 'file.bin'
+    assert received[0].body.content == content
+
+
+def test_send_file_inline_when_the_server_does_not_keep_it(chat_server, tmp_path):
+    content = os.urandom(300_000)
+    (tmp_path / 'file.bin').write_bytes(content)
+    address = chat_server(blob_cache_size=100_000)
+    received = []
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', address, recv_callback=received.append, **AGENT_OPTIONS):
+        assert a.send_file(str(tmp_path / 'file.bin'), recipient='b') == MessageProtocolResponse.OK
+        assert wait_for(lambda: received)
+        assert a.missing_blobs([blob_digest(content)]) == [blob_digest(content)]
+
+    assert received[0].body.content == content
+
+
+def test_concurrent_fetches(chat_server):
+    contents = [os.urandom(200_000), os.urandom(1000)]
+    address = chat_server()
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a:
+        digests = [a.put_blob(content)[1] for content in contents]
+        assert digests == [blob_digest(content) for content in contents]
+
+        # Fetches of the same digest share a request, those of the other one aren't held up by it
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            fetched = list(pool.map(a.fetch_blob, digests * 4))
+        assert fetched == contents * 4
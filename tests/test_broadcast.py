@@ -0,0 +1,102 @@
+from app.common import *
+from app.common.broadcast import ServiceAnnouncement
+from app.common.client import ChatAgent
+from conftest import AGENT_OPTIONS, new_port, wait_for
+
+
+def broadcaster(name: str, port: int, mode=MessageProtocolCode.INSTRUCTION.BROADCAST.CLIENT_DISC, **options):
+    # Multicast over loopback only, announcing fast enough for peers to expire within a second or so
+    return UdpBroadcast(service_name=name,
+                        broadcast_mode=mode,
+                        broadcast_address=MULTICAST_GROUP_V4,
+                        interface='127.0.0.1',
+                        listen_port=port,
+                        broadcast_period=0.05,
+                        max_broadcast_period=0.1,
+                        **options)
+
+
+def test_peers_join_and_leave():
+    port = new_port()
+    joined, left = [], []
+    a = broadcaster('a', port, disc_callback=joined.append, leave_callback=left.append)
+    b = broadcaster('b', port)
+    try:
+        assert wait_for(lambda: joined)
+        assert [peer.src.username for peer in a.peers] == ['b']
+        assert joined[0].src.address[0] == '127.0.0.1'
+
+        b.stop()
+        assert wait_for(lambda: left)
+        assert left[0].src.username == 'b'
+        assert not a.peers
+    finally:
+        a.stop()
+        if not left:
+            b.stop()
+
+
+def test_peers_are_reported_once():
+    port = new_port()
+    joined = []
+    a = broadcaster('a', port, disc_callback=joined.append)
+    b = broadcaster('b', port)
+    try:
+        assert wait_for(lambda: joined)
+        # A few announcements later
+        assert not wait_for(lambda: len(joined) > 1, timeout=0.5)
+    finally:
+        a.stop()
+        b.stop()
+
+
+def test_listeners_ask_servers_to_announce():
+    port = new_port()
+    server = broadcaster('server', port, mode=MessageProtocolCode.INSTRUCTION.BROADCAST.SERVER_DISC,
+                         info=ServiceInfo(port=5000, clients=3, load=0.5))
+    listener = broadcaster('', port, mode=None)
+    try:
+        assert wait_for(lambda: listener.peers)
+        assert service_address(listener.peers[0]) == ('127.0.0.1', 5000)
+        # Listeners are not announced
+        assert not wait_for(lambda: server.peers, timeout=0.3)
+    finally:
+        listener.stop()
+        server.stop()
+
+
+def announcement(port: int, version: int = PROTOCOL_VERSION, clients: int = 0, load: float = 0.) -> MessageProtocol:
+    message = new_message_proto(
+        src=new_user(username=f'server-{port}'),
+        dst=None,
+        message_type=MessageProtocolCode.INSTRUCTION.BROADCAST.SERVER_DISC,
+        body=ServiceAnnouncement(instance=str(port), ttl=1., info=ServiceInfo(port=port, version=version,
+                                                                             clients=clients, load=load))
+    )
+    message.src.address = ('127.0.0.1', 60000)
+    return message
+
+
+def test_servers_are_ranked_by_load():
+    servers = [announcement(1, load=3.), announcement(2, load=1., clients=2), announcement(3, load=1., clients=1),
+               announcement(4, version=PROTOCOL_VERSION - 1)]
+    assert [service_address(server)[1] for server in rank_servers(servers)] == [3, 2, 1]
+    assert service_address(least_loaded(servers)) == ('127.0.0.1', 3)
+    assert least_loaded([]) is None
+
+
+def test_agent_connects_to_the_least_loaded_server(chat_server):
+    port = new_port()
+    discovery = DiscoveryOptions(address=MULTICAST_GROUP_V4, interface='127.0.0.1', port=port)
+    busy = chat_server(discovery=discovery)
+    idle = chat_server(discovery=discovery)
+
+    options = dict(AGENT_OPTIONS, discovery=discovery)
+    with ChatAgent('a', busy, **options):
+        servers = discover_servers(timeout=1.0, broadcast_address=MULTICAST_GROUP_V4, listen_port=port,
+                                   interface='127.0.0.1')
+        assert sorted(service_address(server) for server in servers) == sorted([busy, idle])
+        assert service_address(least_loaded(servers)) == idle
+
+        with ChatAgent('b', None, **options) as b:
+            assert b.remote_address == idle
@@ -0,0 +1,129 @@
+import threading
+import time
+
+from app.common import *
+from app.common.server.chat_room import ChatRoom, ChatRooms
+from conftest import wait_for
+
+
+def message_to(group: str, text: str, sender: str = 'a') -> MessageProtocol:
+    return new_message_proto(src=new_user(username=sender), dst=new_user(username=None, group=group),
+                             message_type=MessageProtocolCode.DATA.PLAIN_TEXT, body=text)
+
+
+def test_room_members_and_relays():
+    room = ChatRoom('g')
+    assert room.add('a') and not room.add('a')
+    members = room.members
+    assert room.subscribe('relay', frozenset({'x', 'y'}))
+    assert not room.subscribe('relay', frozenset({'x', 'y'}))
+
+    # Replaced on every change, whoever read them keeps what they read
+    room.discard('a')
+    assert members == {'a'} and not room.members
+    assert room.relays == ['relay'] and room.audience == {'x', 'y'}
+    assert [room.next_seq() for _ in range(3)] == [1, 2, 3]
+
+
+def test_messages_are_numbered_by_the_room():
+    delivered = []
+    rooms = ChatRooms(deliver=lambda members, message, frame: delivered.append((sorted(members), frame)),
+                      writer_shards=0)
+    try:
+        rooms.create('g')
+        assert rooms.join('g', 'a') and rooms.join('g', 'b')
+        assert not rooms.join('nope', 'a')
+        for i in range(5):
+            assert rooms.post('g', message_to('g', f'm{i}'), b'')
+        assert wait_for(lambda: len(delivered) == 5)
+    finally:
+        rooms.shutdown()
+
+    assert all(members == ['a', 'b'] for members, _ in delivered)
+    received = [deserialize_message(bytes(frame)) for _, frame in delivered]
+    assert [message.seq for message in received] == [1, 2, 3, 4, 5]
+    assert [message.body for message in received] == [f'm{i}' for i in range(5)]
+
+
+def test_large_rooms_spread_their_fan_out():
+    delivered = []
+    lock = threading.Lock()
+
+    def deliver(members, message, frame):
+        with lock:
+            delivered.extend(members)
+
+    rooms = ChatRooms(deliver=deliver, writer_shards=4, spread_members=10)
+    try:
+        rooms.create('g')
+        for i in range(40):
+            rooms.join('g', f'u{i}')
+        rooms.post('g', message_to('g', 'hello'), b'')
+        assert wait_for(lambda: len(delivered) == 40)
+        assert rooms.get('g').spread_out
+    finally:
+        rooms.shutdown()
+
+
+def test_rooms_go_once_empty():
+    changes = []
+    rooms = ChatRooms(deliver=lambda *args: None, on_change=lambda name, audience: changes.append((name, audience)))
+    try:
+        rooms.create('g')
+        rooms.join('g', 'a')
+        assert rooms.rooms_of('a') == ['g']
+        assert rooms.leave('g', 'a')
+        assert rooms.get('g') is None
+        assert rooms.leave('g', 'a') is None
+        assert changes == [('g', {'a'}), ('g', frozenset())]
+    finally:
+        rooms.shutdown()
+
+
+def test_subscriptions_create_and_remove_rooms():
+    relayed = []
+    rooms = ChatRooms(deliver=lambda *args: None, relay=lambda relays, message, frame: relayed.append(relays))
+    try:
+        rooms.subscribe('g', 'relay', ['x'])
+        assert wait_for(lambda: rooms.rooms_of_relay('relay') == ['g'])
+        rooms.post('g', message_to('g', 'hello'), b'')
+        assert wait_for(lambda: relayed == [['relay']])
+
+        rooms.subscribe('g', 'relay', [])
+        assert wait_for(lambda: rooms.get('g') is None)
+    finally:
+        rooms.shutdown()
+
+
+def test_resubscribing_to_a_room_removed_meanwhile():
+    gate, held = threading.Event(), threading.Event()
+    audiences = []
+
+    def on_change(name, audience):
+        if not gate.is_set():
+            held.set()
+            gate.wait(5)
+        audiences.append(audience)
+
+    # One shard with a queue of one task, full while the removed room is subscribed to again
+    rooms = ChatRooms(deliver=lambda *args: None, shards=1, writer_shards=0, queue_size=1, on_change=on_change)
+    try:
+        gate.set()
+        rooms.subscribe('g', 'relay', ['x'])
+        assert wait_for(lambda: audiences == [{'x'}])
+
+        # The shard is held up, the room is removed and subscribed to again before it sees either
+        gate.clear()
+        rooms.resubscribe()
+        assert held.wait(5)
+        rooms.subscribe('g', 'relay', [])
+        subscriber = threading.Thread(target=rooms.subscribe, args=('g', 'relay', ['y']))
+        subscriber.start()
+        gate.set()
+        subscriber.join(5)
+
+        assert wait_for(lambda: audiences[1:] == [{'x'}, frozenset(), {'y'}])
+        assert rooms.get('g').audience == {'y'}
+    finally:
+        gate.set()
+        rooms.shutdown()
@@ -0,0 +1,212 @@
+import dataclasses
+import functools
+import os
+import socket
+import threading
+import time
+
+from app.common import *
+from app.common.client import ChatAgent, TcpClient
+from app.common.server.executor import KeyedExecutor
+from app.common.server import DeliveryOptions, WorkerPools
+from conftest import AGENT_OPTIONS, identified, wait_for
+
+
+class Recorder:
+    def __init__(self, block: threading.Event | None = None):
+        self.batches = []
+        self.block = block
+        self.writing = threading.Event()
+
+    def __call__(self, batch):
+        self.writing.set()
+        if self.block:
+            self.block.wait(5)
+        self.batches.append(list(batch))
+
+
+def test_idle_writer_flushes_right_away():
+    written = threading.Semaphore(0)
+    batches = []
+
+    def writer(batch):
+        batches.append(list(batch))
+        written.release()
+
+    coalescer = MessageCoalescer(writer=writer)
+    try:
+        started = time.perf_counter()
+        for i in range(500):
+            coalescer.push(b'x%d' % i)
+            assert written.acquire(timeout=1)
+        # Sequential pushes never wait for more frames to come
+        assert time.perf_counter() - started < 0.5
+        assert all(len(batch) == 1 for batch in batches)
+    finally:
+        coalescer.close()
+
+
+def test_frames_pushed_during_a_write_go_out_together():
+    release = threading.Event()
+    recorder = Recorder(block=release)
+    coalescer = MessageCoalescer(writer=recorder)
+    try:
+        coalescer.push(b'first')
+        assert recorder.writing.wait(1)
+        for i in range(10):
+            coalescer.push(b'next%d' % i)
+        release.set()
+        assert wait_for(lambda: len(recorder.batches) == 2)
+        assert recorder.batches[0] == [b'first']
+        assert recorder.batches[1] == [b'next%d' % i for i in range(10)]
+    finally:
+        coalescer.close()
+
+
+def test_higher_classes_go_first_and_large_frames_are_fragmented():
+    release = threading.Event()
+    recorder = Recorder(block=release)
+    coalescer = MessageCoalescer(writer=recorder, chunk_size=4)
+    try:
+        coalescer.push(b'blk')
+        assert recorder.writing.wait(1)
+        coalescer.push(b'0123456789', MessagePriority.BULK)
+        coalescer.push(b'ctl', MessagePriority.CONTROL)
+        release.set()
+        assert wait_for(lambda: sum(len(batch) for batch in recorder.batches) == 5)
+
+        frames = [frame for batch in recorder.batches[1:] for frame in batch]
+        assert frames[0] == b'ctl'
+        fragments = frames[1:]
+        assert all(isinstance(fragment, FrameFragment) for fragment in fragments)
+        assert b''.join(bytes(fragment.data) for fragment in fragments) == b'0123456789'
+        assert [fragment.last for fragment in fragments] == [False, False, True]
+    finally:
+        coalescer.close()
+
+
+def test_close_without_flush_returns_what_was_left():
+    release = threading.Event()
+    recorder = Recorder(block=release)
+    coalescer = MessageCoalescer(writer=recorder)
+    coalescer.push(b'written')
+    assert recorder.writing.wait(1)
+    coalescer.push(b'dropped')
+    release.set()
+    assert coalescer.close(flush=False) in ([b'dropped'], [])
+
+
+def test_resequenced_frames_are_fragmented_without_joining_them():
+    message = new_message_proto(src=new_user(username='a'), dst=new_user(username=None, group='g'),
+                                message_type=MessageProtocolCode.DATA.PLAIN_TEXT, body='x' * 1000)
+    frame = resequence_message(message, 7)
+    assert isinstance(frame, MessageFrame)
+    assert bytes(frame) == serialize_message(dataclasses.replace(message, seq=7))
+    assert bytes(frame[10:len(frame.header) + 10]) == bytes(frame)[10:len(frame.header) + 10]
+
+    left, right = socket.socketpair()
+    coalescer = MessageCoalescer(writer=lambda batch: tcp_sock_send_frames(left, batch), chunk_size=100)
+    try:
+        coalescer.push(frame, MessagePriority.BULK)
+        coalescer.push(serialize_message(message))
+        received = [deserialize_message(tcp_sock_recv_frame(right, timeout=1)) for _ in range(2)]
+        assert sorted(received[i].seq or 0 for i in range(2)) == [0, 7]
+        assert all(received_message.body == 'x' * 1000 for received_message in received)
+    finally:
+        coalescer.close()
+        left.close()
+        right.close()
+
+
+def test_submitted_flushes_wait_for_the_writer_to_resume():
+    writable = threading.Event()
+    batches = []
+
+    def writer(batch):
+        batches.append(list(batch))
+        # The first batch is left unwritten until resume()
+        return writable.is_set()
+
+    executor = KeyedExecutor(workers=1)
+    coalescer = MessageCoalescer(writer=writer, submit=functools.partial(executor.submit, 'peer'))
+    try:
+        coalescer.push(b'first')
+        assert wait_for(lambda: batches == [[b'first']])
+        for i in range(10):
+            coalescer.push(b'next%d' % i)
+        time.sleep(0.1)
+        assert len(batches) == 1 and coalescer.pending == 10
+
+        # Everything pushed meanwhile goes out together (behind what the writer was left with)
+        writable.set()
+        coalescer.resume()
+        assert wait_for(lambda: coalescer.pending == 0 and len(batches) == 2)
+        assert batches[1] == [b'next%d' % i for i in range(10)]
+    finally:
+        coalescer.close()
+        executor.shutdown()
+
+
+def test_full_sockets_are_written_once_writable():
+    left, right = socket.socketpair()
+    left.setblocking(False)
+    poller = WritePoller()
+    try:
+        unsent = []
+        frames = [os.urandom(1024 * 1024) for _ in range(8)]
+        assert not tcp_sock_send_frames_nowait(left, frames, unsent) and unsent
+
+        resumed = threading.Event()
+        poller.watch(left, resumed.set)
+        assert not resumed.wait(0.2)
+
+        received = []
+        reader = threading.Thread(target=lambda: received.extend(tcp_sock_recv_frame(right, timeout=5)
+                                                                  for _ in frames))
+        reader.start()
+        while not tcp_sock_send_frames_nowait(left, [], unsent):
+            assert resumed.wait(5)
+            resumed.clear()
+            poller.watch(left, resumed.set)
+        reader.join(5)
+        assert [bytes(frame) for frame in received] == frames
+    finally:
+        poller.stop()
+        left.close()
+        right.close()
+
+
+def test_slow_recipients_hold_up_no_one_else(chat_server):
+    address = chat_server(delivery=DeliveryOptions(coalesce=True), pools=WorkerPools(send_workers=1))
+
+    # Connected, never reading
+    slow = identified(address, 'slow')
+    slave = TcpClient('slow', *address, retry=0.05)
+    for client, message_type in ((slave, MessageProtocolCode.INSTRUCTION.JOIN_SLAVE),
+                                 (slow, MessageProtocolCode.INSTRUCTION.IDENTIFY_SLAVES)):
+        assert client.transaction(new_message_proto(
+            src=new_user(username='slow'),
+            dst=None,
+            message_type=message_type,
+            body=None
+        )).response == MessageProtocolResponse.OK
+
+    received = []
+    try:
+        with ChatAgent('a', address, **AGENT_OPTIONS) as a, \
+                ChatAgent('b', address, recv_callback=received.append, **AGENT_OPTIONS):
+            body = 'x' * 512 * 1024
+            for _ in range(32):
+                assert a.send_private('slow', MessageProtocolCode.DATA.PLAIN_TEXT, body) == MessageProtocolResponse.OK
+
+            # The only sender isn't stuck writing to it
+            assert a.send_private('b', MessageProtocolCode.DATA.PLAIN_TEXT, 'hello') == MessageProtocolResponse.OK
+            assert wait_for(lambda: received)
+            assert received[0].body == 'hello'
+
+            # Nothing was lost meanwhile
+            for _ in range(32):
+                assert slave.receive(timeout=5).body == body
+    finally:
+        slave.close()
+        slow.close()
@@ -0,0 +1,120 @@
+import pickle
+import socket
+import threading
+import time
+
+from app.common import *
+from app.common.client import ChatAgent, UdpClient
+from conftest import AGENT_OPTIONS, identified, wait_for
+
+UNPICKLED = threading.Event()
+
+
+def mark_unpickled():
+    UNPICKLED.set()
+
+
+class Unpickled:
+    def __reduce__(self):
+        return mark_unpickled, ()
+
+
+def test_framer_and_reassembler_round_trip():
+    framer = DatagramFramer(mtu=DATAGRAM_HEADER.size + 4)
+    reassembler = DatagramReassembler()
+    datagrams = framer.frame(b'0123456789')
+    assert len(datagrams) == 3
+
+    assert reassembler.feed(datagrams[2], 'a') is None
+    assert reassembler.feed(datagrams[0], 'a') is None
+    assert reassembler.feed(datagrams[0], 'a') is None
+    seq, payload = reassembler.feed(datagrams[1], 'a')
+    assert payload == b'0123456789'
+    assert reassembler.pending == 0
+
+
+def test_reassembler_drops_incomplete_payloads():
+    framer = DatagramFramer(mtu=DATAGRAM_HEADER.size + 1)
+    reassembler = DatagramReassembler(max_pending=2, timeout=0.01)
+    for _ in range(3):
+        reassembler.feed(framer.frame(b'ab')[0], 'a')
+    assert reassembler.pending == 2
+
+    time.sleep(0.02)
+    reassembler.expire()
+    assert reassembler.pending == 0
+
+
+def test_register_datagram():
+    assert parse_register_datagram(register_datagram('cafe')) == 'cafe'
+    assert parse_register_datagram(DatagramFramer().frame(pickle.dumps('cafe'))[0]) is None
+    assert parse_register_datagram(b'\x00') is None
+
+
+def test_udp_client_only_receives_from_the_remote_address():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as remote, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as other:
+        remote.bind(('127.0.0.1', 0))
+        port = remote.getsockname()[1]
+        # Same port, another host
+        other.bind(('127.0.0.2', port))
+
+        client = UdpClient('a', 'localhost', port)
+        try:
+            local = ('127.0.0.1', client._sock.getsockname()[1])
+            other.sendto(b'spoofed', local)
+            assert client.receive_datagram(timeout=0.1) is None
+
+            remote.sendto(b'genuine', local)
+            assert client.receive_datagram(timeout=1.0) == b'genuine'
+        finally:
+            client.close()
+
+
+def test_unregistered_endpoints_are_not_deserialized(chat_server):
+    address = chat_server(udp=True)
+    received = []
+    with ChatAgent('a', address, udp=True, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', address, udp=True, recv_callback=lambda m: received.append(m.body), **AGENT_OPTIONS) as b:
+        framer = DatagramFramer()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            # On behalf of a, from an endpoint that never registered
+            spoofed = serialize_message(new_message_proto(
+                src=User('a'),
+                dst=User('b'),
+                message_type=MessageProtocolCode.DATA.PLAIN_TEXT,
+                body='spoofed'
+            ))
+            for datagram in framer.frame(spoofed) + framer.frame(pickle.dumps(Unpickled())):
+                sock.sendto(datagram, address)
+
+        assert a.send_private('b', MessageProtocolCode.DATA.PLAIN_TEXT, 'typing', ephemeral=True) == \
+               MessageProtocolResponse.OK
+        assert wait_for(lambda: 'typing' in received)
+        time.sleep(0.1)
+
+    assert received == ['typing']
+    assert not UNPICKLED.is_set()
+
+
+def test_datagram_endpoints_are_joined_for_the_client_of_the_connection_only(chat_server):
+    address = chat_server(udp=True)
+    with ChatAgent('a', address, **AGENT_OPTIONS):
+        client = identified(address, 'b')
+        try:
+            def join(username: str) -> MessageProtocol:
+                return client.transaction(new_message_proto(
+                    src=new_user(username=username),
+                    dst=None,
+                    message_type=MessageProtocolCode.INSTRUCTION.UDP.JOIN,
+                    body=None
+                ))
+
+            # A token to send datagrams as a, on the connection of b
+            spoofed = join('a')
+            assert spoofed.response == MessageProtocolResponse.ERROR and spoofed.body is None
+
+            joined = join('b')
+            assert joined.response == MessageProtocolResponse.OK and joined.body
+        finally:
+            client.close()
@@ -0,0 +1,66 @@
+import os
+
+from app.common import *
+from app.common.client import ChatAgent, FileDownload
+from conftest import AGENT_OPTIONS, wait_for
+
+
+def text_of(received: list) -> list:
+    return [message.body for message in received if message.message_type == MessageProtocolCode.DATA.PLAIN_TEXT]
+
+
+def test_attachments_are_saved_to_files(chat_server, tmp_path):
+    content = os.urandom(300_000)
+    (tmp_path / 'file.bin').write_bytes(content)
+    address = chat_server()
+    received, progress = [], []
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', address, recv_callback=received.append, download_dir=str(tmp_path / 'downloads'),
+                      download_callback=lambda download: progress.append(download.received), **AGENT_OPTIONS):
+        assert a.send_file(str(tmp_path / 'file.bin'), recipient='b') == MessageProtocolResponse.OK
+        assert a.send_file(str(tmp_path / 'file.bin'), recipient='b') == MessageProtocolResponse.OK
+        assert wait_for(lambda: len(received) == 2)
+
+    downloads = sorted((message.body for message in received), key=lambda download: download.path)
+    assert all(isinstance(download, FileDownload) and download.complete for download in downloads)
+    # Same name, files of their own
+    assert [os.path.basename(download.path) for download in downloads] == ['file (1).bin', 'file.bin']
+    assert all(open(download.path, 'rb').read() == content for download in downloads)
+    assert progress[-1] == len(content)
+
+
+def test_failing_download_callback_keeps_the_connection(chat_server, tmp_path):
+    (tmp_path / 'file.bin').write_bytes(os.urandom(300_000))
+    address = chat_server()
+    received = []
+
+    def fail(download):
+        raise RuntimeError('callback failed')
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', address, recv_callback=received.append, download_dir=str(tmp_path / 'downloads'),
+                      download_callback=fail, **AGENT_OPTIONS) as b:
+        assert a.send_file(str(tmp_path / 'file.bin'), recipient='b') == MessageProtocolResponse.OK
+        assert wait_for(lambda: received)
+        assert a.send_private('b', MessageProtocolCode.DATA.PLAIN_TEXT, 'still there') == MessageProtocolResponse.OK
+        assert wait_for(lambda: text_of(received) == ['still there'])
+        assert b.connected
+
+
+def test_undownloadable_attachments_are_dropped(chat_server, tmp_path):
+    (tmp_path / 'file.bin').write_bytes(os.urandom(300_000))
+    # Files can't be created in there
+    (tmp_path / 'downloads').write_bytes(b'')
+    address = chat_server()
+    received = []
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', address, recv_callback=received.append, download_dir=str(tmp_path / 'downloads'),
+                      **AGENT_OPTIONS) as b:
+        assert a.send_file(str(tmp_path / 'file.bin'), recipient='b') == MessageProtocolResponse.OK
+        assert a.send_private('b', MessageProtocolCode.DATA.PLAIN_TEXT, 'after') == MessageProtocolResponse.OK
+        assert wait_for(lambda: received)
+        assert not wait_for(lambda: len(received) > 1, timeout=0.5)
+        assert text_of(received) == ['after']
+        assert b.connected
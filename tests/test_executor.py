@@ -0,0 +1,63 @@
+import threading
+import time
+
+from app.common.server.executor import KeyedExecutor
+
+
+def test_tasks_of_a_key_run_in_order():
+    executor = KeyedExecutor(workers=4)
+    done: dict[str, list[int]] = {key: [] for key in 'abcdef'}
+    try:
+        for i in range(200):
+            for key, results in done.items():
+                executor.submit(key, results.append, i)
+    finally:
+        # Everything submitted is done first
+        executor.shutdown()
+    assert all(results == list(range(200)) for results in done.values())
+
+
+def test_failing_tasks_leave_the_workers():
+    executor = KeyedExecutor(workers=1)
+    done = threading.Event()
+
+    def fail():
+        raise RuntimeError('task failed')
+
+    try:
+        executor.submit('a', fail)
+        executor.submit('a', done.set)
+        assert done.wait(5)
+    finally:
+        executor.shutdown()
+
+
+def test_submitting_to_a_full_queue_waits():
+    executor = KeyedExecutor(workers=1, queue_size=2)
+    started, gate, submitted = threading.Event(), threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        gate.wait(5)
+
+    def submit():
+        for _ in range(3):
+            executor.submit('a', time.sleep, 0)
+        submitted.set()
+
+    try:
+        # The worker is held up, two tasks fit behind it
+        executor.submit('a', hold)
+        assert started.wait(5)
+        submitter = threading.Thread(target=submit)
+        submitter.start()
+        assert not submitted.wait(0.2)
+        assert executor.backlog == 2
+
+        gate.set()
+        assert submitted.wait(5)
+        submitter.join()
+    finally:
+        gate.set()
+        executor.shutdown()
+    assert executor.workers == 1 and executor.backlog == 0
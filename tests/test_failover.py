@@ -0,0 +1,74 @@
+import threading
+
+from app.common import *
+from app.common.client import Backoff, ChatAgent, ConnectionOptions, rank_by_latency
+from conftest import new_port, wait_for
+
+
+def test_backoff_is_bounded():
+    backoff = Backoff(base=0.1, cap=1.0)
+    delays = [backoff.next() for _ in range(10)]
+    assert all(0 <= delay <= 1.0 for delay in delays)
+    assert backoff.attempt == 10
+
+    backoff.reset()
+    assert backoff.next() <= 0.1
+
+
+def test_unreachable_endpoints_are_ranked_last(chat_server):
+    address = chat_server()
+    unreachable = ('127.0.0.1', new_port())
+    assert rank_by_latency([unreachable, address]) == [address, unreachable]
+
+
+def test_headless_agent_fails_over_and_rejoins_its_groups(server_process):
+    first, first_process = server_process()
+    second, second_process = server_process()
+    processes = {first: first_process, second: second_process}
+
+    with ChatAgent('a', [first, second], open_sockets=2,
+                   connection=ConnectionOptions(heartbeat_interval=0, reconnect_delay=0.05)) as a:
+        for group in ('g1', 'g2'):
+            assert a.create_and_join(group) == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+
+        # Nothing but the slave sockets notices the server is gone (no callbacks, no heartbeats)
+        connected = a.remote_address
+        processes[connected].kill()
+        assert wait_for(lambda: a.remote_address != connected)
+
+        response, groups = a.get_groups()
+        assert response == MessageProtocolResponse.OK
+        assert sorted(groups) == ['g1', 'g2']
+        assert sorted(a.get_clients_in_group('g2')[1]) == ['a']
+
+
+def test_requests_cut_off_are_sent_again(server_process):
+    first, first_process = server_process()
+    second, second_process = server_process()
+    processes = {first: first_process, second: second_process}
+
+    with ChatAgent('a', [first, second], open_sockets=2,
+                   connection=ConnectionOptions(heartbeat_interval=0, reconnect_delay=0.05)) as a:
+        assert a.create_and_join('g') == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+
+        connected = a.remote_address
+        results = []
+        done = threading.Event()
+
+        def send():
+            while not done.is_set():
+                results.append(a.send_group('g', MessageProtocolCode.DATA.PLAIN_TEXT, 'hello'))
+
+        # Requests keep going while the server is killed, none of them fails
+        sender = threading.Thread(target=send)
+        sender.start()
+        assert wait_for(lambda: len(results) > 10)
+        processes[connected].kill()
+        assert wait_for(lambda: a.remote_address != connected)
+        sent = len(results)
+        assert wait_for(lambda: len(results) > sent + 10)
+        done.set()
+        sender.join(timeout=30)
+
+        assert not sender.is_alive()
+        assert set(results) == {MessageProtocolResponse.OK}
@@ -0,0 +1,52 @@
+import mmap
+import os
+import socket
+import threading
+
+from app.common.utils.mapped_file import MappedFile
+
+
+def test_written_in_place_a_window_at_a_time(tmp_path):
+    content = os.urandom(5 * mmap.ALLOCATIONGRANULARITY + 123)
+    progress = []
+    path = str(tmp_path / 'sub' / 'file.bin')
+    file = MappedFile(path, len(content), window=mmap.ALLOCATIONGRANULARITY, on_progress=progress.append,
+                      progress_step=2 * mmap.ALLOCATIONGRANULARITY)
+
+    # Preallocated to its final size
+    assert os.path.getsize(path) == len(content)
+    for i in range(0, len(content), 1000):
+        file.write(content[i:i + 1000])
+
+    assert file.complete and file.written == file.size == len(content)
+    assert progress[-1] == len(content) and progress == sorted(progress)
+    assert open(path, 'rb').read() == content
+
+
+def test_received_straight_from_a_socket(tmp_path):
+    content = os.urandom(3 * 1024 * 1024)
+    left, right = socket.socketpair()
+    sender = threading.Thread(target=left.sendall, args=(content,))
+    sender.start()
+
+    file = MappedFile(str(tmp_path / 'file.bin'), len(content), window=1024 * 1024)
+    try:
+        while not file.complete:
+            assert file.recv_from(right, buffer_size=64 * 1024)
+    finally:
+        sender.join()
+        left.close()
+        right.close()
+    assert open(file.path, 'rb').read() == content
+
+
+def test_empty_and_discarded_files(tmp_path):
+    progress = []
+    empty = MappedFile(str(tmp_path / 'empty.bin'), 0, on_progress=progress.append)
+    assert empty.complete and progress == [0]
+    assert os.path.getsize(empty.path) == 0
+
+    file = MappedFile(str(tmp_path / 'cut.bin'), 1000)
+    file.write(b'x' * 10)
+    file.discard()
+    assert not os.path.exists(file.path)
@@ -0,0 +1,72 @@
+import socket
+import time
+
+from app.common import *
+from app.common.client import ChatAgent, probe_latency
+from app.common.server import ChatServer
+
+
+class Counted:
+    """
+    Body counting how many times it is decoded
+    """
+    decoded = 0
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __reduce__(self):
+        return decode_counted, (self.text,)
+
+
+def decode_counted(text: str) -> Counted:
+    Counted.decoded += 1
+    return Counted(text)
+
+
+def new_object(body) -> MessageProtocol:
+    return new_message_proto(src=new_user(username='a'), dst=new_user(username='b'),
+                             message_type=MessageProtocolCode.DATA.PYTHON_OBJECT, body=body)
+
+
+def test_the_body_is_decoded_on_first_use_only():
+    Counted.decoded = 0
+    message = deserialize(serialize(new_object(Counted('hello'))))
+    assert message.dst.username == 'b' and message.message_type == MessageProtocolCode.DATA.PYTHON_OBJECT
+
+    # Passed on as it was received
+    forwarded = deserialize(serialize(message))
+    assert Counted.decoded == 0
+
+    assert forwarded.body.text == 'hello' and forwarded.body is forwarded.body
+    assert Counted.decoded == 1
+
+
+def test_identities_carry_names_only():
+    user = new_user(username='a', group='g')
+    assert deserialize(serialize(user)) == user
+    assert not hasattr(user, '__dict__')
+
+
+def test_messages_are_routed_without_decoding_them():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        address = probe.getsockname()
+    ChatServer(address, 'test')
+    deadline = time.monotonic() + 10
+    while probe_latency(address) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    Counted.decoded = 0
+    received = []
+    with ChatAgent('a', address, open_sockets=2) as a, \
+            ChatAgent('b', address, open_sockets=2, recv_callback=received.append):
+        response = a.send_private('b', MessageProtocolCode.DATA.PYTHON_OBJECT, Counted('hello'))
+        assert response == MessageProtocolResponse.OK
+
+        deadline = time.monotonic() + 5
+        while not received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Neither by the server nor on the way to the callback
+        assert Counted.decoded == 0
+        assert received[0].body.text == 'hello' and Counted.decoded == 1
@@ -0,0 +1,89 @@
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.server.presence import PresenceService
+from conftest import AGENT_OPTIONS, Published, identified, wait_for
+
+
+def states(published: Published, recipient: str) -> list[str]:
+    return [presence.state for presence in published.to(recipient)]
+
+
+def new_service(published: Published, **options) -> PresenceService:
+    options.setdefault('window', 0.01)
+    options.setdefault('debounce', 0.05)
+    return PresenceService(published, audience=lambda username: {'b', 'c'} - {username},
+                           group_members=lambda group: ['a', 'b'], **options)
+
+
+def test_changes_are_pushed_to_the_audience_once_they_hold():
+    published = Published()
+    presence = new_service(published)
+    try:
+        presence.set('a', PresenceState.ONLINE)
+        assert wait_for(lambda: states(published, 'b') == [PresenceState.ONLINE])
+        assert states(published, 'c') == [PresenceState.ONLINE]
+        assert presence.get(['a', 'x']) == [Presence('a', PresenceState.ONLINE), Presence('x', PresenceState.OFFLINE)]
+
+        # Flapping back to where it was is never published
+        presence.set('a', PresenceState.AWAY)
+        presence.set('a', PresenceState.ONLINE)
+        assert not wait_for(lambda: len(published.calls) > 1, timeout=0.3)
+    finally:
+        presence.stop()
+
+
+def test_typing_is_seen_by_the_conversation_and_ends_by_itself():
+    published = Published()
+    presence = new_service(published, typing_timeout=0.2)
+    try:
+        presence.set('a', PresenceState.ONLINE)
+        assert wait_for(lambda: published.calls)
+        presence.set('a', PresenceState.TYPING, group='g')
+        assert wait_for(lambda: states(published, 'b')[1:] == [PresenceState.TYPING])
+        assert states(published, 'c') == [PresenceState.ONLINE]
+        assert wait_for(lambda: states(published, 'b')[2:] == [PresenceState.ONLINE])
+    finally:
+        presence.stop()
+
+
+def test_private_message_partners_are_interested():
+    published = Published()
+    presence = PresenceService(published, audience=lambda username: [], group_members=lambda group: [],
+                               window=0.01, debounce=0.05, max_partners=1)
+    try:
+        presence.touch('a', 'x')
+        presence.touch('a', 'y')
+        presence.set('a', PresenceState.ONLINE)
+        assert wait_for(lambda: published.calls)
+        # Only the most recent partner is kept
+        assert published.calls == [(['y'], [Presence('a', PresenceState.ONLINE)])]
+    finally:
+        presence.stop()
+
+
+def test_presence_is_set_for_the_client_of_the_connection_only(chat_server):
+    address = chat_server()
+    received = []
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', address, presence_callback=received.append, **AGENT_OPTIONS) as b:
+        assert a.create_and_join('g') == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+        assert b.join_group('g') == MessageProtocolResponse.OK
+        assert wait_for(lambda: b.presence_of('a').state == PresenceState.ONLINE)
+
+        # Claims to be b on the connection of c
+        client = identified(address, 'c')
+        try:
+            response = client.transaction(new_message_proto(
+                src=new_user(username='b'),
+                dst=None,
+                message_type=MessageProtocolCode.INSTRUCTION.PRESENCE.SET,
+                body=PresenceState.AWAY
+            ))
+            assert response.response == MessageProtocolResponse.ERROR
+        finally:
+            client.close()
+        assert a.get_presence(['b']) == (MessageProtocolResponse.OK, [Presence('b', PresenceState.ONLINE)])
+
+        assert a.set_presence(PresenceState.AWAY) == MessageProtocolResponse.OK
+        assert wait_for(lambda: b.presence_of('a').state == PresenceState.AWAY)
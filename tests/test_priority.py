@@ -0,0 +1,47 @@
+import os
+import socket
+import threading
+
+from app.common import *
+
+
+def test_classes_of_messages():
+    def priority(message_type: int, body) -> int:
+        return message_priority(new_message_proto(src=new_user(username='a'), dst=new_user(username='b'),
+                                                  message_type=message_type, body=body))
+
+    assert priority(MessageProtocolCode.INSTRUCTION.GROUP.LIST_GROUPS, None) == MessagePriority.CONTROL
+    assert priority(MessageProtocolCode.DATA.PLAIN_TEXT, 'hi') == MessagePriority.INTERACTIVE
+    assert priority(MessageProtocolCode.DATA.IMAGE, b'') == MessagePriority.BULK
+    # Large, whatever its type
+    assert priority(MessageProtocolCode.DATA.PLAIN_TEXT, 'x' * 100_000) == MessagePriority.BULK
+
+
+def test_control_and_interactive_frames_overtake_bulk_ones():
+    left, right = socket.socketpair()
+    writing, gate = threading.Event(), threading.Event()
+
+    def writer(frames: list):
+        if not writing.is_set():
+            # Holds the first chunk of the bulk frame, while the others are pushed
+            writing.set()
+            gate.wait(5)
+        tcp_sock_send_frames(left, frames)
+
+    # One chunk per batch
+    coalescer = MessageCoalescer(writer, max_bytes=1000, chunk_size=1000)
+    bulk = os.urandom(10_000)
+    try:
+        coalescer.push(serialize(bulk), priority=MessagePriority.BULK)
+        assert writing.wait(5)
+        coalescer.push(serialize('typing'), priority=MessagePriority.INTERACTIVE)
+        coalescer.push(serialize('ack'), priority=MessagePriority.CONTROL)
+        gate.set()
+
+        # Chunks of the bulk frame are put back together behind them
+        assert [tcp_sock_recv(right, timeout=5) for _ in range(3)] == ['ack', 'typing', bulk]
+    finally:
+        gate.set()
+        coalescer.close()
+        left.close()
+        right.close()
@@ -0,0 +1,112 @@
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.server import RateLimits, SessionOptions
+from app.common.server.rate_limit import OutboundBacklog, RateLimiter, TokenBucket
+from conftest import AGENT_OPTIONS, identified, wait_for
+
+
+def test_token_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=10., capacity=5.)
+    now = bucket.updated
+    assert all(bucket.take(now=now) for _ in range(5))
+    assert not bucket.take(now=now)
+
+    assert bucket.take(now=now + 0.1)
+    assert not bucket.take(now=now + 0.1)
+    bucket.take(0, now=now + 100)
+    assert bucket.tokens == 5.
+
+
+def test_more_than_a_burst_goes_through_from_a_full_bucket_only():
+    bucket = TokenBucket(rate=1., capacity=10.)
+    now = bucket.updated
+    assert bucket.take(25, now=now)
+    assert bucket.tokens == -15
+    assert not bucket.take(now=now + 10)
+
+
+def test_message_types_are_limited_separately():
+    limiter = RateLimiter(RateLimits(messages_per_second=1., message_burst=2, bytes_per_second=0))
+    assert limiter.admit('a', 1, 10) and limiter.admit('a', 1, 10)
+    assert not limiter.admit('a', 1, 10)
+    assert limiter.admit('a', 2, 10)
+    assert limiter.admit('b', 1, 10)
+
+
+def test_bytes_and_announcements_are_limited():
+    limiter = RateLimiter(RateLimits(messages_per_second=0, bytes_per_second=1., byte_burst=100,
+                                     announces_per_minute=1., announce_burst=1))
+    assert limiter.admit('a', 1, 100)
+    assert not limiter.admit('a', 1, 1)
+
+    assert limiter.admit('b', 1, 1, announce=True)
+    assert not limiter.admit('b', 1, 1, announce=True)
+
+
+def test_forgotten_users_start_over():
+    limiter = RateLimiter(RateLimits(messages_per_second=1., message_burst=1))
+    assert limiter.admit('a', 1, 1)
+    assert not limiter.admit('a', 1, 1)
+    assert limiter.users == 1
+
+    limiter.forget('a')
+    assert limiter.users == 0
+    assert limiter.admit('a', 1, 1)
+
+
+def test_outbound_backlog():
+    backlog = OutboundBacklog(limit=100)
+    backlog.reserve(101)
+    assert backlog.overloaded
+    backlog.release(50)
+    assert not backlog.overloaded and backlog.size == 51
+    assert not OutboundBacklog(limit=0).overloaded
+
+
+def test_buckets_of_expired_sessions_are_forgotten(chat_server, proxy):
+    address = chat_server(sessions=SessionOptions(grace=0.1, heartbeat_timeout=0),
+                          rate_limits=RateLimits(messages_per_second=0.01, message_burst=1))
+    link = proxy(address)
+
+    with ChatAgent('b', address, **AGENT_OPTIONS) as b:
+        assert b.create_and_join('g') == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+        with ChatAgent('a', link.address, **AGENT_OPTIONS) as a:
+            assert a.join_group('g') == MessageProtocolResponse.OK
+            assert wait_for(lambda: b.presence_of('a').state == PresenceState.ONLINE)
+            assert a.send_group('g', MessageProtocolCode.DATA.PLAIN_TEXT, 'hello') == MessageProtocolResponse.OK
+            assert a.send_group('g', MessageProtocolCode.DATA.PLAIN_TEXT, 'again') == MessageProtocolResponse.WARN
+
+            # Dropped without leaving: suspended first, then expired once the grace period is over
+            link.cut()
+            assert wait_for(lambda: b.presence_of('a').state == PresenceState.OFFLINE)
+
+        # Back with a whole burst
+        with ChatAgent('a', address, **AGENT_OPTIONS) as a:
+            assert a.send_private('b', MessageProtocolCode.DATA.PLAIN_TEXT, 'back') == MessageProtocolResponse.OK
+
+
+def test_messages_count_against_the_client_of_the_connection(chat_server):
+    address = chat_server(rate_limits=RateLimits(messages_per_second=0.01, message_burst=1))
+    received = []
+
+    with ChatAgent('a', address, recv_callback=received.append, **AGENT_OPTIONS):
+        client = identified(address, 'b')
+        try:
+            def send(username: str) -> MessageProtocol:
+                return client.transaction(new_message_proto(
+                    src=new_user(username=username),
+                    dst=new_user(username='a'),
+                    message_type=MessageProtocolCode.DATA.PLAIN_TEXT,
+                    body=username
+                ))
+
+            # On behalf of a, on the connection of b: neither delivered nor taken from the bucket of a
+            assert send('a').response == MessageProtocolResponse.ERROR
+            assert send('b').response == MessageProtocolResponse.OK
+            assert send('a').response == MessageProtocolResponse.ERROR
+            assert send('b').response == MessageProtocolResponse.WARN
+        finally:
+            client.close()
+
+        assert wait_for(lambda: received)
+        assert [message.body for message in received] == ['b']
@@ -0,0 +1,83 @@
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.server.receipts import ReceiptTracker
+from conftest import AGENT_OPTIONS, Published, identified, wait_for
+
+def receipts_of(published: Published, sender: str) -> dict[int, Receipt]:
+    return {receipt.seq: receipt for receipt in published.to(sender)}
+
+
+def test_acknowledgements_are_cumulative_and_counted():
+    published = Published()
+    receipts = ReceiptTracker(published, window=0.01)
+    members = frozenset({'s', 'a', 'b'})
+    try:
+        for number in range(1, 4):
+            receipts.track(('group', 'g'), number, 's', seq=10 + number, members=members, group='g')
+
+        receipts.ack('a', ReceiptState.DELIVERED, ('group', 'g'), 3)
+        receipts.ack('b', ReceiptState.READ, ('group', 'g'), 2)
+        # Acknowledged already
+        receipts.ack('b', ReceiptState.READ, ('group', 'g'), 1)
+        assert wait_for(lambda: len(receipts_of(published, 's')) == 3)
+
+        last = receipts_of(published, 's')
+        assert [(last[seq].delivered, last[seq].read) for seq in (11, 12, 13)] == [(2, 1), (2, 1), (1, 0)]
+        assert all(receipt.recipients == 2 for receipt in last.values())
+    finally:
+        receipts.stop()
+
+
+def test_senders_and_strangers_are_not_counted():
+    published = Published()
+    receipts = ReceiptTracker(published, window=0.01)
+    try:
+        receipts.track(('user', 's', 'a'), 1, 's', seq=1, members=frozenset({'a'}), username='a')
+        receipts.ack('s', ReceiptState.READ, ('user', 's', 'a'), 1)
+        receipts.ack('x', ReceiptState.READ, ('user', 's', 'a'), 1)
+        receipts.ack('a', ReceiptState.READ, ('user', 'nope', 'a'), 1)
+        assert not wait_for(lambda: published.calls, timeout=0.2)
+
+        receipts.ack('a', ReceiptState.READ, ('user', 's', 'a'), 1)
+        assert wait_for(lambda: published.calls)
+        assert published.to('s') == [Receipt(seq=1, group=None, username='a', delivered=1, read=1, recipients=1)]
+    finally:
+        receipts.stop()
+
+
+def test_oldest_messages_are_forgotten_first():
+    published = Published()
+    receipts = ReceiptTracker(published, window=0.01, max_tracked=2)
+    try:
+        for number in range(1, 4):
+            receipts.track(('group', 'g'), number, 's', seq=number, members=frozenset({'a'}), group='g')
+        receipts.ack('a', ReceiptState.DELIVERED, ('group', 'g'), 3)
+        assert wait_for(lambda: published.calls)
+        assert sorted(receipts_of(published, 's')) == [2, 3]
+    finally:
+        receipts.stop()
+
+
+def test_receipts_are_acknowledged_for_the_client_of_the_connection_only(chat_server):
+    address = chat_server()
+    received = []
+
+    with ChatAgent('s', address, receipt_callback=received.append, **AGENT_OPTIONS) as s, \
+            ChatAgent('a', address, **AGENT_OPTIONS) as a:
+        assert s.create_and_join('g') == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+        assert a.join_group('g') == MessageProtocolResponse.OK
+        assert s.send_group('g', MessageProtocolCode.DATA.PLAIN_TEXT, 'hello') == MessageProtocolResponse.OK
+
+        # Claims to be a, reading the message on a connection of its own
+        client = identified(address, 'x')
+        try:
+            response = client.transaction(new_message_proto(
+                src=new_user(username='a'),
+                dst=None,
+                message_type=MessageProtocolCode.INSTRUCTION.RECEIPT.ACK,
+                body=[(ReceiptState.READ, 'g', None, 1)]
+            ))
+            assert response.response == MessageProtocolResponse.ERROR
+        finally:
+            client.close()
+        assert not wait_for(lambda: received, timeout=0.5)
@@ -0,0 +1,91 @@
+import socket
+import threading
+import time
+
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.server import RelayOptions
+from app.common.server.relay import RelayLink
+from conftest import AGENT_OPTIONS, wait_for
+
+
+def texts(received: list) -> list:
+    return [message.body for message in received]
+
+
+def test_members_of_relays_see_the_same_order(chat_server):
+    root = chat_server(relay=RelayOptions(secret='secret'))
+    relay = chat_server(relay=RelayOptions(secret='secret', upstream=root))
+    received = {'a': [], 'b': []}
+
+    with ChatAgent('a', root, recv_callback=received['a'].append, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', relay, recv_callback=received['b'].append, **AGENT_OPTIONS) as b:
+        assert a.create_and_join('g') == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+        assert wait_for(lambda: 'g' in b.get_groups()[1])
+        assert b.join_group('g') == MessageProtocolResponse.OK
+        assert wait_for(lambda: sorted(a.get_clients_in_group('g')[1]) == ['a', 'b'])
+
+        for i in range(10):
+            assert a.send_group('g', MessageProtocolCode.DATA.PLAIN_TEXT, f'a{i}') == MessageProtocolResponse.OK
+            assert b.send_group('g', MessageProtocolCode.DATA.PLAIN_TEXT, f'b{i}') == MessageProtocolResponse.OK
+        assert wait_for(lambda: len(received['a']) == 10 and len(received['b']) == 10)
+
+    # Each gets the messages of the other, numbered upstream
+    assert texts(received['a']) == [f'b{i}' for i in range(10)]
+    assert texts(received['b']) == [f'a{i}' for i in range(10)]
+    for messages in received.values():
+        assert [message.seq for message in messages] == sorted(message.seq for message in messages)
+
+
+def test_relays_list_and_join_groups_upstream(chat_server):
+    root = chat_server(relay=RelayOptions(secret='secret'))
+    relay = chat_server(relay=RelayOptions(secret='secret', upstream=root))
+    # A relay of a relay gets the groups passed on
+    second = chat_server(relay=RelayOptions(secret='secret', upstream=relay))
+
+    with ChatAgent('a', root, **AGENT_OPTIONS) as a, ChatAgent('b', relay, **AGENT_OPTIONS) as b, \
+            ChatAgent('c', second, **AGENT_OPTIONS) as c:
+        assert a.create_group('empty') == MessageProtocolResponse.OK
+        assert a.create_and_join('g') == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+        assert wait_for(lambda: sorted(c.get_groups()[1]) == ['empty', 'g'])
+        assert b.create_group('g') == MessageProtocolResponse.EXISTS
+
+        assert b.join_group('g') == MessageProtocolResponse.OK
+        assert c.join_group('empty') == MessageProtocolResponse.OK
+        assert wait_for(lambda: sorted(c.get_clients_in_group('g')[1]) == ['a', 'b'])
+        assert wait_for(lambda: a.get_clients_in_group('empty')[1] == ['c'])
+
+        assert c.join_group('missing') == MessageProtocolResponse.ERROR
+
+        # Removed upstream once nobody is left
+        assert a.leave_group('g') == MessageProtocolResponse.OK
+        assert b.leave_group('g') == MessageProtocolResponse.OK
+        assert wait_for(lambda: 'g' not in c.get_groups()[1])
+
+
+def test_link_writes_never_wait_for_upstream():
+    # Upstream that accepts the relay, and then never reads
+    listener = socket.create_server(('127.0.0.1', 0))
+    accepted = []
+
+    def accept():
+        sock, _ = listener.accept()
+        accepted.append(sock)
+        tcp_sock_recv(sock, timeout=5)
+        tcp_sock_send(sock, new_message_proto(src=None, dst=None, message_type=MessageProtocolCode.INSTRUCTION.RESPONSE,
+                                              response=MessageProtocolResponse.OK, body=None))
+
+    threading.Thread(target=accept, daemon=True).start()
+    link = RelayLink(listener.getsockname(), name='relay', secret='secret', on_frame=lambda *args: None,
+                     on_connect=lambda: None, retry_delay=0.05)
+    try:
+        assert wait_for(lambda: link.connected)
+        frame = bytes(1024 * 1024)
+        started = time.monotonic()
+        assert all(link.send(frame) for _ in range(64))
+        assert time.monotonic() - started < 1.0
+    finally:
+        link.stop()
+        for sock in accepted:
+            sock.close()
+        listener.close()
@@ -0,0 +1,113 @@
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.server import SearchOptions
+from app.common.server.search import SearchIndex
+from conftest import AGENT_OPTIONS, identified, wait_for
+
+
+def seqs(page: SearchPage) -> list[int]:
+    return [hit.seq for hit in page.hits]
+
+
+def test_words_prefixes_and_phrases():
+    index = SearchIndex()
+    index.add('g', 1, 'a', 'Meeting at noon')
+    index.add('g', 2, 'b', 'the big world')
+    index.add('g', 3, 'a', 'world big meetup')
+    index.add('other', 4, 'a', 'meeting elsewhere')
+
+    assert seqs(index.search('g', 'meeting')) == [1]
+    assert seqs(index.search('g', 'meet*')) == [3, 1]
+    assert seqs(index.search('g', 'big world')) == [3, 2]
+    assert seqs(index.search('g', '"big world"')) == [2]
+    assert seqs(index.search('g', 'nothing')) == []
+    assert seqs(index.search('nope', 'meeting')) == []
+
+
+def test_pages_go_on_from_their_cursor():
+    index = SearchIndex()
+    for seq in range(1, 26):
+        index.add('g', seq, 'a', f'message {seq}')
+
+    found, cursor = [], None
+    while True:
+        page = index.search('g', 'message', cursor=cursor, limit=10)
+        found += seqs(page)
+        if (cursor := page.cursor) is None:
+            break
+    assert found == list(range(25, 0, -1))
+
+
+def test_new_terms_are_found_by_prefix():
+    index = SearchIndex()
+    # Many more terms than are merged in at a time
+    for seq in range(1, 1001):
+        index.add('g', seq, 'a', f'word{seq:04}')
+        if seq % 100 == 0:
+            assert seqs(index.search('g', f'word{seq // 100:02}*', limit=100))[0] == seq
+    assert len(index.search('g', 'word*', limit=100).hits) == 100
+
+
+def test_oldest_messages_are_forgotten_beyond_the_limits():
+    index = SearchIndex(max_documents=10)
+    for seq in range(30):
+        index.add('g', seq, 'a', f'common number{seq}')
+    assert index.documents == 10
+    assert seqs(index.search('g', 'common', limit=50)) == list(range(29, 19, -1))
+    assert seqs(index.search('g', 'number1*')) == []
+
+    index = SearchIndex(max_bytes=10_000)
+    for seq in range(100):
+        index.add('g', seq, 'a', 'x' * 500)
+    assert index.size <= 10_000 and 0 < index.documents < 100
+
+
+def test_conversations_are_compacted_a_few_terms_at_a_time():
+    index = SearchIndex(max_documents=100, compact_terms=10)
+    for seq in range(100):
+        index.add('quiet', seq, 'a', f'old{seq}')
+    for seq in range(300):
+        index.add('busy', seq, 'a', f'common new{seq}')
+
+    # Forgotten messages of the quiet conversation went with it, terms of the busy one went a few at a time:
+    # not much more than twice as many as there are messages kept (of two terms each)
+    assert index.conversations == 1
+    assert index.terms <= 201 and index.postings <= 400
+    assert seqs(index.search('busy', 'common', limit=200)) == list(range(299, 199, -1))
+    assert seqs(index.search('busy', 'new1*', limit=200)) == []
+
+
+def test_members_search_their_groups_as_themselves_only(chat_server):
+    address = chat_server()
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, ChatAgent('b', address, **AGENT_OPTIONS) as b:
+        assert a.create_and_join('g') == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+        assert a.send_group('g', MessageProtocolCode.DATA.PLAIN_TEXT, 'secret plans') == MessageProtocolResponse.OK
+        assert wait_for(lambda: a.search('secret', group_name='g')[1].hits)
+        assert b.search('secret', group_name='g')[0] == MessageProtocolResponse.ERROR
+
+        # Claims to be a on a connection of its own
+        client = identified(address, 'c')
+        try:
+            response = client.transaction(new_message_proto(
+                src=new_user(username='a'),
+                dst=new_user(username=None, group='g'),
+                message_type=MessageProtocolCode.INSTRUCTION.SEARCH.QUERY,
+                body=SearchQuery(text='secret')
+            ))
+            assert response.response == MessageProtocolResponse.ERROR
+            assert response.body == SearchPage(hits=[], cursor=None)
+        finally:
+            client.close()
+
+
+def test_private_messages_are_indexed_if_enabled(chat_server):
+    for search_private in (False, True):
+        address = chat_server(search=SearchOptions(private=search_private))
+        with ChatAgent('a', address, **AGENT_OPTIONS) as a, ChatAgent('b', address, **AGENT_OPTIONS) as b:
+            assert a.send_private('b', MessageProtocolCode.DATA.PLAIN_TEXT, 'hello b') == MessageProtocolResponse.OK
+            if search_private:
+                assert wait_for(lambda: b.search('hello', recipient='a')[1].hits)
+            else:
+                assert b.search('hello', recipient='a') == (MessageProtocolResponse.ERROR,
+                                                            SearchPage(hits=[], cursor=None))
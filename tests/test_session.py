@@ -0,0 +1,90 @@
+import socket
+import time
+
+from app.common import *
+from app.common.client import ChatAgent, ConnectionOptions
+from app.common.server import SessionOptions
+from app.common.server.session import SessionStore
+from conftest import AGENT_OPTIONS, wait_for
+
+
+def test_resumption_completes_once_every_socket_is_attached():
+    store = SessionStore(grace=5.0)
+    token = store.open('a')
+    assert store.suspend('a', 'g', {'g'})
+    assert store.queue('a', b'frame')
+
+    master, slave = socket.socket(), socket.socket()
+    try:
+        assert store.attach(token, 'b', master, True, 1) == (None, False)
+        session, complete = store.attach(token, 'a', master, True, 1)
+        assert session and not complete
+        session, complete = store.attach(token, 'a', slave, False)
+        assert complete
+        assert session.token != token and store.owns(session.token, 'a')
+
+        assert store.take_pending('a') == [b'frame']
+        store.activate('a')
+        assert not store.is_suspended('a')
+    finally:
+        master.close()
+        slave.close()
+
+
+def test_sockets_closed_before_resumption_are_dropped():
+    store = SessionStore(grace=5.0)
+    token = store.open('a')
+    store.suspend('a', None, set())
+
+    master, dead, slave = socket.socket(), socket.socket(), socket.socket()
+    try:
+        store.attach(token, 'a', master, True, 2)
+        store.attach(token, 'a', dead, False)
+        assert store.detach(dead)
+        assert not store.detach(dead)
+
+        # The resumption still waits for as many slaves as announced
+        session, complete = store.attach(token, 'a', slave, False)
+        assert not complete
+        assert session.slaves == [slave]
+    finally:
+        for sock in (master, dead, slave):
+            sock.close()
+
+
+def test_suspended_sessions_expire():
+    store = SessionStore(grace=0.05)
+    store.open('a')
+    store.suspend('a', 'g', {'g'})
+    assert store.suspended == ['a']
+
+    time.sleep(0.06)
+    assert [session.username for session in store.expire()] == ['a']
+    assert not store.is_suspended('a')
+    assert len(store) == 0
+
+
+def test_resumption_is_disabled_without_grace():
+    store = SessionStore(grace=0)
+    assert store.open('a') is None
+    assert not store.suspend('a', None, set())
+
+
+def test_messages_missed_while_away_are_replayed(chat_server, proxy):
+    address = chat_server(sessions=SessionOptions(grace=5.0, heartbeat_timeout=0))
+    link = proxy(address)
+    received = []
+
+    with ChatAgent('a', link.address, recv_callback=lambda message: received.append(message.body), open_sockets=2,
+                   connection=ConnectionOptions(heartbeat_interval=0)) as a, \
+            ChatAgent('b', address, **AGENT_OPTIONS) as b:
+        assert a.create_and_join('g') == (MessageProtocolResponse.OK, MessageProtocolResponse.OK)
+        assert b.join_group('g') == MessageProtocolResponse.OK
+
+        # Dropped without leaving, then reconnected
+        link.cut()
+        wait_for(lambda: not a.connected, timeout=0.5)
+        assert b.send_group('g', MessageProtocolCode.DATA.PLAIN_TEXT, 'missed') == MessageProtocolResponse.OK
+
+        assert wait_for(lambda: 'missed' in received)
+        assert sorted(a.get_clients_in_group('g')[1]) == ['a', 'b']
@@ -0,0 +1,124 @@
+import dataclasses
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+from app.common import *
+from app.common.utils import socket_utils
+from app.common.utils.socket_utils import FRAGMENT_BIT, LAST_FRAGMENT_BIT, LANE_SHIFT
+
+
+@pytest.fixture
+def pair():
+    # Connected TCP sockets
+    with socket.create_server(('127.0.0.1', 0)) as server:
+        left = socket.create_connection(server.getsockname())
+        right, _ = server.accept()
+    yield left, right
+    left.close()
+    right.close()
+
+
+def send_later(sock: socket.socket, frames: list) -> threading.Thread:
+    sender = threading.Thread(target=tcp_sock_send_frames, args=(sock, frames))
+    sender.start()
+    return sender
+
+
+def test_profiles_by_name():
+    assert socket_profile('latency') is LATENCY_PROFILE
+    with pytest.raises(ValueError):
+        socket_profile('nope')
+
+
+def test_tuner_follows_the_frame_sizes():
+    tuner = SocketTuner(THROUGHPUT_PROFILE, every=4)
+    assert [tuner.observe(1000) for _ in range(4)] == [False, False, False, True]
+    # Small frames: the smallest buffer of the profile
+    assert tuner.read_buffer(1024 * 1024) == THROUGHPUT_PROFILE.read_buffer
+
+    tuner = SocketTuner(THROUGHPUT_PROFILE)
+    tuner.observe(100_000)
+    assert tuner.read_buffer(64 * 1024) == 1024 * 1024
+    # Within a factor of 4, left as it is
+    assert tuner.read_buffer(512 * 1024) == 512 * 1024
+
+    # Too large to be buffered several at a time
+    tuner.observe(10_000_000)
+    assert tuner.read_buffer(1024 * 1024) == THROUGHPUT_PROFILE.read_buffer
+
+
+def test_profiles_are_applied(pair):
+    left, _ = pair
+    apply_socket_profile(left, LAN_PROFILE)
+    assert left.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    assert left.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= LAN_PROFILE.recv_buffer
+
+
+def test_auto_tuned_connections_receive_frames_of_any_size(pair):
+    left, right = pair
+    apply_socket_profile(right, THROUGHPUT_PROFILE)
+
+    # The read buffer grows with the large frames, and shrinks back with the small ones
+    frames = [os.urandom(size) for size in [100] * 64 + [100_000] * 64 + [10] * 64]
+    sender = threading.Thread(target=tcp_sock_send_frames, args=(left, frames))
+    sender.start()
+    assert [bytes(tcp_sock_recv_frame(right)) for _ in frames] == frames
+    sender.join()
+
+
+def test_frames_larger_than_the_receive_buffer(pair):
+    left, right = pair
+    frames = [os.urandom(10), os.urandom(3 * 1024 * 1024), os.urandom(100)]
+    sender = send_later(left, frames)
+    assert [bytes(tcp_sock_recv_frame(right, buffer_size=4096)) for _ in frames] == frames
+    sender.join()
+
+
+def test_large_frames_are_received_into_pooled_buffers(pair, monkeypatch):
+    pool = BufferPool(max_size=8 * 1024 * 1024)
+    monkeypatch.setattr(socket_utils, '_buffer_pool', pool)
+
+    left, right = pair
+    # Read ahead with the small frame, growing past a few size classes, and beyond the largest one
+    frames = [os.urandom(10), os.urandom(3 * 1024 * 1024), os.urandom(3 * 1024 * 1024 + 1),
+              os.urandom(12 * 1024 * 1024)]
+    sender = send_later(left, frames)
+    assert [bytes(tcp_sock_recv_frame(right, buffer_size=4096)) for _ in frames] == frames
+    sender.join()
+
+    # The second frame grew through the buffers the first one gave back
+    assert pool.reused >= 3 and pool.free_bytes
+
+
+def test_fragments_are_put_together_between_frames(pair):
+    left, right = pair
+    content = os.urandom(10_000)
+    tcp_sock_send_frames(left, [FrameFragment(lane=1, last=False, data=content[:6000]), b'between',
+                                FrameFragment(lane=1, last=True, data=content[6000:])])
+    assert tcp_sock_recv_frame(right) == b'between'
+    assert tcp_sock_recv_frame(right) == content
+
+
+def test_frames_larger_than_the_limit_are_refused(pair):
+    left, right = pair
+    limited = dataclasses.replace(SYSTEM_PROFILE, max_frame=1000)
+    apply_socket_profile(right, limited)
+
+    # Advertised only: nothing the size of it is allocated before the data comes
+    left.sendall(struct.pack('!I', 1_000_000))
+    with pytest.raises(ValueError):
+        tcp_sock_recv_frame(right)
+
+
+def test_fragmented_frames_larger_than_the_limit_are_refused(pair):
+    left, right = pair
+    apply_socket_profile(right, dataclasses.replace(SYSTEM_PROFILE, max_frame=1000))
+
+    header = FRAGMENT_BIT | 2 << LANE_SHIFT
+    left.sendall(struct.pack('!I', header | 600) + bytes(600) + struct.pack('!I', header | LAST_FRAGMENT_BIT | 600))
+    with pytest.raises(ValueError):
+        tcp_sock_recv_frame(right)
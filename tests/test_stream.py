@@ -0,0 +1,63 @@
+import os
+import random
+
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.media import *
+from conftest import AGENT_OPTIONS, wait_for
+
+
+def media_file(path, size: int = 10_000) -> bytes:
+    content = os.urandom(size)
+    path.write_bytes(content)
+    return content
+
+
+def test_chunks_in_any_order_with_duplicates(tmp_path):
+    content = media_file(tmp_path / 'clip.bin')
+    chunks = list(iter_media_chunks(str(tmp_path / 'clip.bin'), chunk_size=1000, keyframe_interval=4))
+    assert [chunk.keyframe for chunk in chunks[:5]] == [True, False, False, False, True]
+    assert chunks[-1].final
+
+    completed = []
+    receiver = MediaReceiver(str(tmp_path / 'received'), on_complete=completed.append)
+    shuffled = chunks + chunks[:3]
+    random.shuffle(shuffled)
+    for chunk in shuffled:
+        receiver.feed('a', chunk)
+    # Late duplicates of a completed stream
+    receiver.feed('a', chunks[0])
+
+    assert len(completed) == 1
+    assert completed[0].received == len(content)
+    assert open(completed[0].path, 'rb').read() == content
+    assert not receiver.streams
+    assert os.listdir(tmp_path / 'received') == ['clip.bin']
+
+
+def test_incomplete_streams_expire(tmp_path):
+    media_file(tmp_path / 'clip.bin')
+    chunks = list(iter_media_chunks(str(tmp_path / 'clip.bin'), chunk_size=1000))
+
+    expired = []
+    receiver = MediaReceiver(str(tmp_path / 'received'), on_expire=expired.append, timeout=0.05)
+    receiver.feed('a', chunks[0])
+    assert len(receiver.streams) == 1
+
+    assert wait_for(lambda: expired)
+    assert not receiver.streams
+    assert not os.path.exists(expired[0].path)
+
+
+def test_headless_media_receiver(chat_server, tmp_path):
+    content = media_file(tmp_path / 'clip.bin', size=200_000)
+    address = chat_server()
+    completed = []
+    receiver = MediaReceiver(str(tmp_path / 'received'), on_complete=completed.append)
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, \
+            ChatAgent('b', address, media_receiver=receiver, **AGENT_OPTIONS):
+        assert a.send_media(str(tmp_path / 'clip.bin'), recipient='b', chunk_size=16384) == MessageProtocolResponse.OK
+        assert wait_for(lambda: completed)
+
+    assert open(completed[0].path, 'rb').read() == content
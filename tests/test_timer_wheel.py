@@ -0,0 +1,61 @@
+import math
+import time
+
+from app.common.server.timer_wheel import TimerWheel
+
+
+def new_wheel(**options) -> tuple[TimerWheel, float]:
+    wheel = TimerWheel(**options)
+    # On a tick, the one the wheel stands on or a later one
+    now = float(math.floor(time.monotonic()))
+    return wheel, now
+
+
+def test_timers_expire_once_past_their_deadline():
+    wheel, now = new_wheel(tick=1.0, slots=8)
+    wheel.schedule('a', now + 2)
+    wheel.schedule('b', now + 5)
+    assert len(wheel) == 2 and 'a' in wheel
+
+    assert wheel.advance(now + 1) == []
+    assert wheel.advance(now + 2) == ['a']
+    assert 'a' not in wheel
+    assert wheel.advance(now + 4.5) == []
+    assert wheel.advance(now + 5) == ['b']
+    assert len(wheel) == 0
+
+
+def test_postponed_and_cancelled_timers():
+    wheel, now = new_wheel(tick=1.0, slots=8)
+    wheel.schedule('a', now + 2)
+    wheel.schedule('b', now + 2)
+    assert wheel.postpone('a', now + 4)
+    # Never earlier
+    assert wheel.postpone('a', now + 3)
+    assert not wheel.postpone('c', now + 4)
+    wheel.cancel('b')
+
+    assert wheel.advance(now + 3) == []
+    assert wheel.advance(now + 4) == ['a']
+
+    # Moved earlier: placed again right away
+    wheel.schedule('d', now + 10)
+    wheel.schedule('d', now + 6)
+    assert wheel.advance(now + 6) == ['d']
+
+
+def test_deadlines_beyond_one_revolution():
+    wheel, now = new_wheel(tick=1.0, slots=4)
+    wheel.schedule('a', now + 10)
+    for second in range(1, 10):
+        assert wheel.advance(now + second) == []
+    assert wheel.advance(now + 10) == ['a']
+
+
+def test_a_wheel_left_alone_catches_up_at_once():
+    wheel, now = new_wheel(tick=1.0, slots=4)
+    for i in range(1, 4):
+        wheel.schedule(i, now + i)
+    wheel.schedule('later', now + 1000)
+    assert sorted(wheel.advance(now + 100)) == [1, 2, 3]
+    assert wheel.advance(now + 1000) == ['later']
@@ -0,0 +1,80 @@
+import shutil
+import socket
+import subprocess
+import threading
+
+import pytest
+
+from app.common import *
+from app.common.client import TcpClient
+from app.common.server import TcpServer
+
+
+@pytest.fixture
+def certificate(tmp_path) -> tuple[str, str]:
+    if not shutil.which('openssl'):
+        pytest.skip('openssl is needed to make a certificate')
+
+    certfile, keyfile = str(tmp_path / 'cert.pem'), str(tmp_path / 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-nodes', '-days', '1',
+                    '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+                    '-keyout', keyfile, '-out', certfile,
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def echo(sock: socket.socket, _):
+    with sock:
+        try:
+            while True:
+                tcp_sock_send(sock, tcp_sock_recv(sock, timeout=None))
+        except (EOFError, OSError):
+            pass
+
+
+@pytest.fixture
+def address(certificate):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    server = TcpServer('127.0.0.1', port, ssl_context=new_tls_server_context(*certificate))
+
+    def serve():
+        try:
+            server.start(echo)
+        except OSError:
+            # Stopped
+            pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield '127.0.0.1', port
+    server.stop()
+
+
+def test_sessions_are_resumed(certificate, address):
+    context = new_tls_client_context(cafile=certificate[0])
+
+    first = TcpClient('a', *address, retry=0.05, ssl_context=context)
+    assert first.status and not first.tls_resumed
+    assert first.transaction('hello') == 'hello'
+    # Tickets came with the reply
+    session = first.tls_session
+    first.close()
+
+    again = TcpClient('a', *address, ssl_context=context, tls_session=session)
+    assert again.status and again.tls_resumed
+    assert again.transaction('hello again') == 'hello again'
+    again.close()
+
+    # Without a session: a full handshake
+    other = TcpClient('b', *address, ssl_context=context)
+    assert other.status and not other.tls_resumed
+    other.close()
+
+
+def test_untrusted_certificates_are_refused(address):
+    client = TcpClient('a', *address, retry=0.05, ssl_context=new_tls_client_context())
+    assert not client.status
+    client.close()
@@ -0,0 +1,113 @@
+import array
+import math
+import wave
+
+import pytest
+
+from app.common import *
+from app.common.client import ChatAgent
+from app.common.media import voice
+from app.common.media import *
+from conftest import AGENT_OPTIONS, wait_for
+
+
+class MemorySink:
+    def __init__(self):
+        self.frames: list[bytes] = []
+
+    def write(self, pcm: bytes):
+        self.frames.append(pcm)
+
+    def close(self):
+        pass
+
+
+def write_tone(path, fmt: VoiceFormat, duration: float = 0.4):
+    samples = array.array('h', (int(8000 * math.sin(2 * math.pi * 440 * i / fmt.sample_rate))
+                                for i in range(int(fmt.sample_rate * duration))))
+    with wave.open(str(path), 'wb') as wav:
+        wav.setframerate(fmt.sample_rate)
+        wav.setnchannels(fmt.channels)
+        wav.setsampwidth(fmt.sample_width)
+        wav.writeframes(samples.tobytes())
+
+
+def frame(seq: int) -> VoiceFrame:
+    return VoiceFrame(seq=seq, timestamp=0., codec='pcm', payload=bytes([seq]))
+
+
+def test_jitter_buffer_reorders_and_conceals_losses():
+    buffer = JitterBuffer(delay=0.)
+    for seq in (1, 0, 3):
+        buffer.put(frame(seq))
+
+    assert [buffer.pop()[1] for _ in range(4)] == [frame(0), frame(1), None, frame(3)]
+
+    # Too late to be played
+    buffer.put(frame(2))
+    assert buffer.size == 0
+
+
+@pytest.mark.parametrize('sample_width', [1, 2, 3, 4])
+def test_mix_frames_without_audioop(monkeypatch, sample_width):
+    limit = (1 << (8 * sample_width - 1)) - 1
+    a = [limit, -limit - 1, 1, -1]
+    b = [limit, -limit - 1, 2, -3]
+
+    def pack(values):
+        return b''.join(v.to_bytes(sample_width, 'little', signed=True) for v in values)
+
+    audioop = voice.audioop
+    monkeypatch.setattr(voice, 'audioop', None)
+    mixed = mix_frames([pack(a), pack(b)], sample_width)
+    assert mixed == pack([limit, -limit - 1, 3, -4])
+
+    # Same as audioop, where there is one
+    if audioop is not None:
+        assert mixed == audioop.add(pack(a), pack(b), sample_width)
+
+
+@pytest.mark.parametrize('sample_width', [1, 2, 4])
+def test_codecs_of_every_sample_width(sample_width):
+    if voice.audioop is None:
+        pytest.skip('u-law codec requires audioop')
+
+    fmt = VoiceFormat(sample_width=sample_width)
+    limit = (1 << (8 * sample_width - 1)) - 1
+    values = [round(limit * math.sin(2 * math.pi * i / fmt.frame_samples)) for i in range(fmt.frame_samples)]
+    pcm = b''.join(v.to_bytes(sample_width, 'little', signed=True) for v in values)
+
+    codec = voice.new_codec('ulaw', fmt)
+    payload = codec.encode(pcm)
+    assert len(payload) == fmt.frame_samples
+    decoded = codec.decode(payload)
+    assert len(decoded) == fmt.frame_bytes
+    # Lossy, within a few percent of full scale
+    assert all(abs(int.from_bytes(decoded[i:i + sample_width], 'little', signed=True) - v) <= limit // 16 + 1
+               for v, i in zip(values, range(0, len(decoded), sample_width)))
+
+    assert voice.new_codec('pcm', fmt).decode(pcm) == pcm
+
+
+def test_speakers_of_a_call():
+    call = VoiceCall(send=lambda _: None)
+    call.receive('a', frame(0))
+    call.receive('b', frame(0))
+    assert sorted(call.speakers) == ['a', 'b']
+
+
+def test_headless_call_over_tcp(chat_server, tmp_path):
+    fmt = VoiceFormat()
+    write_tone(tmp_path / 'tone.wav', fmt)
+    address = chat_server()
+    sink = MemorySink()
+
+    with ChatAgent('a', address, **AGENT_OPTIONS) as a, ChatAgent('b', address, **AGENT_OPTIONS) as b:
+        listener = b.start_call(sink=sink, recipient='a')
+        talker = a.start_call(source=WavSource(str(tmp_path / 'tone.wav'), fmt), recipient='b')
+        assert talker.wait(timeout=5)
+
+        assert wait_for(lambda: any(any(pcm) for pcm in sink.frames))
+        assert listener.speakers == ['a']
+        a.end_call(talker)
+        b.end_call(listener)